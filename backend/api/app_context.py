@@ -0,0 +1,329 @@
+from fastapi import Request
+from pathlib import Path
+from typing import Coroutine
+import asyncio
+import logging
+import time
+
+from core import config
+from services.document_store import DocumentStore, create_document_store
+from services.execution_engine import ExecutionEngine
+from services.extraction_cache import (
+  ExtractionCache,
+  InMemoryCacheBackend,
+  create_extraction_cache
+)
+from services.form_extractor import ExtractionSettings, render_pdf_pages
+from services.form_generator import (
+  Form1040Generator,
+  Form1040Template,
+  FORM_1040_TAX_YEAR,
+  load_form_1040_template
+)
+from services.job_store import INTERRUPTED_JOB_ERROR, JobStore, create_job_store
+from services.llm_gateway import LLMGateway, configure_llm_gateway
+from services.metrics import REGISTRY
+from tax_policy.policy_registry import get_tax_policy
+from services.render_profiles import RenderProfile
+from services.single_flight import SingleFlight
+from models.job_schema import JobStatus
+from models.tax_schema import TaxReturnSummary
+from models.user_pii import FilingType
+
+logger = logging.getLogger(__name__)
+
+CURRENT_DIR = Path(__file__).resolve().parent
+
+FORM_1040_TEMPLATE_PATH = CURRENT_DIR / "../static/templates/f1040_2024.pdf"
+
+# Cheapest render of the template, enough to get PyMuPDF and the render
+# code loaded in every render worker before the first submission
+_WARM_UP_PROFILE = RenderProfile(dpi = 18, grayscale = True, jpeg_quality = 10)
+
+class AppContext:
+  def __init__(
+    self,
+    engine: ExecutionEngine,
+    llm_gateway: LLMGateway,
+    extraction_cache: ExtractionCache | None,
+    extraction_settings: ExtractionSettings,
+    document_store: DocumentStore,
+    job_store: JobStore,
+    form_1040_template_path: Path,
+    form_1040_template: Form1040Template,
+    form_1040_generators: dict[FilingType, Form1040Generator]
+  ):
+    self.engine = engine
+    self.llm_gateway = llm_gateway
+    self.extraction_cache = extraction_cache
+    self.extraction_settings = extraction_settings
+    self.document_store = document_store
+    self.job_store = job_store
+    self.form_1040_template_path = form_1040_template_path
+    self.form_1040_template = form_1040_template
+    self.form_1040_generators = form_1040_generators
+
+    # running job tasks by job id, referenced so they are not garbage
+    # collected, their job store leases are renewed by _renew_job_leases
+    self.job_tasks : dict[str, asyncio.Task] = {}
+    self._lease_task : asyncio.Task | None = None
+    # batches currently streaming results
+    self.active_batches = 0
+    # engine slots the taxpayers of all batches can hold, see
+    # endpoints._in_batch_slot
+    self.batch_slots = asyncio.Semaphore(max(1, config.BATCH_MAX_IN_FLIGHT))
+    # identical submissions being processed, see endpoints._coalesced
+    self.in_flight_submissions : SingleFlight[tuple[str, TaxReturnSummary]] = (
+      SingleFlight()
+    )
+
+    # what startup loaded and checked, reported by /api/health
+    self.checks : dict[str, dict] = {}
+    self.ready = False
+
+  # Queue depths, read on every scrape. With several workers the per worker
+  # gauges add up, the ones read from a shared store do not.
+  def register_gauges(self) -> None:
+    REGISTRY.gauge(
+      "tax_engine_in_flight",
+      "Submissions running in the execution engine",
+      lambda: self.engine.stats()["in_flight"]
+    )
+    REGISTRY.gauge(
+      "tax_engine_queued",
+      "Submissions waiting for an execution engine slot",
+      lambda: self.engine.stats()["queued"]
+    )
+    REGISTRY.gauge(
+      "tax_llm_in_flight",
+      "LLM requests being sent",
+      lambda: self.llm_gateway.stats()["in_flight"]
+    )
+    REGISTRY.gauge(
+      "tax_llm_queue_depth",
+      "LLM requests waiting for the rate limit budget",
+      lambda: self.llm_gateway.stats()["queue_depth"]
+    )
+    REGISTRY.gauge(
+      "tax_jobs_pending",
+      "Background jobs queued or running",
+      self.job_store.count_pending,
+      aggregate = "max"
+    )
+    if self.extraction_cache is not None:
+      REGISTRY.gauge(
+        "tax_extraction_cache_entries",
+        "Extractions in the cache",
+        lambda: len(self.extraction_cache.backend),
+        aggregate = (
+          "sum" if isinstance(self.extraction_cache.backend, InMemoryCacheBackend)
+          else "max"
+        )
+      )
+
+  # Runs a job in the background, its lease is renewed while it runs
+  def start_job(self, job_id: str, job: Coroutine) -> asyncio.Task:
+    if self._lease_task is None or self._lease_task.done():
+      self._lease_task = asyncio.create_task(self._renew_job_leases())
+
+    task = asyncio.create_task(job)
+    self.job_tasks[job_id] = task
+    task.add_done_callback(lambda _: self.job_tasks.pop(job_id, None))
+    return task
+
+  async def _renew_job_leases(self) -> None:
+    interval = self.job_store.lease.total_seconds() / 4
+    while self.job_tasks:
+      await asyncio.sleep(interval)
+      try:
+        await asyncio.to_thread(self.job_store.renew, list(self.job_tasks))
+      except Exception:
+        # a missed renewal is retried, the lease outlasts several
+        logger.exception("Renewing job leases failed")
+
+  def close(self) -> None:
+    self.ready = False
+    if self._lease_task is not None:
+      self._lease_task.cancel()
+    # jobs of this worker are not resumed by another one, they fail now
+    # instead of once their lease runs out
+    interrupted = list(self.job_tasks)
+    for task in self.job_tasks.values():
+      task.cancel()
+    self.engine.shutdown()
+    for job_id in interrupted:
+      try:
+        if not self.job_store.get(job_id).status.is_terminal:
+          self.job_store.update(
+            job_id, status = JobStatus.failed, error = INTERRUPTED_JOB_ERROR
+          )
+      except Exception:
+        logger.exception("Failing interrupted job %s failed", job_id)
+    REGISTRY.disable_multiprocess()
+
+# Everything a request needs, loaded and checked once before the app takes
+# traffic: a missing or broken template, tax policy table or setting fails
+# the startup instead of the first submission
+def create_app_context() -> AppContext:
+  if config.SUBMIT_PIPELINE not in ("async", "threads"):
+    raise ValueError(f"Unknown SUBMIT_PIPELINE: {config.SUBMIT_PIPELINE}")
+  # requests for a document or job land on any worker
+  if config.WEB_CONCURRENCY > 1:
+    for name, backend in (
+      ("DOCUMENT_STORE_BACKEND", config.DOCUMENT_STORE_BACKEND),
+      ("JOB_STORE_BACKEND", config.JOB_STORE_BACKEND)
+    ):
+      if backend == "memory":
+        raise ValueError(f"{name}=memory is per process, WEB_CONCURRENCY > 1")
+
+  checks : dict[str, dict] = {}
+
+  def check(name: str, load, **details):
+    start = time.perf_counter()
+    result = load()
+    checks[name] = {
+      "status" : "ok",
+      "seconds" : round(time.perf_counter() - start, 3),
+      **details
+    }
+    return result
+
+  template_path = FORM_1040_TEMPLATE_PATH.resolve(strict = True)
+  # parsed once, with its widget index, every return fills an in-memory copy
+  template = check(
+    "form_1040_template",
+    lambda: load_form_1040_template(str(template_path)),
+    path = str(template_path)
+  )
+
+  # brackets and standard deduction of every filing status, compiled once
+  generators = check(
+    "tax_policies",
+    lambda: {
+      filing_status : Form1040Generator(
+        get_tax_policy(FORM_1040_TAX_YEAR, filing_status),
+        template = template
+      )
+      for filing_status in FilingType
+    },
+    tax_year = FORM_1040_TAX_YEAR
+  )
+
+  # One OpenAI client and connection pool for the whole process, the
+  # constructor fails without an API key
+  llm_gateway = check(
+    "llm_client",
+    lambda: configure_llm_gateway(
+      requests_per_minute = config.OPENAI_REQUESTS_PER_MINUTE,
+      tokens_per_minute = config.OPENAI_TOKENS_PER_MINUTE,
+      max_attempts = config.OPENAI_MAX_ATTEMPTS,
+      request_timeout_seconds = config.OPENAI_REQUEST_TIMEOUT_SECONDS,
+      deadline_seconds = config.OPENAI_DEADLINE_SECONDS,
+      max_connections = config.OPENAI_MAX_CONNECTIONS,
+      async_max_connections = config.OPENAI_ASYNC_MAX_CONNECTIONS
+    ),
+    model = config.EXTRACTION_MODEL
+  )
+
+  extraction_settings = ExtractionSettings(
+    read_acroforms = config.ACROFORM_FAST_PATH,
+    model = config.EXTRACTION_MODEL,
+    render_profile = RenderProfile(
+      dpi = config.EXTRACTION_DPI,
+      grayscale = config.EXTRACTION_GRAYSCALE,
+      jpeg_quality = config.EXTRACTION_JPEG_QUALITY,
+      crop_to_content = config.EXTRACTION_CROP_TO_CONTENT,
+      detail = config.EXTRACTION_IMAGE_DETAIL
+    ),
+    max_payload_bytes = config.EXTRACTION_MAX_PAYLOAD_BYTES,
+    render_mode = config.EXTRACTION_RENDER_MODE,
+    extraction_mode = config.EXTRACTION_MODE,
+    max_concurrency = config.EXTRACTION_MAX_CONCURRENCY,
+    document_attempts = config.EXTRACTION_DOCUMENT_ATTEMPTS
+  )
+
+  # Process-wide, so that retried submissions of the same PDFs skip the LLM
+  extraction_cache = check(
+    "extraction_cache",
+    lambda: create_extraction_cache(
+      backend = config.EXTRACTION_CACHE_BACKEND,
+      max_entries = config.EXTRACTION_CACHE_MAX_ENTRIES,
+      ttl_seconds = config.EXTRACTION_CACHE_TTL_SECONDS,
+      sqlite_path = config.EXTRACTION_CACHE_PATH
+    ),
+    backend = config.EXTRACTION_CACHE_BACKEND
+  )
+
+  # Generated returns, downloadable from any worker until they expire
+  document_store = check(
+    "document_store",
+    lambda: create_document_store(
+      backend = config.DOCUMENT_STORE_BACKEND,
+      retention_seconds = config.DOCUMENT_RETENTION_SECONDS,
+      max_bytes = config.DOCUMENT_STORE_MAX_BYTES,
+      path = config.DOCUMENT_STORE_PATH,
+      s3_bucket = config.DOCUMENT_STORE_S3_BUCKET,
+      s3_prefix = config.DOCUMENT_STORE_S3_PREFIX,
+      s3_endpoint_url = config.DOCUMENT_STORE_S3_ENDPOINT_URL,
+      redis_url = config.REDIS_URL
+    ),
+    backend = config.DOCUMENT_STORE_BACKEND
+  )
+
+  # Background jobs, pollable from any worker
+  job_store = check(
+    "job_store",
+    lambda: create_job_store(
+      backend = config.JOB_STORE_BACKEND,
+      retention_seconds = config.JOB_RETENTION_SECONDS,
+      lease_seconds = config.JOB_LEASE_SECONDS,
+      path = config.JOB_STORE_PATH,
+      redis_url = config.REDIS_URL
+    ),
+    backend = config.JOB_STORE_BACKEND
+  )
+
+  # Runs the submit pipeline without blocking other requests (e.g. document
+  # downloads): awaited on the event loop (SUBMIT_PIPELINE=async) or in the
+  # engine's I/O threads
+  engine = ExecutionEngine(
+    max_in_flight = config.SUBMIT_MAX_IN_FLIGHT,
+    max_queued = config.SUBMIT_MAX_QUEUED,
+    io_workers = config.SUBMIT_IO_WORKERS,
+    cpu_workers = config.SUBMIT_CPU_WORKERS
+  )
+  try:
+    # render workers started (spawned) now rather than by the first submission
+    check(
+      "render_workers",
+      lambda: engine.warm_up(
+        render_pdf_pages, str(template_path), None, _WARM_UP_PROFILE
+      ),
+      workers = engine.cpu_workers
+    )
+  except BaseException:
+    engine.shutdown()
+    raise
+
+  context = AppContext(
+    engine = engine,
+    llm_gateway = llm_gateway,
+    extraction_cache = extraction_cache,
+    extraction_settings = extraction_settings,
+    document_store = document_store,
+    job_store = job_store,
+    form_1040_template_path = template_path,
+    form_1040_template = template,
+    form_1040_generators = generators
+  )
+  context.checks = checks
+  context.register_gauges()
+  if config.METRICS_MULTIPROCESS_DIR:
+    REGISTRY.enable_multiprocess(
+      config.METRICS_MULTIPROCESS_DIR, config.METRICS_FLUSH_SECONDS
+    )
+  return context
+
+# FastAPI dependency, the context created by the app's lifespan
+def get_app_context(request: Request) -> AppContext:
+  return request.app.state.context
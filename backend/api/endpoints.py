@@ -1,140 +1,815 @@
-from fastapi import APIRouter, UploadFile, File, BackgroundTasks, Form
-from fastapi.responses import FileResponse, JSONResponse
-from typing import List, Annotated
+from fastapi import APIRouter, BackgroundTasks, Depends, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from typing import Any, AsyncIterator, Awaitable, Callable, List
+from functools import partial
 from pathlib import Path
-from tempfile import NamedTemporaryFile
 from pydantic import ValidationError
-import sys
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import os
 import uuid
 
-CURRENT_DIR = Path(__file__).resolve().parent
-SERVICES_DIR = (CURRENT_DIR / "../services").resolve()
-MODELS_DIR = (CURRENT_DIR / "../models").resolve()
+from core import config
+from api.app_context import AppContext, get_app_context
+from services.batch_processor import (
+  BatchManifestError,
+  ZipDocumentSource,
+  parse_manifest,
+  process_batch
+)
+from services.document_store import DocumentTruncatedError
+from services.execution_engine import EngineSaturatedError
+from services.form_extractor import PayloadTooLargeError
+from services.llm_gateway import LLMUnavailableError
+from services.generate_filled_1040 import generate_filled_1040, generate_filled_1040_async
+from services.job_store import JobNotFoundError
+from models.job_schema import JobStatus, TaxFormJob
+from services.metrics import CONTENT_TYPE, REGISTRY, SUBMISSIONS, SUBMISSIONS_COALESCED
+from models.tax_schema import TaxReturnSummary
+from services.upload_ingestion import (
+  SpooledUpload,
+  UploadLimits,
+  UploadRejected,
+  ingest_multipart,
+  sniff_pdf,
+  sniff_zip,
+  verify_pdf_uploads
+)
+from models.user_pii import UserPII
 
-sys.path.append(str(SERVICES_DIR))
-sys.path.append(str(MODELS_DIR))
+router = APIRouter()
 
-from generate_filled_1040 import generate_filled_1040
-from user_pii import UserPII, FilingType
+logger = logging.getLogger(__name__)
 
-router = APIRouter()
+PROCESSING_ERROR = "An unexpected error occurred during tax form processing. Please try again later"
+LLM_UNAVAILABLE_ERROR = "Document analysis is temporarily overloaded. Please try again shortly."
+PAYLOAD_TOO_LARGE_ERROR = "The uploaded documents are too large to process. Please upload fewer or smaller pages."
+# Sent with the 503 of a request turned away before any of its work started
+# (no LLM call made), so clients know it is safe to send again. The 503 of
+# LLMUnavailableError does not have it.
+NOT_STARTED_HEADER = { "X-Submission-Started" : "false" }
+
+class SubmissionRejected(Exception):
+  def __init__(self, status_code: int, content: dict):
+    super().__init__(content)
+    self.status_code = status_code
+    self.content = content
+
+  def response(self) -> JSONResponse:
+    return JSONResponse(status_code = self.status_code, content = self.content)
+
+UPLOAD_LIMITS = UploadLimits(
+  max_file_bytes = config.UPLOAD_MAX_FILE_BYTES,
+  max_request_bytes = config.UPLOAD_MAX_REQUEST_BYTES,
+  max_files = 3
+)
+
+BATCH_UPLOAD_LIMITS = UploadLimits(
+  max_file_bytes = config.BATCH_MAX_ARCHIVE_BYTES,
+  max_request_bytes = config.BATCH_MAX_ARCHIVE_BYTES + 64 * 1024,
+  max_files = 1
+)
+
+def _content_length(request: Request) -> int | None:
+  try:
+    return int(request.headers["content-length"])
+  except (KeyError, ValueError):
+    return None
+
+# Reads the PII form fields and PDFs of a submission off the request
+# stream, the PDFs straight into temporary files. Oversized or non-PDF
+# uploads are rejected as soon as they show up, before the rest of the
+# body is read. The caller is responsible for deleting the uploaded files.
+async def _ingest_submission(request: Request) -> tuple[dict, List[SpooledUpload]]:
+  try:
+    fields, uploads = await ingest_multipart(
+      request.stream(),
+      content_type = request.headers.get("content-type"),
+      content_length = _content_length(request),
+      limits = UPLOAD_LIMITS,
+      file_field = "files",
+      suffix = ".pdf",
+      sniff = sniff_pdf,
+      max_pages = config.UPLOAD_MAX_PAGES_PER_FILE
+    )
+  except UploadRejected as e:
+    raise SubmissionRejected(e.status_code, { "error" : e.message })
+
+  try:
+    if not uploads:
+      raise UploadRejected(400, "You must upload between 1 and 3 PDF files.")
+    await asyncio.to_thread(
+      verify_pdf_uploads, uploads, config.UPLOAD_MAX_PAGES_PER_FILE
+    )
+  except UploadRejected as e:
+    for upload in uploads:
+      upload.path.unlink(missing_ok = True)
+    raise SubmissionRejected(e.status_code, { "error" : e.message })
+
+  return fields, uploads
+
+def _parse_pii(fields: dict) -> UserPII:
+  pii_fields = { name : fields[name] for name in UserPII.model_fields if name in fields }
+  try:
+    return UserPII.model_validate(pii_fields)
+  except ValidationError as e:
+    raise SubmissionRejected(
+      422,
+      {
+        "error" : "Invalid personal information.",
+        "details" : e.errors()
+      }
+    )
+
+# Same documents, in the same order, for the same taxpayer
+def _submission_key(uploads: List[SpooledUpload], pii: UserPII) -> str:
+  submission = {
+    "documents" : [upload.sha256 for upload in uploads],
+    "pii" : pii.model_dump(mode = "json")
+  }
+  return hashlib.sha256(
+    json.dumps(submission, sort_keys = True).encode()
+  ).hexdigest()
 
-OUTPUT_DIR = (CURRENT_DIR / "../static/generated_documents/").resolve()
-OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+# Identical submissions arriving while one is being processed (double
+# clicks, client retries) wait for it instead of extracting the documents
+# again. Each caller still gets its own document_id, a copy of the
+# generated return. joining is awaited before waiting for an identical
+# submission, which does not call run.
+async def _coalesced(
+  context: AppContext,
+  key: str,
+  document_id: str,
+  run: Callable[[], Awaitable[TaxReturnSummary]],
+  joining: Callable[[], Awaitable[None]] | None = None
+) -> TaxReturnSummary:
+  if not config.SUBMIT_COALESCE_IDENTICAL:
+    return await run()
+
+  if joining is not None and context.in_flight_submissions.running(key):
+    await joining()
+
+  async def first() -> tuple[str, TaxReturnSummary]:
+    return document_id, await run()
+
+  (source_id, summary), shared = await context.in_flight_submissions.run(
+    key, first
+  )
+  if shared:
+    SUBMISSIONS_COALESCED.inc()
+    await asyncio.to_thread(context.document_store.copy, source_id, document_id)
+  return summary
+
+# Preloaded by the app context, shared by every return
+def _pipeline_settings(context: AppContext, pii: UserPII) -> dict:
+  return {
+    "input_pdf_path" : context.form_1040_template_path,
+    "render_executor" : context.engine.cpu_executor(),
+    "extraction_cache" : context.extraction_cache,
+    "extraction_settings" : context.extraction_settings,
+    "form_template" : context.form_1040_template,
+    "form_generator" : context.form_1040_generators[pii.filing_status],
+    "document_store" : context.document_store,
+    "llm_gateway" : context.llm_gateway
+  }
+
+def _run_pipeline(
+  context: AppContext,
+  temp_pdf_paths: List[Path],
+  pii: UserPII,
+  document_id: str
+) -> TaxReturnSummary:
+  return generate_filled_1040(
+    file_buffers = temp_pdf_paths,
+    pii = pii,
+    **_pipeline_settings(context, pii),
+    document_id = document_id
+  )
+
+async def _run_pipeline_async(
+  context: AppContext,
+  temp_pdf_paths: List[Path],
+  pii: UserPII,
+  document_id: str
+) -> TaxReturnSummary:
+  return await generate_filled_1040_async(
+    file_buffers = temp_pdf_paths,
+    pii = pii,
+    **_pipeline_settings(context, pii),
+    document_id = document_id
+  )
+
+def _submission_result(document_id: str, summary: TaxReturnSummary) -> dict:
+  return {
+    "document_id" : document_id,
+    "tax_return_summary" : summary.model_dump(mode = "json")
+  }
+
+def _outcome(error: Exception | None) -> str:
+  if error is None:
+    return "succeeded"
+  if isinstance(error, EngineSaturatedError):
+    return "busy"
+  if isinstance(error, PayloadTooLargeError):
+    return "payload_too_large"
+  if isinstance(error, LLMUnavailableError):
+    return "llm_unavailable"
+  return "error"
+
+# Counts the outcome of a submission in tax_submissions_total
+async def _counted(endpoint: str, submission: Awaitable[Any]) -> Any:
+  try:
+    result = await submission
+  except Exception as e:
+    SUBMISSIONS.inc(endpoint = endpoint, outcome = _outcome(e))
+    raise
+  SUBMISSIONS.inc(endpoint = endpoint, outcome = _outcome(None))
+  return result
+
+def _error_message(error: Exception) -> str:
+  if isinstance(error, PayloadTooLargeError):
+    return PAYLOAD_TOO_LARGE_ERROR
+  if isinstance(error, LLMUnavailableError):
+    return LLM_UNAVAILABLE_ERROR
+  return PROCESSING_ERROR
+
+# OpenAPI description of a multipart body read with ingest_multipart, which
+# FastAPI cannot infer from the handler parameters
+def _multipart_body(properties: dict, required: List[str]) -> dict:
+  return {
+    "requestBody" : {
+      "required" : True,
+      "content" : {
+        "multipart/form-data" : {
+          "schema" : {
+            "type" : "object",
+            "properties" : properties,
+            "required" : required
+          }
+        }
+      }
+    }
+  }
+
+_PII_SCHEMA = UserPII.model_json_schema()
+
+SUBMISSION_BODY = _multipart_body(
+  properties = {
+    **{
+      name : { "type" : "string", "description" : field.get("description", "") }
+      for name, field in _PII_SCHEMA["properties"].items()
+    },
+    "files" : {
+      "type" : "array",
+      "items" : { "type" : "string", "format" : "binary" },
+      "minItems" : 1,
+      "maxItems" : 3
+    }
+  },
+  required = [*_PII_SCHEMA["required"], "files"]
+)
+
+BATCH_BODY = _multipart_body(
+  properties = { "archive" : { "type" : "string", "format" : "binary" } },
+  required = ["archive"]
+)
 
 @router.get("/")
 async def home():
   return { "message" : "AI Tax Return Agent backend is running" }
 
+# Readiness: 200 once the app context is loaded and checked (template,
+# tax policies, LLM client, stores, render workers), 503 while starting or
+# shutting down, so load balancers only send traffic to ready workers
+@router.get("/api/health")
+async def health(request: Request):
+  context : AppContext | None = getattr(request.app.state, "context", None)
+  if context is None or not context.ready:
+    return JSONResponse(status_code = 503, content = { "status" : "unavailable" })
+
+  return JSONResponse(
+    content = {
+      "status" : "ready",
+      # which worker process answered
+      "pid" : os.getpid(),
+      "checks" : context.checks,
+      "engine" : context.engine.stats()
+    }
+  )
+
+# Prometheus text format: per stage latency histograms of the submit
+# pipeline, pages rendered, LLM payload bytes and tokens, submissions by
+# outcome and HTTP request durations, for this worker process or, with
+# METRICS_MULTIPROCESS_DIR, for all the workers
+@router.get("/api/metrics")
+async def get_metrics():
+  return Response(await asyncio.to_thread(REGISTRY.render), media_type = CONTENT_TYPE)
+
 # Upload files, post user PII, extract data, calculate taxes, and
 # generate Form 1040 (do not send to user yet)
-@router.post("/api/submit_tax_form", response_class = JSONResponse)
+@router.post(
+  "/api/submit_tax_form",
+  response_class = JSONResponse,
+  openapi_extra = SUBMISSION_BODY
+)
 async def upload_documents(
-  background_tasks          : BackgroundTasks,
- 
-  # Individual form fields
-  # because using UserPII causes 422 error after POST request
-  first_name_middle_initial : Annotated[str, Form()],
-  last_name                 : Annotated[str, Form()],
-  ssn                       : Annotated[str, Form()],
-  address                   : Annotated[str, Form()],
-  city                      : Annotated[str, Form()],
-  state                     : Annotated[str, Form()],
-  zip_code                  : Annotated[str, Form()],
-  filing_status             : Annotated[str, Form()] = FilingType.single,
-  apt_no                    : Annotated[str | None, Form()] = None,
-
-  files                     : List[UploadFile] = File(...),
+  request: Request,
+  background_tasks: BackgroundTasks,
+  context: AppContext = Depends(get_app_context)
 ):
-  temp_pdf_paths = []
-  
-  if not (1 <= len(files) <= 3):
-    return JSONResponse(
-        status_code = 400,
-        content = { "error" : "You must upload between 1 and 3 PDF files." }
-    )
+  try:
+    fields, uploads = await _ingest_submission(request)
+  except SubmissionRejected as e:
+    return e.response()
 
-  for file in files:
-    if file.content_type != "application/pdf" or not file.filename.endswith(".pdf"):
-      return JSONResponse(
-        status_code = 400,
-        content = {
-          "error": f"Invalid file type: {file.filename}. Only PDF files are accepted."
-        }
+  temp_pdf_paths = [upload.path for upload in uploads]
+  for temp_path in temp_pdf_paths:
+    background_tasks.add_task(temp_path.unlink, missing_ok=True)
+
+  try:
+    pii = _parse_pii(fields)
+  except SubmissionRejected as e:
+    return e.response()
+
+  document_id = f"{uuid.uuid4().hex}.pdf"
+
+  try:
+    tax_return_summary : TaxReturnSummary = await _counted(
+      "submit_tax_form",
+      _coalesced(
+        context,
+        _submission_key(uploads, pii),
+        document_id,
+        lambda: (
+          context.engine.submit_async(
+            _run_pipeline_async, context, temp_pdf_paths, pii, document_id
+          )
+          if config.SUBMIT_PIPELINE == "async" else
+          context.engine.submit(
+            _run_pipeline, context, temp_pdf_paths, pii, document_id
+          )
+        )
       )
-    content = await file.read()
-    with NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
-      tmp.write(content)
-      temp_path = Path(tmp.name)
-      temp_pdf_paths.append(temp_path)
-      background_tasks.add_task(temp_path.unlink, missing_ok=True)
-
-  try:
-    pii = UserPII.model_validate({
-      "first_name_middle_initial" : first_name_middle_initial,
-      "last_name"                 : last_name,
-      "ssn"                       : ssn,
-      "address"                   : address,
-      "apt_no"                    : apt_no,
-      "city"                      : city,
-      "state"                     : state,
-      "zip_code"                  : zip_code,
-      "filing_status"             : filing_status,
-    })
-  except ValidationError as e:
+    )
+  except EngineSaturatedError:
     return JSONResponse(
-        status_code = 422,
+        status_code = 503,
+        headers = { "Retry-After" : "5", **NOT_STARTED_HEADER },
         content = {
-          "error" : "Invalid personal information.",
-          "details" : e.errors()
+          "error" : "The server is busy processing other returns. Please try again shortly."
         }
     )
+  except PayloadTooLargeError:
+    return JSONResponse(
+        status_code = 413,
+        content = { "error" : PAYLOAD_TOO_LARGE_ERROR }
+    )
+  except LLMUnavailableError:
+    return JSONResponse(
+        status_code = 503,
+        headers = { "Retry-After" : "30" },
+        content = { "error" : LLM_UNAVAILABLE_ERROR }
+    )
+  except Exception:
+    logger.exception("Tax form submission %s failed", document_id)
+    return JSONResponse(
+        status_code = 500,
+        content = { "error" : PROCESSING_ERROR }
+    )
 
-  input_pdf_path = (
-    CURRENT_DIR / "../static/templates/f1040_2024.pdf"
-  ).resolve(strict=True)
+  return JSONResponse(
+    content = _submission_result(document_id, tax_return_summary)
+  )
 
+async def _run_job(
+  context: AppContext,
+  job_id: str,
+  temp_pdf_paths: List[Path],
+  pii: UserPII,
+  submission_key: str
+):
   document_id = f"{uuid.uuid4().hex}.pdf"
-  output_pdf_path = OUTPUT_DIR / document_id
+
+  job_store = context.job_store
+
+  async def running() -> None:
+    await asyncio.to_thread(job_store.update, job_id, status = JobStatus.running)
+
+  def work() -> TaxReturnSummary:
+    job_store.update(job_id, status = JobStatus.running)
+    return _run_pipeline(context, temp_pdf_paths, pii, document_id)
+
+  async def work_async() -> TaxReturnSummary:
+    await running()
+    return await _run_pipeline_async(context, temp_pdf_paths, pii, document_id)
+
+  def run() -> Awaitable[TaxReturnSummary]:
+    if config.SUBMIT_PIPELINE == "async":
+      return context.engine.run_async(work_async)
+    return context.engine.run(work)
 
   try:
-    tax_return_summary : TaxReturnSummary = generate_filled_1040(
-      file_buffers = temp_pdf_paths,
-      pii = pii,
-      input_pdf_path = input_pdf_path,
-      output_pdf_path = output_pdf_path
+    summary = await _counted(
+      "jobs",
+      # a job sharing an identical job's work runs as soon as it joins
+      _coalesced(context, submission_key, document_id, run, joining = running)
+    )
+  except PayloadTooLargeError:
+    await asyncio.to_thread(
+      job_store.update,
+      job_id, status = JobStatus.failed, error = PAYLOAD_TOO_LARGE_ERROR
+    )
+  except LLMUnavailableError:
+    await asyncio.to_thread(
+      job_store.update,
+      job_id, status = JobStatus.failed, error = LLM_UNAVAILABLE_ERROR
+    )
+  except Exception:
+    logger.exception("Job %s failed", job_id)
+    await asyncio.to_thread(
+      job_store.update,
+      job_id, status = JobStatus.failed, error = PROCESSING_ERROR
     )
+  else:
+    await asyncio.to_thread(
+      job_store.update,
+      job_id,
+      status = JobStatus.succeeded,
+      document_id = document_id,
+      tax_return_summary = summary
+    )
+  finally:
+    for temp_path in temp_pdf_paths:
+      temp_path.unlink(missing_ok = True)
+
+def _job_status(job: TaxFormJob) -> dict:
+  return {
+    **job.model_dump(mode = "json", exclude = { "tax_return_summary" }),
+    "status_url" : f"/api/jobs/{job.job_id}",
+    "result_url" : f"/api/jobs/{job.job_id}/result",
+    "events_url" : f"/api/jobs/{job.job_id}/events"
+  }
+
+def _job_not_found() -> JSONResponse:
+  return JSONResponse(status_code = 404, content = { "error" : "Job not found" })
+
+# Same input as /api/submit_tax_form, but returns a job id right away and
+# processes the documents in the background
+@router.post(
+  "/api/jobs",
+  response_class = JSONResponse,
+  status_code = 202,
+  openapi_extra = SUBMISSION_BODY
+)
+async def create_tax_form_job(
+  request: Request,
+  context: AppContext = Depends(get_app_context)
+):
+  pending = await asyncio.to_thread(context.job_store.count_pending)
+  if pending >= config.JOB_MAX_PENDING:
+    return JSONResponse(
+        status_code = 503,
+        headers = { "Retry-After" : "5", **NOT_STARTED_HEADER },
+        content = {
+          "error" : "Too many returns are being processed. Please try again shortly."
+        }
+    )
+
+  try:
+    fields, uploads = await _ingest_submission(request)
+  except SubmissionRejected as e:
+    return e.response()
+
+  temp_pdf_paths = [upload.path for upload in uploads]
+  try:
+    pii = _parse_pii(fields)
+  except SubmissionRejected as e:
+    for temp_path in temp_pdf_paths:
+      temp_path.unlink(missing_ok = True)
+    return e.response()
+
+  job = await asyncio.to_thread(context.job_store.create)
+
+  context.start_job(
+    job.job_id,
+    _run_job(
+      context, job.job_id, temp_pdf_paths, pii, _submission_key(uploads, pii)
+    )
+  )
+
+  return JSONResponse(status_code = 202, content = _job_status(job))
+
+@router.get("/api/jobs/{job_id}", response_class = JSONResponse)
+async def get_tax_form_job(
+  job_id: str,
+  context: AppContext = Depends(get_app_context)
+):
+  try:
+    job = await asyncio.to_thread(context.job_store.get, job_id)
+  except JobNotFoundError:
+    return _job_not_found()
+
+  return JSONResponse(content = _job_status(job))
+
+# Same payload as /api/submit_tax_form once the job succeeded,
+# 202 with the job status while it is still processing
+@router.get("/api/jobs/{job_id}/result", response_class = JSONResponse)
+async def get_tax_form_job_result(
+  job_id: str,
+  context: AppContext = Depends(get_app_context)
+):
+  try:
+    job = await asyncio.to_thread(context.job_store.get, job_id)
+  except JobNotFoundError:
+    return _job_not_found()
+
+  if job.status == JobStatus.succeeded:
+    return JSONResponse(
+      content = _submission_result(job.document_id, job.tax_return_summary)
+    )
+
+  if job.status == JobStatus.failed:
+    return JSONResponse(status_code = 500, content = { "error" : job.error })
+
+  return JSONResponse(status_code = 202, content = _job_status(job))
+
+# Server-sent events: one "status" event per status change,
+# the stream ends once the job succeeded or failed
+@router.get("/api/jobs/{job_id}/events")
+async def stream_tax_form_job_events(
+  job_id: str,
+  request: Request,
+  context: AppContext = Depends(get_app_context)
+):
+  job_store = context.job_store
+  try:
+    await asyncio.to_thread(job_store.get, job_id)
+  except JobNotFoundError:
+    return _job_not_found()
+
+  async def events() -> AsyncIterator[str]:
+    last_status = None
+    idle = 0.0
+
+    while not await request.is_disconnected():
+      try:
+        job = await asyncio.to_thread(job_store.get, job_id)
+      except JobNotFoundError:
+        return
+
+      if job.status != last_status:
+        last_status = job.status
+        idle = 0.0
+        yield f"event: status\ndata: {json.dumps(_job_status(job))}\n\n"
+        if job.status.is_terminal:
+          return
+      elif idle >= config.JOB_EVENTS_KEEPALIVE_SECONDS:
+        # comment line, keeps proxies from closing an idle connection
+        idle = 0.0
+        yield ": keep-alive\n\n"
+
+      await asyncio.sleep(config.JOB_EVENTS_POLL_SECONDS)
+      idle += config.JOB_EVENTS_POLL_SECONDS
+
+  return StreamingResponse(
+    events(),
+    media_type = "text/event-stream",
+    headers = { "Cache-Control" : "no-cache", "X-Accel-Buffering" : "no" }
+  )
+
+# Single "bytes=" range as (start, end) inclusive, None to send the whole
+# document. Raises ValueError when the range cannot be satisfied.
+def _parse_range(range_header: str, size: int) -> tuple[int, int] | None:
+  unit, _, ranges = range_header.partition("=")
+  # multiple ranges are allowed to be answered with the whole document
+  if unit.strip() != "bytes" or "," in ranges:
+    return None
+
+  first, _, last = ranges.strip().partition("-")
+  try:
+    if not first:
+      # suffix range: the last n bytes
+      start, end = max(size - int(last), 0), size - 1
+    else:
+      start = int(first)
+      end = min(int(last), size - 1) if last else size - 1
+  except ValueError:
+    return None
+
+  if start > end or start >= size:
+    raise ValueError(range_header)
+  return start, end
+
+# Batch taxpayers hold at most BATCH_MAX_IN_FLIGHT engine slots between
+# all the batches of the worker, so they cannot take every slot (or fill
+# the wait queue) ahead of interactive submissions
+async def _in_batch_slot(
+  context: AppContext,
+  run: Callable[..., Awaitable[Any]],
+  *args
+) -> Any:
+  async with context.batch_slots:
+    return await run(*args)
+
+def _run_batch_return(
+  context: AppContext,
+  temp_pdf_paths: List[Path],
+  pii: UserPII,
+  taxpayer_id: str
+) -> dict:
+  document_id = f"{uuid.uuid4().hex}.pdf"
+  try:
+    summary = _run_pipeline(context, temp_pdf_paths, pii, document_id)
   except Exception as e:
+    SUBMISSIONS.inc(endpoint = "batches", outcome = _outcome(e))
+    raise
+  SUBMISSIONS.inc(endpoint = "batches", outcome = _outcome(None))
+  return _submission_result(document_id, summary)
+
+async def _run_batch_return_async(
+  context: AppContext,
+  temp_pdf_paths: List[Path],
+  pii: UserPII,
+  taxpayer_id: str
+) -> dict:
+  document_id = f"{uuid.uuid4().hex}.pdf"
+  summary = await _counted(
+    "batches",
+    _in_batch_slot(
+      context,
+      context.engine.run_async,
+      _run_pipeline_async, context, temp_pdf_paths, pii, document_id
+    )
+  )
+  return _submission_result(document_id, summary)
+
+# Many taxpayers in one request: a zip archive with a manifest.jsonl (or
+# manifest.json) at its root, one line per taxpayer:
+#   { "taxpayer_id" : "...", "pii" : { ...same fields as the form... },
+#     "documents" : ["path/in/archive/w2.pdf", ...] }
+# Streams one NDJSON line per taxpayer as soon as it completes, with the
+# same document_id + tax_return_summary as /api/submit_tax_form, or an
+# error. Taxpayers go through the shared execution engine at most
+# BATCH_MAX_IN_FLIGHT at a time across all batches, and no more are
+# started while the client is not reading.
+@router.post("/api/batches", openapi_extra = BATCH_BODY)
+async def submit_batch(
+  request: Request,
+  context: AppContext = Depends(get_app_context)
+):
+  # the slot is taken before the archive is read, so concurrent uploads
+  # cannot all get past the limit. It is released here when the batch is
+  # rejected, otherwise by the result stream once it ends.
+  if context.active_batches >= config.BATCH_MAX_CONCURRENT:
     return JSONResponse(
-        status_code = 500,
+        status_code = 503,
+        headers = { "Retry-After" : "30", **NOT_STARTED_HEADER },
         content = {
-          "error" : "An unexpected error occurred during tax form processing. Please try again later"
+          "error" : "Too many batches are being processed. Please try again shortly."
         }
     )
+  context.active_batches += 1
 
-  return JSONResponse(content = {
-    "document_id" : document_id,
-    "tax_return_summary" : tax_return_summary.model_dump(mode = "json")
-  })
+  archive_path = None
+  source = None
+  streaming = False
+  try:
+    # the archive goes straight to a temporary file that outlives this
+    # handler, results keep streaming from it after it returns
+    try:
+      _, uploads = await ingest_multipart(
+        request.stream(),
+        content_type = request.headers.get("content-type"),
+        content_length = _content_length(request),
+        limits = BATCH_UPLOAD_LIMITS,
+        file_field = "archive",
+        suffix = ".zip",
+        sniff = sniff_zip
+      )
+    except UploadRejected as e:
+      return JSONResponse(status_code = e.status_code, content = { "error" : e.message })
 
-# return form 1040 generated
-@router.get("/api/documents/{document_id}", response_class = FileResponse)
+    if not uploads:
+      return JSONResponse(
+          status_code = 400,
+          content = { "error" : "The batch archive is missing." }
+      )
+    archive_path = uploads[0].path
+
+    try:
+      source = await asyncio.to_thread(
+        ZipDocumentSource, archive_path, config.BATCH_MAX_DOCUMENT_BYTES
+      )
+      taxpayers = parse_manifest(
+        await asyncio.to_thread(source.manifest),
+        max_taxpayers = config.BATCH_MAX_TAXPAYERS
+      )
+    except BatchManifestError as e:
+      return JSONResponse(status_code = 400, content = { "error" : str(e) })
+
+    async def results() -> AsyncIterator[str]:
+      try:
+        async for result in process_batch(
+          taxpayers,
+          source,
+          run_return = partial(
+            _run_batch_return_async
+            if config.SUBMIT_PIPELINE == "async" else
+            _run_batch_return,
+            context
+          ),
+          execute = partial(_in_batch_slot, context, context.engine.run),
+          max_in_flight = config.BATCH_MAX_IN_FLIGHT,
+          describe_error = _error_message
+        ):
+          yield json.dumps(result) + "\n"
+      finally:
+        context.active_batches -= 1
+        source.close()
+        archive_path.unlink(missing_ok = True)
+
+    response = StreamingResponse(
+      results(),
+      media_type = "application/x-ndjson",
+      headers = { "Cache-Control" : "no-cache", "X-Accel-Buffering" : "no" }
+    )
+    streaming = True
+    return response
+  finally:
+    if not streaming:
+      context.active_batches -= 1
+      if source is not None:
+        source.close()
+      if archive_path is not None:
+        archive_path.unlink(missing_ok = True)
+
+# return form 1040 generated, can be downloaded again (and resumed with
+# Range requests) until the document store expires it
+@router.get("/api/documents/{document_id}")
 async def get_generated_form1040(
-  background_tasks: BackgroundTasks,
-  document_id: str
+  request: Request,
+  document_id: str,
+  context: AppContext = Depends(get_app_context)
 ):
-  file_path = OUTPUT_DIR / document_id
+  document_store = context.document_store
+  document = await asyncio.to_thread(document_store.stat, document_id)
 
-  if not file_path.exists():
+  if document is None:
     return JSONResponse(
       status_code = 404,
       content = { "error" : "Document not found" }
     )
 
-  background_tasks.add_task(file_path.unlink, missing_ok = True)
+  headers = {
+    "ETag" : document.etag,
+    "Accept-Ranges" : "bytes",
+    "Cache-Control" : "private, no-store",
+    "Content-Disposition" : 'attachment; filename="filled_1040.pdf"'
+  }
+
+  if_none_match = request.headers.get("if-none-match")
+  if if_none_match and document.etag in (t.strip() for t in if_none_match.split(",")):
+    return Response(status_code = 304, headers = headers)
+
+  byte_range = None
+  range_header = request.headers.get("range")
+  if_range = request.headers.get("if-range")
+  # a stale If-Range means the client's partial copy is of another version
+  if range_header and (if_range is None or if_range == document.etag):
+    try:
+      byte_range = _parse_range(range_header, document.size)
+    except ValueError:
+      return Response(
+        status_code = 416,
+        headers = { **headers, "Content-Range" : f"bytes */{document.size}" }
+      )
+
+  if byte_range is None:
+    start, end, status_code = 0, document.size - 1, 200
+  else:
+    start, end = byte_range
+    status_code = 206
+    headers["Content-Range"] = f"bytes {start}-{end}/{document.size}"
+  headers["Content-Length"] = str(end - start + 1)
+
+  # the document can expire or be replaced between stat and read: its first
+  # chunk is read before the headers go out, so that answers 404 rather
+  # than a body cut short of its Content-Length. Later the stream fails.
+  chunks = document_store.read(document_id, start, end)
+  try:
+    first_chunk = await asyncio.to_thread(next, chunks, b"")
+  except (KeyError, DocumentTruncatedError):
+    return JSONResponse(
+      status_code = 404,
+      content = { "error" : "Document not found" }
+    )
 
-  return FileResponse(
-    path = file_path,
+  return StreamingResponse(
+    itertools.chain((first_chunk,), chunks),
+    status_code = status_code,
     media_type = "application/pdf",
-    filename = "filled_1040.pdf"
+    headers = headers
   )
@@ -0,0 +1,46 @@
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import time
+
+from services.metrics import HTTP_REQUEST_SECONDS
+from services.tracing import span
+
+# Times every HTTP request into http_request_duration_seconds, labeled with
+# the route template (/api/jobs/{job_id}) rather than the path so the
+# number of series stays bounded, and opens the request's root span when
+# tracing is on. Plain ASGI, so streamed responses (SSE, NDJSON, document
+# downloads) are timed until their last chunk has been sent.
+class RequestMetricsMiddleware:
+  def __init__(self, app: ASGIApp):
+    self.app = app
+
+  async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+    if scope["type"] != "http":
+      await self.app(scope, receive, send)
+      return
+
+    start = time.perf_counter()
+    status = 500
+
+    async def send_with_status(message: Message) -> None:
+      nonlocal status
+      if message["type"] == "http.response.start":
+        status = message["status"]
+      await send(message)
+
+    with span(f"HTTP {scope['method']}") as current:
+      try:
+        await self.app(scope, receive, send_with_status)
+      finally:
+        # set on the scope by the router once a route matched
+        route = getattr(scope.get("route"), "path", None) or "unmatched"
+        if current is not None:
+          current.update_name(f"{scope['method']} {route}")
+          current.set_attribute("http.route", route)
+          current.set_attribute("http.response.status_code", status)
+
+        HTTP_REQUEST_SECONDS.observe(
+          time.perf_counter() - start,
+          method = scope["method"],
+          route = route,
+          status = str(status)
+        )
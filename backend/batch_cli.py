@@ -0,0 +1,193 @@
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import List
+import argparse
+import asyncio
+import json
+import multiprocessing
+import sys
+import time
+
+from core import config
+from services.batch_processor import (
+  BatchManifestError,
+  open_document_source,
+  parse_manifest,
+  process_batch
+)
+from services.execution_engine import ExecutionEngine
+from services.extraction_cache import create_extraction_cache
+from services.form_extractor import ExtractionSettings
+from services.render_profiles import RenderProfile
+from services.form_generator import load_form_1040_template
+from services.generate_filled_1040 import generate_filled_1040
+from services.llm_gateway import configure_llm_gateway
+from models.user_pii import UserPII
+
+CURRENT_DIR = Path(__file__).resolve().parent
+
+# Batch counterpart of POST /api/batches, without the HTTP server. Takes a
+# zip archive with a manifest at its root, or a manifest file whose
+# documents are relative to its directory, writes <taxpayer_id>.pdf to
+# --output-dir and one NDJSON result line per taxpayer as it completes.
+# Same configuration (environment variables) as the API.
+#
+#   python batch_cli.py households.zip --output-dir out/ > results.ndjson
+#   python batch_cli.py manifest.jsonl --output-dir out/ --max-in-flight 16
+#   python batch_cli.py households.zip --output-dir out/ --processes 4
+
+FORM_1040_TEMPLATE_PATH = CURRENT_DIR / "static" / "templates" / "f1040_2024.pdf"
+
+# Per process pipeline state, built once by _init_pipeline (in this process,
+# or in every worker process with --processes)
+_pipeline : dict = {}
+
+def _init_pipeline(output_dir: str, budget_share: float) -> None:
+  configure_llm_gateway(
+    # worker processes split the OpenAI budgets between them
+    requests_per_minute = config.OPENAI_REQUESTS_PER_MINUTE * budget_share,
+    tokens_per_minute = config.OPENAI_TOKENS_PER_MINUTE * budget_share,
+    max_attempts = config.OPENAI_MAX_ATTEMPTS,
+    request_timeout_seconds = config.OPENAI_REQUEST_TIMEOUT_SECONDS,
+    deadline_seconds = config.OPENAI_DEADLINE_SECONDS,
+    max_connections = config.OPENAI_MAX_CONNECTIONS
+  )
+  _pipeline.update(
+    output_dir = Path(output_dir),
+    extraction_cache = create_extraction_cache(
+      backend = config.EXTRACTION_CACHE_BACKEND,
+      max_entries = config.EXTRACTION_CACHE_MAX_ENTRIES,
+      ttl_seconds = config.EXTRACTION_CACHE_TTL_SECONDS,
+      sqlite_path = config.EXTRACTION_CACHE_PATH
+    ),
+    extraction_settings = ExtractionSettings(
+      read_acroforms = config.ACROFORM_FAST_PATH,
+      model = config.EXTRACTION_MODEL,
+      render_profile = RenderProfile(
+        dpi = config.EXTRACTION_DPI,
+        grayscale = config.EXTRACTION_GRAYSCALE,
+        jpeg_quality = config.EXTRACTION_JPEG_QUALITY,
+        crop_to_content = config.EXTRACTION_CROP_TO_CONTENT,
+        detail = config.EXTRACTION_IMAGE_DETAIL
+      ),
+      max_payload_bytes = config.EXTRACTION_MAX_PAYLOAD_BYTES,
+      render_mode = config.EXTRACTION_RENDER_MODE,
+      extraction_mode = config.EXTRACTION_MODE,
+      max_concurrency = config.EXTRACTION_MAX_CONCURRENCY,
+      document_attempts = config.EXTRACTION_DOCUMENT_ATTEMPTS
+    ),
+    form_template = load_form_1040_template(str(FORM_1040_TEMPLATE_PATH))
+  )
+
+def _generate_return(
+  temp_pdf_paths: List[Path],
+  pii: UserPII,
+  taxpayer_id: str,
+  render_executor: Executor | None = None
+) -> dict:
+  output_pdf_path = _pipeline["output_dir"] / f"{taxpayer_id}.pdf"
+  summary = generate_filled_1040(
+    file_buffers = temp_pdf_paths,
+    pii = pii,
+    input_pdf_path = FORM_1040_TEMPLATE_PATH,
+    output_pdf_path = output_pdf_path,
+    render_executor = render_executor,
+    extraction_cache = _pipeline["extraction_cache"],
+    extraction_settings = _pipeline["extraction_settings"],
+    form_template = _pipeline["form_template"]
+  )
+  return {
+    "output_pdf_path" : str(output_pdf_path),
+    "tax_return_summary" : summary.model_dump(mode = "json")
+  }
+
+async def run_batch(args: argparse.Namespace) -> int:
+  try:
+    source = open_document_source(args.input, config.BATCH_MAX_DOCUMENT_BYTES)
+    taxpayers = parse_manifest(source.manifest())
+  except (BatchManifestError, OSError) as e:
+    print(f"error: {e}", file = sys.stderr)
+    return 2
+
+  Path(args.output_dir).mkdir(parents = True, exist_ok = True)
+
+  # Threads spool each taxpayer's documents out of the source and wait on
+  # the pipeline; with --processes the pipeline itself (AcroForm reads,
+  # rendering, form filling, all CPU bound) runs in worker processes
+  engine = ExecutionEngine(
+    max_in_flight = args.max_in_flight,
+    max_queued = 0,
+    io_workers = args.max_in_flight,
+    cpu_workers = 0 if args.processes else config.SUBMIT_CPU_WORKERS
+  )
+  if args.processes:
+    workers = ProcessPoolExecutor(
+      max_workers = args.processes,
+      mp_context = multiprocessing.get_context("spawn"),
+      initializer = _init_pipeline,
+      initargs = (args.output_dir, 1 / args.processes)
+    )
+
+    def run_return(temp_pdf_paths: List[Path], pii: UserPII, taxpayer_id: str) -> dict:
+      return workers.submit(_generate_return, temp_pdf_paths, pii, taxpayer_id).result()
+  else:
+    workers = None
+    _init_pipeline(args.output_dir, 1.0)
+
+    def run_return(temp_pdf_paths: List[Path], pii: UserPII, taxpayer_id: str) -> dict:
+      return _generate_return(
+        temp_pdf_paths, pii, taxpayer_id, render_executor = engine.cpu_executor()
+      )
+
+  results = open(args.results, "w") if args.results else sys.stdout
+  failed = 0
+  start = time.perf_counter()
+  try:
+    async for result in process_batch(
+      taxpayers,
+      source,
+      run_return = run_return,
+      execute = engine.run,
+      max_in_flight = args.max_in_flight,
+      describe_error = lambda e: f"{type(e).__name__}: {e}"
+    ):
+      failed += result["status"] == "failed"
+      results.write(json.dumps(result) + "\n")
+      results.flush()
+  finally:
+    source.close()
+    engine.shutdown()
+    if workers is not None:
+      workers.shutdown()
+    if results is not sys.stdout:
+      results.close()
+
+  elapsed = time.perf_counter() - start
+  print(
+    f"{len(taxpayers)} taxpayers, {failed} failed, {elapsed:.1f}s "
+    f"({len(taxpayers) / elapsed:.1f} returns/s)",
+    file = sys.stderr
+  )
+  return 1 if failed else 0
+
+def main():
+  parser = argparse.ArgumentParser(
+    description = "Generate Form 1040s for a batch of taxpayers"
+  )
+  parser.add_argument("input", help = "zip archive or manifest file")
+  parser.add_argument("--output-dir", required = True,
+                      help = "directory for the filled <taxpayer_id>.pdf files")
+  parser.add_argument("--results", help = "NDJSON results file (default: stdout)")
+  # the whole engine, there are no interactive submissions to leave room for
+  parser.add_argument("--max-in-flight", type = int,
+                      default = config.SUBMIT_MAX_IN_FLIGHT,
+                      help = "taxpayers in the pipeline at the same time")
+  parser.add_argument("--processes", type = int, default = 0,
+                      help = "worker processes running the pipeline, 0 runs "
+                             "it in threads of this process")
+  args = parser.parse_args()
+
+  sys.exit(asyncio.run(run_batch(args)))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,129 @@
+from decimal import Decimal
+import argparse
+import json
+import time
+import sys
+
+import numpy as np
+from services.batch_tax_calculator import BatchTaxCalculator
+from services.tax_calculator import TaxCalculator
+from tax_policy.policy_registry import get_tax_policy, get_bracket_schedule
+from models.tax_schema import TaxFormData
+from models.user_pii import FilingType
+
+# Throughput of TaxCalculator.summarize (one Decimal return at a time) vs.
+# BatchTaxCalculator.summarize_cents (NumPy, integer cents) over random
+# income profiles. Every profile of the scalar run is also checked against
+# the batch result, to the cent.
+#
+#   python -m benchmarks.bench_batch_tax --profiles 1000000 --scalar-profiles 20000
+
+def random_profiles(n: int, seed: int) -> dict:
+  rng = np.random.default_rng(seed)
+  return {
+    "wages" : rng.integers(0, 50_000_000, n),
+    "nonemployee_compensation" : rng.integers(0, 5_000_000, n),
+    "interest_income" : rng.integers(0, 500_000, n),
+    "tax_withheld" : rng.integers(0, 8_000_000, n),
+  }
+
+def _tax_form_data(profiles: dict, i: int) -> TaxFormData:
+  def dollars(name: str) -> Decimal:
+    return Decimal(int(profiles[name][i])).scaleb(-2)
+
+  return TaxFormData.model_validate({
+    "w2" : {
+      "wages" : dollars("wages"),
+      "federal_income_tax_withheld" : dollars("tax_withheld")
+    },
+    "1099_nec" : { "nonemployee_compensation" : dollars("nonemployee_compensation") },
+    "1099_int" : { "interest_income" : dollars("interest_income") }
+  })
+
+def main():
+  parser = argparse.ArgumentParser(
+    description = "Scalar vs. batch tax calculation throughput"
+  )
+  parser.add_argument("--profiles", type = int, default = 1_000_000,
+                      help = "income profiles for the batch calculator")
+  parser.add_argument("--scalar-profiles", type = int, default = 20_000,
+                      help = "income profiles for summarize (and the check)")
+  parser.add_argument("--seed", type = int, default = 2024)
+  parser.add_argument("--tax-year", type = int, default = 2024)
+  parser.add_argument("--filing-status", default = FilingType.single.value,
+                      choices = [f.value for f in FilingType])
+  parser.add_argument("--json", action = "store_true")
+  args = parser.parse_args()
+
+  policy = get_tax_policy(args.tax_year, FilingType(args.filing_status))
+  schedule = get_bracket_schedule(policy.tax_year, policy.filing_status)
+  scalar = TaxCalculator(schedule, policy.standard_deduction)
+  batch = BatchTaxCalculator(schedule, policy.standard_deduction)
+
+  profiles = random_profiles(args.profiles, args.seed)
+  total_income = (
+    profiles["wages"] +
+    profiles["nonemployee_compensation"] +
+    profiles["interest_income"]
+  )
+
+  start = time.perf_counter()
+  result = batch.summarize_cents(total_income, profiles["tax_withheld"])
+  batch_seconds = time.perf_counter() - start
+
+  n_scalar = min(args.scalar_profiles, args.profiles)
+  forms = [_tax_form_data(profiles, i) for i in range(n_scalar)]
+  start = time.perf_counter()
+  summaries = [scalar.summarize(form) for form in forms]
+  scalar_seconds = time.perf_counter() - start
+
+  mismatches = 0
+  for i, summary in enumerate(summaries):
+    expected = (
+      summary.taxable_income,
+      summary.estimated_tax_due,
+      summary.estimated_refund,
+      summary.amount_owed
+    )
+    actual = tuple(
+      Decimal(int(values[i])).scaleb(-2)
+      for values in (
+        result.taxable_income,
+        result.estimated_tax_due,
+        result.estimated_refund,
+        result.amount_owed
+      )
+    )
+    mismatches += expected != actual
+
+  results = [
+    {
+      "calculator" : "summarize",
+      "profiles" : n_scalar,
+      "profiles_per_second" : n_scalar / scalar_seconds,
+      "mismatches" : mismatches
+    },
+    {
+      "calculator" : "batch",
+      "profiles" : args.profiles,
+      "profiles_per_second" : args.profiles / batch_seconds,
+      "mismatches" : mismatches
+    }
+  ]
+
+  if args.json:
+    print(json.dumps(results, indent = 2))
+  else:
+    columns = list(results[0].keys())
+    print(" | ".join(columns))
+    for row in results:
+      print(" | ".join(
+        f"{row[c]:.0f}" if isinstance(row[c], float) else str(row[c])
+        for c in columns
+      ))
+
+  if mismatches:
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
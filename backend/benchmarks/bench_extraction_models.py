@@ -0,0 +1,321 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List
+import argparse
+import json
+import threading
+import time
+import os
+import sys
+
+from services.acroform_extractor import extract_acroform
+from benchmarks.bench_pipeline import _percentile, expected_data, load_corpus
+from benchmarks.bench_render_profiles import AMOUNT_FIELDS
+from benchmarks.fake_responses import FakeResponsesClient
+from services.form_extractor import ExtractionSettings, FormExtractor
+from services.llm_gateway import LLMGateway
+from models.tax_schema import TaxFormData
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+SAMPLE_DOCS_DIR = os.path.join(BACKEND_DIR, "sample_docs")
+
+# Accuracy vs. latency and cost of extraction configurations (model, page
+# rendering, extraction mode) over a labeled corpus, to pick the EXTRACTION_*
+# settings to deploy. The corpus is either
+#   - a manifest written by services/dummy_form_generator.py --manifest,
+#     labeled with the expected tax_form_data of each taxpayer, or
+#   - numbered folders (sample_docs), labeled with their AcroForm values
+# Every return is extracted from its page images (AcroForm fast path off),
+# through the OpenAI API (needs OPENAI_API_KEY), or with --offline through
+# the local FakeResponsesClient, which only exercises the harness.
+# Reported per configuration: field and return accuracy, failed returns,
+# latency percentiles per return, base64 image payload and tokens per
+# return, and the cost of 1000 returns at --price.
+#
+#   python -m benchmarks.bench_extraction_models --returns 20
+#   python -m benchmarks.bench_extraction_models --configs mini-full nano-full \
+#     --corpus /data/corpus/manifest.jsonl --returns 200 --concurrency 8
+#   python -m benchmarks.bench_extraction_models --config-file configs.json --json
+#
+# --config-file: { "name" : { ...ExtractionSettings fields... }, ... }
+
+CONFIGS : Dict[str, dict] = {
+  "mini-full" : { "model" : "gpt-4.1-mini" },
+  "mini-adaptive" : { "model" : "gpt-4.1-mini", "render_mode" : "adaptive" },
+  "mini-200dpi-gray" : {
+    "model" : "gpt-4.1-mini",
+    "render_profile" : { "dpi" : 200, "grayscale" : True, "jpeg_quality" : 80 }
+  },
+  "mini-150dpi-crop-low" : {
+    "model" : "gpt-4.1-mini",
+    "render_profile" : {
+      "dpi" : 150, "grayscale" : True, "jpeg_quality" : 75,
+      "crop_to_content" : True, "detail" : "low"
+    }
+  },
+  "mini-combined" : { "model" : "gpt-4.1-mini", "extraction_mode" : "combined" },
+  "nano-full" : { "model" : "gpt-4.1-nano" },
+  "nano-adaptive" : { "model" : "gpt-4.1-nano", "render_mode" : "adaptive" },
+}
+
+# USD per million (input, output) tokens, override with --price
+PRICES = {
+  "gpt-4.1" : (2.00, 8.00),
+  "gpt-4.1-mini" : (0.40, 1.60),
+  "gpt-4.1-nano" : (0.10, 0.40),
+  "gpt-4o" : (2.50, 10.00),
+  "gpt-4o-mini" : (0.15, 0.60),
+}
+
+class LabeledReturn:
+  def __init__(self, pdfs: List[str], expected: TaxFormData):
+    self.pdfs = pdfs
+    self.expected = expected
+
+def load_labeled_corpus(corpus: str, n_returns: int) -> List[LabeledReturn]:
+  manifest = Path(corpus)
+  if manifest.is_dir() and (manifest / "manifest.jsonl").exists():
+    manifest = manifest / "manifest.jsonl"
+
+  returns = []
+  if manifest.is_file():
+    with open(manifest) as lines:
+      for line in lines:
+        if len(returns) == n_returns:
+          break
+        if not line.strip():
+          continue
+        entry = json.loads(line)
+        returns.append(LabeledReturn(
+          [str(manifest.parent / document) for document in entry["documents"]],
+          TaxFormData.model_validate(entry["expected"]["tax_form_data"])
+        ))
+    return returns
+
+  for pdfs in load_corpus(corpus, n_returns):
+    expected = expected_data(pdfs)
+    if expected is not None:
+      returns.append(LabeledReturn(pdfs, expected))
+  return returns
+
+# Gateway in front of the real one, adding up what the extractor sends
+# and the usage the API reports
+class MeteredGateway:
+  def __init__(self, gateway: LLMGateway):
+    self.gateway = gateway
+    self._lock = threading.Lock()
+    self.totals = {
+      "requests" : 0,
+      "payload_bytes" : 0,
+      "input_tokens" : 0,
+      "output_tokens" : 0,
+    }
+
+  def parse(self, **kwargs) -> Any:
+    payload_bytes = sum(
+      len(item.get("image_url", ""))
+      for message in kwargs["input"] for item in message["content"]
+    )
+    response = self.gateway.parse(**kwargs)
+
+    usage = getattr(response, "usage", None)
+    with self._lock:
+      self.totals["requests"] += 1
+      self.totals["payload_bytes"] += payload_bytes
+      self.totals["input_tokens"] += getattr(usage, "input_tokens", 0) or 0
+      self.totals["output_tokens"] += getattr(usage, "output_tokens", 0) or 0
+    return response
+
+def score(actual: TaxFormData | None, expected: TaxFormData) -> tuple[int, bool]:
+  if actual is None:
+    return 0, False
+  correct = sum(
+    value(actual) == value(expected) for value in AMOUNT_FIELDS.values()
+  )
+  return correct, (
+    correct == len(AMOUNT_FIELDS) and
+    set(actual.forms_submitted) == set(expected.forms_submitted)
+  )
+
+def evaluate(
+  name: str,
+  settings: ExtractionSettings,
+  returns: List[LabeledReturn],
+  client: Any,
+  concurrency: int,
+  prices: Dict[str, tuple[float, float]]
+) -> dict:
+  gateway = MeteredGateway(LLMGateway(
+    client = client, requests_per_minute = 0, tokens_per_minute = 0
+  ))
+  extractor = FormExtractor(settings = settings, gateway = gateway)
+
+  def extract(labeled: LabeledReturn) -> tuple[TaxFormData | None, float]:
+    start = time.perf_counter()
+    try:
+      actual = extractor.extract_from_pdfs(labeled.pdfs)
+    except Exception:
+      actual = None
+    return actual, time.perf_counter() - start
+
+  with ThreadPoolExecutor(max_workers = concurrency) as pool:
+    outcomes = list(pool.map(extract, returns))
+
+  fields_correct = 0
+  returns_correct = 0
+  for labeled, (actual, _) in zip(returns, outcomes):
+    correct, exact = score(actual, labeled.expected)
+    fields_correct += correct
+    returns_correct += exact
+
+  latencies = [latency for _, latency in outcomes]
+  totals = gateway.totals
+  n = max(len(returns), 1)
+  input_price, output_price = prices.get(settings.model, (0.0, 0.0))
+  cost = (
+    totals["input_tokens"] * input_price +
+    totals["output_tokens"] * output_price
+  ) / 1_000_000
+
+  return {
+    "config" : name,
+    "model" : settings.model,
+    "returns" : len(returns),
+    "field_accuracy" : fields_correct / (n * len(AMOUNT_FIELDS)),
+    "return_accuracy" : returns_correct / n,
+    "failed" : sum(actual is None for actual, _ in outcomes),
+    "p50_ms" : 1000 * _percentile(latencies, 0.50),
+    "p95_ms" : 1000 * _percentile(latencies, 0.95),
+    "requests_per_return" : totals["requests"] / n,
+    "payload_kb_per_return" : totals["payload_bytes"] / n / 1024,
+    "input_tokens_per_return" : totals["input_tokens"] / n,
+    "output_tokens_per_return" : totals["output_tokens"] / n,
+    "usd_per_1000_returns" : 1000 * cost / n,
+    "settings" : settings.model_dump(
+      mode = "json", include = { "model", "render_mode", "render_profile", "extraction_mode" }
+    ),
+  }
+
+# Environment of the API / batch CLI that deploys a configuration
+def deployment_env(settings: dict) -> List[str]:
+  profile = settings["render_profile"]
+  return [
+    f"EXTRACTION_MODEL={settings['model']}",
+    f"EXTRACTION_RENDER_MODE={settings['render_mode']}",
+    f"EXTRACTION_MODE={settings['extraction_mode']}",
+    f"EXTRACTION_DPI={profile['dpi']}",
+    f"EXTRACTION_GRAYSCALE={str(profile['grayscale']).lower()}",
+    f"EXTRACTION_JPEG_QUALITY={profile['jpeg_quality']}",
+    f"EXTRACTION_CROP_TO_CONTENT={str(profile['crop_to_content']).lower()}",
+    f"EXTRACTION_IMAGE_DETAIL={profile['detail']}",
+  ]
+
+def _parse_price(value: str) -> tuple[str, tuple[float, float]]:
+  try:
+    model, prices = value.split("=", 1)
+    input_price, output_price = (float(price) for price in prices.split(","))
+  except ValueError:
+    raise argparse.ArgumentTypeError("expected MODEL=INPUT,OUTPUT")
+  return model, (input_price, output_price)
+
+def main():
+  parser = argparse.ArgumentParser(
+    description = "Accuracy vs. latency and cost of extraction configurations"
+  )
+  parser.add_argument("--corpus", default = SAMPLE_DOCS_DIR,
+                      help = "manifest.jsonl of a generated corpus, or a "
+                             "directory of numbered folders")
+  parser.add_argument("--returns", type = int, default = 20)
+  parser.add_argument("--configs", nargs = "+", default = list(CONFIGS),
+                      help = "configurations to evaluate, by name")
+  parser.add_argument("--config-file",
+                      help = "JSON object of named ExtractionSettings, "
+                             "evaluated instead of the built-in ones")
+  parser.add_argument("--concurrency", type = int, default = 4,
+                      help = "returns extracted at the same time")
+  parser.add_argument("--price", type = _parse_price, action = "append",
+                      default = [], metavar = "MODEL=INPUT,OUTPUT",
+                      help = "USD per million input / output tokens")
+  parser.add_argument("--min-accuracy", type = float, default = 0.99,
+                      help = "field accuracy the recommended configuration "
+                             "must reach")
+  parser.add_argument("--offline", action = "store_true",
+                      help = "answer with FakeResponsesClient instead of "
+                             "calling OpenAI")
+  parser.add_argument("--latency-ms", type = float, default = 800,
+                      help = "--offline: latency of a request")
+  parser.add_argument("--json", action = "store_true")
+  args = parser.parse_args()
+
+  if args.config_file:
+    with open(args.config_file) as config_file:
+      configs = json.load(config_file)
+  else:
+    unknown = set(args.configs) - set(CONFIGS)
+    if unknown:
+      parser.error(f"unknown configurations: {', '.join(sorted(unknown))}")
+    configs = { name : CONFIGS[name] for name in args.configs }
+
+  settings = {
+    name : ExtractionSettings(read_acroforms = False, **config)
+    for name, config in configs.items()
+  }
+  prices = { **PRICES, **dict(args.price) }
+
+  returns = load_labeled_corpus(args.corpus, args.returns)
+  if not returns:
+    raise SystemExit(f"No labeled returns in {args.corpus}")
+
+  client = None
+  if args.offline:
+    client = FakeResponsesClient(latency_ms = args.latency_ms)
+    profiles = { config.render_profile for config in settings.values() }
+    for labeled in returns:
+      for pdf in labeled.pdfs:
+        data = extract_acroform(pdf)
+        if data is not None:
+          client.register(pdf, data, profiles = profiles)
+
+  results = []
+  for name, config in settings.items():
+    result = evaluate(name, config, returns, client, args.concurrency, prices)
+    results.append(result)
+    print(
+      f"{name}: field accuracy {result['field_accuracy']:.3f}, "
+      f"p50 {result['p50_ms']:.0f} ms",
+      file = sys.stderr
+    )
+
+  # cheapest, then fastest, among the accurate enough configurations
+  accurate = [r for r in results if r["field_accuracy"] >= args.min_accuracy]
+  best = min(
+    accurate,
+    key = lambda r: (r["usd_per_1000_returns"], r["p95_ms"]),
+    default = None
+  )
+
+  if args.json:
+    print(json.dumps({
+      "results" : results,
+      "recommended" : best["config"] if best else None
+    }, indent = 2))
+    return
+
+  columns = [column for column in results[0] if column != "settings"]
+  print(" | ".join(columns))
+  for result in results:
+    print(" | ".join(
+      f"{result[c]:.3f}" if isinstance(result[c], float) else str(result[c])
+      for c in columns
+    ))
+
+  if best is None:
+    print(f"\nNo configuration reached a field accuracy of {args.min_accuracy}")
+    return
+  print(f"\nRecommended: {best['config']}")
+  for line in deployment_env(best["settings"]):
+    print(f"  {line}")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,129 @@
+from decimal import Decimal
+from pydantic import BaseModel
+import argparse
+import json
+import time
+import os
+
+import pymupdf
+from services.form_generator import Form1040Generator, Form1040Template, FORM_1040_TAX_YEAR
+from tax_policy.policy_registry import get_tax_policy
+from models.tax_schema import TaxFormData
+from models.user_pii import UserPII, FilingType
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_PATH = os.path.abspath(
+  os.path.join(CURRENT_DIR, "..", "static", "templates", "f1040_2024.pdf")
+)
+
+# Time to fill Form 1040 for one return:
+#   legacy   : previous implementation, template opened from disk and every
+#              widget walked three times (form values, PII, checkbox)
+#   compiled : Form1040Template, in-memory copy and a precomputed widget
+#              index, all values set in a single pass
+# Both write nothing to disk, the filled PDF is serialized to bytes.
+#
+#   python -m benchmarks.bench_form_fill --returns 200
+
+def _sample_return(i: int) -> tuple[TaxFormData, UserPII]:
+  data = TaxFormData.model_validate({
+    "w2" : {
+      "wages" : Decimal(50_000 + 137 * i),
+      "federal_income_tax_withheld" : Decimal(6_000 + 11 * i)
+    },
+    "1099_nec" : { "nonemployee_compensation" : Decimal(1_000 + i) },
+    "1099_int" : { "interest_income" : Decimal(100 + i) }
+  })
+  pii = UserPII(
+    first_name_middle_initial = "Jane Q",
+    last_name = f"Public{i}",
+    ssn = "123-45-6789",
+    address = "1 Main St",
+    city = "Springfield",
+    state = "IL",
+    zip_code = "62701",
+    filing_status = FilingType.single
+  )
+  return data, pii
+
+def _legacy_fill(generator: Form1040Generator, data: TaxFormData, pii: UserPII) -> bytes:
+  def fill_textfields(doc: pymupdf.Document, model: BaseModel) -> None:
+    alias_map = {
+      field.alias : getattr(model, name)
+      for name, field in type(model).model_fields.items()
+    }
+    for page in doc:
+      for field in page.widgets():
+        if field.field_name in alias_map:
+          field.field_value = str(alias_map[field.field_name])
+          field.update()
+
+  summary = generator.calculator.summarize(data)
+  form = generator._create_form_1040(data, pii, summary)
+
+  doc = pymupdf.open(TEMPLATE_PATH)
+  fill_textfields(doc, form)
+  fill_textfields(doc, pii)
+
+  checkbox_field = generator.FILING_STATUS_CHECKBOXES[pii.filing_status]
+  for page in doc:
+    for widget in page.widgets():
+      if widget.field_name == checkbox_field:
+        widget.field_value = "Yes"
+        widget.update()
+
+  pdf_bytes = doc.tobytes()
+  doc.close()
+  return pdf_bytes
+
+def _compiled_fill(generator: Form1040Generator, data: TaxFormData, pii: UserPII) -> bytes:
+  return generator.generate_pdf_bytes(data, pii)[1]
+
+def measure(name: str, fill, generator: Form1040Generator, returns: list) -> dict:
+  # warm up PyMuPDF before measuring
+  fill(generator, *returns[0])
+
+  start = time.perf_counter()
+  for data, pii in returns:
+    fill(generator, data, pii)
+  elapsed = time.perf_counter() - start
+
+  return {
+    "mode" : name,
+    "returns" : len(returns),
+    "ms_per_return" : 1000 * elapsed / len(returns)
+  }
+
+def main():
+  parser = argparse.ArgumentParser(
+    description = "Form 1040 fill time per return, legacy vs compiled template"
+  )
+  parser.add_argument("--returns", type = int, default = 200)
+  parser.add_argument("--json", action = "store_true")
+  args = parser.parse_args()
+
+  returns = [_sample_return(i) for i in range(args.returns)]
+  generator = Form1040Generator(
+    get_tax_policy(FORM_1040_TAX_YEAR, FilingType.single),
+    template = Form1040Template.load(TEMPLATE_PATH)
+  )
+
+  results = [
+    measure("legacy", _legacy_fill, generator, returns),
+    measure("compiled", _compiled_fill, generator, returns)
+  ]
+
+  if args.json:
+    print(json.dumps(results, indent = 2))
+    return
+
+  columns = list(results[0].keys())
+  print(" | ".join(columns))
+  for result in results:
+    print(" | ".join(
+      f"{result[c]:.3f}" if isinstance(result[c], float) else str(result[c])
+      for c in columns
+    ))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,529 @@
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import List
+import argparse
+import asyncio
+import json
+import resource
+import subprocess
+import time
+import os
+import sys
+
+from services.acroform_extractor import extract_acroform
+from benchmarks.fake_responses import FakeAsyncResponsesClient, FakeResponsesClient
+from services.form_extractor import merge_tax_form_data
+from models.tax_schema import TaxFormData
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+SAMPLE_DOCS_DIR = os.path.join(BACKEND_DIR, "sample_docs")
+TEMPLATE_PATH = os.path.join(BACKEND_DIR, "static", "templates", "f1040_2024.pdf")
+
+# End-to-end submit path without OpenAI: every LLM call goes to the local
+# FakeResponsesClient (configurable latency, injected 429 / 500 / timeouts),
+# which answers with the AcroForm values of the documents, so every return
+# is also checked against the expected tax summary.
+#   pipeline : generate_filled_1040 through the ExecutionEngine, N returns
+#              at a time, as the API runs them
+#   api      : POST /api/submit_tax_form on the FastAPI app, in process
+#              through httpx's ASGI transport, from N concurrent clients,
+#              with the app's SUBMIT_PIPELINE (async by default)
+# Each return is one sample_docs/<n> folder (or <n> folder of --corpus),
+# cycled through until --returns. The AcroForm fast path is off unless
+# --acroform, so documents go through rendering and the LLM stand-in.
+# Each (mode, clients) scenario runs in its own process so peak RSS is not
+# shared. Reported per scenario: throughput, latency percentiles, time per
+# return in each pipeline stage (summed over concurrent documents), LLM
+# calls / retries / injected failures, peak RSS.
+#
+#   python -m benchmarks.bench_pipeline --returns 40 --clients 1 8
+#   python -m benchmarks.bench_pipeline --mode pipeline api --latency-ms 0
+#   python -m benchmarks.bench_pipeline --error-rate 0.1 --max-failures 2
+#
+# As a regression gate: exits 1 when a return fails (beyond --max-failures)
+# or does not match, or, against a saved baseline, when throughput, p95
+# latency or peak RSS regress by more than --max-regression.
+#
+#   python -m benchmarks.bench_pipeline --save-baseline bench_baseline.json
+#   python -m benchmarks.bench_pipeline --baseline bench_baseline.json
+
+BENCH_PII = {
+  "first_name_middle_initial" : "Jane Q",
+  "last_name" : "Public",
+  "ssn" : "123-45-6789",
+  "address" : "1 Main St",
+  "city" : "Springfield",
+  "state" : "IL",
+  "zip_code" : "62701",
+  "filing_status" : "Single",
+}
+
+# PDFs of each return, one numbered folder per return as in sample_docs
+# (its templates folder is not a return)
+def load_corpus(corpus_dir: str, n_returns: int) -> List[List[str]]:
+  folders = sorted(
+    (
+      folder for folder in Path(corpus_dir).iterdir()
+      if folder.is_dir() and folder.name.isdigit()
+    ),
+    key = lambda folder: int(folder.name)
+  )
+  corpus = [
+    [str(pdf) for pdf in sorted(folder.glob("*.pdf"))]
+    for folder in folders
+  ]
+  corpus = [pdfs for pdfs in corpus if pdfs]
+  if not corpus:
+    raise SystemExit(f"No PDFs found in the numbered folders of {corpus_dir}")
+
+  return [corpus[i % len(corpus)] for i in range(n_returns)]
+
+# What the documents say, None when one of them is not fillable and
+# nothing can be checked
+def expected_data(pdfs: List[str]) -> TaxFormData | None:
+  results = [extract_acroform(pdf) for pdf in pdfs]
+  if any(result is None for result in results):
+    return None
+  return results[0] if len(results) == 1 else merge_tax_form_data(results)
+
+def _percentile(values: List[float], q: float) -> float:
+  ordered = sorted(values)
+  return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
+
+# VmHWM on Linux: ru_maxrss survives exec, so a process started from a
+# large parent would report the parent's peak
+def _peak_rss_mb(pid: int | str = "self") -> float:
+  try:
+    with open(f"/proc/{pid}/status") as status:
+      for line in status:
+        if line.startswith("VmHWM:"):
+          return int(line.split()[1]) / 1024
+  except OSError:
+    pass
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if pid == "self" else 0.0
+
+def run_worker(args: argparse.Namespace) -> dict:
+  # read by core.config at import time, hence the imports below
+  os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+  os.environ["DOCUMENT_STORE_BACKEND"] = "memory"
+  os.environ["JOB_STORE_BACKEND"] = "memory"
+  os.environ["WEB_CONCURRENCY"] = "1"
+  # every return has to reach the LLM stand-in
+  os.environ["EXTRACTION_CACHE_BACKEND"] = "none"
+  os.environ["ACROFORM_FAST_PATH"] = "true" if args.acroform else "false"
+
+  from core import config
+  from services.llm_gateway import configure_llm_gateway
+  from services.pipeline_timing import StageTimings, record_stages
+  from tax_policy.policy_registry import get_bracket_schedule, get_tax_policy
+  from services.tax_calculator import TaxCalculator
+  from models.user_pii import UserPII
+
+  pii = UserPII.model_validate(BENCH_PII)
+  policy = get_tax_policy(2024, pii.filing_status)
+  calculator = TaxCalculator(
+    brackets = get_bracket_schedule(2024, pii.filing_status),
+    standard_deduction = policy.standard_deduction
+  )
+
+  returns = load_corpus(args.corpus, args.returns + 1)
+  expected = []
+  for pdfs in returns:
+    data = expected_data(pdfs)
+    expected.append(
+      None if data is None else calculator.summarize(data).model_dump(mode = "json")
+    )
+
+  client = FakeResponsesClient(
+    latency_ms = args.latency_ms,
+    latency_per_image_ms = args.latency_per_image_ms,
+    jitter = args.jitter,
+    error_rate = args.error_rate,
+    timeout_rate = args.timeout_rate,
+    seed = args.seed
+  )
+  with open(args.answers) as answers:
+    client.load_answers(json.load(answers))
+
+  if args.worker == "pipeline":
+    from services.execution_engine import ExecutionEngine
+    from services.document_store import InMemoryDocumentStore
+    from services.form_extractor import ExtractionSettings
+    from services.render_profiles import RenderProfile
+    from services.form_generator import load_form_1040_template
+    from services.generate_filled_1040 import generate_filled_1040
+
+    engine = ExecutionEngine(
+      max_in_flight = args.clients,
+      max_queued = 0,
+      io_workers = args.clients,
+      cpu_workers = config.SUBMIT_CPU_WORKERS
+    )
+    settings = ExtractionSettings(
+      read_acroforms = config.ACROFORM_FAST_PATH,
+      model = config.EXTRACTION_MODEL,
+      render_profile = RenderProfile(
+        dpi = config.EXTRACTION_DPI,
+        grayscale = config.EXTRACTION_GRAYSCALE,
+        jpeg_quality = config.EXTRACTION_JPEG_QUALITY,
+        crop_to_content = config.EXTRACTION_CROP_TO_CONTENT,
+        detail = config.EXTRACTION_IMAGE_DETAIL
+      ),
+      max_payload_bytes = config.EXTRACTION_MAX_PAYLOAD_BYTES,
+      render_mode = config.EXTRACTION_RENDER_MODE,
+      extraction_mode = config.EXTRACTION_MODE,
+      max_concurrency = config.EXTRACTION_MAX_CONCURRENCY,
+      document_attempts = config.EXTRACTION_DOCUMENT_ATTEMPTS
+    )
+    template = load_form_1040_template(TEMPLATE_PATH)
+    store = InMemoryDocumentStore(
+      max_bytes = config.DOCUMENT_STORE_MAX_BYTES,
+      retention_seconds = config.DOCUMENT_RETENTION_SECONDS
+    )
+
+    def run_return(i: int, timings: StageTimings) -> dict | None:
+      with record_stages(timings):
+        summary = generate_filled_1040(
+          file_buffers = returns[i],
+          pii = pii,
+          input_pdf_path = TEMPLATE_PATH,
+          render_executor = engine.cpu_executor(),
+          extraction_settings = settings,
+          form_template = template,
+          document_store = store,
+          document_id = f"bench-{i}.pdf"
+        )
+      return summary.model_dump(mode = "json")
+
+    async def submit(i: int, timings: StageTimings) -> dict | None:
+      return await engine.run(run_return, i, timings)
+  else:
+    import httpx
+    import main as app_main
+    from api.app_context import create_app_context
+
+    # what the app's lifespan does, which the ASGI transport does not run
+    context = app_main.app.state.context = create_app_context()
+    context.ready = True
+    engine = context.engine
+    uploads = {
+      pdf : Path(pdf).read_bytes() for pdfs in returns for pdf in pdfs
+    }
+    http = httpx.AsyncClient(
+      transport = httpx.ASGITransport(app = app_main.app),
+      base_url = "http://bench",
+      timeout = None
+    )
+
+    async def submit(i: int, timings: StageTimings) -> dict | None:
+      # the app runs in this task, the engine hands the context to its
+      # threads, so the stages of this request land in timings
+      with record_stages(timings):
+        response = await http.post(
+          "/api/submit_tax_form",
+          data = BENCH_PII,
+          files = [
+            ("files", (Path(pdf).name, uploads[pdf], "application/pdf"))
+            for pdf in returns[i]
+          ]
+        )
+      if response.status_code != 200:
+        raise RuntimeError(f"HTTP {response.status_code}: {response.text}")
+      return response.json()["tax_return_summary"]
+
+  # after creating the app context, which configures its own gateway
+  # budgets off, the stand-in does not throttle unless told to
+  gateway = configure_llm_gateway(
+    client = client,
+    async_client = FakeAsyncResponsesClient(client),
+    requests_per_minute = 0,
+    tokens_per_minute = 0,
+    max_attempts = config.OPENAI_MAX_ATTEMPTS,
+    request_timeout_seconds = config.OPENAI_REQUEST_TIMEOUT_SECONDS,
+    deadline_seconds = config.OPENAI_DEADLINE_SECONDS
+  )
+  if args.worker == "api":
+    context.llm_gateway = gateway
+
+  totals = StageTimings()
+  latencies = []
+  failures = []
+  mismatched = 0
+  unverified = 0
+
+  async def run_one(i: int) -> None:
+    nonlocal mismatched, unverified
+    timings = StageTimings()
+    start = time.perf_counter()
+    try:
+      summary = await submit(i, timings)
+    except Exception as e:
+      failures.append(f"{type(e).__name__}: {e}")
+      return
+    latencies.append(time.perf_counter() - start)
+    totals.merge(timings)
+
+    if expected[i] is None:
+      unverified += 1
+    elif summary != expected[i]:
+      mismatched += 1
+
+  async def run_all() -> float:
+    # first return warms up imports, the render pool and the template
+    await submit(len(returns) - 1, StageTimings())
+    gateway_before = gateway.stats()
+
+    # closed loop: each client sends its next return once the previous
+    # one is done
+    remaining = iter(range(args.returns))
+
+    async def client_loop() -> None:
+      for i in remaining:
+        await run_one(i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(args.clients)))
+    elapsed = time.perf_counter() - start
+
+    for name, value in gateway.stats().items():
+      if name not in ("queue_depth", "in_flight"):
+        llm_stats[name] = value - gateway_before[name]
+    return elapsed
+
+  llm_stats = {}
+  elapsed = asyncio.run(run_all())
+
+  render_pool = engine.cpu_executor()
+  render_workers_peak_rss_mb = sum(
+    _peak_rss_mb(pid) for pid in getattr(render_pool, "_processes", None) or {}
+  )
+  engine.shutdown()
+
+  completed = len(latencies)
+  stage_ms = {
+    name : 1000 * stage["seconds"] / max(1, completed)
+    for name, stage in totals.as_dict().items()
+  }
+  fake_stats = client.stats()
+  return {
+    "mode" : args.worker,
+    "clients" : args.clients,
+    "returns" : args.returns,
+    "failed" : len(failures),
+    "mismatched" : mismatched,
+    "unverified" : unverified,
+    "seconds" : elapsed,
+    "returns_per_second" : completed / elapsed,
+    "latency_ms" : {
+      "p50" : 1000 * _percentile(latencies, 0.50) if latencies else None,
+      "p95" : 1000 * _percentile(latencies, 0.95) if latencies else None,
+      "max" : 1000 * max(latencies) if latencies else None,
+    },
+    "stage_ms_per_return" : stage_ms,
+    "llm" : {
+      **llm_stats,
+      "injected_errors" : fake_stats["injected_errors"],
+      "injected_timeouts" : fake_stats["injected_timeouts"],
+      "unmatched_images" : fake_stats["unmatched"],
+    },
+    "peak_rss_mb" : _peak_rss_mb(),
+    # summed over the render processes
+    "render_workers_peak_rss_mb" : render_workers_peak_rss_mb,
+    "errors" : sorted(set(failures))[:5],
+  }
+
+# Reasons the results fail the gate, empty when they pass
+def check_results(
+  results: List[dict],
+  baseline: List[dict] | None,
+  max_regression: float,
+  max_failures: int
+) -> List[str]:
+  problems = []
+  previous = {
+    (result["mode"], result["clients"]) : result for result in baseline or []
+  }
+
+  for result in results:
+    name = f"{result['mode']} x{result['clients']}"
+    if result["failed"] > max_failures:
+      problems.append(f"{name}: {result['failed']} returns failed {result['errors']}")
+    if result["mismatched"]:
+      problems.append(f"{name}: {result['mismatched']} summaries do not match")
+
+    base = previous.get((result["mode"], result["clients"]))
+    if base is None:
+      continue
+
+    if result["returns_per_second"] < base["returns_per_second"] * (1 - max_regression):
+      problems.append(
+        f"{name}: {result['returns_per_second']:.2f} returns/s, "
+        f"baseline {base['returns_per_second']:.2f}"
+      )
+    p95, base_p95 = result["latency_ms"]["p95"], base["latency_ms"]["p95"]
+    if p95 is not None and base_p95 and p95 > base_p95 * (1 + max_regression):
+      problems.append(f"{name}: p95 {p95:.0f} ms, baseline {base_p95:.0f} ms")
+    if result["peak_rss_mb"] > base["peak_rss_mb"] * (1 + max_regression):
+      problems.append(
+        f"{name}: peak RSS {result['peak_rss_mb']:.0f} MB, "
+        f"baseline {base['peak_rss_mb']:.0f} MB"
+      )
+
+  return problems
+
+def _print_table(results: List[dict]) -> None:
+  columns = [
+    "mode", "clients", "returns", "failed", "returns/s",
+    "p50 ms", "p95 ms", "max ms", "peak MB", "render MB"
+  ]
+  print(" | ".join(columns))
+  for result in results:
+    latency = result["latency_ms"]
+    print(" | ".join([
+      result["mode"],
+      str(result["clients"]),
+      str(result["returns"]),
+      str(result["failed"]),
+      f"{result['returns_per_second']:.2f}",
+      *(
+        "-" if latency[key] is None else f"{latency[key]:.0f}"
+        for key in ("p50", "p95", "max")
+      ),
+      f"{result['peak_rss_mb']:.0f}",
+      f"{result['render_workers_peak_rss_mb']:.0f}",
+    ]))
+
+  print()
+  for result in results:
+    stages = ", ".join(
+      f"{name} {ms:.1f}"
+      for name, ms in sorted(
+        result["stage_ms_per_return"].items(), key = lambda item: -item[1]
+      )
+    )
+    llm = ", ".join(f"{name} {value}" for name, value in result["llm"].items())
+    print(f"{result['mode']} x{result['clients']}")
+    print(f"  ms per return : {stages}")
+    print(f"  llm           : {llm}")
+
+def main():
+  parser = argparse.ArgumentParser(
+    description = "Offline end-to-end submit pipeline benchmark"
+  )
+  parser.add_argument("--mode", nargs = "+", choices = ["pipeline", "api"],
+                      default = ["pipeline"])
+  parser.add_argument("--clients", nargs = "+", type = int, default = [1, 4],
+                      help = "concurrent returns, one scenario per value")
+  parser.add_argument("--returns", type = int, default = 20,
+                      help = "returns per scenario")
+  parser.add_argument("--corpus", default = SAMPLE_DOCS_DIR,
+                      help = "folder with one numbered sub folder of PDFs per return")
+  parser.add_argument("--acroform", action = "store_true",
+                      help = "keep the AcroForm fast path on")
+  parser.add_argument("--latency-ms", type = float, default = 800,
+                      help = "LLM stand-in latency per call")
+  parser.add_argument("--latency-per-image-ms", type = float, default = 150)
+  parser.add_argument("--jitter", type = float, default = 0.25,
+                      help = "sigma of the lognormal latency jitter")
+  parser.add_argument("--error-rate", type = float, default = 0.0,
+                      help = "share of LLM calls failing with 429 / 500")
+  parser.add_argument("--timeout-rate", type = float, default = 0.0,
+                      help = "share of LLM calls hanging until the timeout")
+  parser.add_argument("--seed", type = int, default = 0)
+  parser.add_argument("--json", action = "store_true",
+                      help = "print raw results as JSON")
+  parser.add_argument("--baseline", help = "results JSON to compare against")
+  parser.add_argument("--save-baseline", help = "write the results JSON here")
+  parser.add_argument("--max-regression", type = float, default = 0.2,
+                      help = "allowed relative regression against --baseline")
+  parser.add_argument("--max-failures", type = int, default = 0,
+                      help = "failed returns allowed per scenario")
+  parser.add_argument("--worker", choices = ["pipeline", "api"],
+                      help = argparse.SUPPRESS)
+  parser.add_argument("--answers", help = argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.worker:
+    args.clients = args.clients[0]
+    print(json.dumps(run_worker(args)))
+    return
+
+  from core import config
+  from services.render_profiles import RenderProfile
+
+  # Renders the documents once for every scenario, also with the
+  # EXTRACTION_* profile the workers are configured with
+  configured_profile = RenderProfile(
+    dpi = config.EXTRACTION_DPI,
+    grayscale = config.EXTRACTION_GRAYSCALE,
+    jpeg_quality = config.EXTRACTION_JPEG_QUALITY,
+    crop_to_content = config.EXTRACTION_CROP_TO_CONTENT,
+    detail = config.EXTRACTION_IMAGE_DETAIL
+  )
+  client = FakeResponsesClient()
+  for pdfs in load_corpus(args.corpus, args.returns + 1):
+    for pdf in pdfs:
+      data = expected_data([pdf])
+      if data is not None:
+        client.register(pdf, data, profiles = [configured_profile])
+
+  with NamedTemporaryFile("w", suffix = ".json", delete = False) as answers:
+    json.dump(client.export_answers(), answers)
+
+  worker_args = [
+    "--returns", str(args.returns),
+    "--corpus", args.corpus,
+    "--latency-ms", str(args.latency_ms),
+    "--latency-per-image-ms", str(args.latency_per_image_ms),
+    "--jitter", str(args.jitter),
+    "--error-rate", str(args.error_rate),
+    "--timeout-rate", str(args.timeout_rate),
+    "--seed", str(args.seed),
+    "--answers", answers.name,
+    *(["--acroform"] if args.acroform else []),
+  ]
+
+  results = []
+  try:
+    for mode in args.mode:
+      for clients in args.clients:
+        output = subprocess.run(
+          [
+            sys.executable, "-m", "benchmarks.bench_pipeline",
+            "--worker", mode,
+            "--clients", str(clients),
+            *worker_args
+          ],
+          check = True,
+          capture_output = True,
+          text = True,
+          cwd = BACKEND_DIR
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+  finally:
+    os.unlink(answers.name)
+
+  if args.json:
+    print(json.dumps(results, indent = 2))
+  else:
+    _print_table(results)
+
+  if args.save_baseline:
+    with open(args.save_baseline, "w") as baseline:
+      json.dump(results, baseline, indent = 2)
+
+  baseline = None
+  if args.baseline:
+    with open(args.baseline) as baseline_file:
+      baseline = json.load(baseline_file)
+
+  problems = check_results(
+    results, baseline, args.max_regression, args.max_failures
+  )
+  for problem in problems:
+    print(f"REGRESSION {problem}", file = sys.stderr)
+  sys.exit(1 if problems else 0)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,152 @@
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import List
+import argparse
+import base64
+import json
+import resource
+import subprocess
+import time
+import os
+import sys
+
+import pymupdf
+# imported by both modes so the baseline RSS is the same
+from services.form_extractor import render_pdf_pages
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+SAMPLE_DOCS_DIR = os.path.join(BACKEND_DIR, "sample_docs")
+
+# Compares the page -> base64 payload step of FormExtractor:
+#   tempfile : previous implementation, JPEG written to a NamedTemporaryFile
+#              and read back to be base64 encoded
+#   memory   : render_pdf_pages + base64 entirely in memory
+# Each mode runs in its own process so peak RSS is not shared.
+#
+#   python -m benchmarks.bench_rasterization --docs 20 --repeat 3
+
+def _tempfile_payloads(pdf_path: str) -> List[str]:
+  image_paths = []
+  with pymupdf.open(pdf_path) as doc:
+    for page in doc:
+      pix = page.get_pixmap(dpi = 300)
+      image_file = NamedTemporaryFile(delete = False, suffix = ".jpg")
+      image_file.write(pix.tobytes("jpg"))
+      image_file.close()
+      image_paths.append(Path(image_file.name))
+
+  payloads = []
+  for path in image_paths:
+    with open(path, "rb") as image_file:
+      payloads.append(base64.b64encode(image_file.read()).decode("utf-8"))
+    os.remove(path)
+  return payloads
+
+def _memory_payloads(pdf_path: str) -> List[str]:
+  return [
+    base64.b64encode(image).decode("ascii")
+    for image in render_pdf_pages(pdf_path).pages
+  ]
+
+def _proc_io() -> dict:
+  # Linux only: bytes passed to read()/write() syscalls and bytes that
+  # actually hit the block layer
+  try:
+    with open("/proc/self/io") as io:
+      return {
+        key : int(value)
+        for key, value in (line.split(": ") for line in io)
+      }
+  except OSError:
+    return {}
+
+def sample_pdfs(n_docs: int) -> List[str]:
+  paths = []
+  for i in range(1, n_docs + 1):
+    for form_type in ("w2", "nec", "int"):
+      path = os.path.join(SAMPLE_DOCS_DIR, str(i), f"{form_type}_{i}.pdf")
+      if os.path.exists(path):
+        paths.append(path)
+  return paths
+
+def run_worker(mode: str, n_docs: int, repeat: int) -> dict:
+  payload_fn = _tempfile_payloads if mode == "tempfile" else _memory_payloads
+  pdfs = sample_pdfs(n_docs)
+
+  # warm up imports and PyMuPDF before measuring
+  payload_fn(pdfs[0])
+
+  io_before = _proc_io()
+  start = time.perf_counter()
+  payload_bytes = 0
+  for _ in range(repeat):
+    for pdf in pdfs:
+      payload_bytes += sum(len(p) for p in payload_fn(pdf))
+  elapsed = time.perf_counter() - start
+  io_after = _proc_io()
+
+  return {
+    "mode" : mode,
+    "documents" : len(pdfs) * repeat,
+    "seconds" : elapsed,
+    "ms_per_document" : 1000 * elapsed / (len(pdfs) * repeat),
+    "payload_bytes" : payload_bytes,
+    "peak_rss_mb" : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "write_syscall_bytes" : io_after.get("wchar", 0) - io_before.get("wchar", 0),
+    "read_syscall_bytes" : io_after.get("rchar", 0) - io_before.get("rchar", 0),
+    "disk_write_bytes" : (
+      io_after.get("write_bytes", 0) - io_before.get("write_bytes", 0)
+    )
+  }
+
+def main():
+  parser = argparse.ArgumentParser(
+    description = "Temp-file vs in-memory page rasterization benchmark"
+  )
+  parser.add_argument("--docs", type = int, default = 20,
+                      help = "number of sample_docs folders to render")
+  parser.add_argument("--repeat", type = int, default = 1)
+  parser.add_argument("--json", action = "store_true",
+                      help = "print raw results as JSON")
+  parser.add_argument("--worker", choices = ["tempfile", "memory"],
+                      help = argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.worker:
+    print(json.dumps(run_worker(args.worker, args.docs, args.repeat)))
+    return
+
+  results = []
+  for mode in ("tempfile", "memory"):
+    output = subprocess.run(
+      [
+        sys.executable, "-m", "benchmarks.bench_rasterization",
+        "--worker", mode,
+        "--docs", str(args.docs),
+        "--repeat", str(args.repeat)
+      ],
+      check = True,
+      cwd = BACKEND_DIR,
+      capture_output = True,
+      text = True
+    ).stdout
+    results.append(json.loads(output))
+
+  if args.json:
+    print(json.dumps(results, indent = 2))
+    return
+
+  columns = [
+    "mode", "documents", "ms_per_document", "peak_rss_mb",
+    "write_syscall_bytes", "read_syscall_bytes", "disk_write_bytes"
+  ]
+  print(" | ".join(columns))
+  for result in results:
+    print(" | ".join(
+      f"{result[c]:.1f}" if isinstance(result[c], float) else str(result[c])
+      for c in columns
+    ))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,141 @@
+from typing import List
+import argparse
+import json
+import time
+import os
+
+from services.acroform_extractor import extract_acroform
+from services.form_extractor import (
+  FormExtractor,
+  ExtractionSettings,
+  render_pdf_pages,
+  _encoded_size
+)
+from services.render_profiles import RenderProfile, FULL_FIDELITY_PROFILE
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_DOCS_DIR = os.path.abspath(os.path.join(CURRENT_DIR, "..", "sample_docs"))
+
+# Accuracy vs. payload size of page render profiles over sample_docs.
+#
+# Payload size is measured offline. With --evaluate every document is also
+# extracted by the LLM (needs OPENAI_API_KEY) with each profile, and the
+# amounts are compared with the values of the filled form fields.
+#
+#   python -m benchmarks.bench_render_profiles --docs 20
+#   python -m benchmarks.bench_render_profiles --docs 5 --evaluate
+
+CANDIDATE_PROFILES = {
+  "full" : FULL_FIDELITY_PROFILE,
+  # None: per form type profile picked by FormExtractor's adaptive mode
+  "adaptive" : None,
+  "200dpi_gray_q80" : RenderProfile(dpi = 200, grayscale = True, jpeg_quality = 80),
+  "150dpi_gray_q75_crop" : RenderProfile(
+    dpi = 150, grayscale = True, jpeg_quality = 75, crop_to_content = True
+  ),
+  "120dpi_gray_q70_crop" : RenderProfile(
+    dpi = 120, grayscale = True, jpeg_quality = 70, crop_to_content = True
+  ),
+  "100dpi_gray_q60_crop_low" : RenderProfile(
+    dpi = 100, grayscale = True, jpeg_quality = 60, crop_to_content = True,
+    detail = "low"
+  ),
+}
+
+AMOUNT_FIELDS = {
+  "w2.wages" : lambda d: d.w2.wages,
+  "w2.federal_income_tax_withheld" : lambda d: d.w2.federal_income_tax_withheld,
+  "1099_nec.nonemployee_compensation" : (
+    lambda d: d.nec_1099.nonemployee_compensation
+  ),
+  "1099_int.interest_income" : lambda d: d.int_1099.interest_income,
+}
+
+def sample_pdfs(n_docs: int) -> List[str]:
+  paths = []
+  for i in range(1, n_docs + 1):
+    for form_type in ("w2", "nec", "int"):
+      path = os.path.join(SAMPLE_DOCS_DIR, str(i), f"{form_type}_{i}.pdf")
+      if os.path.exists(path):
+        paths.append(path)
+  return paths
+
+def measure_payload(profile: RenderProfile | None, pdfs: List[str]) -> dict:
+  payload_bytes = 0
+  pages = 0
+  start = time.perf_counter()
+  for pdf in pdfs:
+    document = render_pdf_pages(pdf, profile = profile)
+    pages += len(document.pages)
+    payload_bytes += sum(_encoded_size(len(page)) for page in document.pages)
+  elapsed = time.perf_counter() - start
+
+  return {
+    "pages" : pages,
+    "payload_bytes_per_page" : payload_bytes / max(pages, 1),
+    "render_ms_per_page" : 1000 * elapsed / max(pages, 1)
+  }
+
+def measure_accuracy(profile: RenderProfile | None, pdfs: List[str]) -> dict:
+  extractor = FormExtractor(
+    settings = ExtractionSettings(read_acroforms = False)
+  )
+  correct = 0
+  total = 0
+  latencies = []
+
+  for pdf in pdfs:
+    expected = extract_acroform(pdf)
+    if expected is None:
+      continue
+
+    start = time.perf_counter()
+    try:
+      actual, _ = extractor._parse_rendered([pdf], profile)
+    except Exception:
+      actual = None
+    latencies.append(time.perf_counter() - start)
+
+    for field, value in AMOUNT_FIELDS.items():
+      total += 1
+      if actual is not None and value(actual) == value(expected):
+        correct += 1
+
+  return {
+    "field_accuracy" : correct / max(total, 1),
+    "llm_seconds_mean" : sum(latencies) / max(len(latencies), 1)
+  }
+
+def main():
+  parser = argparse.ArgumentParser(
+    description = "Accuracy vs. payload size of page render profiles"
+  )
+  parser.add_argument("--docs", type = int, default = 20,
+                      help = "number of sample_docs folders to use")
+  parser.add_argument("--evaluate", action = "store_true",
+                      help = "also measure LLM extraction accuracy")
+  parser.add_argument("--json", action = "store_true")
+  args = parser.parse_args()
+
+  pdfs = sample_pdfs(args.docs)
+  results = []
+  for name, profile in CANDIDATE_PROFILES.items():
+    result = { "profile" : name, **measure_payload(profile, pdfs) }
+    if args.evaluate:
+      result.update(measure_accuracy(profile, pdfs))
+    results.append(result)
+
+  if args.json:
+    print(json.dumps(results, indent = 2))
+    return
+
+  columns = list(results[0].keys())
+  print(" | ".join(columns))
+  for result in results:
+    print(" | ".join(
+      f"{result[c]:.3f}" if isinstance(result[c], float) else str(result[c])
+      for c in columns
+    ))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,166 @@
+from collections import defaultdict
+from statistics import median
+from typing import Dict, List
+import argparse
+import json
+import subprocess
+import sys
+import os
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+
+# Cold start of a backend worker, every run in a fresh interpreter:
+#   import  : `import main`, what uvicorn does before starting the app
+#   startup : import + create_app_context(), what the lifespan does before
+#             the worker reports ready (template, policies, OpenAI clients,
+#             render worker processes)
+#   render worker : import of services.form_extractor, what every render
+#             worker process loads before its first page
+# A `python -X importtime` run of each target breaks the import time down
+# by top level package, and checks that heavy packages only needed later
+# (openai, faker) stay out of it.
+#
+# As a budget: exits 1 when a median time is over its budget or a
+# forbidden package gets imported, e.g. after a new module level import.
+#
+#   python -m benchmarks.bench_startup --runs 5
+#   python -m benchmarks.bench_startup --import-budget-ms 600 --json
+
+# Packages each target must not import
+FORBIDDEN_IMPORTS = {
+  "main" : ["openai", "faker"],
+  "services.form_extractor" : ["openai", "faker", "fastapi"]
+}
+
+_STARTUP = """
+import json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+from api.app_context import create_app_context
+context = create_app_context()
+ready = time.perf_counter()
+context.close()
+print(json.dumps({
+  "import_ms" : (imported - start) * 1000,
+  "startup_ms" : (ready - start) * 1000,
+  "checks" : context.checks
+}))
+"""
+
+_IMPORT = """
+import json, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{ "import_ms" : (time.perf_counter() - start) * 1000 }}))
+"""
+
+def _environment() -> dict:
+  env = dict(os.environ)
+  # create_app_context only builds the OpenAI clients, nothing is sent
+  env.setdefault("OPENAI_API_KEY", "offline-benchmark")
+  env["DOCUMENT_STORE_BACKEND"] = "memory"
+  env["JOB_STORE_BACKEND"] = "memory"
+  env["WEB_CONCURRENCY"] = "1"
+  env["EXTRACTION_CACHE_BACKEND"] = "none"
+  env["TRACING_EXPORTER"] = "none"
+  return env
+
+def _run(args: List[str]) -> subprocess.CompletedProcess:
+  return subprocess.run(
+    [sys.executable, *args],
+    check = True,
+    capture_output = True,
+    text = True,
+    cwd = BACKEND_DIR,
+    env = _environment()
+  )
+
+# Self time per top level package from `python -X importtime` output
+def import_breakdown(module: str) -> Dict[str, float]:
+  stderr = _run(["-X", "importtime", "-c", f"import {module}"]).stderr
+  packages : Dict[str, float] = defaultdict(float)
+  for line in stderr.splitlines():
+    if not line.startswith("import time:") or "self [us]" in line:
+      continue
+    self_us, _, name = line[len("import time:"):].split("|")
+    packages[name.strip().split(".")[0]] += int(self_us) / 1000
+  return dict(packages)
+
+def measure(runs: int) -> dict:
+  startups = [json.loads(_run(["-c", _STARTUP]).stdout) for _ in range(runs)]
+  render_worker = [
+    json.loads(
+      _run(["-c", _IMPORT.format(module = "services.form_extractor")]).stdout
+    )["import_ms"]
+    for _ in range(runs)
+  ]
+
+  breakdown = { module : import_breakdown(module) for module in FORBIDDEN_IMPORTS }
+  return {
+    "runs" : runs,
+    "import_ms" : median(run["import_ms"] for run in startups),
+    "startup_ms" : median(run["startup_ms"] for run in startups),
+    "render_worker_ms" : median(render_worker),
+    # from the last run, seconds per startup check
+    "checks" : {
+      name : check["seconds"] for name, check in startups[-1]["checks"].items()
+    },
+    "packages" : breakdown
+  }
+
+def check_budgets(result: dict, args: argparse.Namespace) -> List[str]:
+  problems = []
+  for name, budget in (
+    ("import_ms", args.import_budget_ms),
+    ("startup_ms", args.startup_budget_ms),
+    ("render_worker_ms", args.render_worker_budget_ms)
+  ):
+    if budget and result[name] > budget:
+      problems.append(f"{name} {result[name]:.0f} > budget {budget:.0f}")
+
+  for module, packages in FORBIDDEN_IMPORTS.items():
+    for package in packages:
+      if package in result["packages"][module]:
+        problems.append(f"import {module} loads {package}")
+  return problems
+
+def main():
+  parser = argparse.ArgumentParser(
+    description = "Backend worker import and startup time, against a budget"
+  )
+  parser.add_argument("--runs", type = int, default = 5)
+  parser.add_argument("--top", type = int, default = 10,
+                      help = "packages listed per target, by import time")
+  # 0 disables a budget. Defaults leave headroom over a 1 CPU container,
+  # tighten them to the hardware the check runs on
+  parser.add_argument("--import-budget-ms", type = float, default = 900)
+  parser.add_argument("--startup-budget-ms", type = float, default = 3000)
+  parser.add_argument("--render-worker-budget-ms", type = float, default = 500)
+  parser.add_argument("--json", action = "store_true")
+  args = parser.parse_args()
+
+  result = measure(args.runs)
+  problems = check_budgets(result, args)
+
+  if args.json:
+    print(json.dumps({ **result, "problems" : problems }, indent = 2))
+  else:
+    print(f"import main       : {result['import_ms']:.0f} ms")
+    print(f"ready             : {result['startup_ms']:.0f} ms")
+    print(f"render worker     : {result['render_worker_ms']:.0f} ms")
+    print("startup checks    : " + ", ".join(
+      f"{name} {seconds * 1000:.0f}" for name, seconds in result["checks"].items()
+    ))
+    for module, packages in result["packages"].items():
+      top = sorted(packages.items(), key = lambda item: -item[1])[:args.top]
+      print(f"import {module} :")
+      print("  " + ", ".join(f"{name} {ms:.0f}" for name, ms in top))
+
+  for problem in problems:
+    print(f"BUDGET {problem}", file = sys.stderr)
+  sys.exit(1 if problems else 0)
+
+if __name__ == "__main__":
+  main()
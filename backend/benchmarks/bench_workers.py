@@ -0,0 +1,332 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import List
+import argparse
+import asyncio
+import json
+import socket
+import subprocess
+import sys
+import time
+import os
+
+import httpx
+from benchmarks.bench_pipeline import (
+  BENCH_PII,
+  SAMPLE_DOCS_DIR,
+  _percentile,
+  expected_data,
+  load_corpus
+)
+from benchmarks.fake_responses import FakeResponsesClient
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+
+# The deployed serving mode, offline: `uvicorn --workers N` serving
+# benchmarks.offline_app (the backend with the LLM stand-in) on a local
+# port, with the job and document stores shared between the workers.
+# N concurrent clients submit returns, and every follow-up request (the
+# document download, the job status polls) goes out on a new connection,
+# so it can land on any worker. Reported per worker count: throughput,
+# latency percentiles, failed returns, summaries that do not match, and
+# downloads / job results another worker could not find.
+#   submit : POST /api/submit_tax_form, then GET /api/documents/{id}
+#   jobs   : POST /api/jobs, poll /api/jobs/{id}/result, then the download
+#
+#   python -m benchmarks.bench_workers --workers 1 2 4 --clients 8
+#   python -m benchmarks.bench_workers --flow jobs --store redis
+#
+# Exits 1 when a return fails or does not match, e.g. a document stored
+# by one worker and not found by another.
+
+def _free_port() -> int:
+  with socket.socket() as sock:
+    sock.bind(("127.0.0.1", 0))
+    return sock.getsockname()[1]
+
+def _environment(args: argparse.Namespace, workers: int, state_dir: str,
+                 answers_path: str) -> dict:
+  env = dict(os.environ)
+  env.setdefault("OPENAI_API_KEY", "offline-benchmark")
+  env.update({
+    "WEB_CONCURRENCY" : str(workers),
+    "OFFLINE_ANSWERS" : answers_path,
+    "OFFLINE_LATENCY_MS" : str(args.latency_ms),
+    # every return has to reach the LLM stand-in
+    "EXTRACTION_CACHE_BACKEND" : "none",
+    "ACROFORM_FAST_PATH" : "false",
+    "SUBMIT_MAX_QUEUED" : str(args.clients),
+    "JOB_MAX_PENDING" : str(args.clients * 2),
+  })
+  if args.store == "redis":
+    env["DOCUMENT_STORE_BACKEND"] = env["JOB_STORE_BACKEND"] = "redis"
+  else:
+    env["DOCUMENT_STORE_BACKEND"] = "filesystem"
+    env["DOCUMENT_STORE_PATH"] = os.path.join(state_dir, "documents")
+    env["JOB_STORE_BACKEND"] = "sqlite"
+    env["JOB_STORE_PATH"] = os.path.join(state_dir, "jobs.sqlite3")
+  return env
+
+# Started once every worker answered /api/health, returns the worker pids
+async def _wait_ready(base_url: str, workers: int, timeout: float) -> set:
+  pids = set()
+  deadline = time.monotonic() + timeout
+  while time.monotonic() < deadline:
+    try:
+      # new connection per probe, so probes spread over the workers
+      async with httpx.AsyncClient(base_url = base_url) as http:
+        response = await http.get("/api/health")
+      if response.status_code == 200:
+        pids.add(response.json()["pid"])
+        if len(pids) >= workers:
+          return pids
+    except httpx.TransportError:
+      pass
+    await asyncio.sleep(0.2)
+  if not pids:
+    raise RuntimeError(f"Server not ready after {timeout:.0f}s")
+  return pids
+
+async def run_scenario(
+  args: argparse.Namespace,
+  base_url: str,
+  returns: List[List[str]],
+  expected: List[dict | None]
+) -> dict:
+  uploads = { pdf : Path(pdf).read_bytes() for pdfs in returns for pdf in pdfs }
+  latencies = []
+  failures = []
+  mismatched = 0
+  not_found = 0
+
+  async def follow_up(path: str) -> httpx.Response:
+    async with httpx.AsyncClient(base_url = base_url, timeout = None) as http:
+      return await http.get(path)
+
+  async def submit(http: httpx.AsyncClient, i: int) -> dict:
+    nonlocal not_found
+    files = [
+      ("files", (Path(pdf).name, uploads[pdf], "application/pdf"))
+      for pdf in returns[i]
+    ]
+    if args.flow == "submit":
+      response = await http.post(
+        "/api/submit_tax_form", data = BENCH_PII, files = files
+      )
+      if response.status_code != 200:
+        raise RuntimeError(f"HTTP {response.status_code}: {response.text}")
+      result = response.json()
+    else:
+      response = await http.post("/api/jobs", data = BENCH_PII, files = files)
+      if response.status_code != 202:
+        raise RuntimeError(f"HTTP {response.status_code}: {response.text}")
+      result_url = response.json()["result_url"]
+      while True:
+        response = await follow_up(result_url)
+        if response.status_code == 404:
+          not_found += 1
+          raise RuntimeError(f"Job not found: {result_url}")
+        if response.status_code != 202:
+          break
+        await asyncio.sleep(0.2)
+      if response.status_code != 200:
+        raise RuntimeError(f"HTTP {response.status_code}: {response.text}")
+      result = response.json()
+
+    document = await follow_up(f"/api/documents/{result['document_id']}")
+    if document.status_code == 404:
+      not_found += 1
+    if document.status_code != 200 or not document.content.startswith(b"%PDF"):
+      raise RuntimeError(f"Download HTTP {document.status_code}")
+    return result["tax_return_summary"]
+
+  async def client_loop(http: httpx.AsyncClient, remaining) -> None:
+    nonlocal mismatched
+    for i in remaining:
+      start = time.perf_counter()
+      try:
+        summary = await submit(http, i)
+      except Exception as e:
+        failures.append(f"{type(e).__name__}: {e}")
+        continue
+      latencies.append(time.perf_counter() - start)
+      if expected[i] is not None and summary != expected[i]:
+        mismatched += 1
+
+  # one keep-alive connection per client, like browsers behind nginx
+  clients = [
+    httpx.AsyncClient(base_url = base_url, timeout = None)
+    for _ in range(args.clients)
+  ]
+  try:
+    # first return warms up every worker's template and render processes
+    # enough to not count the cold start
+    await asyncio.gather(*(
+      client_loop(http, [len(returns) - 1]) for http in clients
+    ))
+    latencies.clear()
+    failures.clear()
+    mismatched = not_found = 0
+
+    remaining = iter(range(args.returns))
+    start = time.perf_counter()
+    await asyncio.gather(*(client_loop(http, remaining) for http in clients))
+    elapsed = time.perf_counter() - start
+  finally:
+    for http in clients:
+      await http.aclose()
+
+  return {
+    "returns" : args.returns,
+    "failed" : len(failures),
+    "mismatched" : mismatched,
+    "not_found" : not_found,
+    "seconds" : elapsed,
+    "returns_per_second" : len(latencies) / elapsed,
+    "latency_ms" : {
+      "p50" : 1000 * _percentile(latencies, 0.50) if latencies else None,
+      "p95" : 1000 * _percentile(latencies, 0.95) if latencies else None,
+    },
+    "errors" : sorted(set(failures))[:5],
+  }
+
+def run_workers(
+  args: argparse.Namespace,
+  workers: int,
+  answers_path: str,
+  returns: List[List[str]],
+  expected: List[dict | None]
+) -> dict:
+  port = _free_port()
+  base_url = f"http://127.0.0.1:{port}"
+  with TemporaryDirectory() as state_dir:
+    server = subprocess.Popen(
+      [
+        sys.executable, "-m", "uvicorn", "benchmarks.offline_app:app",
+        "--host", "127.0.0.1",
+        "--port", str(port),
+        "--workers", str(workers),
+        "--log-level", "warning"
+      ],
+      cwd = BACKEND_DIR,
+      env = _environment(args, workers, state_dir, answers_path)
+    )
+    try:
+      pids = asyncio.run(_wait_ready(base_url, workers, args.startup_timeout))
+      result = asyncio.run(run_scenario(args, base_url, returns, expected))
+    finally:
+      server.terminate()
+      server.wait(timeout = 30)
+
+  return {
+    "workers" : workers,
+    "clients" : args.clients,
+    "flow" : args.flow,
+    "store" : args.store,
+    "workers_ready" : len(pids),
+    **result
+  }
+
+def _print_table(results: List[dict]) -> None:
+  columns = [
+    "workers", "clients", "returns", "failed", "not found", "returns/s",
+    "p50 ms", "p95 ms"
+  ]
+  print(" | ".join(columns))
+  for result in results:
+    latency = result["latency_ms"]
+    print(" | ".join([
+      str(result["workers"]),
+      str(result["clients"]),
+      str(result["returns"]),
+      str(result["failed"]),
+      str(result["not_found"]),
+      f"{result['returns_per_second']:.2f}",
+      *(
+        "-" if latency[key] is None else f"{latency[key]:.0f}"
+        for key in ("p50", "p95")
+      ),
+    ]))
+  for result in results:
+    for error in result["errors"]:
+      print(f"  {result['workers']} workers: {error}")
+
+def main():
+  parser = argparse.ArgumentParser(
+    description = "Offline multi-worker serving benchmark"
+  )
+  parser.add_argument("--workers", nargs = "+", type = int, default = [1, 2],
+                      help = "uvicorn worker processes, one scenario per value")
+  parser.add_argument("--clients", type = int, default = 8)
+  parser.add_argument("--returns", type = int, default = 40,
+                      help = "returns per scenario")
+  parser.add_argument("--flow", choices = ["submit", "jobs"], default = "submit")
+  parser.add_argument("--store", choices = ["local", "redis"], default = "local",
+                      help = "local: filesystem documents and SQLite jobs, "
+                             "redis: both on REDIS_URL")
+  parser.add_argument("--corpus", default = SAMPLE_DOCS_DIR,
+                      help = "folder with one numbered sub folder of PDFs per return")
+  parser.add_argument("--latency-ms", type = float, default = 800,
+                      help = "LLM stand-in latency per call")
+  parser.add_argument("--startup-timeout", type = float, default = 120)
+  parser.add_argument("--json", action = "store_true",
+                      help = "print raw results as JSON")
+  args = parser.parse_args()
+
+  from core import config
+  from models.user_pii import UserPII
+  from services.render_profiles import RenderProfile
+  from services.tax_calculator import TaxCalculator
+  from tax_policy.policy_registry import get_bracket_schedule, get_tax_policy
+
+  pii = UserPII.model_validate(BENCH_PII)
+  calculator = TaxCalculator(
+    brackets = get_bracket_schedule(2024, pii.filing_status),
+    standard_deduction = get_tax_policy(2024, pii.filing_status).standard_deduction
+  )
+
+  # Renders the documents once, with the EXTRACTION_* profile the workers
+  # are configured with, and hands the answers to every worker
+  configured_profile = RenderProfile(
+    dpi = config.EXTRACTION_DPI,
+    grayscale = config.EXTRACTION_GRAYSCALE,
+    jpeg_quality = config.EXTRACTION_JPEG_QUALITY,
+    crop_to_content = config.EXTRACTION_CROP_TO_CONTENT,
+    detail = config.EXTRACTION_IMAGE_DETAIL
+  )
+  returns = load_corpus(args.corpus, args.returns + 1)
+  client = FakeResponsesClient()
+  expected = []
+  registered = set()
+  for pdfs in returns:
+    for pdf in set(pdfs) - registered:
+      registered.add(pdf)
+      data = expected_data([pdf])
+      if data is not None:
+        client.register(pdf, data, profiles = [configured_profile])
+    data = expected_data(pdfs)
+    expected.append(
+      None if data is None else calculator.summarize(data).model_dump(mode = "json")
+    )
+
+  with TemporaryDirectory() as answers_dir:
+    answers_path = os.path.join(answers_dir, "answers.json")
+    with open(answers_path, "w") as answers:
+      json.dump(client.export_answers(), answers)
+
+    results = [
+      run_workers(args, workers, answers_path, returns, expected)
+      for workers in args.workers
+    ]
+
+  if args.json:
+    print(json.dumps(results, indent = 2))
+  else:
+    _print_table(results)
+
+  failed = any(result["failed"] or result["mismatched"] for result in results)
+  sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,230 @@
+from typing import Any, Dict, List, Sequence
+import asyncio
+import base64
+import hashlib
+import random
+import threading
+import time
+
+import httpx
+import openai
+import pymupdf
+from services.form_extractor import merge_tax_form_data, render_pdf_pages
+from services.render_profiles import (
+  FULL_FIDELITY_PROFILE,
+  RenderProfile,
+  detect_form_type,
+  select_render_profile
+)
+from models.tax_schema import TaxFormData, W2Data
+
+# Local stand-in for the OpenAI client, enough of it for LLMGateway and
+# FormExtractor (client.responses.parse). Nothing leaves the machine:
+#   - answers : the TaxFormData registered for the documents whose page
+#               images are in the request, so results can be checked
+#   - latency : latency_ms + latency_per_image_ms per image, with seeded
+#               lognormal jitter, honoring the request timeout
+#   - errors  : error_rate of the calls fail with 429 / 500, timeout_rate
+#               of them hang until the request timeout
+#
+#   client = FakeResponsesClient(latency_ms = 800, error_rate = 0.05)
+#   client.register("sample_docs/1/w2_1.pdf", expected_data)
+#   configure_llm_gateway(
+#     client = client,
+#     async_client = FakeAsyncResponsesClient(client),
+#     requests_per_minute = 0,
+#     ...
+#   )
+
+_REQUEST = httpx.Request("POST", "https://api.openai.com/v1/responses")
+
+_EMPTY_ANSWER = TaxFormData(
+  w2 = W2Data(wages = 0, federal_income_tax_withheld = 0)
+)
+
+def image_key(image_url: str) -> str:
+  return hashlib.sha256(image_url.encode("ascii")).hexdigest()
+
+class FakeUsage:
+  def __init__(self, input_tokens: int, output_tokens: int):
+    self.input_tokens = input_tokens
+    self.output_tokens = output_tokens
+    self.total_tokens = input_tokens + output_tokens
+
+class FakeResponse:
+  def __init__(self, output_parsed: Any, input_tokens: int, output_tokens: int):
+    self.output_parsed = output_parsed
+    self.usage = FakeUsage(input_tokens, output_tokens)
+
+class FakeResponsesClient:
+  def __init__(
+    self,
+    latency_ms: float = 800,
+    latency_per_image_ms: float = 150,
+    jitter: float = 0.25,
+    error_rate: float = 0.0,
+    timeout_rate: float = 0.0,
+    seed: int = 0
+  ):
+    self.latency_ms = latency_ms
+    self.latency_per_image_ms = latency_per_image_ms
+    self.jitter = jitter
+    self.error_rate = error_rate
+    self.timeout_rate = timeout_rate
+
+    # client.responses.parse, like the OpenAI client
+    self.responses = self
+
+    self._random = random.Random(seed)
+    self._lock = threading.Lock()
+    # image hash -> (document, data), pages of one document are answered once
+    self._answers : Dict[str, tuple[str, TaxFormData]] = {}
+    self._counters = {
+      "calls" : 0,
+      "injected_errors" : 0,
+      "injected_timeouts" : 0,
+      "unmatched" : 0,
+    }
+
+  # Maps the page images of a PDF, as FormExtractor renders them in fixed
+  # and adaptive mode (and with any other given profiles), to the data the
+  # model is expected to read from it
+  def register(
+    self,
+    pdf_path: str,
+    data: TaxFormData,
+    profiles: Sequence[RenderProfile] = ()
+  ) -> None:
+    with pymupdf.open(pdf_path) as doc:
+      adaptive_profile = select_render_profile(detect_form_type(doc))
+
+    for profile in {FULL_FIDELITY_PROFILE, adaptive_profile, *profiles}:
+      for image in render_pdf_pages(pdf_path, profile = profile).pages:
+        encoded = base64.b64encode(image).decode("ascii")
+        self._answers[image_key(f"data:image/jpeg;base64,{encoded}")] = (
+          pdf_path, data
+        )
+
+  # Registered answers by image hash, to hand them to another process
+  # without rendering the documents again
+  def export_answers(self) -> Dict[str, dict]:
+    return {
+      key : {
+        "document" : document,
+        "data" : data.model_dump(mode = "json", by_alias = True)
+      }
+      for key, (document, data) in self._answers.items()
+    }
+
+  def load_answers(self, answers: Dict[str, dict]) -> None:
+    for key, answer in answers.items():
+      self._answers[key] = (
+        answer["document"], TaxFormData.model_validate(answer["data"])
+      )
+
+  def _count(self, name: str) -> None:
+    with self._lock:
+      self._counters[name] += 1
+
+  def stats(self) -> dict:
+    with self._lock:
+      return dict(self._counters)
+
+  # (latency in seconds, None or the injected failure: "timeout", 429, 500)
+  def _sample(self, n_images: int) -> tuple[float, str | int | None]:
+    with self._lock:
+      jitter = self._random.lognormvariate(0, self.jitter) if self.jitter else 1.0
+      roll = self._random.random()
+      failure = (
+        "timeout" if roll < self.timeout_rate else
+        self._random.choice((429, 500))
+        if roll < self.timeout_rate + self.error_rate else
+        None
+      )
+    latency = (self.latency_ms + self.latency_per_image_ms * n_images) * jitter
+    return latency / 1000, failure
+
+  def _answer(self, images: List[dict]) -> TaxFormData:
+    answers : Dict[str, TaxFormData] = {}
+    for image in images:
+      key = image_key(image["image_url"])
+      answer = self._answers.get(key)
+      if answer is None:
+        # not a registered document, read as an empty form
+        self._count("unmatched")
+        answer = (key, _EMPTY_ANSWER)
+      answers.setdefault(*answer)
+
+    if len(answers) == 1:
+      return next(iter(answers.values()))
+    return merge_tax_form_data(list(answers.values()))
+
+  def parse(
+    self,
+    input: List[dict],
+    timeout: float | None = None,
+    **kwargs
+  ) -> FakeResponse:
+    delay, outcome = self.respond(input, timeout)
+    time.sleep(delay)
+    if isinstance(outcome, Exception):
+      raise outcome
+    return outcome
+
+  # (seconds the call takes, then the response or the error it raises)
+  def respond(
+    self,
+    input: List[dict],
+    timeout: float | None
+  ) -> tuple[float, FakeResponse | Exception]:
+    self._count("calls")
+    images = [
+      item for message in input for item in message["content"]
+      if item["type"] == "input_image"
+    ]
+    latency, failure = self._sample(len(images))
+
+    if failure == "timeout" or (timeout is not None and latency > timeout):
+      self._count("injected_timeouts")
+      return (
+        timeout if timeout is not None else latency,
+        openai.APITimeoutError(request = _REQUEST)
+      )
+
+    if failure is not None:
+      self._count("injected_errors")
+      error_type = (
+        openai.RateLimitError if failure == 429 else openai.InternalServerError
+      )
+      # fails fast, like a throttled or overloaded API
+      return latency / 10, error_type(
+        f"Injected {failure}",
+        response = httpx.Response(failure, request = _REQUEST),
+        body = None
+      )
+
+    # same estimate as the gateway: 85 base + 4 tiles per high detail page,
+    # instructions, and a short JSON answer
+    input_tokens = 500 + sum(
+      85 if image["detail"] == "low" else 765 for image in images
+    )
+    return latency, FakeResponse(self._answer(images), input_tokens, 100)
+
+# AsyncOpenAI flavour of a FakeResponsesClient (await client.responses.parse),
+# sharing its answers, latency model and counters
+class FakeAsyncResponsesClient:
+  def __init__(self, client: FakeResponsesClient):
+    self.client = client
+    self.responses = self
+
+  async def parse(
+    self,
+    input: List[dict],
+    timeout: float | None = None,
+    **kwargs
+  ) -> FakeResponse:
+    delay, outcome = self.client.respond(input, timeout)
+    await asyncio.sleep(delay)
+    if isinstance(outcome, Exception):
+      raise outcome
+    return outcome
@@ -0,0 +1,45 @@
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
+import json
+import os
+
+from benchmarks.fake_responses import FakeAsyncResponsesClient, FakeResponsesClient
+from core import config
+from main import app
+from services.llm_gateway import configure_llm_gateway
+
+# The backend app with OpenAI replaced by the local FakeResponsesClient, to
+# serve the real multi-process setup offline. Every worker process loads
+# the answers exported by FakeResponsesClient.export_answers from
+# OFFLINE_ANSWERS, latency from OFFLINE_LATENCY_MS.
+#
+#   OFFLINE_ANSWERS=answers.json OFFLINE_LATENCY_MS=800 \
+#     uvicorn benchmarks.offline_app:app --workers 4
+
+_lifespan = app.router.lifespan_context
+
+@asynccontextmanager
+async def offline_lifespan(app: FastAPI):
+  async with _lifespan(app):
+    client = FakeResponsesClient(
+      latency_ms = float(os.getenv("OFFLINE_LATENCY_MS", "800")),
+      seed = os.getpid()
+    )
+    answers_path = os.getenv("OFFLINE_ANSWERS")
+    if answers_path:
+      with open(answers_path) as answers:
+        client.load_answers(json.load(answers))
+
+    # budgets off, the stand-in does not throttle
+    app.state.context.llm_gateway = configure_llm_gateway(
+      client = client,
+      async_client = FakeAsyncResponsesClient(client),
+      requests_per_minute = 0,
+      tokens_per_minute = 0,
+      max_attempts = config.OPENAI_MAX_ATTEMPTS,
+      request_timeout_seconds = config.OPENAI_REQUEST_TIMEOUT_SECONDS,
+      deadline_seconds = config.OPENAI_DEADLINE_SECONDS
+    )
+    yield
+
+app.router.lifespan_context = offline_lifespan
@@ -1,5 +1,199 @@
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import FastAPI
+import os
+
+# Worker processes serving the API (uvicorn --workers, which reads the same
+# variable). Every limit below is per worker process.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+# Submit pipeline execution limits
+# Submissions beyond SUBMIT_MAX_IN_FLIGHT wait for a slot, and once
+# SUBMIT_MAX_QUEUED are already waiting new ones are rejected with 503
+SUBMIT_MAX_IN_FLIGHT = int(os.getenv("SUBMIT_MAX_IN_FLIGHT", "8"))
+SUBMIT_MAX_QUEUED = int(os.getenv("SUBMIT_MAX_QUEUED", "32"))
+# Identical submissions (same PDFs and PII) arriving while one is being
+# processed share its result instead of running the pipeline again
+SUBMIT_COALESCE_IDENTICAL = (
+  os.getenv("SUBMIT_COALESCE_IDENTICAL", "true").lower() == "true"
+)
+# "async" awaits the submit pipeline on the event loop (AsyncOpenAI, pages
+# rendered on the CPU workers, form filling in a thread), so in-flight
+# submissions are no longer bounded by SUBMIT_IO_WORKERS threads. "threads"
+# runs the whole blocking pipeline in the I/O threads.
+SUBMIT_PIPELINE = os.getenv("SUBMIT_PIPELINE", "async")
+# Threads running the blocking pipeline (OpenAI calls, form filling)
+SUBMIT_IO_WORKERS = int(
+  os.getenv("SUBMIT_IO_WORKERS", str(SUBMIT_MAX_IN_FLIGHT))
+)
+# Processes rasterizing PDF pages with PyMuPDF, 0 renders in the I/O thread.
+# By default the cores are split between the web workers.
+SUBMIT_CPU_WORKERS = int(
+  os.getenv(
+    "SUBMIT_CPU_WORKERS",
+    str(max(1, min(4, (os.cpu_count() or 1) // WEB_CONCURRENCY)))
+  )
+)
+
+# Uploaded PDFs (POST /api/submit_tax_form, /api/jobs), checked while the
+# request body streams in, requests over a limit are cut off with 413
+UPLOAD_MAX_FILE_BYTES = int(
+  os.getenv("UPLOAD_MAX_FILE_BYTES", str(16 * 1024 * 1024))
+)
+UPLOAD_MAX_REQUEST_BYTES = int(
+  os.getenv("UPLOAD_MAX_REQUEST_BYTES", str(3 * 16 * 1024 * 1024 + 64 * 1024))
+)
+UPLOAD_MAX_PAGES_PER_FILE = int(os.getenv("UPLOAD_MAX_PAGES_PER_FILE", "10"))
+
+# Background jobs (POST /api/jobs)
+# Job state: "memory" (single worker), "sqlite" (shared by the workers on
+# a host) or "redis" (REDIS_URL, shared across hosts)
+JOB_STORE_BACKEND = os.getenv("JOB_STORE_BACKEND", "sqlite")
+JOB_STORE_PATH = os.getenv(
+  "JOB_STORE_PATH",
+  os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..", "cache", "jobs.sqlite3"
+  )
+)
+# New jobs are rejected with 503 while JOB_MAX_PENDING are queued or running
+JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", "100"))
+# Finished jobs are kept this long for status and result polling
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+# A queued or running job whose worker stopped renewing its lease this long
+# (killed or restarted) is failed, and no longer counts towards JOB_MAX_PENDING
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_EVENTS_POLL_SECONDS = float(os.getenv("JOB_EVENTS_POLL_SECONDS", "0.5"))
+JOB_EVENTS_KEEPALIVE_SECONDS = float(
+  os.getenv("JOB_EVENTS_KEEPALIVE_SECONDS", "15")
+)
+
+# Read fillable (AcroForm) W-2 / 1099 fields directly instead of calling the LLM
+ACROFORM_FAST_PATH = os.getenv("ACROFORM_FAST_PATH", "true").lower() == "true"
+
+# Ceiling on the base64 page images sent to the LLM for one submission
+EXTRACTION_MAX_PAYLOAD_BYTES = int(
+  os.getenv("EXTRACTION_MAX_PAYLOAD_BYTES", str(32 * 1024 * 1024))
+)
+
+# Vision model reading scanned / flattened documents
+EXTRACTION_MODEL = os.getenv("EXTRACTION_MODEL", "gpt-4.1-mini")
+
+# Page rendering for the LLM: "fixed" (the EXTRACTION_* profile below) or
+# "adaptive" (cheaper per form type profile, retried with the profile below
+# if it does not validate)
+EXTRACTION_RENDER_MODE = os.getenv("EXTRACTION_RENDER_MODE", "fixed")
+EXTRACTION_DPI = int(os.getenv("EXTRACTION_DPI", "300"))
+EXTRACTION_GRAYSCALE = os.getenv("EXTRACTION_GRAYSCALE", "false").lower() == "true"
+EXTRACTION_JPEG_QUALITY = int(os.getenv("EXTRACTION_JPEG_QUALITY", "95"))
+EXTRACTION_CROP_TO_CONTENT = (
+  os.getenv("EXTRACTION_CROP_TO_CONTENT", "false").lower() == "true"
+)
+# "low", "high" or "auto", see the OpenAI vision docs
+EXTRACTION_IMAGE_DETAIL = os.getenv("EXTRACTION_IMAGE_DETAIL", "high")
+
+# "per_document" extracts each uploaded PDF in its own LLM request,
+# concurrently, "combined" sends all of them in a single request
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "per_document")
+EXTRACTION_MAX_CONCURRENCY = int(os.getenv("EXTRACTION_MAX_CONCURRENCY", "3"))
+# Attempts per document before the submission fails
+EXTRACTION_DOCUMENT_ATTEMPTS = int(
+  os.getenv("EXTRACTION_DOCUMENT_ATTEMPTS", "2")
+)
+
+# Shared OpenAI client: budgets (0 disables), retries and timeouts
+OPENAI_REQUESTS_PER_MINUTE = float(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "500"))
+OPENAI_TOKENS_PER_MINUTE = float(os.getenv("OPENAI_TOKENS_PER_MINUTE", "200000"))
+OPENAI_MAX_ATTEMPTS = int(os.getenv("OPENAI_MAX_ATTEMPTS", "4"))
+# single HTTP request, and whole call including waiting and retries
+OPENAI_REQUEST_TIMEOUT_SECONDS = float(
+  os.getenv("OPENAI_REQUEST_TIMEOUT_SECONDS", "60")
+)
+OPENAI_DEADLINE_SECONDS = float(os.getenv("OPENAI_DEADLINE_SECONDS", "120"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+# connection pool of the async client used by SUBMIT_PIPELINE=async
+OPENAI_ASYNC_MAX_CONNECTIONS = int(
+  os.getenv("OPENAI_ASYNC_MAX_CONNECTIONS", "200")
+)
+
+# Per-document extraction cache: "memory", "sqlite" or "none"
+EXTRACTION_CACHE_BACKEND = os.getenv("EXTRACTION_CACHE_BACKEND", "memory")
+EXTRACTION_CACHE_MAX_ENTRIES = int(
+  os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "1024")
+)
+EXTRACTION_CACHE_TTL_SECONDS = float(
+  os.getenv("EXTRACTION_CACHE_TTL_SECONDS", "86400")
+)
+EXTRACTION_CACHE_PATH = os.getenv(
+  "EXTRACTION_CACHE_PATH",
+  os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..", "cache", "extraction_cache.sqlite3"
+  )
+)
+
+# Batch submissions (POST /api/batches, batch_cli.py)
+# Taxpayers of all the batches of a worker in the pipeline at the same
+# time: a share of the SUBMIT_MAX_IN_FLIGHT slots, the rest are kept for
+# /api/submit_tax_form and /api/jobs
+BATCH_MAX_IN_FLIGHT = int(
+  os.getenv("BATCH_MAX_IN_FLIGHT", str(max(1, SUBMIT_MAX_IN_FLIGHT // 2)))
+)
+# Batches streaming at the same time before new ones get 503
+BATCH_MAX_CONCURRENT = int(os.getenv("BATCH_MAX_CONCURRENT", "2"))
+BATCH_MAX_TAXPAYERS = int(os.getenv("BATCH_MAX_TAXPAYERS", "1000"))
+BATCH_MAX_ARCHIVE_BYTES = int(
+  os.getenv("BATCH_MAX_ARCHIVE_BYTES", str(512 * 1024 * 1024))
+)
+# Per document inside a batch, after decompression
+BATCH_MAX_DOCUMENT_BYTES = int(
+  os.getenv("BATCH_MAX_DOCUMENT_BYTES", str(16 * 1024 * 1024))
+)
+
+# Generated Form 1040s: "memory" (single worker), "filesystem" (shared by
+# the workers on a host or a shared volume), "s3" (any S3-compatible
+# object storage, e.g. MinIO through DOCUMENT_STORE_S3_ENDPOINT_URL) or
+# "redis" (REDIS_URL)
+DOCUMENT_STORE_BACKEND = os.getenv("DOCUMENT_STORE_BACKEND", "filesystem")
+# Documents stay downloadable (and re-downloadable) this long
+DOCUMENT_RETENTION_SECONDS = float(
+  os.getenv("DOCUMENT_RETENTION_SECONDS", "3600")
+)
+DOCUMENT_STORE_MAX_BYTES = int(
+  os.getenv("DOCUMENT_STORE_MAX_BYTES", str(256 * 1024 * 1024))
+)
+DOCUMENT_STORE_PATH = os.getenv(
+  "DOCUMENT_STORE_PATH",
+  os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..", "static", "generated_documents"
+  )
+)
+DOCUMENT_STORE_S3_BUCKET = os.getenv("DOCUMENT_STORE_S3_BUCKET", "")
+DOCUMENT_STORE_S3_PREFIX = os.getenv(
+  "DOCUMENT_STORE_S3_PREFIX", "generated_documents/"
+)
+DOCUMENT_STORE_S3_ENDPOINT_URL = os.getenv("DOCUMENT_STORE_S3_ENDPOINT_URL", "")
+
+# Redis, or any server speaking its protocol (Valkey, KeyDB, ...), used by
+# the "redis" job and document stores, requires redis
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# /api/metrics of several workers: every worker writes its metrics to this
+# directory every METRICS_FLUSH_SECONDS and a scrape, whichever worker it
+# lands on, reports the sum of all of them. Empty keeps metrics per worker.
+METRICS_MULTIPROCESS_DIR = os.getenv(
+  "METRICS_MULTIPROCESS_DIR",
+  os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..", "cache", "metrics"
+  ) if WEB_CONCURRENCY > 1 else ""
+)
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "1"))
+
+# Tracing of requests and pipeline stages: "none", "otlp" (endpoint from
+# the OTEL_EXPORTER_OTLP_* variables) or "console", requires opentelemetry-sdk
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none")
+TRACING_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "ai-tax-return-backend")
 
 def api_middleware(app: FastAPI) -> None:
   app.add_middleware(
@@ -1,9 +1,27 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from api import endpoints
+from api.app_context import create_app_context
+from api.request_metrics import RequestMetricsMiddleware
 from core import config
+from services.tracing import configure_tracing, shutdown_tracing
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+  configure_tracing(config.TRACING_EXPORTER, config.TRACING_SERVICE_NAME)
+  # loaded and checked before serving, a broken deployment fails here
+  context = create_app_context()
+  app.state.context = context
+  context.ready = True
+  try:
+    yield
+  finally:
+    context.close()
+    shutdown_tracing()
 
 app = FastAPI(
   title       = "AI Tax Return Agent",
+  lifespan    = lifespan,
   docs_url    = "/api/docs",
   redoc_url   = "/api/redoc",
   openapi_url = "/api/openapi.json"
@@ -11,3 +29,4 @@ app = FastAPI(
 
 app.include_router(endpoints.router)
 config.api_middleware(app)
+app.add_middleware(RequestMetricsMiddleware)
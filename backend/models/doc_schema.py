@@ -1,9 +1,7 @@
 from pydantic import BaseModel, Field
 from decimal import Decimal
-import os
-import sys
 
-from user_pii import UserPII
+from models.user_pii import UserPII
 
 class Form1040(BaseModel):
   pii: UserPII = Field(
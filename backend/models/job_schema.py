@@ -0,0 +1,27 @@
+from pydantic import BaseModel, Field
+from datetime import datetime
+from enum import Enum
+
+from models.tax_schema import TaxReturnSummary
+
+class JobStatus(str, Enum):
+  queued = "queued"
+  running = "running"
+  succeeded = "succeeded"
+  failed = "failed"
+
+  @property
+  def is_terminal(self) -> bool:
+    return self in (JobStatus.succeeded, JobStatus.failed)
+
+class TaxFormJob(BaseModel):
+  job_id: str = Field(description = "Job identifier")
+  status: JobStatus = Field(default = JobStatus.queued)
+  created_at: datetime = Field(description = "When the job was accepted")
+  updated_at: datetime = Field(description = "Last status change")
+  document_id: str | None = Field(
+    default = None,
+    description = "Generated Form 1040, set once the job succeeded"
+  )
+  tax_return_summary: TaxReturnSummary | None = Field(default = None)
+  error: str | None = Field(default = None)
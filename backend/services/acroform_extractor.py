@@ -0,0 +1,104 @@
+from pydantic import BaseModel, ValidationError
+from typing import Callable, Type
+import pymupdf
+
+from models.dummy_doc_schema import FormW2, Form1099INT, Form1099NEC
+from models.tax_schema import TaxFormData, W2Data, NECData, INTData
+from services.render_profiles import FORM_TITLES
+
+class AcroFormLayout(BaseModel):
+  form_name: str
+  # text printed on the form, tells apart forms sharing widget names
+  title: str
+  widgets: Type[BaseModel]
+  to_tax_form_data: Callable[[BaseModel], TaxFormData]
+
+# Fillable W-2 / 1099 layouts, widget names are the aliases of the
+# dummy_doc_schema models the sample documents are generated from
+ACROFORM_LAYOUTS = [
+  AcroFormLayout(
+    form_name = "W-2",
+    title = FORM_TITLES["W-2"],
+    widgets = FormW2,
+    to_tax_form_data = lambda form: TaxFormData(
+      forms_submitted = ["W-2"],
+      w2 = W2Data(
+        wages = form.wages,
+        federal_income_tax_withheld = form.federal_income_tax_withheld
+      )
+    )
+  ),
+  AcroFormLayout(
+    form_name = "1099-NEC",
+    title = FORM_TITLES["1099-NEC"],
+    widgets = Form1099NEC,
+    to_tax_form_data = lambda form: TaxFormData.model_validate({
+      "forms_submitted" : ["1099-NEC"],
+      "w2" : W2Data(wages = 0, federal_income_tax_withheld = 0),
+      "1099_nec" : NECData(
+        nonemployee_compensation = form.nonemployee_compensation
+      )
+    })
+  ),
+  AcroFormLayout(
+    form_name = "1099-INT",
+    title = FORM_TITLES["1099-INT"],
+    widgets = Form1099INT,
+    to_tax_form_data = lambda form: TaxFormData.model_validate({
+      "forms_submitted" : ["1099-INT"],
+      "w2" : W2Data(wages = 0, federal_income_tax_withheld = 0),
+      "1099_int" : INTData(interest_income = form.interest_income)
+    })
+  )
+]
+
+def _widget_aliases(model: Type[BaseModel]) -> set[str]:
+  return { field.alias or name for name, field in model.model_fields.items() }
+
+def _read_widgets(doc: pymupdf.Document) -> dict[str, str]:
+  values = {}
+  for page in doc:
+    for widget in page.widgets():
+      if widget.field_name and widget.field_value not in (None, ""):
+        values.setdefault(widget.field_name, str(widget.field_value).strip())
+  return values
+
+def detect_acroform_layout(
+  doc: pymupdf.Document,
+  widget_names: set[str] | None = None
+) -> AcroFormLayout | None:
+  if widget_names is None:
+    widget_names = {
+      widget.field_name for page in doc for widget in page.widgets()
+    }
+  text = "".join(page.get_text() for page in doc)
+
+  for layout in ACROFORM_LAYOUTS:
+    if _widget_aliases(layout.widgets) <= widget_names and layout.title in text:
+      return layout
+
+  return None
+
+# Reads the filled widgets of a fillable W-2 / 1099 directly.
+# Returns None when the document is not one of the known layouts or the
+# amounts are missing or invalid (e.g. scanned or flattened documents),
+# which is the cue to fall back to the vision LLM.
+def extract_acroform(pdf_path: str) -> TaxFormData | None:
+  with pymupdf.open(pdf_path) as doc:
+    if not doc.is_form_pdf:
+      return None
+
+    widget_names = {
+      widget.field_name for page in doc for widget in page.widgets()
+    }
+    layout = detect_acroform_layout(doc, widget_names)
+    if layout is None:
+      return None
+
+    values = _read_widgets(doc)
+
+  try:
+    form = layout.widgets.model_validate(values)
+    return layout.to_tax_form_data(form)
+  except (ValidationError, ArithmeticError):
+    return None
@@ -0,0 +1,270 @@
+from abc import ABC, abstractmethod
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Any, AsyncIterator, Awaitable, Callable, IO, List
+from pydantic import BaseModel, Field, ValidationError
+import asyncio
+import inspect
+import json
+import zipfile
+
+from models.user_pii import UserPII
+
+MANIFEST_NAMES = ("manifest.jsonl", "manifest.json")
+
+# Problems with one taxpayer of a batch (missing document, invalid PII...),
+# reported on that taxpayer's result line instead of failing the batch
+class BatchItemError(ValueError):
+  pass
+
+class BatchManifestError(ValueError):
+  pass
+
+class BatchTaxpayer(BaseModel):
+  # also names the taxpayer's output files in the CLI
+  taxpayer_id: str = Field(pattern = r"^[A-Za-z0-9_.-]{1,128}$")
+  pii: dict
+  documents: List[str] = Field(min_length = 1, max_length = 3)
+
+# A JSON array of taxpayers, an object with a "taxpayers" array, or JSON
+# lines with one taxpayer each
+def parse_manifest(raw: bytes, max_taxpayers: int | None = None) -> List[BatchTaxpayer]:
+  try:
+    text = raw.decode("utf-8-sig")
+    try:
+      rows = json.loads(text)
+    except json.JSONDecodeError:
+      rows = [json.loads(line) for line in text.splitlines() if line.strip()]
+  except (UnicodeDecodeError, json.JSONDecodeError) as e:
+    raise BatchManifestError(f"Manifest is not valid JSON: {e}") from e
+
+  if isinstance(rows, dict):
+    rows = rows.get("taxpayers", [rows] if "taxpayer_id" in rows else [])
+  if not isinstance(rows, list):
+    raise BatchManifestError("Manifest must list taxpayers")
+
+  if not rows:
+    raise BatchManifestError("Manifest lists no taxpayers")
+  if max_taxpayers is not None and len(rows) > max_taxpayers:
+    raise BatchManifestError(
+      f"Manifest lists {len(rows)} taxpayers, at most {max_taxpayers} are accepted"
+    )
+
+  try:
+    taxpayers = [BatchTaxpayer.model_validate(row) for row in rows]
+  except ValidationError as e:
+    raise BatchManifestError(f"Invalid manifest entry: {e}") from e
+
+  seen = set()
+  for taxpayer in taxpayers:
+    if taxpayer.taxpayer_id in seen:
+      raise BatchManifestError(f"Duplicate taxpayer_id {taxpayer.taxpayer_id}")
+    seen.add(taxpayer.taxpayer_id)
+
+  return taxpayers
+
+# Where the documents named in a manifest are read from. Reads happen in
+# worker threads, for up to max_in_flight taxpayers of process_batch at
+# once, so copy_to has to be safe to call concurrently.
+class DocumentSource(ABC):
+  def __init__(self, max_document_bytes: int):
+    self.max_document_bytes = max_document_bytes
+
+  @abstractmethod
+  def manifest(self) -> bytes:
+    ...
+
+  # Copies the document into dst, raises BatchItemError when it is missing
+  # or too large
+  @abstractmethod
+  def copy_to(self, name: str, dst: IO[bytes]) -> None:
+    ...
+
+  def close(self) -> None:
+    pass
+
+  def _copy_limited(self, name: str, src: IO[bytes], dst: IO[bytes]) -> None:
+    copied = 0
+    while chunk := src.read(64 * 1024):
+      copied += len(chunk)
+      if copied > self.max_document_bytes:
+        raise BatchItemError(f"{name} is larger than {self.max_document_bytes} bytes")
+      dst.write(chunk)
+
+# Zip archive with a manifest at its root, documents named by their path
+# inside the archive
+class ZipDocumentSource(DocumentSource):
+  def __init__(self, archive: str | Path | IO[bytes], max_document_bytes: int):
+    super().__init__(max_document_bytes)
+    try:
+      self._zip = zipfile.ZipFile(archive)
+    except zipfile.BadZipFile as e:
+      raise BatchManifestError("The archive is not a valid zip file") from e
+
+  def manifest(self) -> bytes:
+    for name in MANIFEST_NAMES:
+      try:
+        info = self._zip.getinfo(name)
+      except KeyError:
+        continue
+      if info.file_size > self.max_document_bytes:
+        raise BatchManifestError("The manifest is too large")
+      return self._zip.read(info)
+    raise BatchManifestError(
+      f"The archive has no {' or '.join(MANIFEST_NAMES)} at its root"
+    )
+
+  def copy_to(self, name: str, dst: IO[bytes]) -> None:
+    try:
+      info = self._zip.getinfo(name)
+    except KeyError:
+      raise BatchItemError(f"{name} is not in the archive")
+
+    # declared size first, so a zip bomb is never inflated
+    if info.file_size > self.max_document_bytes:
+      raise BatchItemError(f"{name} is larger than {self.max_document_bytes} bytes")
+    with self._zip.open(info) as src:
+      self._copy_limited(name, src, dst)
+
+  def close(self) -> None:
+    self._zip.close()
+
+# Manifest file on disk, documents named relative to its directory
+class DirectoryDocumentSource(DocumentSource):
+  def __init__(self, manifest_path: str | Path, max_document_bytes: int):
+    super().__init__(max_document_bytes)
+    self.manifest_path = Path(manifest_path)
+    self.root = self.manifest_path.parent.resolve()
+
+  def manifest(self) -> bytes:
+    return self.manifest_path.read_bytes()
+
+  def copy_to(self, name: str, dst: IO[bytes]) -> None:
+    path = (self.root / name).resolve()
+    if not path.is_relative_to(self.root) or not path.is_file():
+      raise BatchItemError(f"{name} was not found next to the manifest")
+
+    with open(path, "rb") as src:
+      self._copy_limited(name, src, dst)
+
+def open_document_source(path: str | Path, max_document_bytes: int) -> DocumentSource:
+  if zipfile.is_zipfile(path):
+    return ZipDocumentSource(path, max_document_bytes)
+  return DirectoryDocumentSource(path, max_document_bytes)
+
+_PDF_MAGIC = b"%PDF-"
+
+# Validates a taxpayer's PII and spools its documents to temporary files,
+# appended to temp_pdf_paths as they are created for the caller to remove
+def _prepare_taxpayer(
+  taxpayer: BatchTaxpayer,
+  source: DocumentSource,
+  temp_pdf_paths: List[Path]
+) -> UserPII:
+  try:
+    pii = UserPII.model_validate(taxpayer.pii)
+  except ValidationError as e:
+    raise BatchItemError(
+      "Invalid personal information: " +
+      "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+    )
+
+  for name in taxpayer.documents:
+    with NamedTemporaryFile(suffix = ".pdf", delete = False) as tmp:
+      temp_pdf_paths.append(Path(tmp.name))
+      source.copy_to(name, tmp)
+
+    with open(temp_pdf_paths[-1], "rb") as pdf:
+      if pdf.read(len(_PDF_MAGIC)) != _PDF_MAGIC:
+        raise BatchItemError(f"{name} is not a PDF")
+  return pii
+
+def _remove(paths: List[Path]) -> None:
+  for path in paths:
+    path.unlink(missing_ok = True)
+
+# Runs one taxpayer in a worker thread, documents and run_return included
+def _process_taxpayer(
+  taxpayer: BatchTaxpayer,
+  source: DocumentSource,
+  run_return: Callable[[List[Path], UserPII, str], dict]
+) -> dict:
+  temp_pdf_paths : List[Path] = []
+  try:
+    pii = _prepare_taxpayer(taxpayer, source, temp_pdf_paths)
+    return run_return(temp_pdf_paths, pii, taxpayer.taxpayer_id)
+  finally:
+    _remove(temp_pdf_paths)
+
+# Same with a coroutine run_return, awaited on the event loop once the
+# documents have been spooled in a thread
+async def _process_taxpayer_async(
+  taxpayer: BatchTaxpayer,
+  source: DocumentSource,
+  run_return: Callable[[List[Path], UserPII, str], Awaitable[dict]]
+) -> dict:
+  temp_pdf_paths : List[Path] = []
+  try:
+    pii = await asyncio.to_thread(_prepare_taxpayer, taxpayer, source, temp_pdf_paths)
+    return await run_return(temp_pdf_paths, pii, taxpayer.taxpayer_id)
+  finally:
+    _remove(temp_pdf_paths)
+
+# Processes the taxpayers of a batch with at most max_in_flight of them
+# in the pipeline at once, yielding one result per taxpayer as soon as it
+# completes (not in manifest order). A new taxpayer is only started when a
+# result has been taken, so a slow consumer (e.g. a client reading the
+# NDJSON stream slowly) holds the batch back instead of results piling up.
+#
+#   execute    : awaits a blocking callable in a worker, e.g. engine.run
+#   run_return : returns the result fields of one taxpayer, either blocking
+#                (run through execute) or a coroutine function
+#   describe_error : message reported for unexpected pipeline errors
+async def process_batch(
+  taxpayers: List[BatchTaxpayer],
+  source: DocumentSource,
+  run_return: Callable[[List[Path], UserPII, str], dict | Awaitable[dict]],
+  execute: Callable[..., Awaitable[Any]],
+  max_in_flight: int,
+  describe_error: Callable[[Exception], str] = lambda e: "Processing failed"
+) -> AsyncIterator[dict]:
+  is_async = inspect.iscoroutinefunction(run_return)
+
+  async def run_one(taxpayer: BatchTaxpayer) -> dict:
+    try:
+      if is_async:
+        result = await _process_taxpayer_async(taxpayer, source, run_return)
+      else:
+        result = await execute(_process_taxpayer, taxpayer, source, run_return)
+    except BatchItemError as e:
+      return { "taxpayer_id" : taxpayer.taxpayer_id, "status" : "failed", "error" : str(e) }
+    except Exception as e:
+      return {
+        "taxpayer_id" : taxpayer.taxpayer_id,
+        "status" : "failed",
+        "error" : describe_error(e)
+      }
+    return { "taxpayer_id" : taxpayer.taxpayer_id, "status" : "succeeded", **result }
+
+  remaining = iter(taxpayers)
+  pending : set[asyncio.Task] = set()
+  try:
+    while True:
+      while len(pending) < max(1, max_in_flight):
+        taxpayer = next(remaining, None)
+        if taxpayer is None:
+          break
+        pending.add(asyncio.create_task(run_one(taxpayer)))
+
+      if not pending:
+        return
+
+      done, pending = await asyncio.wait(
+        pending, return_when = asyncio.FIRST_COMPLETED
+      )
+      for task in done:
+        yield task.result()
+  finally:
+    # consumer went away (e.g. client disconnected), do not start the rest
+    for task in pending:
+      task.cancel()
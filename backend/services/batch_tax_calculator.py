@@ -0,0 +1,124 @@
+from decimal import Decimal
+from typing import Iterable, List, Sequence
+from pydantic import BaseModel
+import numpy as np
+
+from models.tax_schema import TaxBracket
+from tax_policy.bracket_schedule import BracketSchedule
+
+# Amounts are int64 cents. Income times the scaled rate has to fit in
+# int64, which still leaves room for incomes of tens of billions of dollars.
+_MAX_CENTS = 10 ** 15
+
+def to_cents(values: Iterable[Decimal | str | int]) -> np.ndarray:
+  cents = []
+  for value in values:
+    amount = Decimal(value) * 100
+    if amount != amount.to_integral_value():
+      raise ValueError(f"Amount has fractions of a cent: {value}")
+    cents.append(int(amount))
+  return np.asarray(cents, dtype = np.int64)
+
+def from_cents(cents: np.ndarray) -> List[Decimal]:
+  return [Decimal(int(c)).scaleb(-2) for c in cents]
+
+# Integer division rounding half to even, like Decimal.quantize under the
+# default context used by TaxCalculator
+def _divide_half_even(numerator: np.ndarray, denominator: int) -> np.ndarray:
+  quotient, remainder = np.divmod(numerator, denominator)
+  round_up = (2 * remainder > denominator) | (
+    (2 * remainder == denominator) & (quotient % 2 == 1)
+  )
+  return quotient + round_up
+
+class TaxSummaryBatch(BaseModel):
+  total_income: np.ndarray
+  taxable_income: np.ndarray
+  total_tax_withheld: np.ndarray
+  estimated_tax_due: np.ndarray
+  estimated_refund: np.ndarray
+  amount_owed: np.ndarray
+
+  model_config = { "arbitrary_types_allowed": True, "frozen": True }
+
+# Vectorized TaxCalculator.summarize over arrays of taxpayers, for bulk
+# recomputation and what-if runs. Everything is exact integer cents math:
+# rates are scaled to integers, the tax at every bracket threshold is
+# precomputed, and each income needs one searchsorted and one multiply.
+# Results match summarize to the cent for amounts in whole cents.
+class BatchTaxCalculator:
+  def __init__(
+    self,
+    brackets: BracketSchedule | Sequence[TaxBracket],
+    standard_deduction: Decimal
+  ):
+    if not isinstance(brackets, BracketSchedule):
+      brackets = BracketSchedule(brackets)
+
+    # rates as integers over rate_scale, e.g. 0.22 -> 22 / 100
+    rate_places = max(-b.rate.normalize().as_tuple().exponent for b in brackets)
+    self.rate_scale = 10 ** max(rate_places, 0)
+
+    self.lower_cents = to_cents(b.lower_limit for b in brackets)
+    self.upper_cents = to_cents(
+      _MAX_CENTS // 100 if b.upper_limit is None else b.upper_limit
+      for b in brackets
+    )
+    self.rates = np.array(
+      [int(b.rate * self.rate_scale) for b in brackets], dtype = np.int64
+    )
+
+    # tax (times rate_scale) owed on everything below each bracket
+    full_bracket_tax = (self.upper_cents - self.lower_cents) * self.rates
+    self.cumulative_tax = np.concatenate(
+      ([0], np.cumsum(full_bracket_tax[:-1]))
+    ).astype(np.int64)
+
+    self.standard_deduction_cents = int(to_cents([standard_deduction])[0])
+
+  def calculate_tax_cents(self, taxable_income_cents: np.ndarray) -> np.ndarray:
+    taxable = np.asarray(taxable_income_cents, dtype = np.int64)
+    if taxable.size and taxable.max() > _MAX_CENTS:
+      raise ValueError("Taxable income is too large for the batch calculator")
+
+    # bracket containing each income, -1 when at or below the first threshold
+    index = np.searchsorted(self.lower_cents, taxable, side = "left") - 1
+    in_brackets = index >= 0
+    index = np.maximum(index, 0)
+
+    lower = self.lower_cents[index]
+    amount_in_bracket = np.minimum(taxable, self.upper_cents[index]) - lower
+    scaled_tax = np.where(
+      in_brackets,
+      self.cumulative_tax[index] + amount_in_bracket * self.rates[index],
+      0
+    )
+    return _divide_half_even(scaled_tax, self.rate_scale)
+
+  # total_income, tax_withheld and (optionally, per taxpayer) deduction in
+  # cents; the standard deduction is used when deduction_cents is None
+  def summarize_cents(
+    self,
+    total_income_cents: np.ndarray,
+    tax_withheld_cents: np.ndarray,
+    deduction_cents: np.ndarray | None = None
+  ) -> TaxSummaryBatch:
+    total_income = np.asarray(total_income_cents, dtype = np.int64)
+    tax_withheld = np.asarray(tax_withheld_cents, dtype = np.int64)
+    deduction = (
+      self.standard_deduction_cents if deduction_cents is None
+      else np.asarray(deduction_cents, dtype = np.int64)
+    )
+
+    taxable_income = np.maximum(total_income - deduction, 0)
+    tax_due = self.calculate_tax_cents(taxable_income)
+    balance = tax_withheld - tax_due
+
+    return TaxSummaryBatch(
+      total_income = total_income,
+      taxable_income = taxable_income,
+      total_tax_withheld = tax_withheld,
+      estimated_tax_due = tax_due,
+      estimated_refund = np.maximum(balance, 0),
+      amount_owed = np.maximum(-balance, 0)
+    )
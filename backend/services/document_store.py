@@ -0,0 +1,462 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterator
+from pydantic import BaseModel
+import hashlib
+import math
+import os
+import re
+import threading
+import time
+
+# Document ids are generated by the API ("<uuid4 hex>.pdf"), anything else
+# is treated as not found so it can never reach a file path or an object key
+_DOCUMENT_ID = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]{0,127}$")
+
+def _valid_document_id(document_id: str) -> bool:
+  return bool(_DOCUMENT_ID.match(document_id))
+
+# The document ended before the requested range, it was replaced or expired
+# while being read. Raised instead of returning short, so a download never
+# sends less than its Content-Length.
+class DocumentTruncatedError(OSError):
+  pass
+
+def _etag(data: bytes) -> str:
+  return f'"{hashlib.sha256(data).hexdigest()[:32]}"'
+
+class StoredDocument(BaseModel):
+  document_id: str
+  size: int
+  etag: str
+  created_at: float
+
+# Generated Form 1040 PDFs, written once by the worker that produced them
+# and streamed (whole or by byte range) by whichever worker gets the
+# download. Documents expire retention_seconds after they were stored.
+class DocumentStore(ABC):
+  CHUNK_SIZE = 64 * 1024
+  # expired documents are swept at most this often, on put
+  PURGE_INTERVAL_SECONDS = 60.0
+
+  def __init__(self, retention_seconds: float):
+    self.retention_seconds = retention_seconds
+    self.evictions = 0
+    self._last_purge = time.monotonic()
+    self._purge_lock = threading.Lock()
+
+  @abstractmethod
+  def _put(self, document_id: str, data: bytes) -> None:
+    ...
+
+  @abstractmethod
+  def stat(self, document_id: str) -> StoredDocument | None:
+    ...
+
+  # Chunks of bytes [start, end], both inclusive. Raises KeyError, before
+  # the first chunk, when the document is gone, DocumentTruncatedError when
+  # it ends before end.
+  @abstractmethod
+  def _read(self, document_id: str, start: int, end: int) -> Iterator[bytes]:
+    ...
+
+  @abstractmethod
+  def delete(self, document_id: str) -> None:
+    ...
+
+  # Removes expired documents, returns how many
+  @abstractmethod
+  def purge_expired(self) -> int:
+    ...
+
+  def put(self, document_id: str, data: bytes) -> None:
+    if not _valid_document_id(document_id):
+      raise ValueError(f"Invalid document id: {document_id!r}")
+
+    self._put(document_id, data)
+    self._maybe_purge()
+
+  # Lazy, nothing is read until iterated (StreamingResponse iterates it in
+  # a worker thread). end is inclusive, the whole document when None.
+  def read(
+    self,
+    document_id: str,
+    start: int = 0,
+    end: int | None = None
+  ) -> Iterator[bytes]:
+    if end is None:
+      document = self.stat(document_id)
+      if document is None:
+        raise KeyError(document_id)
+      end = document.size - 1
+
+    if start <= end:
+      yield from self._read(document_id, start, end)
+
+  # Stores a document again under another id, e.g. for every caller of a
+  # coalesced submission. Raises KeyError when the source is gone.
+  def copy(self, source_id: str, document_id: str) -> None:
+    self.put(document_id, b"".join(self.read(source_id)))
+
+  def _is_expired(self, created_at: float) -> bool:
+    return created_at + self.retention_seconds < time.time()
+
+  def _maybe_purge(self) -> None:
+    now = time.monotonic()
+    with self._purge_lock:
+      if now - self._last_purge < self.PURGE_INTERVAL_SECONDS:
+        return
+      self._last_purge = now
+
+    self.evictions += self.purge_expired()
+
+# Per process, oldest documents are evicted first once the stored bytes
+# go over max_bytes. Only suitable for a single worker.
+class InMemoryDocumentStore(DocumentStore):
+  def __init__(self, max_bytes: int, retention_seconds: float):
+    super().__init__(retention_seconds)
+    self.max_bytes = max_bytes
+    self._documents : OrderedDict[str, tuple[StoredDocument, bytes]] = OrderedDict()
+    self._size = 0
+    self._lock = threading.Lock()
+
+  def _put(self, document_id: str, data: bytes) -> None:
+    if len(data) > self.max_bytes:
+      raise ValueError("Document is larger than the document store budget")
+
+    document = StoredDocument(
+      document_id = document_id,
+      size = len(data),
+      etag = _etag(data),
+      created_at = time.time()
+    )
+    with self._lock:
+      self._pop(document_id)
+      self._documents[document_id] = (document, data)
+      self._size += len(data)
+
+      while self._size > self.max_bytes:
+        self._pop(next(iter(self._documents)))
+        self.evictions += 1
+
+  def _pop(self, document_id: str) -> None:
+    entry = self._documents.pop(document_id, None)
+    if entry is not None:
+      self._size -= entry[0].size
+
+  def stat(self, document_id: str) -> StoredDocument | None:
+    with self._lock:
+      entry = self._documents.get(document_id)
+      if entry is None:
+        return None
+
+      if self._is_expired(entry[0].created_at):
+        self._pop(document_id)
+        self.evictions += 1
+        return None
+      return entry[0]
+
+  def _read(self, document_id: str, start: int, end: int) -> Iterator[bytes]:
+    with self._lock:
+      entry = self._documents.get(document_id)
+    if entry is None:
+      raise KeyError(document_id)
+
+    view = memoryview(entry[1])
+    for offset in range(start, end + 1, self.CHUNK_SIZE):
+      yield bytes(view[offset : min(offset + self.CHUNK_SIZE, end + 1)])
+
+  def delete(self, document_id: str) -> None:
+    with self._lock:
+      self._pop(document_id)
+
+  def purge_expired(self) -> int:
+    with self._lock:
+      expired = [
+        document_id
+        for document_id, (document, _) in self._documents.items()
+        if self._is_expired(document.created_at)
+      ]
+      for document_id in expired:
+        self._pop(document_id)
+    return len(expired)
+
+  @property
+  def size_bytes(self) -> int:
+    return self._size
+
+# One file per document in a directory, shared by every worker on the host
+# (or on a shared volume). Files are written under a temporary name and
+# renamed, so a download never sees a partial PDF.
+class FilesystemDocumentStore(DocumentStore):
+  def __init__(self, root: str | Path, retention_seconds: float):
+    super().__init__(retention_seconds)
+    self.root = Path(root)
+    self.root.mkdir(parents = True, exist_ok = True)
+
+  def _path(self, document_id: str) -> Path:
+    return self.root / document_id
+
+  def _put(self, document_id: str, data: bytes) -> None:
+    path = self._path(document_id)
+    # hidden, document ids never start with a dot
+    temp_path = self.root / f".{document_id}.{os.getpid()}.{threading.get_ident()}"
+    temp_path.write_bytes(data)
+    os.replace(temp_path, path)
+
+  def stat(self, document_id: str) -> StoredDocument | None:
+    if not _valid_document_id(document_id):
+      return None
+
+    try:
+      st = self._path(document_id).stat()
+    except FileNotFoundError:
+      return None
+
+    if self._is_expired(st.st_mtime):
+      self.delete(document_id)
+      self.evictions += 1
+      return None
+
+    return StoredDocument(
+      document_id = document_id,
+      size = st.st_size,
+      # same file on every worker -> same ETag, without hashing it
+      etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"',
+      created_at = st.st_mtime
+    )
+
+  def _read(self, document_id: str, start: int, end: int) -> Iterator[bytes]:
+    try:
+      f = open(self._path(document_id), "rb")
+    except FileNotFoundError:
+      raise KeyError(document_id) from None
+    with f:
+      f.seek(start)
+      remaining = end - start + 1
+      while remaining > 0:
+        chunk = f.read(min(self.CHUNK_SIZE, remaining))
+        if not chunk:
+          raise DocumentTruncatedError(document_id)
+        remaining -= len(chunk)
+        yield chunk
+
+  def delete(self, document_id: str) -> None:
+    if _valid_document_id(document_id):
+      self._path(document_id).unlink(missing_ok = True)
+
+  def purge_expired(self) -> int:
+    purged = 0
+    for path in self.root.iterdir():
+      if path.name.startswith(".") or not path.is_file():
+        continue
+      try:
+        if self._is_expired(path.stat().st_mtime):
+          path.unlink(missing_ok = True)
+          purged += 1
+      except FileNotFoundError:
+        continue
+    return purged
+
+# S3 or any S3-compatible object storage (MinIO, LocalStack, ...) through
+# endpoint_url. Prefer a bucket lifecycle rule for retention in production,
+# purge_expired only covers the objects under prefix.
+class S3DocumentStore(DocumentStore):
+  def __init__(
+    self,
+    bucket: str,
+    retention_seconds: float,
+    prefix: str = "generated_documents/",
+    endpoint_url: str | None = None,
+    client = None
+  ):
+    super().__init__(retention_seconds)
+    self.bucket = bucket
+    self.prefix = prefix
+
+    if client is None:
+      try:
+        import boto3
+      except ImportError as e:
+        raise RuntimeError(
+          "The s3 document store requires boto3 (pip install boto3)"
+        ) from e
+      client = boto3.client("s3", endpoint_url = endpoint_url)
+    self.client = client
+
+  def _key(self, document_id: str) -> str:
+    return f"{self.prefix}{document_id}"
+
+  def _put(self, document_id: str, data: bytes) -> None:
+    self.client.put_object(
+      Bucket = self.bucket,
+      Key = self._key(document_id),
+      Body = data,
+      ContentType = "application/pdf"
+    )
+
+  def stat(self, document_id: str) -> StoredDocument | None:
+    if not _valid_document_id(document_id):
+      return None
+
+    try:
+      head = self.client.head_object(
+        Bucket = self.bucket, Key = self._key(document_id)
+      )
+    except self.client.exceptions.ClientError as e:
+      if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+        return None
+      raise
+
+    created_at = head["LastModified"].timestamp()
+    if self._is_expired(created_at):
+      self.delete(document_id)
+      self.evictions += 1
+      return None
+
+    return StoredDocument(
+      document_id = document_id,
+      size = head["ContentLength"],
+      etag = head["ETag"],
+      created_at = created_at
+    )
+
+  def _read(self, document_id: str, start: int, end: int) -> Iterator[bytes]:
+    try:
+      response = self.client.get_object(
+        Bucket = self.bucket,
+        Key = self._key(document_id),
+        Range = f"bytes={start}-{end}"
+      )
+    except self.client.exceptions.NoSuchKey:
+      raise KeyError(document_id) from None
+
+    remaining = end - start + 1
+    for chunk in response["Body"].iter_chunks(self.CHUNK_SIZE):
+      remaining -= len(chunk)
+      yield chunk
+    if remaining > 0:
+      raise DocumentTruncatedError(document_id)
+
+  def delete(self, document_id: str) -> None:
+    if _valid_document_id(document_id):
+      self.client.delete_object(Bucket = self.bucket, Key = self._key(document_id))
+
+  def purge_expired(self) -> int:
+    purged = 0
+    paginator = self.client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket = self.bucket, Prefix = self.prefix):
+      for obj in page.get("Contents", []):
+        if self._is_expired(obj["LastModified"].timestamp()):
+          self.client.delete_object(Bucket = self.bucket, Key = obj["Key"])
+          purged += 1
+    return purged
+
+# Redis, or any server speaking its protocol (Valkey, KeyDB, ...): the PDF
+# and its metadata under two keys expiring after retention_seconds, so
+# there is nothing to purge. Ranges are read with GETRANGE, one chunk per
+# round trip. Mind the server's maxmemory, documents are ~100 KB each.
+class RedisDocumentStore(DocumentStore):
+  def __init__(
+    self,
+    retention_seconds: float,
+    url: str | None = None,
+    prefix: str = "tax:documents:",
+    client = None
+  ):
+    super().__init__(retention_seconds)
+    self.prefix = prefix
+
+    if client is None:
+      try:
+        import redis
+      except ImportError as e:
+        raise RuntimeError(
+          "The redis document store requires redis (pip install redis)"
+        ) from e
+      client = redis.Redis.from_url(url)
+    self.client = client
+    # an unreachable server fails the startup, not the first request
+    self.client.ping()
+
+  def _key(self, document_id: str) -> str:
+    return f"{self.prefix}{document_id}"
+
+  def _put(self, document_id: str, data: bytes) -> None:
+    document = StoredDocument(
+      document_id = document_id,
+      size = len(data),
+      etag = _etag(data),
+      created_at = time.time()
+    )
+    ttl = max(1, math.ceil(self.retention_seconds))
+    pipe = self.client.pipeline()
+    pipe.set(self._key(document_id), data, ex = ttl)
+    pipe.set(f"{self._key(document_id)}:meta", document.model_dump_json(), ex = ttl)
+    pipe.execute()
+
+  def stat(self, document_id: str) -> StoredDocument | None:
+    if not _valid_document_id(document_id):
+      return None
+
+    value = self.client.get(f"{self._key(document_id)}:meta")
+    if value is None:
+      return None
+    return StoredDocument.model_validate_json(value)
+
+  def _read(self, document_id: str, start: int, end: int) -> Iterator[bytes]:
+    for offset in range(start, end + 1, self.CHUNK_SIZE):
+      chunk_end = min(offset + self.CHUNK_SIZE, end + 1) - 1
+      chunk = self.client.getrange(self._key(document_id), offset, chunk_end)
+      if not chunk and offset == start:
+        raise KeyError(document_id)
+      # expired or replaced while being downloaded
+      if len(chunk) != chunk_end - offset + 1:
+        raise DocumentTruncatedError(document_id)
+      yield chunk
+
+  def delete(self, document_id: str) -> None:
+    if _valid_document_id(document_id):
+      self.client.delete(self._key(document_id), f"{self._key(document_id)}:meta")
+
+  def purge_expired(self) -> int:
+    return 0
+
+# backend: "memory", "filesystem", "s3" or "redis"
+def create_document_store(
+  backend: str,
+  retention_seconds: float,
+  max_bytes: int | None = None,
+  path: str | Path | None = None,
+  s3_bucket: str | None = None,
+  s3_prefix: str = "generated_documents/",
+  s3_endpoint_url: str | None = None,
+  redis_url: str | None = None
+) -> DocumentStore:
+  if backend == "memory":
+    if max_bytes is None:
+      raise ValueError("max_bytes is required for the memory document store")
+    return InMemoryDocumentStore(max_bytes, retention_seconds)
+
+  if backend == "filesystem":
+    if path is None:
+      raise ValueError("path is required for the filesystem document store")
+    return FilesystemDocumentStore(path, retention_seconds)
+
+  if backend == "s3":
+    if not s3_bucket:
+      raise ValueError("s3_bucket is required for the s3 document store")
+    return S3DocumentStore(
+      s3_bucket,
+      retention_seconds,
+      prefix = s3_prefix,
+      endpoint_url = s3_endpoint_url or None
+    )
+
+  if backend == "redis":
+    if not redis_url:
+      raise ValueError("redis_url is required for the redis document store")
+    return RedisDocumentStore(retention_seconds, url = redis_url)
+
+  raise ValueError(f"Unknown document store backend: {backend}")
@@ -1,54 +1,98 @@
+from concurrent.futures import ProcessPoolExecutor
 import pymupdf
 from pydantic import BaseModel
-from typing import Type
-from faker import Faker
+from typing import Iterator, List
+import argparse
+import json
+import multiprocessing
 import random
 import sys
 import os
+import time
 
-CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
-MODELS_DIR = os.path.abspath(os.path.join(CURRENT_DIR, "..", "models"))
-
-if MODELS_DIR not in sys.path:
-    sys.path.insert(0, MODELS_DIR)
+from models.dummy_doc_schema import FormW2, Form1099INT, Form1099NEC
+from models.tax_schema import TaxFormData, W2Data, NECData, INTData
+from services.tax_calculator import TaxCalculator
+from tax_policy.policy_registry import get_bracket_schedule, get_tax_policy
+from models.user_pii import FilingType, UserPII
 
-from dummy_doc_schema import FormW2, Form1099INT, Form1099NEC
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 
-faker = Faker()
+FORM_TYPES = ["w2", "nec", "int"]
 
 class DummyTaxDocumentGenerator:
+  # seed: every taxpayer's documents depend only on (seed, taxpayer number),
+  # so a corpus is reproducible however it is split between processes.
+  # None keeps them random.
   def __init__(self, w2_template: str, nec_template: str,
-               int_template: str, output_base_dir: str):
+               int_template: str, output_base_dir: str,
+               seed: int | None = None, tax_year: int = 2024):
     self.templates = {
       "w2" : w2_template,
       "nec" : nec_template,
       "int" : int_template
     }
     self.output_base_dir = output_base_dir
+    self.seed = seed
+    self.tax_year = tax_year
     os.makedirs(output_base_dir, exist_ok = True)
 
+    # Opened once, every taxpayer refills the widgets of the same
+    # in-memory documents before they are saved under a new name
+    self._documents = {
+      form_type : pymupdf.open(path) for form_type, path in self.templates.items()
+    }
+    # only needed to generate documents, not by the modules importing this one
+    from faker import Faker
+    self.faker = Faker("en_US")
+    self.random = random.Random(seed)
+    self._calculators = {}
+
+  def close(self) -> None:
+    for doc in self._documents.values():
+      doc.close()
+
+  def _seed_taxpayer(self, number: int) -> None:
+    if self.seed is None:
+      return
+    # string seeds are hashed with SHA-512, stable across processes
+    key = f"{self.seed}:{number}"
+    self.random.seed(key)
+    self.faker.seed_instance(key)
+
   def _generate_shared_identity(self) -> dict:
-    name = faker.name()
-    street = faker.street_address()
-    city_etc = f"{faker.city()}, {faker.state_abbr()} {faker.zipcode()}"
-    full_address = f"{street}, {city_etc}"
-    recipient_tin = f"{random.randint(100, 999)}-{random.randint(10, 99)}-{random.randint(1000, 9999)}"
+    first_name = self.faker.first_name()
+    middle_initial = self.random.choice("ABCDEFGHIJKLMNOPRSTW")
+    last_name = self.faker.last_name()
+    street = self.faker.street_address()
+    city = self.faker.city()
+    state = self.faker.state_abbr(include_territories = False)
+    zip_code = self.faker.zipcode()
+    city_etc = f"{city}, {state} {zip_code}"
+    ssn = self.faker.ssn()
     return {
-      "name" : name,
+      "name" : f"{first_name} {middle_initial} {last_name}",
+      "first_name_middle_initial" : f"{first_name} {middle_initial}",
+      "last_name" : last_name,
       "street" : street,
+      "city" : city,
+      "state" : state,
+      "zip_code" : zip_code,
       "city_etc" : city_etc,
-      "address" : full_address,
-      "recipient_tin" : recipient_tin
+      "address" : f"{street}, {city_etc}",
+      "ssn" : ssn,
+      # the recipient of a 1099 is the same individual
+      "recipient_tin" : ssn
     }
 
   def _generate_form_data(self, form_type: str, identity: dict) -> BaseModel:
     if form_type == "w2":
       return FormW2(
-        ssn = faker.ssn(),
+        ssn = identity["ssn"],
         name = identity["name"],
         address = identity["address"],
-        wages = f"{random.uniform(100, 100000):.2f}",
-        federal_income_tax_withheld = f"{random.uniform(1, 10000):.2f}"
+        wages = f"{self.random.uniform(100, 100000):.2f}",
+        federal_income_tax_withheld = f"{self.random.uniform(1, 10000):.2f}"
       )
     elif form_type == "nec":
       return Form1099NEC(
@@ -56,8 +100,8 @@ class DummyTaxDocumentGenerator:
         name = identity["name"],
         street = identity["street"],
         city_etc = identity["city_etc"],
-        nonemployee_compensation = f"{random.uniform(5000, 30000):.2f}",
-        federal_income_tax_withheld = f"{random.uniform(0, 3000):.2f}"
+        nonemployee_compensation = f"{self.random.uniform(5000, 30000):.2f}",
+        federal_income_tax_withheld = f"{self.random.uniform(0, 3000):.2f}"
       )
     elif form_type == "int":
       return Form1099INT(
@@ -65,7 +109,7 @@ class DummyTaxDocumentGenerator:
         name = identity["name"],
         street = identity["street"],
         city_etc = identity["city_etc"],
-        interest_income = f"{random.uniform(10, 2000):.2f}"
+        interest_income = f"{self.random.uniform(10, 2000):.2f}"
       )
 
   def _fill_textfields(self, doc: pymupdf.Document, data: BaseModel):
@@ -86,22 +130,123 @@ class DummyTaxDocumentGenerator:
           field.field_value = str(alias_map[key])
           field.update()
 
-  def generate_documents(self, n: int):
-    for i in range(n):
-      identity = self._generate_shared_identity()
-      folder = os.path.join(self.output_base_dir, str(i + 1))
-      os.makedirs(folder, exist_ok = True)
-
-      # fill template forms and create a triplet of dummy forms
-      for form_type in ["w2", "nec", "int"]:
-        sample_path = self.templates[form_type]
-        doc = pymupdf.open(sample_path)
-        form_data = self._generate_form_data(form_type, identity)
-        self._fill_textfields(doc, form_data)
-        output_path = os.path.join(folder, f"{form_type}_{i + 1}.pdf")
-        doc.save(output_path)
-        doc.close()
+  # What the pipeline should extract from the taxpayer's documents
+  def _expected_tax_form_data(self, forms: dict) -> TaxFormData:
+    return TaxFormData.model_validate({
+      "forms_submitted" : ["W-2", "1099-NEC", "1099-INT"],
+      "w2" : W2Data(
+        wages = forms["w2"].wages,
+        federal_income_tax_withheld = forms["w2"].federal_income_tax_withheld
+      ),
+      "1099_nec" : NECData(
+        nonemployee_compensation = forms["nec"].nonemployee_compensation
+      ),
+      "1099_int" : INTData(interest_income = forms["int"].interest_income)
+    })
+
+  def _calculator(self, filing_status: FilingType) -> TaxCalculator:
+    calculator = self._calculators.get(filing_status)
+    if calculator is None:
+      policy = get_tax_policy(self.tax_year, filing_status)
+      calculator = self._calculators[filing_status] = TaxCalculator(
+        brackets = get_bracket_schedule(self.tax_year, filing_status),
+        standard_deduction = policy.standard_deduction
+      )
+    return calculator
+
+  # Writes <number>/{w2,nec,int}_<number>.pdf and returns the taxpayer's
+  # manifest entry: the batch manifest fields (documents relative to
+  # output_base_dir) plus the expected extraction and tax return summary
+  def generate_taxpayer(self, number: int) -> dict:
+    self._seed_taxpayer(number)
+    identity = self._generate_shared_identity()
+    folder = os.path.join(self.output_base_dir, str(number))
+    os.makedirs(folder, exist_ok = True)
+
+    # fill template forms and create a triplet of dummy forms
+    forms = {}
+    documents = []
+    for form_type in FORM_TYPES:
+      doc = self._documents[form_type]
+      form_data = forms[form_type] = self._generate_form_data(form_type, identity)
+      self._fill_textfields(doc, form_data)
+      document = f"{number}/{form_type}_{number}.pdf"
+      doc.save(os.path.join(self.output_base_dir, document), no_new_id = True)
+      documents.append(document)
 
+    pii = UserPII.model_validate(identity)
+    tax_form_data = self._expected_tax_form_data(forms)
+    summary = self._calculator(pii.filing_status).summarize(tax_form_data)
+    return {
+      "taxpayer_id" : str(number),
+      "pii" : pii.model_dump(mode = "json", exclude_none = True),
+      "documents" : documents,
+      "expected" : {
+        "tax_form_data" : tax_form_data.model_dump(mode = "json", by_alias = True),
+        "tax_return_summary" : summary.model_dump(mode = "json")
+      }
+    }
+
+  def generate_documents(self, n: int, start: int = 1) -> List[dict]:
+    return [self.generate_taxpayer(number) for number in range(start, start + n)]
+
+# Per worker process generator, templates opened once by _init_worker
+_worker_generator : DummyTaxDocumentGenerator | None = None
+
+def _init_worker(settings: dict) -> None:
+  global _worker_generator
+  _worker_generator = DummyTaxDocumentGenerator(**settings)
+
+def _generate_shard(numbers: range) -> List[dict]:
+  return [_worker_generator.generate_taxpayer(number) for number in numbers]
+
+# Generates taxpayers start .. start + n - 1, sharded over worker processes
+# in contiguous ranges of shard_size taxpayer numbers. Yields the manifest
+# entries in taxpayer order.
+def generate_corpus(
+  w2_template: str,
+  nec_template: str,
+  int_template: str,
+  output_base_dir: str,
+  n: int,
+  start: int = 1,
+  seed: int | None = 0,
+  processes: int = 1,
+  shard_size: int = 50
+) -> Iterator[dict]:
+  settings = {
+    "w2_template" : w2_template,
+    "nec_template" : nec_template,
+    "int_template" : int_template,
+    "output_base_dir" : output_base_dir,
+    "seed" : seed
+  }
+  shards = [
+    range(first, min(first + shard_size, start + n))
+    for first in range(start, start + n, shard_size)
+  ]
+
+  if processes <= 1:
+    _init_worker(settings)
+    try:
+      for shard in shards:
+        yield from _generate_shard(shard)
+    finally:
+      _worker_generator.close()
+    return
+
+  with ProcessPoolExecutor(
+    max_workers = processes,
+    mp_context = multiprocessing.get_context("spawn"),
+    initializer = _init_worker,
+    initargs = (settings,)
+  ) as workers:
+    for entries in workers.map(_generate_shard, shards):
+      yield from entries
+
+#   python -m services.dummy_form_generator --count 20
+#   python -m services.dummy_form_generator --count 100000 --processes 8 \
+#     --output-dir /data/corpus --manifest /data/corpus/manifest.jsonl
 if __name__ == "__main__":
   TEMPLATE_DIR = os.path.abspath(
     os.path.join(CURRENT_DIR, "..", "sample_docs", "templates")
@@ -109,11 +254,50 @@ if __name__ == "__main__":
 
   OUTPUT_DIR = os.path.abspath(os.path.join(CURRENT_DIR, "..", "sample_docs"))
 
-  generator = DummyTaxDocumentGenerator(
-    w2_template = os.path.join(TEMPLATE_DIR, "2024 Form W-2.pdf"),
-    nec_template = os.path.join(TEMPLATE_DIR, "Form 1099-NEC.pdf"),
-    int_template = os.path.join(TEMPLATE_DIR, "Form 1099-INT.pdf"),
-    output_base_dir = OUTPUT_DIR
+  parser = argparse.ArgumentParser(
+    description = "Generate dummy W-2, 1099-NEC and 1099-INT documents"
   )
+  parser.add_argument("--count", type = int, default = 20,
+                      help = "number of taxpayers, three documents each")
+  parser.add_argument("--start", type = int, default = 1,
+                      help = "first taxpayer number (folder name)")
+  parser.add_argument("--output-dir", default = OUTPUT_DIR)
+  parser.add_argument("--seed", type = int, default = 0)
+  parser.add_argument("--processes", type = int, default = os.cpu_count() or 1)
+  parser.add_argument("--shard-size", type = int, default = 50,
+                      help = "taxpayers per task sent to a worker process")
+  parser.add_argument("--manifest",
+                      help = "JSONL manifest with the expected extraction and "
+                             "summary of every taxpayer, usable as a batch "
+                             "manifest when written to --output-dir")
+  args = parser.parse_args()
 
-  generator.generate_documents(20)
+  os.makedirs(args.output_dir, exist_ok = True)
+  manifest = open(args.manifest, "w") if args.manifest else None
+  begin = time.perf_counter()
+  generated = 0
+  try:
+    for entry in generate_corpus(
+      w2_template = os.path.join(TEMPLATE_DIR, "2024 Form W-2.pdf"),
+      nec_template = os.path.join(TEMPLATE_DIR, "Form 1099-NEC.pdf"),
+      int_template = os.path.join(TEMPLATE_DIR, "Form 1099-INT.pdf"),
+      output_base_dir = args.output_dir,
+      n = args.count,
+      start = args.start,
+      seed = args.seed,
+      processes = args.processes,
+      shard_size = args.shard_size
+    ):
+      generated += 1
+      if manifest is not None:
+        manifest.write(json.dumps(entry) + "\n")
+  finally:
+    if manifest is not None:
+      manifest.close()
+
+  elapsed = time.perf_counter() - begin
+  print(
+    f"{generated} taxpayers, {generated * len(FORM_TYPES)} documents, "
+    f"{elapsed:.1f}s ({generated * len(FORM_TYPES) / elapsed:.0f} documents/s)",
+    file = sys.stderr
+  )
@@ -0,0 +1,152 @@
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextvars import copy_context
+from functools import partial
+from typing import Any, Awaitable, Callable
+import asyncio
+import multiprocessing
+import threading
+
+from services.pipeline_timing import stage
+
+class EngineSaturatedError(RuntimeError):
+  pass
+
+# Runs the submit pipeline, blocking functions away from the event loop
+# and coroutines (the async pipeline) on it.
+#   - admission : at most max_in_flight submissions run at once and at most
+#                 max_queued wait for a slot, anything beyond is rejected
+#   - I/O pool  : threads running the blocking pipeline (OpenAI calls,
+#                 form filling)
+#   - CPU pool  : processes for PyMuPDF rasterization, created on first use
+class ExecutionEngine:
+  def __init__(
+    self,
+    max_in_flight: int,
+    max_queued: int,
+    io_workers: int,
+    cpu_workers: int
+  ):
+    self.max_in_flight = max(1, max_in_flight)
+    self.max_queued = max(0, max_queued)
+    self.cpu_workers = max(0, cpu_workers)
+
+    self._io_pool = ThreadPoolExecutor(
+      max_workers = max(1, io_workers),
+      thread_name_prefix = "submit-io"
+    )
+    self._cpu_pool : ProcessPoolExecutor | None = None
+    self._cpu_lock = threading.Lock()
+
+    self._slots = asyncio.Semaphore(self.max_in_flight)
+    self._queued = 0
+    self._in_flight = 0
+
+  def cpu_executor(self) -> Executor | None:
+    if self.cpu_workers == 0:
+      return None
+
+    with self._cpu_lock:
+      if self._cpu_pool is None:
+        # spawn, since forking a process that already runs threads is unsafe
+        self._cpu_pool = ProcessPoolExecutor(
+          max_workers = self.cpu_workers,
+          mp_context = multiprocessing.get_context("spawn")
+        )
+      return self._cpu_pool
+
+  def _release(self) -> None:
+    self._in_flight -= 1
+    self._slots.release()
+
+  def _check_admission(self) -> None:
+    if self._slots.locked() and self._queued >= self.max_queued:
+      raise EngineSaturatedError("Too many submissions in progress")
+
+  async def _acquire(self) -> None:
+    self._queued += 1
+    try:
+      with stage("queue"):
+        await self._slots.acquire()
+    finally:
+      self._queued -= 1
+
+    self._in_flight += 1
+
+  # Rejects with EngineSaturatedError when the wait queue is full
+  async def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+    self._check_admission()
+    return await self.run(fn, *args, **kwargs)
+
+  async def submit_async(
+    self,
+    fn: Callable[..., Awaitable[Any]],
+    *args,
+    **kwargs
+  ) -> Any:
+    self._check_admission()
+    return await self.run_async(fn, *args, **kwargs)
+
+  # Waits for a slot however long the queue is, for callers that do their
+  # own admission control (e.g. background jobs)
+  async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+    await self._acquire()
+    loop = asyncio.get_running_loop()
+
+    try:
+      # in a copy of the caller's context, like asyncio.to_thread
+      future = self._io_pool.submit(
+        copy_context().run, partial(fn, *args, **kwargs)
+      )
+    except BaseException:
+      self._release()
+      raise
+
+    # Keep the slot until the thread is actually done, even if the awaiting
+    # request gets cancelled (client disconnects) half way through
+    future.add_done_callback(
+      lambda _: loop.call_soon_threadsafe(self._release)
+    )
+
+    return await asyncio.wrap_future(future)
+
+  # Coroutine pipeline on the event loop, the slot is held until it returns
+  # or is cancelled along with the request
+  async def run_async(
+    self,
+    fn: Callable[..., Awaitable[Any]],
+    *args,
+    **kwargs
+  ) -> Any:
+    await self._acquire()
+    try:
+      return await fn(*args, **kwargs)
+    finally:
+      self._release()
+
+  # Starts every CPU worker and runs fn(*args) once in each, so the first
+  # submissions do not pay for spawning them and importing their modules
+  def warm_up(self, fn: Callable[..., Any], *args) -> None:
+    executor = self.cpu_executor()
+    if executor is None:
+      return
+    futures = [executor.submit(fn, *args) for _ in range(self.cpu_workers)]
+    for future in futures:
+      future.result()
+
+  def stats(self) -> dict:
+    return {
+      "in_flight" : self._in_flight,
+      "queued" : self._queued,
+      "max_in_flight" : self.max_in_flight,
+      "max_queued" : self.max_queued
+    }
+
+  def shutdown(self) -> None:
+    self._io_pool.shutdown(wait = False, cancel_futures = True)
+
+    with self._cpu_lock:
+      if self._cpu_pool is not None:
+        # waits for the render processes to exit (pages being rendered are
+        # short), a worker process exiting first would leave them running
+        self._cpu_pool.shutdown(wait = True, cancel_futures = True)
+        self._cpu_pool = None
@@ -0,0 +1,235 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Type
+from pydantic import BaseModel
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from models.tax_schema import TaxFormData
+from services.metrics import EXTRACTION_CACHE_EVICTIONS, EXTRACTION_CACHE_LOOKUPS
+
+# Bump whenever rendering or parsing changes in a way that invalidates
+# previously cached extractions without touching the prompt or schema
+CACHE_FORMAT_VERSION = 1
+
+class CacheBackend(ABC):
+  def __init__(self):
+    self.evictions = 0
+
+  def _evicted(self, count: int = 1) -> None:
+    self.evictions += count
+    EXTRACTION_CACHE_EVICTIONS.inc(count)
+
+  @abstractmethod
+  def get(self, key: str) -> str | None:
+    ...
+
+  @abstractmethod
+  def set(self, key: str, value: str) -> None:
+    ...
+
+  @abstractmethod
+  def clear(self) -> None:
+    ...
+
+  @abstractmethod
+  def __len__(self) -> int:
+    ...
+
+# LRU with a time to live, entries are evicted least recently used first
+class InMemoryCacheBackend(CacheBackend):
+  def __init__(self, max_entries: int, ttl_seconds: float):
+    super().__init__()
+    self.max_entries = max_entries
+    self.ttl_seconds = ttl_seconds
+    self._entries : OrderedDict[str, tuple[float, str]] = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key: str) -> str | None:
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        return None
+
+      expires_at, value = entry
+      if expires_at < time.monotonic():
+        del self._entries[key]
+        self._evicted()
+        return None
+
+      self._entries.move_to_end(key)
+      return value
+
+  def set(self, key: str, value: str) -> None:
+    with self._lock:
+      self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+      self._entries.move_to_end(key)
+
+      while len(self._entries) > self.max_entries:
+        self._entries.popitem(last = False)
+        self._evicted()
+
+  def clear(self) -> None:
+    with self._lock:
+      self._entries.clear()
+
+  def __len__(self) -> int:
+    return len(self._entries)
+
+# On-disk cache shared by every worker on the host, same LRU + TTL policy
+class SQLiteCacheBackend(CacheBackend):
+  def __init__(self, path: str | Path, max_entries: int, ttl_seconds: float):
+    super().__init__()
+    self.max_entries = max_entries
+    self.ttl_seconds = ttl_seconds
+    self._lock = threading.Lock()
+
+    Path(path).parent.mkdir(parents = True, exist_ok = True)
+    self._conn = sqlite3.connect(
+      str(path),
+      check_same_thread = False,
+      isolation_level = None
+    )
+    self._conn.execute("PRAGMA journal_mode=WAL")
+    self._conn.execute(
+      """CREATE TABLE IF NOT EXISTS extraction_cache (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        accessed_at REAL NOT NULL
+      )"""
+    )
+    self._conn.execute(
+      """CREATE INDEX IF NOT EXISTS extraction_cache_accessed_at
+        ON extraction_cache (accessed_at)"""
+    )
+
+  def get(self, key: str) -> str | None:
+    now = time.time()
+    with self._lock:
+      row = self._conn.execute(
+        "SELECT value, created_at FROM extraction_cache WHERE key = ?",
+        (key,)
+      ).fetchone()
+      if row is None:
+        return None
+
+      value, created_at = row
+      if created_at + self.ttl_seconds < now:
+        self._conn.execute("DELETE FROM extraction_cache WHERE key = ?", (key,))
+        self._evicted()
+        return None
+
+      self._conn.execute(
+        "UPDATE extraction_cache SET accessed_at = ? WHERE key = ?",
+        (now, key)
+      )
+      return value
+
+  def set(self, key: str, value: str) -> None:
+    now = time.time()
+    with self._lock:
+      self._conn.execute(
+        """INSERT OR REPLACE INTO extraction_cache
+          (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)""",
+        (key, value, now, now)
+      )
+      evicted = self._conn.execute(
+        """DELETE FROM extraction_cache WHERE key IN (
+          SELECT key FROM extraction_cache
+          ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+        )""",
+        (self.max_entries,)
+      ).rowcount
+      if evicted > 0:
+        self._evicted(evicted)
+
+  def clear(self) -> None:
+    with self._lock:
+      self._conn.execute("DELETE FROM extraction_cache")
+
+  def __len__(self) -> int:
+    with self._lock:
+      return self._conn.execute(
+        "SELECT COUNT(*) FROM extraction_cache"
+      ).fetchone()[0]
+
+# Per-document cache of parsed extractions, keyed by the PDF bytes and
+# everything else that influences the LLM output
+class ExtractionCache:
+  def __init__(self, backend: CacheBackend):
+    self.backend = backend
+    self.hits = 0
+    self.misses = 0
+    self._lock = threading.Lock()
+
+  @staticmethod
+  def make_key(
+    pdf_bytes: bytes,
+    model: str,
+    instructions: str,
+    schema: Type[BaseModel] = TaxFormData,
+    variant: str = ""
+  ) -> str:
+    digest = hashlib.sha256()
+    for part in (
+      str(CACHE_FORMAT_VERSION).encode(),
+      model.encode(),
+      instructions.encode(),
+      variant.encode(),
+      json.dumps(schema.model_json_schema(), sort_keys = True).encode()
+    ):
+      digest.update(hashlib.sha256(part).digest())
+    digest.update(hashlib.sha256(pdf_bytes).digest())
+    return digest.hexdigest()
+
+  def get(self, key: str) -> TaxFormData | None:
+    value = self.backend.get(key)
+
+    with self._lock:
+      if value is None:
+        self.misses += 1
+      else:
+        self.hits += 1
+    EXTRACTION_CACHE_LOOKUPS.inc(result = "miss" if value is None else "hit")
+
+    if value is None:
+      return None
+    return TaxFormData.model_validate_json(value)
+
+  def put(self, key: str, data: TaxFormData) -> None:
+    self.backend.set(key, data.model_dump_json(by_alias = True))
+
+  def stats(self) -> dict:
+    return {
+      "hits" : self.hits,
+      "misses" : self.misses,
+      "evictions" : self.backend.evictions,
+      "entries" : len(self.backend)
+    }
+
+# backend: "memory", "sqlite", or "none" to disable caching
+def create_extraction_cache(
+  backend: str,
+  max_entries: int,
+  ttl_seconds: float,
+  sqlite_path: str | Path | None = None
+) -> ExtractionCache | None:
+  if backend == "none":
+    return None
+
+  if backend == "memory":
+    return ExtractionCache(InMemoryCacheBackend(max_entries, ttl_seconds))
+
+  if backend == "sqlite":
+    if sqlite_path is None:
+      raise ValueError("sqlite_path is required for the sqlite cache backend")
+    return ExtractionCache(
+      SQLiteCacheBackend(sqlite_path, max_entries, ttl_seconds)
+    )
+
+  raise ValueError(f"Unknown extraction cache backend: {backend}")
@@ -1,20 +1,139 @@
-import openai
-from openai import OpenAI
 import pymupdf
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextvars import copy_context
+from decimal import Decimal
 from pathlib import Path
-from tempfile import NamedTemporaryFile
-from typing import List
+from pydantic import BaseModel, Field, ValidationError
+from typing import Iterable, Iterator, List, Literal
+import asyncio
 import base64
-import os
-import sys
 
-CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
-MODELS_DIR = os.path.abspath(os.path.join(CURRENT_DIR, "..", "models"))
+from models.tax_schema import TaxFormData, W2Data, NECData, INTData
+from services.acroform_extractor import extract_acroform
+from services.extraction_cache import ExtractionCache
+from services.metrics import DOCUMENTS_EXTRACTED, LLM_PAYLOAD_BYTES, PAGES_RENDERED
+from services.pipeline_timing import stage
+from services.llm_gateway import LLMGateway, LLMUnavailableError, get_llm_gateway
+from services.render_profiles import (
+  RenderProfile,
+  FULL_FIDELITY_PROFILE,
+  detect_form_type,
+  render_page,
+  select_render_profile
+)
 
-if MODELS_DIR not in sys.path:
-    sys.path.insert(0, MODELS_DIR)
+class PayloadTooLargeError(ValueError):
+  pass
 
-from tax_schema import TaxFormData
+def _encoded_size(n_bytes: int) -> int:
+  return 4 * ((n_bytes + 2) // 3)
+
+class RenderedDocument(BaseModel):
+  form_type: str | None
+  profile: RenderProfile
+  pages: List[bytes]
+
+# Render every page to JPEG bytes in memory, with the given profile or, when
+# profile is None, the adaptive profile of the detected form type.
+# Raises PayloadTooLargeError as soon as the base64 encoded pages would
+# exceed max_payload_bytes.
+# Module level so it can be shipped to a process pool.
+def render_pdf_pages(
+  pdf_path: str,
+  max_payload_bytes: int | None = None,
+  profile: RenderProfile | None = FULL_FIDELITY_PROFILE
+) -> RenderedDocument:
+  pages = []
+  payload_bytes = 0
+
+  with pymupdf.open(pdf_path) as doc:
+    form_type = detect_form_type(doc)
+    if profile is None:
+      profile = select_render_profile(form_type)
+
+    for page in doc:
+      image = render_page(page, profile)
+
+      payload_bytes += _encoded_size(len(image))
+      if max_payload_bytes is not None and payload_bytes > max_payload_bytes:
+        raise PayloadTooLargeError(
+          f"Rendered pages of {Path(pdf_path).name} exceed "
+          f"{max_payload_bytes} bytes"
+        )
+
+      pages.append(image)
+
+  return RenderedDocument(form_type = form_type, profile = profile, pages = pages)
+
+class ExtractionSettings(BaseModel):
+  # vision model the page images are sent to
+  model: str = "gpt-4.1-mini"
+  # rendering of every page in "fixed" mode, and of the "adaptive" retry
+  render_profile: RenderProfile = FULL_FIDELITY_PROFILE
+  # read fillable W-2 / 1099 widgets directly and only send the remaining
+  # (scanned, flattened) documents to the LLM
+  read_acroforms: bool = True
+  # ceiling on the base64 image payload of one submission
+  max_payload_bytes: int | None = None
+  # "fixed" renders every page with render_profile, "adaptive" picks a
+  # cheaper profile per form type and retries with render_profile when the
+  # parsed result does not validate
+  render_mode: Literal["fixed", "adaptive"] = "fixed"
+  # "combined" sends all documents in one LLM request, "per_document"
+  # extracts each document on its own, concurrently, so that one slow or
+  # failing document does not gate the others. A cache always implies
+  # per document extraction.
+  extraction_mode: Literal["combined", "per_document"] = "per_document"
+  max_concurrency: int = Field(default = 3, ge = 1)
+  # attempts per document before the submission fails
+  document_attempts: int = Field(default = 2, ge = 1)
+
+# Rough token count of a request for the tokens per minute budget:
+# a letter page at "high" detail is scaled to 768x994, i.e. 4 tiles of
+# 170 tokens plus 85 base tokens, "low" detail is a flat 85 tokens.
+# The rest covers the instructions and the JSON answer.
+def _estimate_tokens(encoded_images: List[dict]) -> int:
+  return 600 + sum(
+    85 if image["detail"] == "low" else 765
+    for image in encoded_images
+  )
+
+# The amount every form of a given type must have, used to sanity check
+# what the LLM extracted from a cheaper rendering
+_PRIMARY_AMOUNTS = {
+  "W-2" : lambda data: data.w2.wages,
+  "1099-NEC" : lambda data: data.nec_1099.nonemployee_compensation,
+  "1099-INT" : lambda data: data.int_1099.interest_income,
+}
+
+# Combine per-document extractions into one TaxFormData, summing amounts
+# and keeping the form names in upload order
+def merge_tax_form_data(results: List[TaxFormData]) -> TaxFormData:
+  forms_submitted = []
+  for result in results:
+    for form in result.forms_submitted:
+      if form not in forms_submitted:
+        forms_submitted.append(form)
+
+  return TaxFormData.model_validate({
+    "forms_submitted" : forms_submitted,
+    "w2" : W2Data(
+      wages = sum((r.w2.wages for r in results), Decimal("0")),
+      federal_income_tax_withheld = sum(
+        (r.w2.federal_income_tax_withheld for r in results), Decimal("0")
+      )
+    ),
+    "1099_nec" : NECData(
+      nonemployee_compensation = sum(
+        (r.nec_1099.nonemployee_compensation for r in results), Decimal("0")
+      )
+    ),
+    "1099_int" : INTData(
+      interest_income = sum(
+        (r.int_1099.interest_income for r in results), Decimal("0")
+      )
+    )
+  })
 
 class FormExtractor:
   SYSTEM_INSTRUCTIONS = """You are a tax form data extraction assistant. 
@@ -31,63 +150,389 @@ Your task is to:
 - Always return string values with no dollar signs, commas, or additional text.
 - Do not include explanations, summaries, or comments. JSON only."""
 
-  def __init__(self):
-    self.api_key = os.getenv("OPENAI_API_KEY")
-    self.client = OpenAI(api_key = self.api_key)
-    self.model = "gpt-4.1-nano"
+  # render_executor: optional (process) pool to rasterize PDFs on,
+  # otherwise pages are rendered in the calling thread
+  # cache: optional per-document extraction cache
+  # gateway: LLM access, the process-wide gateway unless given
+  def __init__(
+    self,
+    render_executor: Executor | None = None,
+    cache: ExtractionCache | None = None,
+    settings: ExtractionSettings | None = None,
+    gateway: LLMGateway | None = None
+  ):
+    self.gateway = gateway or get_llm_gateway()
+    self.render_executor = render_executor
+    self.cache = cache
+    self.settings = settings or ExtractionSettings()
+
+  def _render_documents(
+    self,
+    pdf_paths: List[str],
+    profile: RenderProfile | None
+  ) -> Iterator[RenderedDocument]:
+    if self.render_executor is None:
+      for pdf_path in pdf_paths:
+        with stage("rasterize"):
+          document = render_pdf_pages(
+            str(pdf_path), self.settings.max_payload_bytes, profile
+          )
+        yield document
+      return
+
+    # Render all documents in parallel, keeping the upload order
+    futures = [
+      self.render_executor.submit(
+        render_pdf_pages, str(pdf_path), self.settings.max_payload_bytes, profile
+      )
+      for pdf_path in pdf_paths
+    ]
+    try:
+      for future in futures:
+        # time spent waiting on the pool
+        with stage("rasterize"):
+          document = future.result()
+        yield document
+    finally:
+      for future in futures:
+        future.cancel()
+
+  def _encode_image(self, image: bytes) -> str:
+    return base64.b64encode(image).decode("ascii")
+
+  # Page images as Responses API input, encoded document by document so
+  # only one copy of each page (the base64 string) is kept around.
+  # Also returns the detected form type of each document.
+  def _encode_pages(
+    self,
+    pdf_paths: List[str],
+    profile: RenderProfile | None
+  ) -> tuple[List[dict], List[str | None]]:
+    return self._encode_documents(self._render_documents(pdf_paths, profile))
 
-  def _pdf_to_image_files(self, pdf_path: str) -> List[Path]:
-    doc = pymupdf.open(pdf_path)
-    image_paths = []
+  def _encode_documents(
+    self,
+    documents: Iterable[RenderedDocument]
+  ) -> tuple[List[dict], List[str | None]]:
+    encoded_images = []
+    form_types = []
+    payload_bytes = 0
 
-    for page_num in range(len(doc)):
-      page = doc.load_page(page_num)
-      pix = page.get_pixmap(dpi = 300)
+    for document in documents:
+      form_types.append(document.form_type)
+      PAGES_RENDERED.inc(
+        len(document.pages), form_type = document.form_type or "unknown"
+      )
 
-      image_file = NamedTemporaryFile(delete = False, suffix = ".jpg")
-      image_file.write(pix.tobytes("jpg"))
-      image_file.close()
+      with stage("encode"):
+        while document.pages:
+          encoded = self._encode_image(document.pages.pop(0))
 
-      image_paths.append(Path(image_file.name))
+          payload_bytes += len(encoded)
+          if (
+            self.settings.max_payload_bytes is not None and
+            payload_bytes > self.settings.max_payload_bytes
+          ):
+            raise PayloadTooLargeError(
+              f"Rendered pages exceed {self.settings.max_payload_bytes} bytes"
+            )
 
-    return image_paths
+          # list of dicts containing image information to pass as input
+          encoded_images.append({
+            "type" : "input_image",
+            "image_url" : f"data:image/jpeg;base64,{encoded}",
+            "detail" : document.profile.detail
+          })
 
-  def _encode_image(self, image_path: Path) -> str:
-    with open(image_path, "rb") as image_file:
-      return base64.b64encode(image_file.read()).decode("utf-8")
+    LLM_PAYLOAD_BYTES.observe(payload_bytes)
+    return encoded_images, form_types
+
+  def _read_acroforms(self, pdf_paths: List[str]) -> List[TaxFormData | None]:
+    with stage("acroform"):
+      results : List[TaxFormData | None] = [
+        extract_acroform(pdf_path) if self.settings.read_acroforms else None
+        for pdf_path in pdf_paths
+      ]
+    read = sum(result is not None for result in results)
+    if read:
+      DOCUMENTS_EXTRACTED.inc(read, path = "acroform")
+    return results
 
   def extract_from_pdfs(self, pdf_paths: List[str]) -> TaxFormData:
-    all_image_paths = []
-
-    for pdf_path in pdf_paths:
-      image_paths = self._pdf_to_image_files(pdf_path)
-      all_image_paths.extend(image_paths)
-
-    # list of dicts containing image information to pass as input
-    encoded_images = [
-      {
-        "type" : "input_image",
-        "image_url" : f"data:image/jpeg;base64,{self._encode_image(path)}",
-        "detail" : "high"
-      }
-      for path in all_image_paths
-    ]
+    results = self._read_acroforms(pdf_paths)
+    pending = [i for i, result in enumerate(results) if result is None]
+
+    if (
+      pending and
+      self.cache is None and
+      self.settings.extraction_mode == "combined"
+    ):
+      results[pending[0]] = self._extract_with_llm(
+        [pdf_paths[i] for i in pending]
+      )
+    elif pending:
+      extracted = self._extract_documents([pdf_paths[i] for i in pending])
+      for i, data in zip(pending, extracted):
+        results[i] = data
+
+    results = [result for result in results if result is not None]
+    if len(results) == 1:
+      return results[0]
+
+    return merge_tax_form_data(results)
+
+  # One extraction per document, at most max_concurrency at a time,
+  # results in the same order as pdf_paths
+  def _extract_documents(self, pdf_paths: List[str]) -> List[TaxFormData]:
+    workers = min(self.settings.max_concurrency, len(pdf_paths))
+    if workers == 1:
+      return [self._extract_document(pdf_path) for pdf_path in pdf_paths]
 
-    response = self.client.responses.parse(
-      model = "gpt-4.1-mini",
+    with ThreadPoolExecutor(
+      max_workers = workers,
+      thread_name_prefix = "extract"
+    ) as pool:
+      # each document in a copy of the caller's context (stage timings)
+      futures = [
+        pool.submit(copy_context().run, self._extract_document, pdf_path)
+        for pdf_path in pdf_paths
+      ]
+      return [future.result() for future in futures]
+
+  # Retries a failed document on its own, without redoing the others
+  def _extract_document(self, pdf_path: str) -> TaxFormData:
+    for attempt in range(1, self.settings.document_attempts + 1):
+      try:
+        if self.cache is None:
+          return self._extract_with_llm([pdf_path])
+        return self._extract_cached(pdf_path)
+      except (PayloadTooLargeError, LLMUnavailableError):
+        # too large either way, or already retried by the gateway
+        raise
+      except Exception:
+        if attempt == self.settings.document_attempts:
+          raise
+
+  def _cache_key(self, pdf_path: str) -> str:
+    return self.cache.make_key(
+      pdf_bytes = Path(pdf_path).read_bytes(),
+      model = self.settings.model,
       instructions = self.SYSTEM_INSTRUCTIONS,
-      temperature = 0,
-      input = [{
+      variant = (
+        f"{self.settings.render_mode}:"
+        f"{self.settings.render_profile.model_dump_json()}"
+      )
+    )
+
+  def _extract_cached(self, pdf_path: str) -> TaxFormData:
+    key = self._cache_key(pdf_path)
+
+    data = self.cache.get(key)
+    if data is None:
+      data = self._extract_with_llm([pdf_path])
+      self.cache.put(key, data)
+    else:
+      DOCUMENTS_EXTRACTED.inc(path = "cache")
+
+    return data
+
+  # Documents are counted once extracted, not on every attempt
+  def _extract_with_llm(self, pdf_paths: List[str]) -> TaxFormData:
+    data = self._parse_with_llm(pdf_paths)
+    DOCUMENTS_EXTRACTED.inc(len(pdf_paths), path = "llm")
+    return data
+
+  def _parse_with_llm(self, pdf_paths: List[str]) -> TaxFormData:
+    if self.settings.render_mode == "adaptive":
+      try:
+        data, form_types = self._parse_rendered(pdf_paths, profile = None)
+      except (ValidationError, ArithmeticError):
+        data = None
+
+      if data is not None and self._is_plausible(data, form_types):
+        return data
+
+    # fixed mode, or the cheaper rendering did not validate
+    data, _ = self._parse_rendered(
+      pdf_paths, profile = self.settings.render_profile
+    )
+    if data is None:
+      raise ValueError("The model did not return any tax form data")
+
+    return data
+
+  # Every detected form must come with its primary amount (e.g. a W-2
+  # with wages), otherwise the rendering was probably too lossy
+  def _is_plausible(
+    self,
+    data: TaxFormData,
+    form_types: List[str | None]
+  ) -> bool:
+    for form_type in form_types:
+      amount = _PRIMARY_AMOUNTS.get(form_type)
+      if amount is not None and amount(data) <= 0:
+        return False
+    return True
+
+  def _parse_rendered(
+    self,
+    pdf_paths: List[str],
+    profile: RenderProfile | None
+  ) -> tuple[TaxFormData | None, List[str | None]]:
+    encoded_images, form_types = self._encode_pages(pdf_paths, profile)
+
+    with stage("llm"):
+      response = self.gateway.parse(**self._llm_request(encoded_images))
+
+    event = response.output_parsed
+
+    return event, form_types
+
+  def _llm_request(self, encoded_images: List[dict]) -> dict:
+    return {
+      "estimated_tokens" : _estimate_tokens(encoded_images),
+      "model" : self.settings.model,
+      "instructions" : self.SYSTEM_INSTRUCTIONS,
+      "temperature" : 0,
+      "input" : [{
         "role": "user",
         "content": encoded_images
       }],
-      text_format = TaxFormData
+      "text_format" : TaxFormData
+    }
+
+  # Coroutine counterpart of extract_from_pdfs: LLM requests go through
+  # the gateway's async client and wait without holding a thread, PDFs are
+  # read and rendered on the render executor (or worker threads), so many
+  # submissions can be extracted concurrently on one event loop
+  async def extract_from_pdfs_async(self, pdf_paths: List[str]) -> TaxFormData:
+    results = await asyncio.to_thread(self._read_acroforms, pdf_paths)
+    pending = [i for i, result in enumerate(results) if result is None]
+
+    if (
+      pending and
+      self.cache is None and
+      self.settings.extraction_mode == "combined"
+    ):
+      results[pending[0]] = await self._extract_with_llm_async(
+        [pdf_paths[i] for i in pending]
+      )
+    elif pending:
+      extracted = await self._extract_documents_async(
+        [pdf_paths[i] for i in pending]
+      )
+      for i, data in zip(pending, extracted):
+        results[i] = data
+
+    results = [result for result in results if result is not None]
+    if len(results) == 1:
+      return results[0]
+
+    return merge_tax_form_data(results)
+
+  async def _extract_documents_async(
+    self,
+    pdf_paths: List[str]
+  ) -> List[TaxFormData]:
+    slots = asyncio.Semaphore(self.settings.max_concurrency)
+
+    async def extract(pdf_path: str) -> TaxFormData:
+      async with slots:
+        return await self._extract_document_async(pdf_path)
+
+    tasks = [asyncio.ensure_future(extract(pdf_path)) for pdf_path in pdf_paths]
+    try:
+      return await asyncio.gather(*tasks)
+    except BaseException:
+      # the submission fails anyway, stop paying for the other documents
+      for task in tasks:
+        task.cancel()
+      raise
+
+  async def _extract_document_async(self, pdf_path: str) -> TaxFormData:
+    for attempt in range(1, self.settings.document_attempts + 1):
+      try:
+        if self.cache is None:
+          return await self._extract_with_llm_async([pdf_path])
+        return await self._extract_cached_async(pdf_path)
+      except (PayloadTooLargeError, LLMUnavailableError):
+        raise
+      except Exception:
+        if attempt == self.settings.document_attempts:
+          raise
+
+  async def _extract_cached_async(self, pdf_path: str) -> TaxFormData:
+    key = await asyncio.to_thread(self._cache_key, pdf_path)
+
+    data = await asyncio.to_thread(self.cache.get, key)
+    if data is None:
+      data = await self._extract_with_llm_async([pdf_path])
+      await asyncio.to_thread(self.cache.put, key, data)
+    else:
+      DOCUMENTS_EXTRACTED.inc(path = "cache")
+
+    return data
+
+  async def _extract_with_llm_async(self, pdf_paths: List[str]) -> TaxFormData:
+    data = await self._parse_with_llm_async(pdf_paths)
+    DOCUMENTS_EXTRACTED.inc(len(pdf_paths), path = "llm")
+    return data
+
+  async def _parse_with_llm_async(self, pdf_paths: List[str]) -> TaxFormData:
+    if self.settings.render_mode == "adaptive":
+      try:
+        data, form_types = await self._parse_rendered_async(
+          pdf_paths, profile = None
+        )
+      except (ValidationError, ArithmeticError):
+        data = None
+
+      if data is not None and self._is_plausible(data, form_types):
+        return data
+
+    data, _ = await self._parse_rendered_async(
+      pdf_paths, profile = self.settings.render_profile
     )
+    if data is None:
+      raise ValueError("The model did not return any tax form data")
 
-    # delete all temporary images
-    for path in all_image_paths:
-      os.remove(path)
+    return data
 
-    event = response.output_parsed
+  # All documents rendered concurrently, on the render executor when there
+  # is one, otherwise in worker threads
+  async def _render_documents_async(
+    self,
+    pdf_paths: List[str],
+    profile: RenderProfile | None
+  ) -> List[RenderedDocument]:
+    loop = asyncio.get_running_loop()
+
+    async def render(pdf_path: str) -> RenderedDocument:
+      with stage("rasterize"):
+        if self.render_executor is None:
+          return await asyncio.to_thread(
+            render_pdf_pages, str(pdf_path), self.settings.max_payload_bytes, profile
+          )
+        return await loop.run_in_executor(
+          self.render_executor,
+          render_pdf_pages, str(pdf_path), self.settings.max_payload_bytes, profile
+        )
+
+    return await asyncio.gather(*(render(pdf_path) for pdf_path in pdf_paths))
+
+  async def _parse_rendered_async(
+    self,
+    pdf_paths: List[str],
+    profile: RenderProfile | None
+  ) -> tuple[TaxFormData | None, List[str | None]]:
+    documents = await self._render_documents_async(pdf_paths, profile)
+    encoded_images, form_types = await asyncio.to_thread(
+      self._encode_documents, documents
+    )
+
+    with stage("llm"):
+      response = await self.gateway.parse_async(
+        **self._llm_request(encoded_images)
+      )
 
-    return event
+    return response.output_parsed, form_types
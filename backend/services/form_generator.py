@@ -1,34 +1,86 @@
+from collections import defaultdict
 from decimal import Decimal
-from typing import Type
+from pathlib import Path
 import pymupdf
 from pydantic import BaseModel
-from functools import wraps
-import os
-import sys
-
-CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
-MODELS_DIR = os.path.abspath(os.path.join(CURRENT_DIR, "..", "models"))
-TAX_POLICY_DIR = os.path.abspath(os.path.join(CURRENT_DIR, "..", "tax_policy"))
-
-if MODELS_DIR not in sys.path:
-    sys.path.insert(0, MODELS_DIR)
-
-if TAX_POLICY_DIR not in sys.path:
-    sys.path.insert(0, TAX_POLICY_DIR)
-
-from tax_calculator import TaxCalculator, TaxReturnSummary, TaxFormData
-from tax_policy_config import SingleFiler2024Config
-from tax_schema import TaxBracket
-from doc_schema import Form1040
-from user_pii import UserPII, FilingType
+from functools import lru_cache
+
+from services.tax_calculator import TaxCalculator, TaxReturnSummary, TaxFormData
+from services.pipeline_timing import stage
+from tax_policy.policy_registry import TaxPolicy, get_bracket_schedule
+from models.tax_schema import TaxBracket
+from models.doc_schema import Form1040
+from models.user_pii import UserPII, FilingType
+
+# Tax year of the static/templates/f1040_2024.pdf form
+FORM_1040_TAX_YEAR = 2024
+
+# Form 1040 template compiled once: the PDF bytes and an index of every
+# widget name to its (page, xref), so filling a return opens an in-memory
+# copy and touches only the widgets that get a value
+class Form1040Template:
+  def __init__(self, template_bytes: bytes):
+    self.template_bytes = template_bytes
+    self.widget_index : dict[str, tuple[int, int]] = {}
+
+    with pymupdf.open(stream = template_bytes, filetype = "pdf") as doc:
+      for page in doc:
+        for widget in page.widgets():
+          self.widget_index[widget.field_name] = (page.number, widget.xref)
+
+    if not self.widget_index:
+      raise ValueError("Form 1040 template has no fillable fields")
+
+  @classmethod
+  def load(cls, path: str | Path) -> "Form1040Template":
+    return cls(Path(path).read_bytes())
+
+  # Fill all values (text and checkboxes) in a single pass,
+  # returns the filled PDF
+  def fill(self, values: dict[str, str]) -> bytes:
+    by_page : dict[int, list[tuple[int, str]]] = defaultdict(list)
+    for name, value in values.items():
+      if name in self.widget_index:
+        page_number, xref = self.widget_index[name]
+        by_page[page_number].append((xref, value))
+
+    with pymupdf.open(stream = self.template_bytes, filetype = "pdf") as doc:
+      for page_number, widgets in sorted(by_page.items()):
+        page = doc[page_number]
+        for xref, value in widgets:
+          widget = page.load_widget(xref)
+          widget.field_value = value
+          widget.update()
+
+      return doc.tobytes()
+
+# Templates read from disk, compiled once per path
+@lru_cache(maxsize = 8)
+def load_form_1040_template(path: str) -> Form1040Template:
+  return Form1040Template.load(path)
 
 class Form1040Generator:
-  def __init__(self, tax_config_cls: Type[SingleFiler2024Config]):
-    self.tax_config = tax_config_cls()
+  FILING_STATUS_CHECKBOXES = {
+    FilingType.single            : "filing_status_single_checkbox",
+    FilingType.married_joint     : "filing_status_married_joint_checkbox",
+    FilingType.married_separate  : "filing_status_married_separate_checkbox",
+    FilingType.head_of_household : "filing_status_head_checkbox",
+    FilingType.qualifying_spouse : "filing_status_qualifying_spouse_checkbox"
+  }
+
+  def __init__(
+    self,
+    tax_policy: TaxPolicy,
+    template: Form1040Template | None = None
+  ):
+    self.tax_policy = tax_policy
     self.calculator = TaxCalculator(
-      brackets = self.tax_config.get_brackets(),
-      standard_deduction = self.tax_config.get_standard_deduction()
+      brackets = get_bracket_schedule(
+        tax_policy.tax_year, tax_policy.filing_status
+      ),
+      standard_deduction = tax_policy.standard_deduction
     )
+    self.template = template
 
   def _create_form_1040(
     self,
@@ -44,7 +96,7 @@ class Form1040Generator:
       other_income          = data.nec_1099.nonemployee_compensation,
       total_income          = summary.total_income,
       adjusted_gross_income = summary.total_income,
-      standard_deduction    = self.tax_config.get_standard_deduction(),
+      standard_deduction    = self.tax_policy.standard_deduction,
       tax                   = summary.estimated_tax_due,
       federal_tax_withheld  = data.w2.federal_income_tax_withheld,
       total_payments        = summary.total_tax_withheld,
@@ -53,55 +105,43 @@ class Form1040Generator:
       amount_owed           = summary.amount_owed
     )
 
-  def _fill_textfields(self, doc: pymupdf.Document, data: BaseModel) -> None:
-    alias_map = {
-      field.alias : getattr(data, name)
+  # The text fields in the template are named after the model aliases
+  def _field_values(self, data: BaseModel) -> dict[str, str]:
+    return {
+      field.alias : str(getattr(data, name))
       for name, field in type(data).model_fields.items()
+      if field.alias and getattr(data, name) is not None
     }
 
-    for page in doc:
-      for field in page.widgets():
-        key = field.field_name
-        if key in alias_map:
-          field.field_value = str(alias_map[key])
-          field.update()
-
-  @staticmethod
-  def _checkbox_decorator(mapping: dict, field_attr: str):
-    def decorator(func):
-      @wraps(func)
-      def wrapper(self, doc: pymupdf.Document, data: BaseModel):
-        result = func(self, doc, data)
-        checkbox_field = mapping.get(getattr(data, field_attr, None))
-
-        if checkbox_field:
-          for page in doc:
-            for widget in page.widgets():
-              if widget.field_name == checkbox_field:
-                widget.field_value = "Yes"
-                widget.update()
-
-        return result
-      return wrapper
-    return decorator
-
-  @_checkbox_decorator(
-    mapping = {
-      FilingType.single            : "filing_status_single_checkbox",
-      FilingType.married_joint     : "filing_status_married_joint_checkbox",
-      FilingType.married_separate  : "filing_status_married_separate_checkbox",
-      FilingType.head_of_household : "filing_status_head_checkbox",
-      FilingType.qualifying_spouse : "filing_status_qualifying_spouse_checkbox"
-    },
-    field_attr = "filing_status"
-  )
-  def _fill_filing_status_checkbox(
+  def _form_values(self, form: Form1040, pii: UserPII) -> dict[str, str]:
+    values = { **self._field_values(form), **self._field_values(pii) }
+
+    checkbox_field = self.FILING_STATUS_CHECKBOXES.get(pii.filing_status)
+    if checkbox_field:
+      values[checkbox_field] = "Yes"
+
+    return values
+
+  # Calculate the tax summary and fill Form 1040, without touching disk
+  def generate_pdf_bytes(
     self,
-    doc: pymupdf.Document,
-    data: BaseModel
-  ):
-    # Decorator does the work
-    pass
+    data: TaxFormData,
+    pii: UserPII,
+    input_pdf_path: str | None = None
+  ) -> tuple[TaxReturnSummary, bytes]:
+    template = self.template or load_form_1040_template(str(input_pdf_path))
+
+    with stage("calculate"):
+      # Calculate tax summary
+      summary : TaxReturnSummary = self.calculator.summarize(data)
+
+      # Create the form model using summary
+      form = self._create_form_1040(data, pii, summary)
+
+    # Fill tax form data, PII and filing status checkbox in one pass
+    with stage("fill"):
+      pdf_bytes = template.fill(self._form_values(form, pii))
+    return summary, pdf_bytes
 
   def generate_pdf(
     self,
@@ -110,25 +150,8 @@ class Form1040Generator:
     pii: UserPII,
     output_pdf_path: str
   ) -> TaxReturnSummary:
-    # Calculate tax summary
-    summary : TaxReturnSummary = self.calculator.summarize(data)
-
-    # Create the form model using summary
-    form = self._create_form_1040(data, pii, summary)
-
-    # Load PDF and fill text fields
-    doc = pymupdf.open(input_pdf_path)
-
-    # Fill tax form data
-    self._fill_textfields(doc, form)
-
-    # Fill PII
-    self._fill_textfields(doc, pii)
-
-    # Tick checkbox
-    self._fill_filing_status_checkbox(doc, pii)
-
-    doc.save(output_pdf_path)
-    doc.close()
+    summary, pdf_bytes = self.generate_pdf_bytes(data, pii, input_pdf_path)
+    with stage("save"):
+      Path(output_pdf_path).write_bytes(pdf_bytes)
 
     return summary
@@ -1,44 +1,128 @@
+from concurrent.futures import Executor
 from pathlib import Path
-from typing import List, Dict, Type
-import os
-import sys
+from typing import List
+import asyncio
 
-CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
-MODELS_DIR = os.path.abspath(os.path.join(CURRENT_DIR, "..", "models"))
-TAX_POLICY_DIR = os.path.abspath(os.path.join(CURRENT_DIR, "..", "tax_policy"))
+from services.document_store import DocumentStore
+from services.extraction_cache import ExtractionCache
+from services.form_extractor import FormExtractor, ExtractionSettings
+from services.form_generator import Form1040Generator, Form1040Template, FORM_1040_TAX_YEAR
+from services.llm_gateway import LLMGateway
+from services.pipeline_timing import stage
+from services.tracing import span
+from models.tax_schema import TaxFormData, TaxReturnSummary
+from tax_policy.policy_registry import TaxPolicy, get_tax_policy
+from models.user_pii import UserPII
 
-if MODELS_DIR not in sys.path:
-    sys.path.insert(0, MODELS_DIR)
-
-if TAX_POLICY_DIR not in sys.path:
-    sys.path.insert(0, TAX_POLICY_DIR)
+def generate_filled_1040(
+  file_buffers: List[tuple[str, bytes]],
+  pii: UserPII,
+  input_pdf_path: Path,
+  output_pdf_path: Path | None = None,
+  render_executor: Executor | None = None,
+  extraction_cache: ExtractionCache | None = None,
+  extraction_settings: ExtractionSettings | None = None,
+  form_template: Form1040Template | None = None,
+  document_store: DocumentStore | None = None,
+  document_id: str | None = None,
+  tax_year: int = FORM_1040_TAX_YEAR,
+  form_generator: Form1040Generator | None = None,
+  llm_gateway: LLMGateway | None = None
+) -> TaxReturnSummary:
+  # parent span of the pipeline stages when tracing is on
+  with span("generate_filled_1040", documents = len(file_buffers)):
+    # Extract tax data
+    extractor = FormExtractor(
+      render_executor = render_executor,
+      cache = extraction_cache,
+      settings = extraction_settings,
+      gateway = llm_gateway
+    )
+    tax_form_data: TaxFormData = extractor.extract_from_pdfs(file_buffers)
 
-from form_extractor import FormExtractor
-from form_generator import Form1040Generator
-from tax_schema import TaxFormData, TaxReturnSummary
-from tax_policy_config import SingleFiler2024Config
-from user_pii import UserPII, FilingType
+    return _fill_1040(
+      tax_form_data = tax_form_data,
+      pii = pii,
+      input_pdf_path = input_pdf_path,
+      output_pdf_path = output_pdf_path,
+      form_template = form_template,
+      document_store = document_store,
+      document_id = document_id,
+      tax_year = tax_year,
+      form_generator = form_generator
+    )
 
-def generate_filled_1040(
+# Same pipeline as a coroutine, for the API: the extraction awaits the LLM
+# on the event loop instead of blocking a thread, filling and saving the
+# Form 1040 run in a worker thread
+async def generate_filled_1040_async(
   file_buffers: List[tuple[str, bytes]],
   pii: UserPII,
   input_pdf_path: Path,
-  output_pdf_path: Path
+  output_pdf_path: Path | None = None,
+  render_executor: Executor | None = None,
+  extraction_cache: ExtractionCache | None = None,
+  extraction_settings: ExtractionSettings | None = None,
+  form_template: Form1040Template | None = None,
+  document_store: DocumentStore | None = None,
+  document_id: str | None = None,
+  tax_year: int = FORM_1040_TAX_YEAR,
+  form_generator: Form1040Generator | None = None,
+  llm_gateway: LLMGateway | None = None
 ) -> TaxReturnSummary:
-  # Extract tax data
-  extractor = FormExtractor()
-  tax_form_data: TaxFormData = extractor.extract_from_pdfs(file_buffers)
+  with span("generate_filled_1040", documents = len(file_buffers)):
+    extractor = FormExtractor(
+      render_executor = render_executor,
+      cache = extraction_cache,
+      settings = extraction_settings,
+      gateway = llm_gateway
+    )
+    tax_form_data: TaxFormData = await extractor.extract_from_pdfs_async(
+      file_buffers
+    )
 
-  filing_type : FilingType = pii.filing_status
+    return await asyncio.to_thread(
+      _fill_1040,
+      tax_form_data = tax_form_data,
+      pii = pii,
+      input_pdf_path = input_pdf_path,
+      output_pdf_path = output_pdf_path,
+      form_template = form_template,
+      document_store = document_store,
+      document_id = document_id,
+      tax_year = tax_year,
+      form_generator = form_generator
+    )
 
-  config_map : Dict[FilingType, Type[TaxPolicyConfigBase]] = {
-    FilingType.single: SingleFiler2024Config,
-    # Add more mappings when other configs exist
-  }
+def _fill_1040(
+  tax_form_data: TaxFormData,
+  pii: UserPII,
+  input_pdf_path: Path,
+  output_pdf_path: Path | None,
+  form_template: Form1040Template | None,
+  document_store: DocumentStore | None,
+  document_id: str | None,
+  tax_year: int,
+  form_generator: Form1040Generator | None
+) -> TaxReturnSummary:
+  generator = form_generator
+  if generator is None:
+    # Brackets and standard deduction of the year and filing status,
+    # parsed from tax_policy/data on first use
+    tax_policy : TaxPolicy = get_tax_policy(tax_year, pii.filing_status)
 
-  tax_config_cls : FilingType = config_map[filing_type]
+    generator = Form1040Generator(tax_policy, template = form_template)
 
-  generator = Form1040Generator(tax_config_cls)
+  # Filled form goes to the document store when given, otherwise to disk
+  if document_store is not None:
+    tax_return_summary, pdf_bytes = generator.generate_pdf_bytes(
+      data = tax_form_data,
+      pii = pii,
+      input_pdf_path = input_pdf_path
+    )
+    with stage("save"):
+      document_store.put(document_id, pdf_bytes)
+    return tax_return_summary
 
   # Calculate tax summary
   tax_return_summary : TaxReturnSummary = generator.generate_pdf(
@@ -0,0 +1,411 @@
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from typing import Iterable
+import math
+import os
+import socket
+import sqlite3
+import threading
+import uuid
+
+from models.job_schema import TaxFormJob, JobStatus
+
+class JobNotFoundError(KeyError):
+  pass
+
+INTERRUPTED_JOB_ERROR = (
+  "The server stopped while processing this return. Please submit it again."
+)
+
+# Submission jobs, created and updated by the worker running them and read
+# by whichever worker gets the status, result or events request. Finished
+# jobs are dropped once they are older than retention_seconds.
+#
+# Jobs run as tasks of the worker that created them (their owner), which
+# holds a lease on each of its queued or running jobs and renews it while
+# they run. A job whose lease ran out (its worker was killed or restarted)
+# is failed with INTERRUPTED_JOB_ERROR the next time jobs are created or
+# counted, so it neither stays pending forever nor counts towards
+# JOB_MAX_PENDING.
+class JobStore(ABC):
+  def __init__(self, retention_seconds: int, lease_seconds: float):
+    self.retention = timedelta(seconds = retention_seconds)
+    self.lease = timedelta(seconds = lease_seconds)
+    # this worker process, across hosts
+    self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+  @abstractmethod
+  def create(self) -> TaxFormJob:
+    ...
+
+  @abstractmethod
+  def get(self, job_id: str) -> TaxFormJob:
+    ...
+
+  @abstractmethod
+  def update(self, job_id: str, **changes) -> TaxFormJob:
+    ...
+
+  # Jobs queued or running, stale ones are failed first
+  @abstractmethod
+  def count_pending(self) -> int:
+    ...
+
+  # Extends the lease of this worker's jobs that are still pending
+  @abstractmethod
+  def renew(self, job_ids: Iterable[str]) -> None:
+    ...
+
+  @staticmethod
+  def _new_job() -> TaxFormJob:
+    now = datetime.now(timezone.utc)
+    return TaxFormJob(job_id = uuid.uuid4().hex, created_at = now, updated_at = now)
+
+  @staticmethod
+  def _updated(job: TaxFormJob, changes: dict) -> TaxFormJob:
+    return job.model_copy(
+      update = { **changes, "updated_at" : datetime.now(timezone.utc) }
+    )
+
+  @classmethod
+  def _interrupted(cls, job: TaxFormJob) -> TaxFormJob:
+    return cls._updated(
+      job, { "status" : JobStatus.failed, "error" : INTERRUPTED_JOB_ERROR }
+    )
+
+# Thread-safe, per process. Only suitable for a single worker.
+class InMemoryJobStore(JobStore):
+  def __init__(self, retention_seconds: int, lease_seconds: float):
+    super().__init__(retention_seconds, lease_seconds)
+    self._jobs : dict[str, TaxFormJob] = {}
+    # lease expiry of pending jobs
+    self._leases : dict[str, datetime] = {}
+    self._lock = threading.Lock()
+
+  def _fail_stale(self, now: datetime) -> None:
+    stale = [job_id for job_id, expires_at in self._leases.items() if expires_at < now]
+    for job_id in stale:
+      del self._leases[job_id]
+      self._jobs[job_id] = self._interrupted(self._jobs[job_id])
+
+  def _prune(self, now: datetime) -> None:
+    self._fail_stale(now)
+    expired = [
+      job_id
+      for job_id, job in self._jobs.items()
+      if job.status.is_terminal and now - job.updated_at > self.retention
+    ]
+    for job_id in expired:
+      del self._jobs[job_id]
+
+  def create(self) -> TaxFormJob:
+    job = self._new_job()
+
+    with self._lock:
+      self._prune(job.created_at)
+      self._jobs[job.job_id] = job
+      self._leases[job.job_id] = job.created_at + self.lease
+
+    return job.model_copy()
+
+  def get(self, job_id: str) -> TaxFormJob:
+    with self._lock:
+      job = self._jobs.get(job_id)
+      if job is None:
+        raise JobNotFoundError(job_id)
+      return job.model_copy()
+
+  def update(self, job_id: str, **changes) -> TaxFormJob:
+    with self._lock:
+      job = self._jobs.get(job_id)
+      if job is None:
+        raise JobNotFoundError(job_id)
+
+      job = self._updated(job, changes)
+      self._jobs[job_id] = job
+      if job.status.is_terminal:
+        self._leases.pop(job_id, None)
+      return job.model_copy()
+
+  def count_pending(self) -> int:
+    with self._lock:
+      self._fail_stale(datetime.now(timezone.utc))
+      return len(self._leases)
+
+  def renew(self, job_ids: Iterable[str]) -> None:
+    expires_at = datetime.now(timezone.utc) + self.lease
+    with self._lock:
+      for job_id in job_ids:
+        if job_id in self._leases:
+          self._leases[job_id] = expires_at
+
+_PENDING = (JobStatus.queued.value, JobStatus.running.value)
+
+# SQLite file shared by every worker on the host (WAL, so status polling
+# does not block the workers writing)
+class SQLiteJobStore(JobStore):
+  def __init__(self, path: str | Path, retention_seconds: int, lease_seconds: float):
+    super().__init__(retention_seconds, lease_seconds)
+    self._lock = threading.Lock()
+
+    Path(path).parent.mkdir(parents = True, exist_ok = True)
+    self._conn = sqlite3.connect(
+      str(path),
+      check_same_thread = False,
+      isolation_level = None,
+      # other workers hold the write lock for one statement at most
+      timeout = 30
+    )
+    self._conn.execute("PRAGMA journal_mode=WAL")
+    self._conn.execute(
+      """CREATE TABLE IF NOT EXISTS jobs (
+        job_id TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        job TEXT NOT NULL,
+        updated_at REAL NOT NULL,
+        owner TEXT,
+        lease_expires_at REAL
+      )"""
+    )
+    # files written before jobs had leases, their pending jobs are stale
+    columns = { row[1] for row in self._conn.execute("PRAGMA table_info(jobs)") }
+    for column, kind in (("owner", "TEXT"), ("lease_expires_at", "REAL")):
+      if column not in columns:
+        self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+    self._conn.execute(
+      "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, updated_at)"
+    )
+
+  # owner and lease are only set on create and renew
+  def _write(self, job: TaxFormJob) -> None:
+    self._conn.execute(
+      """INSERT INTO jobs (job_id, status, job, updated_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT (job_id) DO UPDATE SET
+          status = excluded.status,
+          job = excluded.job,
+          updated_at = excluded.updated_at""",
+      (
+        job.job_id,
+        job.status.value,
+        job.model_dump_json(),
+        job.updated_at.timestamp()
+      )
+    )
+
+  # Each row is only failed if it is still pending with an expired lease
+  # once written, a renewal or a final status from its owner wins
+  def _fail_stale(self, now: datetime) -> None:
+    stale = """status IN (?, ?) AND (lease_expires_at IS NULL OR lease_expires_at < ?)"""
+    rows = self._conn.execute(
+      f"SELECT job FROM jobs WHERE {stale}", (*_PENDING, now.timestamp())
+    ).fetchall()
+    for (value,) in rows:
+      job = self._interrupted(TaxFormJob.model_validate_json(value))
+      self._conn.execute(
+        f"UPDATE jobs SET status = ?, job = ?, updated_at = ? WHERE job_id = ? AND {stale}",
+        (
+          job.status.value,
+          job.model_dump_json(),
+          job.updated_at.timestamp(),
+          job.job_id,
+          *_PENDING,
+          now.timestamp()
+        )
+      )
+
+  def create(self) -> TaxFormJob:
+    job = self._new_job()
+    expired_before = (job.created_at - self.retention).timestamp()
+
+    with self._lock:
+      self._fail_stale(job.created_at)
+      self._conn.execute(
+        "DELETE FROM jobs WHERE status NOT IN (?, ?) AND updated_at < ?",
+        (*_PENDING, expired_before)
+      )
+      self._conn.execute(
+        """INSERT INTO jobs (job_id, status, job, updated_at, owner, lease_expires_at)
+          VALUES (?, ?, ?, ?, ?, ?)""",
+        (
+          job.job_id,
+          job.status.value,
+          job.model_dump_json(),
+          job.updated_at.timestamp(),
+          self.owner,
+          (job.created_at + self.lease).timestamp()
+        )
+      )
+    return job
+
+  def get(self, job_id: str) -> TaxFormJob:
+    with self._lock:
+      row = self._conn.execute(
+        "SELECT job FROM jobs WHERE job_id = ?", (job_id,)
+      ).fetchone()
+    if row is None:
+      raise JobNotFoundError(job_id)
+    return TaxFormJob.model_validate_json(row[0])
+
+  # A job is only ever updated by the worker running it, so reading and
+  # writing it back needs no lock across workers
+  def update(self, job_id: str, **changes) -> TaxFormJob:
+    job = self._updated(self.get(job_id), changes)
+    with self._lock:
+      self._write(job)
+    return job
+
+  def count_pending(self) -> int:
+    with self._lock:
+      self._fail_stale(datetime.now(timezone.utc))
+      return self._conn.execute(
+        "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", _PENDING
+      ).fetchone()[0]
+
+  def renew(self, job_ids: Iterable[str]) -> None:
+    expires_at = (datetime.now(timezone.utc) + self.lease).timestamp()
+    with self._lock:
+      self._conn.executemany(
+        """UPDATE jobs SET lease_expires_at = ?
+          WHERE job_id = ? AND owner = ? AND status IN (?, ?)""",
+        [(expires_at, job_id, self.owner, *_PENDING) for job_id in job_ids]
+      )
+
+# Redis, or any server speaking its protocol (Valkey, KeyDB, ...), shared
+# by workers on any number of hosts. Finished jobs expire through the key
+# TTL, the ids of pending jobs are kept in a set for count_pending. The
+# lease of a pending job is a key holding its owner, expiring with it.
+class RedisJobStore(JobStore):
+  def __init__(
+    self,
+    retention_seconds: int,
+    lease_seconds: float,
+    url: str | None = None,
+    prefix: str = "tax:jobs:",
+    client = None
+  ):
+    super().__init__(retention_seconds, lease_seconds)
+    self.prefix = prefix
+    self._pending_key = f"{prefix}pending"
+
+    if client is None:
+      try:
+        import redis
+      except ImportError as e:
+        raise RuntimeError(
+          "The redis job store requires redis (pip install redis)"
+        ) from e
+      client = redis.Redis.from_url(url)
+    self.client = client
+    # an unreachable server fails the startup, not the first request
+    self.client.ping()
+
+  def _key(self, job_id: str) -> str:
+    return f"{self.prefix}{job_id}"
+
+  def _lease_key(self, job_id: str) -> str:
+    return f"{self.prefix}{job_id}:lease"
+
+  @property
+  def _lease_ttl(self) -> int:
+    return max(1, math.ceil(self.lease.total_seconds()))
+
+  def _terminal(self, pipe, job: TaxFormJob) -> None:
+    pipe.set(
+      self._key(job.job_id),
+      job.model_dump_json(),
+      ex = max(1, math.ceil(self.retention.total_seconds()))
+    )
+    pipe.srem(self._pending_key, job.job_id)
+    pipe.delete(self._lease_key(job.job_id))
+
+  # Pending jobs whose lease key expired
+  def _fail_stale(self) -> None:
+    job_ids = [
+      job_id.decode() if isinstance(job_id, bytes) else job_id
+      for job_id in self.client.smembers(self._pending_key)
+    ]
+    if not job_ids:
+      return
+
+    pipe = self.client.pipeline()
+    for job_id in job_ids:
+      pipe.exists(self._lease_key(job_id))
+    leased = pipe.execute()
+
+    for job_id, has_lease in zip(job_ids, leased):
+      if has_lease:
+        continue
+      value = self.client.get(self._key(job_id))
+      pipe = self.client.pipeline()
+      if value is None:
+        pipe.srem(self._pending_key, job_id)
+      else:
+        job = TaxFormJob.model_validate_json(value)
+        if job.status.is_terminal:
+          pipe.srem(self._pending_key, job_id)
+        else:
+          self._terminal(pipe, self._interrupted(job))
+      pipe.execute()
+
+  def create(self) -> TaxFormJob:
+    self._fail_stale()
+    job = self._new_job()
+    pipe = self.client.pipeline()
+    pipe.set(self._key(job.job_id), job.model_dump_json())
+    pipe.set(self._lease_key(job.job_id), self.owner, ex = self._lease_ttl)
+    pipe.sadd(self._pending_key, job.job_id)
+    pipe.execute()
+    return job
+
+  def get(self, job_id: str) -> TaxFormJob:
+    value = self.client.get(self._key(job_id))
+    if value is None:
+      raise JobNotFoundError(job_id)
+    return TaxFormJob.model_validate_json(value)
+
+  # Only ever updated by the worker running the job, see SQLiteJobStore
+  def update(self, job_id: str, **changes) -> TaxFormJob:
+    job = self._updated(self.get(job_id), changes)
+    pipe = self.client.pipeline()
+    if job.status.is_terminal:
+      self._terminal(pipe, job)
+    else:
+      pipe.set(self._key(job_id), job.model_dump_json())
+    pipe.execute()
+    return job
+
+  def count_pending(self) -> int:
+    self._fail_stale()
+    return self.client.scard(self._pending_key)
+
+  # Only leases that still exist are extended (xx), a job failed as stale
+  # meanwhile stays failed
+  def renew(self, job_ids: Iterable[str]) -> None:
+    pipe = self.client.pipeline()
+    for job_id in job_ids:
+      pipe.set(self._lease_key(job_id), self.owner, ex = self._lease_ttl, xx = True)
+    pipe.execute()
+
+# backend: "memory", "sqlite" or "redis"
+def create_job_store(
+  backend: str,
+  retention_seconds: int,
+  lease_seconds: float,
+  path: str | Path | None = None,
+  redis_url: str | None = None
+) -> JobStore:
+  if backend == "memory":
+    return InMemoryJobStore(retention_seconds, lease_seconds)
+
+  if backend == "sqlite":
+    if path is None:
+      raise ValueError("path is required for the sqlite job store")
+    return SQLiteJobStore(path, retention_seconds, lease_seconds)
+
+  if backend == "redis":
+    if not redis_url:
+      raise ValueError("redis_url is required for the redis job store")
+    return RedisJobStore(retention_seconds, lease_seconds, url = redis_url)
+
+  raise ValueError(f"Unknown job store backend: {backend}")
@@ -0,0 +1,318 @@
+from typing import Any
+import asyncio
+import random
+import threading
+import time
+import os
+
+from services.metrics import LLM_EVENTS, LLM_TOKENS
+
+class LLMUnavailableError(RuntimeError):
+  pass
+
+# Reservation based token bucket refilled continuously at per_minute / 60
+# per second. reserve() takes the amount right away, possibly going into
+# debt, and returns how long the caller has to wait before using it, which
+# keeps callers roughly first come first served.
+class TokenBucket:
+  def __init__(self, per_minute: float):
+    self.capacity = float(per_minute)
+    self.rate = self.capacity / 60.0
+    self._tokens = self.capacity
+    self._updated = time.monotonic()
+    self._lock = threading.Lock()
+
+  def _refill(self) -> None:
+    now = time.monotonic()
+    self._tokens = min(
+      self.capacity, self._tokens + (now - self._updated) * self.rate
+    )
+    self._updated = now
+
+  # A request larger than the whole budget waits for a full bucket, not
+  # forever: it takes at most capacity
+  def _taken(self, amount: float) -> float:
+    return min(amount, self.capacity)
+
+  def reserve(self, amount: float) -> float:
+    with self._lock:
+      self._refill()
+      self._tokens -= self._taken(amount)
+      return max(0.0, -self._tokens / self.rate)
+
+  # Settles a reservation of amount against what was actually used: gives
+  # back what reserve took, takes used. Without used, cancels it.
+  def settle(self, amount: float, used: float = 0) -> None:
+    with self._lock:
+      self._refill()
+      self._tokens = min(self.capacity, self._tokens + self._taken(amount) - used)
+
+# Process-wide access to the OpenAI Responses API:
+#   - one client and HTTP connection pool shared by every request (parse),
+#     and an AsyncOpenAI client with its own pool for coroutines
+#     (parse_async), both under the same budgets
+#   - requests / tokens per minute budgets, callers wait for their turn
+#   - retries with full-jitter exponential backoff (honoring Retry-After)
+#   - a deadline per call covering waiting, retries and the requests
+# openai (a large import) is only loaded once a gateway is created, not by
+# the modules importing this one, e.g. form_extractor in render workers.
+class LLMGateway:
+  def __init__(
+    self,
+    api_key: str | None = None,
+    requests_per_minute: float = 500,
+    tokens_per_minute: float = 200_000,
+    max_attempts: int = 4,
+    backoff_base_seconds: float = 0.5,
+    backoff_max_seconds: float = 8.0,
+    request_timeout_seconds: float = 60.0,
+    deadline_seconds: float = 120.0,
+    max_connections: int = 20,
+    async_max_connections: int = 200,
+    client: Any = None,
+    async_client: Any = None
+  ):
+    self.max_attempts = max(1, max_attempts)
+    self.backoff_base_seconds = backoff_base_seconds
+    self.backoff_max_seconds = backoff_max_seconds
+    self.request_timeout_seconds = request_timeout_seconds
+    self.deadline_seconds = deadline_seconds
+
+    # 0 disables a budget
+    self.request_bucket = (
+      TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+    )
+    self.token_bucket = (
+      TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+    )
+
+    import httpx
+    import openai
+
+    # Errors worth retrying: throttling, timeouts, dropped connections, 5xx
+    self.retryable_errors = (
+      openai.RateLimitError,
+      openai.APITimeoutError,
+      openai.APIConnectionError,
+      openai.InternalServerError,
+    )
+    self._rate_limit_error = openai.RateLimitError
+
+    # With only a custom (e.g. fake) client given, parse_async runs it in
+    # a thread instead of creating an AsyncOpenAI client
+    if client is None and async_client is None:
+      async_client = openai.AsyncOpenAI(
+        api_key = api_key or os.getenv("OPENAI_API_KEY"),
+        max_retries = 0,
+        timeout = request_timeout_seconds,
+        # bound to the event loop it is first used on, the server's
+        http_client = openai.DefaultAsyncHttpxClient(
+          limits = httpx.Limits(
+            max_connections = async_max_connections,
+            max_keepalive_connections = async_max_connections
+          )
+        )
+      )
+    self.async_client = async_client
+
+    if client is None:
+      client = openai.OpenAI(
+        api_key = api_key or os.getenv("OPENAI_API_KEY"),
+        # retries are handled here, with the rate limit budgets in mind
+        max_retries = 0,
+        timeout = request_timeout_seconds,
+        http_client = openai.DefaultHttpxClient(
+          limits = httpx.Limits(
+            max_connections = max_connections,
+            max_keepalive_connections = max_connections
+          )
+        )
+      )
+    self.client = client
+
+    self._lock = threading.Lock()
+    self._waiting = 0
+    self._in_flight = 0
+    self._counters = {
+      "calls" : 0,
+      "retries" : 0,
+      "rate_limited" : 0,
+      "failures" : 0,
+      "tokens_used" : 0,
+    }
+
+  def _count(self, name: str, amount: int = 1) -> None:
+    with self._lock:
+      self._counters[name] += amount
+
+    if name == "tokens_used":
+      LLM_TOKENS.inc(amount)
+    else:
+      LLM_EVENTS.inc(amount, event = name)
+
+  # Takes the budgets of one request, returns how long to wait before
+  # sending it
+  def _reserve_budget(self, estimated_tokens: int, deadline: float) -> float:
+    reservations = []
+    if self.request_bucket is not None:
+      reservations.append(
+        (self.request_bucket, 1, self.request_bucket.reserve(1))
+      )
+    if self.token_bucket is not None:
+      reservations.append((
+        self.token_bucket,
+        estimated_tokens,
+        self.token_bucket.reserve(estimated_tokens)
+      ))
+
+    wait = max((w for _, _, w in reservations), default = 0.0)
+    if time.monotonic() + wait > deadline:
+      for bucket, amount, _ in reservations:
+        bucket.settle(amount)
+      self._count("failures")
+      raise LLMUnavailableError("LLM rate limit budget exhausted")
+
+    return wait
+
+  def _track(self, attribute: str, delta: int) -> None:
+    with self._lock:
+      setattr(self, attribute, getattr(self, attribute) + delta)
+
+  def _backoff(self, attempt: int, error: Exception) -> float:
+    delay = random.uniform(
+      0, min(self.backoff_max_seconds, self.backoff_base_seconds * 2 ** attempt)
+    )
+
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+      delay = max(delay, float(retry_after))
+    except (TypeError, ValueError):
+      pass
+
+    return delay
+
+  # Delay before retrying a failed request, or LLMUnavailableError when
+  # out of attempts or time
+  def _retry_delay(self, attempt: int, error: Exception, deadline: float) -> float:
+    if isinstance(error, self._rate_limit_error):
+      self._count("rate_limited")
+
+    delay = self._backoff(attempt, error)
+    if (
+      attempt + 1 == self.max_attempts or
+      time.monotonic() + delay >= deadline
+    ):
+      self._count("failures")
+      raise LLMUnavailableError("LLM request failed after retries") from error
+
+    self._count("retries")
+    return delay
+
+  # Timeout of the next request, LLMUnavailableError instead of sending it
+  # once the deadline has passed (e.g. a budget wait that overslept)
+  def _request_timeout(self, deadline: float) -> float:
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+      self._count("failures")
+      raise LLMUnavailableError("LLM deadline passed before the request was sent")
+    return min(self.request_timeout_seconds, remaining)
+
+  # Same arguments as client.responses.parse, plus a rough token estimate
+  # of the request used against the tokens per minute budget
+  def parse(self, estimated_tokens: int = 1000, **kwargs) -> Any:
+    deadline = time.monotonic() + self.deadline_seconds
+    self._count("calls")
+
+    for attempt in range(self.max_attempts):
+      # retries count against the budgets like any other request
+      wait = self._reserve_budget(estimated_tokens, deadline)
+      if wait > 0:
+        self._track("_waiting", 1)
+        try:
+          time.sleep(wait)
+        finally:
+          self._track("_waiting", -1)
+
+      timeout = self._request_timeout(deadline)
+      self._track("_in_flight", 1)
+      try:
+        response = self.client.responses.parse(timeout = timeout, **kwargs)
+      except self.retryable_errors as e:
+        delay = self._retry_delay(attempt, e, deadline)
+        time.sleep(delay)
+        continue
+      finally:
+        self._track("_in_flight", -1)
+
+      self._record_usage(response, estimated_tokens)
+      return response
+
+  # parse() for coroutines: waiting for the budgets, backoff and the request
+  # itself do not hold a thread, so one process can keep many requests in
+  # flight (up to async_max_connections at once)
+  async def parse_async(self, estimated_tokens: int = 1000, **kwargs) -> Any:
+    if self.async_client is None:
+      return await asyncio.to_thread(self.parse, estimated_tokens, **kwargs)
+
+    deadline = time.monotonic() + self.deadline_seconds
+    self._count("calls")
+
+    for attempt in range(self.max_attempts):
+      wait = self._reserve_budget(estimated_tokens, deadline)
+      if wait > 0:
+        self._track("_waiting", 1)
+        try:
+          await asyncio.sleep(wait)
+        finally:
+          self._track("_waiting", -1)
+
+      timeout = self._request_timeout(deadline)
+      self._track("_in_flight", 1)
+      try:
+        response = await self.async_client.responses.parse(timeout = timeout, **kwargs)
+      except self.retryable_errors as e:
+        delay = self._retry_delay(attempt, e, deadline)
+        await asyncio.sleep(delay)
+        continue
+      finally:
+        self._track("_in_flight", -1)
+
+      self._record_usage(response, estimated_tokens)
+      return response
+
+  def _record_usage(self, response: Any, estimated_tokens: int) -> None:
+    usage = getattr(response, "usage", None)
+    total_tokens = getattr(usage, "total_tokens", None)
+    if not isinstance(total_tokens, int):
+      return
+
+    self._count("tokens_used", total_tokens)
+    if self.token_bucket is not None:
+      # settle the estimate against what was actually used
+      self.token_bucket.settle(estimated_tokens, total_tokens)
+
+  def stats(self) -> dict:
+    with self._lock:
+      return {
+        "queue_depth" : self._waiting,
+        "in_flight" : self._in_flight,
+        **self._counters
+      }
+
+_gateway : LLMGateway | None = None
+_gateway_lock = threading.Lock()
+
+def configure_llm_gateway(**settings) -> LLMGateway:
+  global _gateway
+  with _gateway_lock:
+    _gateway = LLMGateway(**settings)
+    return _gateway
+
+# The process-wide gateway, created with defaults unless configured first
+def get_llm_gateway() -> LLMGateway:
+  global _gateway
+  with _gateway_lock:
+    if _gateway is None:
+      _gateway = LLMGateway()
+    return _gateway
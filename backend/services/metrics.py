@@ -0,0 +1,409 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from pathlib import Path
+from typing import Callable, Dict, List, Sequence, Tuple
+import json
+import math
+import os
+import threading
+import time
+
+# Process-wide metrics in the Prometheus text format, without a client
+# library. Updating a counter or histogram is a lock and a few additions,
+# cheap enough to leave on in production. Gauges are callbacks read when
+# /api/metrics is scraped. Every worker process has its own values, see
+# MetricsRegistry.enable_multiprocess to scrape several as one.
+#
+# prometheus_client's multiprocess mode does not fit uvicorn --workers: it
+# has no callback gauges (the queue depths below), needs its directory set
+# before it is imported and leaves the files of exited workers to a
+# mark_process_dead hook that only gunicorn calls.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+SECONDS_BUCKETS = (
+  0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120
+)
+BYTES_BUCKETS = tuple(64 * 1024 * 4 ** i for i in range(7))
+
+def _escape(value: str) -> str:
+  return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+  if not names:
+    return ""
+  pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+  return "{" + pairs + "}"
+
+def _format_value(value: float) -> str:
+  if value == math.inf:
+    return "+Inf"
+  if float(value).is_integer():
+    return str(int(value))
+  return repr(float(value))
+
+class _Metric(ABC):
+  kind = ""
+
+  def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+    self.name = name
+    self.help = help
+    self.label_names = tuple(label_names)
+    self._lock = threading.Lock()
+
+  def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+    return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+  def header(self) -> List[str]:
+    return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+  # Current values as JSON-compatible [label values, value...] rows
+  @abstractmethod
+  def snapshot(self) -> list:
+    ...
+
+  # Rows of several processes' snapshots combined into one snapshot
+  @abstractmethod
+  def merge(self, snapshots: List[list]) -> list:
+    ...
+
+  @abstractmethod
+  def lines(self, snapshot: list) -> List[str]:
+    ...
+
+  def samples(self) -> List[str]:
+    return self.lines(self.snapshot())
+
+class Counter(_Metric):
+  kind = "counter"
+
+  def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+    super().__init__(name, help, label_names)
+    self._values : Dict[Tuple[str, ...], float] = {}
+
+  def inc(self, amount: float = 1, **labels: str) -> None:
+    key = self._key(labels)
+    with self._lock:
+      self._values[key] = self._values.get(key, 0) + amount
+
+  def value(self, **labels: str) -> float:
+    with self._lock:
+      return self._values.get(self._key(labels), 0)
+
+  def snapshot(self) -> list:
+    with self._lock:
+      return [[list(key), value] for key, value in self._values.items()]
+
+  def merge(self, snapshots: List[list]) -> list:
+    totals : Dict[Tuple[str, ...], float] = {}
+    for snapshot in snapshots:
+      for key, value in snapshot:
+        totals[tuple(key)] = totals.get(tuple(key), 0) + value
+    return [[list(key), value] for key, value in totals.items()]
+
+  def lines(self, snapshot: list) -> List[str]:
+    return [
+      f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+      for key, value in snapshot
+    ]
+
+class Histogram(_Metric):
+  kind = "histogram"
+
+  def __init__(
+    self,
+    name: str,
+    help: str,
+    label_names: Sequence[str] = (),
+    buckets: Sequence[float] = SECONDS_BUCKETS
+  ):
+    super().__init__(name, help, label_names)
+    self.buckets = tuple(sorted(buckets))
+    # per label values: [observations per bucket (last one +Inf), sum]
+    self._values : Dict[Tuple[str, ...], list] = {}
+
+  def observe(self, value: float, **labels: str) -> None:
+    key = self._key(labels)
+    index = bisect_left(self.buckets, value)
+    with self._lock:
+      entry = self._values.get(key)
+      if entry is None:
+        entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+      entry[0][index] += 1
+      entry[1] += value
+
+  def snapshot(self) -> list:
+    with self._lock:
+      return [
+        [list(key), list(counts), total]
+        for key, (counts, total) in self._values.items()
+      ]
+
+  def merge(self, snapshots: List[list]) -> list:
+    totals : Dict[Tuple[str, ...], list] = {}
+    for snapshot in snapshots:
+      for key, counts, total in snapshot:
+        # buckets changed between deployments, not comparable
+        if len(counts) != len(self.buckets) + 1:
+          continue
+        entry = totals.setdefault(tuple(key), [[0] * len(counts), 0.0])
+        entry[0] = [a + b for a, b in zip(entry[0], counts)]
+        entry[1] += total
+    return [[list(key), counts, total] for key, (counts, total) in totals.items()]
+
+  def lines(self, snapshot: list) -> List[str]:
+    lines = []
+    names = (*self.label_names, "le")
+    for key, counts, total in snapshot:
+      cumulative = 0
+      for bound, count in zip((*self.buckets, math.inf), counts):
+        cumulative += count
+        labels = _format_labels(names, (*key, _format_value(bound)))
+        lines.append(f"{self.name}_bucket{labels} {cumulative}")
+      labels = _format_labels(self.label_names, key)
+      lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+      lines.append(f"{self.name}_count{labels} {cumulative}")
+    return lines
+
+class Gauge(_Metric):
+  kind = "gauge"
+
+  # aggregate: how the values of several worker processes combine, "sum"
+  # for per process values (e.g. requests in flight), "max" for values
+  # every worker reads from the same shared store
+  def __init__(
+    self,
+    name: str,
+    help: str,
+    read: Callable[[], float],
+    aggregate: str = "sum"
+  ):
+    super().__init__(name, help)
+    if aggregate not in ("sum", "max"):
+      raise ValueError(f"Unknown gauge aggregate: {aggregate}")
+    self.read = read
+    self.aggregate = aggregate
+
+  def snapshot(self) -> list:
+    try:
+      value = self.read()
+    except Exception:
+      # a broken callback must not break the whole scrape
+      return []
+    return [[[], value]]
+
+  def merge(self, snapshots: List[list]) -> list:
+    values = [value for snapshot in snapshots for _, value in snapshot]
+    if not values:
+      return []
+    return [[[], sum(values) if self.aggregate == "sum" else max(values)]]
+
+  def lines(self, snapshot: list) -> List[str]:
+    return [f"{self.name} {_format_value(value)}" for _, value in snapshot]
+
+def _is_alive(pid: int) -> bool:
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    pass
+  return True
+
+class MetricsRegistry:
+  def __init__(self):
+    self._metrics : Dict[str, _Metric] = {}
+    self._lock = threading.Lock()
+    self._multiprocess_dir : Path | None = None
+    self._snapshot_path : Path | None = None
+    self._flusher : threading.Thread | None = None
+    self._stop_flushing = threading.Event()
+    self._write_lock = threading.Lock()
+
+  def _register(self, metric: _Metric, replace: bool = False) -> _Metric:
+    with self._lock:
+      existing = self._metrics.get(metric.name)
+      if existing is not None and not replace:
+        return existing
+      self._metrics[metric.name] = metric
+      return metric
+
+  def counter(self, name: str, help: str, label_names: Sequence[str] = ()) -> Counter:
+    return self._register(Counter(name, help, label_names))
+
+  def histogram(
+    self,
+    name: str,
+    help: str,
+    label_names: Sequence[str] = (),
+    buckets: Sequence[float] = SECONDS_BUCKETS
+  ) -> Histogram:
+    return self._register(Histogram(name, help, label_names, buckets))
+
+  # read is called on every scrape, registering a name again replaces it
+  def gauge(
+    self,
+    name: str,
+    help: str,
+    read: Callable[[], float],
+    aggregate: str = "sum"
+  ) -> Gauge:
+    return self._register(Gauge(name, help, read, aggregate), replace = True)
+
+  def _sorted_metrics(self) -> List[_Metric]:
+    with self._lock:
+      return sorted(self._metrics.values(), key = lambda metric: metric.name)
+
+  def snapshot(self) -> Dict[str, list]:
+    return { metric.name : metric.snapshot() for metric in self._sorted_metrics() }
+
+  # Several worker processes (uvicorn --workers) scraped as one: every
+  # process writes a snapshot of its values to directory every
+  # flush_seconds, and render() adds up the snapshots of all the workers
+  # of the same server, its own read live. Counters and histograms of
+  # workers that exited are kept so totals never go backwards; gauges
+  # only come from running workers. Snapshots of a previous server run
+  # are deleted on start. Blocking file I/O, call render() in a thread.
+  def enable_multiprocess(self, directory: str | Path, flush_seconds: float) -> None:
+    directory = Path(directory)
+    directory.mkdir(parents = True, exist_ok = True)
+    # workers of one server share their parent, the uvicorn supervisor
+    server = os.getppid()
+    for path in directory.iterdir():
+      try:
+        parent, pid, _ = path.stem.split("-", 2)
+        stale = int(parent) != server and not _is_alive(int(pid))
+      except ValueError:
+        continue
+      if stale:
+        path.unlink(missing_ok = True)
+
+    self._multiprocess_dir = directory
+    # start time in the name, a recycled pid does not overwrite an exited
+    # worker's totals
+    self._snapshot_path = directory / f"{server}-{os.getpid()}-{time.time_ns()}.json"
+    self.write_snapshot()
+
+    self._stop_flushing.clear()
+    def flush() -> None:
+      while not self._stop_flushing.wait(flush_seconds):
+        self.write_snapshot()
+    self._flusher = threading.Thread(target = flush, name = "metrics-flush", daemon = True)
+    self._flusher.start()
+
+  # Last snapshot written, the process keeps counting towards the totals
+  # after it exits
+  def disable_multiprocess(self) -> None:
+    if self._flusher is None:
+      return
+    self._stop_flushing.set()
+    self._flusher.join()
+    self._flusher = None
+    self.write_snapshot()
+    self._multiprocess_dir = self._snapshot_path = None
+
+  def write_snapshot(self, snapshot: Dict[str, list] | None = None) -> None:
+    path = self._snapshot_path
+    if path is None:
+      return
+    if snapshot is None:
+      snapshot = self.snapshot()
+    temp_path = path.with_suffix(".tmp")
+    # readers only ever see a whole snapshot
+    with self._write_lock:
+      temp_path.write_text(json.dumps(snapshot))
+      os.replace(temp_path, path)
+
+  # Snapshots of the other workers of this server: (pid, snapshot)
+  def _worker_snapshots(self) -> List[Tuple[int, Dict[str, list]]]:
+    server = os.getppid()
+    snapshots = []
+    for path in self._multiprocess_dir.glob(f"{server}-*.json"):
+      if path == self._snapshot_path:
+        continue
+      try:
+        snapshots.append((int(path.stem.split("-")[1]), json.loads(path.read_text())))
+      except (FileNotFoundError, ValueError):
+        # being replaced
+        continue
+    return snapshots
+
+  def render(self) -> str:
+    metrics = self._sorted_metrics()
+    snapshot = { metric.name : metric.snapshot() for metric in metrics }
+
+    if self._multiprocess_dir is not None:
+      self.write_snapshot(snapshot)
+      workers = self._worker_snapshots()
+      for metric in metrics:
+        snapshot[metric.name] = metric.merge([snapshot[metric.name]] + [
+          values.get(metric.name, [])
+          for pid, values in workers
+          if not isinstance(metric, Gauge) or _is_alive(pid)
+        ])
+
+    lines = []
+    for metric in metrics:
+      lines += metric.header()
+      lines += metric.lines(snapshot[metric.name])
+    return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+PIPELINE_STAGE_SECONDS = REGISTRY.histogram(
+  "tax_pipeline_stage_seconds",
+  "Time spent in each stage of the submit pipeline",
+  label_names = ("stage",)
+)
+PIPELINE_STAGE_FAILURES = REGISTRY.counter(
+  "tax_pipeline_stage_failures_total",
+  "Pipeline stages that raised, by stage and exception type",
+  label_names = ("stage", "error")
+)
+DOCUMENTS_EXTRACTED = REGISTRY.counter(
+  "tax_documents_extracted_total",
+  "Uploaded documents by extraction path: acroform, cache or llm",
+  label_names = ("path",)
+)
+EXTRACTION_CACHE_LOOKUPS = REGISTRY.counter(
+  "tax_extraction_cache_lookups_total",
+  "Extraction cache lookups by result: hit or miss",
+  label_names = ("result",)
+)
+EXTRACTION_CACHE_EVICTIONS = REGISTRY.counter(
+  "tax_extraction_cache_evictions_total",
+  "Extraction cache entries dropped for their age or the size limit"
+)
+PAGES_RENDERED = REGISTRY.counter(
+  "tax_pages_rendered_total",
+  "Pages rasterized for the LLM, by detected form type",
+  label_names = ("form_type",)
+)
+LLM_PAYLOAD_BYTES = REGISTRY.histogram(
+  "tax_llm_payload_bytes",
+  "Base64 image payload of one LLM request",
+  buckets = BYTES_BUCKETS
+)
+LLM_TOKENS = REGISTRY.counter(
+  "tax_llm_tokens_total",
+  "Tokens used by LLM requests, as reported by the API"
+)
+LLM_EVENTS = REGISTRY.counter(
+  "tax_llm_events_total",
+  "LLM gateway calls, retries, rate limited requests and failed calls",
+  label_names = ("event",)
+)
+SUBMISSIONS = REGISTRY.counter(
+  "tax_submissions_total",
+  "Submissions by endpoint and outcome",
+  label_names = ("endpoint", "outcome")
+)
+SUBMISSIONS_COALESCED = REGISTRY.counter(
+  "tax_submissions_coalesced_total",
+  "Submissions answered from an identical submission already in flight"
+)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+  "http_request_duration_seconds",
+  "HTTP request duration until the response has been sent",
+  label_names = ("method", "route", "status")
+)
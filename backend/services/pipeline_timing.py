@@ -0,0 +1,73 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator
+import threading
+import time
+
+from services.metrics import PIPELINE_STAGE_FAILURES, PIPELINE_STAGE_SECONDS
+from services.tracing import span
+
+# Wall time spent in each stage of the submit pipeline (queue, acroform,
+# rasterize, encode, llm, calculate, fill, save). Every stage is observed
+# in the tax_pipeline_stage_seconds histogram, traced as a span when
+# tracing is on, and added to the StageTimings of the current context
+# when one is set with record_stages() (benchmarks). Documents extracted
+# concurrently each add their own time, so the stages of a return can add
+# up to more than its latency.
+class StageTimings:
+  def __init__(self):
+    self.seconds : Dict[str, float] = defaultdict(float)
+    self.calls : Dict[str, int] = defaultdict(int)
+    self._lock = threading.Lock()
+
+  def add(self, name: str, seconds: float) -> None:
+    with self._lock:
+      self.seconds[name] += seconds
+      self.calls[name] += 1
+
+  def merge(self, other: "StageTimings") -> None:
+    with other._lock:
+      items = [(name, other.seconds[name], other.calls[name]) for name in other.seconds]
+    with self._lock:
+      for name, seconds, calls in items:
+        self.seconds[name] += seconds
+        self.calls[name] += calls
+
+  def as_dict(self) -> Dict[str, dict]:
+    with self._lock:
+      return {
+        name : { "seconds" : self.seconds[name], "calls" : self.calls[name] }
+        for name in self.seconds
+      }
+
+_current : ContextVar[StageTimings | None] = ContextVar(
+  "stage_timings", default = None
+)
+
+# Records the stages run in this context, and in the worker threads the
+# pipeline hands work to (they run in a copy of it)
+@contextmanager
+def record_stages(timings: StageTimings | None = None) -> Iterator[StageTimings]:
+  timings = StageTimings() if timings is None else timings
+  token = _current.set(timings)
+  try:
+    yield timings
+  finally:
+    _current.reset(token)
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+  start = time.perf_counter()
+  try:
+    with span(f"pipeline.{name}"):
+      yield
+  except BaseException as e:
+    PIPELINE_STAGE_FAILURES.inc(stage = name, error = type(e).__name__)
+    raise
+  finally:
+    elapsed = time.perf_counter() - start
+    PIPELINE_STAGE_SECONDS.observe(elapsed, stage = name)
+    timings = _current.get()
+    if timings is not None:
+      timings.add(name, elapsed)
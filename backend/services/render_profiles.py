@@ -0,0 +1,75 @@
+from pydantic import BaseModel, Field
+from typing import Literal
+import pymupdf
+
+class RenderProfile(BaseModel):
+  dpi: int = Field(gt = 0)
+  grayscale: bool = False
+  jpeg_quality: int = Field(default = 95, ge = 1, le = 100)
+  # clip the page to the area that actually has text, drawings or widgets
+  crop_to_content: bool = False
+  detail: Literal["low", "high", "auto"] = "high"
+
+  model_config = { "frozen": True }
+
+# What FormExtractor always used before adaptive rendering, and what a
+# retry falls back to when the cheaper rendering did not parse
+FULL_FIDELITY_PROFILE = RenderProfile(dpi = 300, jpeg_quality = 95)
+
+# Per form type. The amount boxes are printed at >= 8pt, which stays legible
+# in grayscale at 150 DPI once the empty lower half of the W-2 / 1099 pages
+# is cropped away. Rerun benchmarks/bench_render_profiles.py (payload size,
+# and field accuracy with --evaluate) over sample_docs/1..20 when tuning.
+ADAPTIVE_PROFILES : dict[str, RenderProfile] = {
+  "W-2" : RenderProfile(
+    dpi = 150, grayscale = True, jpeg_quality = 75, crop_to_content = True
+  ),
+  "1099-NEC" : RenderProfile(
+    dpi = 150, grayscale = True, jpeg_quality = 75, crop_to_content = True
+  ),
+  "1099-INT" : RenderProfile(
+    dpi = 150, grayscale = True, jpeg_quality = 75, crop_to_content = True
+  ),
+}
+
+# Scanned documents or forms without a recognizable text layer
+DEFAULT_ADAPTIVE_PROFILE = RenderProfile(
+  dpi = 200, grayscale = True, jpeg_quality = 80
+)
+
+# Printed title of each supported form, as found in its text layer
+FORM_TITLES = {
+  "W-2" : "Form W-2",
+  "1099-NEC" : "Form 1099-NEC",
+  "1099-INT" : "Form 1099-INT",
+}
+
+def detect_form_type(doc: pymupdf.Document) -> str | None:
+  text = "".join(page.get_text() for page in doc)
+  for form_type, title in FORM_TITLES.items():
+    if title in text:
+      return form_type
+  return None
+
+def select_render_profile(form_type: str | None) -> RenderProfile:
+  return ADAPTIVE_PROFILES.get(form_type, DEFAULT_ADAPTIVE_PROFILE)
+
+def _content_rect(page: pymupdf.Page, margin: float = 12) -> pymupdf.Rect:
+  rect = pymupdf.Rect()
+  for _, bbox in page.get_bboxlog():
+    rect |= pymupdf.Rect(bbox)
+  for widget in page.widgets():
+    rect |= widget.rect
+
+  if rect.is_empty:
+    return page.rect
+
+  return (rect + (-margin, -margin, margin, margin)) & page.rect
+
+def render_page(page: pymupdf.Page, profile: RenderProfile) -> bytes:
+  pix = page.get_pixmap(
+    dpi = profile.dpi,
+    colorspace = pymupdf.csGRAY if profile.grayscale else pymupdf.csRGB,
+    clip = _content_rect(page) if profile.crop_to_content else None
+  )
+  return pix.tobytes("jpg", jpg_quality = profile.jpeg_quality)
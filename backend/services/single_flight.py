@@ -0,0 +1,42 @@
+from typing import Awaitable, Callable, Dict, Generic, Hashable, TypeVar
+import asyncio
+
+T = TypeVar("T")
+
+# Concurrent calls with the same key share one execution: the first caller
+# starts it, callers arriving while it runs wait for the same result (or
+# exception). The work runs in its own task, so a caller that goes away
+# (e.g. the client disconnected) does not cancel it for the others.
+# Nothing is kept once the call completes, a later call with the same key
+# runs again. Per process and event loop.
+class SingleFlight(Generic[T]):
+  def __init__(self):
+    self._calls : Dict[Hashable, asyncio.Task] = {}
+
+  def in_flight(self) -> int:
+    return len(self._calls)
+
+  def running(self, key: Hashable) -> bool:
+    return key in self._calls
+
+  # (result, shared), shared is False for the caller whose call did the work
+  async def run(
+    self,
+    key: Hashable,
+    fn: Callable[[], Awaitable[T]]
+  ) -> tuple[T, bool]:
+    task = self._calls.get(key)
+    shared = task is not None
+    if task is None:
+      task = asyncio.ensure_future(fn())
+      self._calls[key] = task
+      task.add_done_callback(lambda done: self._done(key, done))
+
+    return await asyncio.shield(task), shared
+
+  def _done(self, key: Hashable, task: asyncio.Task) -> None:
+    if self._calls.get(key) is task:
+      del self._calls[key]
+    # retrieved here too, in case every caller was cancelled meanwhile
+    if not task.cancelled():
+      task.exception()
@@ -1,32 +1,25 @@
 from decimal import Decimal
-from typing import List
-import os
-import sys
+from typing import Sequence
 
-CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
-MODELS_DIR = os.path.abspath(os.path.join(CURRENT_DIR, "..", "models"))
-
-if MODELS_DIR not in sys.path:
-    sys.path.insert(0, MODELS_DIR)
-
-from tax_schema import TaxReturnSummary, TaxBracket, TaxFormData
+from models.tax_schema import TaxReturnSummary, TaxBracket, TaxFormData
+from tax_policy.bracket_schedule import BracketSchedule
 
 class TaxCalculator:
-  def __init__(self, brackets: List[TaxBracket], standard_deduction: Decimal):
-    self.brackets = sorted(brackets, key = lambda b: b.lower_limit)
+  # brackets: a compiled schedule (shared, e.g. from
+  # get_bracket_schedule) or plain brackets compiled for this calculator
+  def __init__(
+    self,
+    brackets: BracketSchedule | Sequence[TaxBracket],
+    standard_deduction: Decimal
+  ):
+    self.schedule = (
+      brackets if isinstance(brackets, BracketSchedule)
+      else BracketSchedule(brackets)
+    )
     self.standard_deduction = standard_deduction
 
   def calculate_tax(self, taxable_income: Decimal) -> Decimal:
-    tax = Decimal("0")
-    for bracket in self.brackets:
-      if taxable_income <= bracket.lower_limit:
-        break
-
-      upper = bracket.upper_limit or taxable_income
-      amount_in_bracket = min(taxable_income, upper) - bracket.lower_limit
-      if amount_in_bracket > 0:
-        tax += amount_in_bracket * bracket.rate
-    return tax.quantize(Decimal("0.01"))
+    return self.schedule.tax(taxable_income)
 
   def summarize(self, data: TaxFormData) -> TaxReturnSummary:
     total_income = (
@@ -0,0 +1,78 @@
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+# Optional OpenTelemetry tracing. Off (and the opentelemetry packages never
+# imported) until configure_tracing() is called with an exporter:
+#   "otlp"    : OTLP over HTTP, endpoint and headers from the standard
+#               OTEL_EXPORTER_OTLP_* variables, requires opentelemetry-sdk
+#               and opentelemetry-exporter-otlp-proto-http
+#   "console" : spans printed to stdout, requires opentelemetry-sdk
+# Spans follow the context, so the stages a request runs in worker threads
+# (the engine and the extractor copy it) end up in the request's trace.
+
+_tracer : Any = None
+_provider : Any = None
+
+def configure_tracing(exporter: str, service_name: str) -> None:
+  global _tracer, _provider
+
+  if exporter == "none":
+    return
+
+  try:
+    from opentelemetry import trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import (
+      BatchSpanProcessor,
+      ConsoleSpanExporter
+    )
+  except ImportError as e:
+    raise RuntimeError(
+      "Tracing requires opentelemetry-sdk (pip install opentelemetry-sdk)"
+    ) from e
+
+  if exporter == "otlp":
+    try:
+      from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+        OTLPSpanExporter
+      )
+    except ImportError as e:
+      raise RuntimeError(
+        "OTLP tracing requires opentelemetry-exporter-otlp-proto-http"
+      ) from e
+    span_exporter = OTLPSpanExporter()
+  elif exporter == "console":
+    span_exporter = ConsoleSpanExporter()
+  else:
+    raise ValueError(f"Unknown tracing exporter: {exporter}")
+
+  _provider = TracerProvider(
+    resource = Resource.create({ "service.name" : service_name })
+  )
+  # spans are exported from a background thread, in batches
+  _provider.add_span_processor(BatchSpanProcessor(span_exporter))
+  trace.set_tracer_provider(_provider)
+  _tracer = trace.get_tracer("ai-tax-return")
+
+# Flushes the spans still queued for export
+def shutdown_tracing() -> None:
+  global _tracer, _provider
+  if _provider is not None:
+    _provider.shutdown()
+  _tracer = None
+  _provider = None
+
+def tracing_enabled() -> bool:
+  return _tracer is not None
+
+# Current span for the block, None when tracing is off. Exceptions leaving
+# the block are recorded on the span.
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Any]:
+  if _tracer is None:
+    yield None
+    return
+
+  with _tracer.start_as_current_span(name, attributes = attributes) as current:
+    yield current
@@ -0,0 +1,285 @@
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import AsyncIterator, Callable, Dict, IO, List
+from pydantic import BaseModel
+from python_multipart.multipart import MultipartParser, parse_options_header
+import asyncio
+import hashlib
+import pymupdf
+import re
+
+# Reads multipart/form-data straight off the request stream: file parts go
+# chunk by chunk into temporary files, nothing holds a whole upload in
+# memory, and limits / file type checks abort the request as soon as they
+# fail instead of after everything was received.
+
+class UploadRejected(Exception):
+  def __init__(self, status_code: int, message: str):
+    super().__init__(message)
+    self.status_code = status_code
+    self.message = message
+
+class UploadLimits(BaseModel):
+  max_file_bytes: int
+  max_request_bytes: int
+  max_files: int
+  max_field_bytes: int = 64 * 1024
+  max_fields: int = 32
+
+class SpooledUpload(BaseModel):
+  field_name: str
+  filename: str
+  path: Path
+  size: int
+  # of the file contents, computed as they arrive
+  sha256: str = ""
+  # from the first bytes of the file when it tells, e.g. linearized PDFs
+  page_count: int | None = None
+
+# Bytes of a file handed to the sniffer before the first write is accepted
+SNIFF_BYTES = 1024
+
+_PDF_MAGIC = b"%PDF-"
+_LINEARIZED_PAGES = re.compile(rb"/Linearized\b.{0,512}?/N\s+(\d+)", re.S)
+
+# The PDF header may be preceded by up to 1 KB of junk. Linearized PDFs
+# (most scanner / "fast web view" output) declare their page count in the
+# first object, so it is known before the rest of the file arrives.
+def sniff_pdf(head: bytes) -> int | None:
+  if _PDF_MAGIC not in head[:SNIFF_BYTES]:
+    raise UploadRejected(400, "Only PDF files are accepted.")
+
+  match = _LINEARIZED_PAGES.search(head)
+  return int(match.group(1)) if match else None
+
+def sniff_zip(head: bytes) -> int | None:
+  if not head.startswith(b"PK\x03\x04"):
+    raise UploadRejected(400, "The batch archive must be a zip file.")
+  return None
+
+class _Part:
+  def __init__(self):
+    self.headers : Dict[bytes, bytes] = {}
+    self.header_field = b""
+    self.header_value = b""
+    self.name = ""
+    self.filename : str | None = None
+    self.data = bytearray()
+    self.file : IO[bytes] | None = None
+    self.upload : SpooledUpload | None = None
+    self.head = bytearray()
+    self.sniffed = False
+    self.digest = hashlib.sha256()
+
+class _MultipartIngestion:
+  def __init__(
+    self,
+    boundary: bytes,
+    limits: UploadLimits,
+    file_field: str,
+    suffix: str,
+    sniff: Callable[[bytes], int | None],
+    max_pages: int | None
+  ):
+    self.limits = limits
+    self.file_field = file_field
+    self.suffix = suffix
+    self.sniff = sniff
+    self.max_pages = max_pages
+    self.fields : Dict[str, str] = {}
+    self.uploads : List[SpooledUpload] = []
+    self.part = _Part()
+    self.complete = False
+    self.parser = MultipartParser(boundary, callbacks = {
+      "on_part_begin" : self._on_part_begin,
+      "on_header_field" : self._on_header_field,
+      "on_header_value" : self._on_header_value,
+      "on_header_end" : self._on_header_end,
+      "on_headers_finished" : self._on_headers_finished,
+      "on_part_data" : self._on_part_data,
+      "on_part_end" : self._on_part_end,
+      "on_end" : self._on_end,
+    })
+
+  def _on_part_begin(self) -> None:
+    self.part = _Part()
+
+  def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+    self.part.header_field += data[start:end]
+
+  def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+    self.part.header_value += data[start:end]
+
+  def _on_header_end(self) -> None:
+    part = self.part
+    part.headers[part.header_field.lower()] = part.header_value
+    part.header_field = b""
+    part.header_value = b""
+
+  def _on_headers_finished(self) -> None:
+    part = self.part
+    _, options = parse_options_header(part.headers.get(b"content-disposition", b""))
+    part.name = options.get(b"name", b"").decode("utf-8", "replace")
+    filename = options.get(b"filename")
+
+    if filename is None:
+      if len(self.fields) >= self.limits.max_fields:
+        raise UploadRejected(413, "Too many form fields.")
+      return
+
+    if part.name != self.file_field:
+      raise UploadRejected(400, f"Unexpected file field {part.name}.")
+    if len(self.uploads) >= self.limits.max_files:
+      raise UploadRejected(
+        400, f"At most {self.limits.max_files} files can be uploaded."
+      )
+
+    part.filename = Path(filename.decode("utf-8", "replace")).name
+    part.file = NamedTemporaryFile(suffix = self.suffix, delete = False)
+    part.upload = SpooledUpload(
+      field_name = part.name,
+      filename = part.filename,
+      path = Path(part.file.name),
+      size = 0
+    )
+    # registered right away so it is cleaned up if the request is rejected
+    self.uploads.append(part.upload)
+
+  def _sniff(self, part: _Part) -> None:
+    part.sniffed = True
+    try:
+      part.upload.page_count = self.sniff(bytes(part.head))
+    except UploadRejected as e:
+      raise UploadRejected(
+        e.status_code, f"Invalid file type: {part.filename}. {e.message}"
+      )
+    if (
+      self.max_pages is not None and
+      part.upload.page_count is not None and
+      part.upload.page_count > self.max_pages
+    ):
+      raise UploadRejected(
+        413, f"{part.filename} has more than {self.max_pages} pages."
+      )
+    part.file.write(part.head)
+    part.head = bytearray()
+
+  def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+    part = self.part
+    chunk = data[start:end]
+
+    if part.file is None:
+      part.data += chunk
+      if len(part.data) > self.limits.max_field_bytes:
+        raise UploadRejected(413, f"Form field {part.name} is too large.")
+      return
+
+    part.upload.size += len(chunk)
+    part.digest.update(chunk)
+    if part.upload.size > self.limits.max_file_bytes:
+      raise UploadRejected(
+        413,
+        f"{part.filename} is larger than {self.limits.max_file_bytes} bytes."
+      )
+
+    if part.sniffed:
+      part.file.write(chunk)
+      return
+
+    part.head += chunk
+    if len(part.head) >= SNIFF_BYTES:
+      self._sniff(part)
+
+  def _on_part_end(self) -> None:
+    part = self.part
+    if part.file is None:
+      self.fields[part.name] = part.data.decode("utf-8", "replace")
+      return
+
+    if not part.sniffed:
+      self._sniff(part)
+    part.file.close()
+    part.upload.sha256 = part.digest.hexdigest()
+
+  def _on_end(self) -> None:
+    self.complete = True
+
+  # earlier files were closed at the end of their part
+  def close_files(self) -> None:
+    if self.part.file is not None and not self.part.file.closed:
+      self.part.file.close()
+
+  def discard(self) -> None:
+    self.close_files()
+    for upload in self.uploads:
+      upload.path.unlink(missing_ok = True)
+
+# Parses a multipart/form-data body from its chunks. Only file_field may
+# carry files, each one checked by sniff on its first SNIFF_BYTES and
+# spooled to a temporary file ending in suffix.
+# Returns the text fields and the spooled files; the caller deletes the
+# files. Raises UploadRejected (nothing left on disk) on the first limit
+# or check that fails, without reading the rest of the body.
+async def ingest_multipart(
+  chunks: AsyncIterator[bytes],
+  content_type: str | None,
+  content_length: int | None,
+  limits: UploadLimits,
+  file_field: str,
+  suffix: str,
+  sniff: Callable[[bytes], int | None],
+  max_pages: int | None = None
+) -> tuple[Dict[str, str], List[SpooledUpload]]:
+  media_type, options = parse_options_header(content_type or "")
+  boundary = options.get(b"boundary")
+  if media_type != b"multipart/form-data" or not boundary:
+    raise UploadRejected(400, "Expected a multipart/form-data request.")
+
+  if content_length is not None and content_length > limits.max_request_bytes:
+    raise UploadRejected(413, "The upload is too large.")
+
+  ingestion = _MultipartIngestion(
+    boundary, limits, file_field, suffix, sniff, max_pages
+  )
+  received = 0
+  ingested = False
+  try:
+    async for chunk in chunks:
+      received += len(chunk)
+      if received > limits.max_request_bytes:
+        raise UploadRejected(413, "The upload is too large.")
+      # parts are written to their files as they are parsed
+      await asyncio.to_thread(ingestion.parser.write, chunk)
+    if not ingestion.complete:
+      # the body ended before the closing boundary
+      raise UploadRejected(400, "The upload is incomplete.")
+    ingested = True
+  except UploadRejected:
+    raise
+  except Exception as e:
+    # malformed body, or the client went away
+    raise UploadRejected(400, "Malformed multipart body.") from e
+  finally:
+    if not ingested:
+      ingestion.discard()
+
+  ingestion.close_files()
+  return ingestion.fields, ingestion.uploads
+
+# Opens the spooled PDFs (blocking, run it in a worker thread) to reject
+# damaged or encrypted files and count the pages of those whose count was
+# not declared up front
+def verify_pdf_uploads(uploads: List[SpooledUpload], max_pages: int) -> None:
+  for upload in uploads:
+    try:
+      with pymupdf.open(upload.path, filetype = "pdf") as doc:
+        if doc.needs_pass:
+          raise UploadRejected(400, f"{upload.filename} is password protected.")
+        upload.page_count = doc.page_count
+    except (pymupdf.FileDataError, RuntimeError):
+      raise UploadRejected(400, f"{upload.filename} is not a readable PDF.")
+
+    if upload.page_count > max_pages:
+      raise UploadRejected(
+        413, f"{upload.filename} has more than {max_pages} pages."
+      )
@@ -0,0 +1,82 @@
+from bisect import bisect_left, bisect_right
+from decimal import Decimal
+from typing import Iterable
+
+from models.tax_schema import TaxBracket
+
+# Compiled, immutable form of a list of tax brackets. Thresholds, rates and
+# the tax owed on all income below each threshold are computed once, so
+# the tax of an income is a bisect plus one multiply.
+class BracketSchedule:
+  __slots__ = (
+    "brackets", "lower_limits", "upper_limits", "rates", "cumulative_tax"
+  )
+
+  def __init__(self, brackets: Iterable[TaxBracket]):
+    brackets = tuple(sorted(brackets, key = lambda b: b.lower_limit))
+    if not brackets:
+      raise ValueError("At least one tax bracket is required")
+
+    cumulative_tax = [Decimal("0")]
+    for bracket in brackets[:-1]:
+      if bracket.upper_limit is None:
+        raise ValueError("Only the top bracket can be open ended")
+      cumulative_tax.append(
+        cumulative_tax[-1] +
+        (bracket.upper_limit - bracket.lower_limit) * bracket.rate
+      )
+
+    object.__setattr__(self, "brackets", brackets)
+    object.__setattr__(
+      self, "lower_limits", tuple(b.lower_limit for b in brackets)
+    )
+    object.__setattr__(
+      self, "upper_limits", tuple(b.upper_limit for b in brackets)
+    )
+    object.__setattr__(self, "rates", tuple(b.rate for b in brackets))
+    object.__setattr__(self, "cumulative_tax", tuple(cumulative_tax))
+
+  def __setattr__(self, name, value):
+    raise AttributeError("BracketSchedule is immutable")
+
+  def __delattr__(self, name):
+    raise AttributeError("BracketSchedule is immutable")
+
+  # Same result as walking the brackets one by one, rounded to the cent
+  def tax(self, taxable_income: Decimal) -> Decimal:
+    # bracket the last dollar falls in: lower_limit < taxable_income
+    index = bisect_left(self.lower_limits, taxable_income) - 1
+    if index < 0:
+      return Decimal("0").quantize(Decimal("0.01"))
+
+    upper = self.upper_limits[index]
+    amount_in_bracket = (
+      (taxable_income if upper is None else min(taxable_income, upper)) -
+      self.lower_limits[index]
+    )
+    tax = self.cumulative_tax[index] + amount_in_bracket * self.rates[index]
+    return tax.quantize(Decimal("0.01"))
+
+  # Rate applied to the next dollar of taxable income
+  def marginal_rate(self, taxable_income: Decimal) -> Decimal:
+    index = bisect_right(self.lower_limits, taxable_income) - 1
+    if index < 0:
+      return Decimal("0")
+    return self.rates[index]
+
+  # Tax as a share of taxable income
+  def effective_rate(self, taxable_income: Decimal) -> Decimal:
+    if taxable_income <= 0:
+      return Decimal("0")
+    return self.tax(taxable_income) / taxable_income
+
+  def __len__(self) -> int:
+    return len(self.brackets)
+
+  def __iter__(self):
+    return iter(self.brackets)
+
+  def __repr__(self) -> str:
+    return (
+      f"BracketSchedule(lower_limits={self.lower_limits}, rates={self.rates})"
+    )
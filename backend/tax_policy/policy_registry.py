@@ -0,0 +1,129 @@
+from decimal import Decimal
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+from pydantic import BaseModel, Field
+import json
+import threading
+import tomllib
+import os
+
+from models.tax_schema import TaxBracket
+from models.user_pii import FilingType
+from tax_policy.bracket_schedule import BracketSchedule
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# One file per tax year, named after it (2024.json, 2025.toml, ...):
+#
+#   tax_year, version, source
+#   filing_statuses:
+#     <FilingType value>:
+#       standard_deduction: "14600"
+#       brackets: [{ rate: "0.10", up_to: "11600" }, ..., { rate, up_to: null }]
+#
+# Brackets are listed in order, each one starting where the previous one
+# ends. Amounts are strings so they are read as exact Decimals.
+POLICY_DATA_DIR = Path(CURRENT_DIR) / "data"
+
+_LOADERS : Dict[str, Callable[[bytes], Any]] = {
+  ".json" : lambda raw: json.loads(raw),
+  ".toml" : lambda raw: tomllib.loads(raw.decode("utf-8")),
+}
+
+class TaxPolicyNotFoundError(KeyError):
+  pass
+
+class TaxPolicy(BaseModel):
+  tax_year: int
+  filing_status: FilingType
+  version: str
+  standard_deduction: Decimal = Field(ge = 0)
+  brackets: Tuple[TaxBracket, ...]
+
+  model_config = { "frozen": True }
+
+def _parse_brackets(rows: List[dict]) -> Tuple[TaxBracket, ...]:
+  brackets = []
+  lower_limit = Decimal("0")
+  for i, row in enumerate(rows):
+    up_to = row.get("up_to")
+    if up_to is None and i != len(rows) - 1:
+      raise ValueError("Only the top bracket can be open ended")
+
+    upper_limit = None if up_to is None else Decimal(str(up_to))
+    brackets.append(TaxBracket(
+      lower_limit = lower_limit,
+      upper_limit = upper_limit,
+      rate = Decimal(str(row["rate"]))
+    ))
+    lower_limit = upper_limit
+  return tuple(brackets)
+
+def _parse_policy_file(path: Path) -> Dict[FilingType, TaxPolicy]:
+  data = _LOADERS[path.suffix](path.read_bytes())
+  tax_year = int(data["tax_year"])
+  if str(tax_year) != path.stem:
+    raise ValueError(f"{path.name} contains the {tax_year} tax year")
+
+  return {
+    FilingType(status) : TaxPolicy(
+      tax_year = tax_year,
+      filing_status = FilingType(status),
+      version = str(data["version"]),
+      standard_deduction = Decimal(str(policy["standard_deduction"])),
+      brackets = _parse_brackets(policy["brackets"])
+    )
+    for status, policy in data["filing_statuses"].items()
+  }
+
+# Tax policies per (tax year, filing status). Only file names are listed
+# up front, a year's file is parsed on first use and kept for the life of
+# the process.
+class TaxPolicyRegistry:
+  def __init__(self, data_dir: str | Path = POLICY_DATA_DIR):
+    self.data_dir = Path(data_dir)
+    self._years : Dict[int, Dict[FilingType, TaxPolicy]] = {}
+    self._lock = threading.Lock()
+
+  def _policy_file(self, tax_year: int) -> Path | None:
+    for suffix in _LOADERS:
+      path = self.data_dir / f"{tax_year}{suffix}"
+      if path.exists():
+        return path
+    return None
+
+  def available_years(self) -> List[int]:
+    return sorted(
+      int(path.stem) for path in self.data_dir.iterdir()
+      if path.suffix in _LOADERS and path.stem.isdigit()
+    )
+
+  def _load_year(self, tax_year: int) -> Dict[FilingType, TaxPolicy]:
+    with self._lock:
+      policies = self._years.get(tax_year)
+      if policies is None:
+        path = self._policy_file(tax_year)
+        if path is None:
+          raise TaxPolicyNotFoundError(f"No tax policy for {tax_year}")
+        policies = _parse_policy_file(path)
+        self._years[tax_year] = policies
+      return policies
+
+  def get(self, tax_year: int, filing_status: FilingType) -> TaxPolicy:
+    policy = self._load_year(tax_year).get(filing_status)
+    if policy is None:
+      raise TaxPolicyNotFoundError(
+        f"No {filing_status.value} tax policy for {tax_year}"
+      )
+    return policy
+
+_registry = TaxPolicyRegistry()
+
+def get_tax_policy(tax_year: int, filing_status: FilingType) -> TaxPolicy:
+  return _registry.get(tax_year, filing_status)
+
+# Compiled once per (tax year, filing status) and shared process-wide
+@lru_cache(maxsize = None)
+def get_bracket_schedule(tax_year: int, filing_status: FilingType) -> BracketSchedule:
+  return BracketSchedule(get_tax_policy(tax_year, filing_status).brackets)
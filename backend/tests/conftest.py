@@ -0,0 +1,15 @@
+import os
+import sys
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if BACKEND_DIR not in sys.path:
+  sys.path.insert(0, BACKEND_DIR)
+
+# core.config is read on import: a single worker with per-process stores,
+# and an OpenAI client that is built but never called
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["WEB_CONCURRENCY"] = "1"
+os.environ["DOCUMENT_STORE_BACKEND"] = "memory"
+os.environ["JOB_STORE_BACKEND"] = "memory"
+os.environ["EXTRACTION_CACHE_BACKEND"] = "none"
+os.environ["TRACING_EXPORTER"] = "none"
@@ -0,0 +1,170 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+import hashlib
+import time
+
+# In-process stand-ins for the Redis and S3 clients the shared stores are
+# given through client=. Only the calls the stores make are implemented,
+# with the server's semantics (bytes values, TTLs on time.time()).
+
+def _bytes(value) -> bytes:
+  if isinstance(value, bytes):
+    return value
+  return str(value).encode()
+
+class _FakePipeline:
+  def __init__(self, client: "FakeRedis"):
+    self._client = client
+    self._calls = []
+
+  def __getattr__(self, name: str):
+    def call(*args, **kwargs):
+      self._calls.append((name, args, kwargs))
+      return self
+    return call
+
+  def execute(self) -> list:
+    calls, self._calls = self._calls, []
+    return [getattr(self._client, name)(*args, **kwargs) for name, args, kwargs in calls]
+
+class FakeRedis:
+  def __init__(self):
+    self.values : dict[str, bytes] = {}
+    self.sets : dict[str, set[bytes]] = {}
+    # key -> time.time() it expires at
+    self.expires : dict[str, float] = {}
+
+  def _live(self, key: str) -> bool:
+    expires_at = self.expires.get(key)
+    if expires_at is not None and expires_at <= time.time():
+      self.values.pop(key, None)
+      self.expires.pop(key, None)
+    return key in self.values or key in self.sets
+
+  def ttl(self, key: str) -> float | None:
+    return self.expires[key] - time.time() if key in self.expires else None
+
+  def ping(self) -> bool:
+    return True
+
+  def pipeline(self) -> _FakePipeline:
+    return _FakePipeline(self)
+
+  def set(self, key: str, value, ex: float | None = None, xx: bool = False):
+    if xx and not self._live(key):
+      return None
+    self.values[key] = _bytes(value)
+    if ex is None:
+      self.expires.pop(key, None)
+    else:
+      self.expires[key] = time.time() + ex
+    return True
+
+  def get(self, key: str) -> bytes | None:
+    return self.values[key] if self._live(key) else None
+
+  def getrange(self, key: str, start: int, end: int) -> bytes:
+    value = self.get(key)
+    return b"" if value is None else value[start : end + 1]
+
+  def exists(self, *keys: str) -> int:
+    return sum(1 for key in keys if self._live(key))
+
+  def delete(self, *keys: str) -> int:
+    deleted = 0
+    for key in keys:
+      if self._live(key):
+        deleted += 1
+      self.values.pop(key, None)
+      self.sets.pop(key, None)
+      self.expires.pop(key, None)
+    return deleted
+
+  def sadd(self, key: str, *members) -> int:
+    members = { _bytes(member) for member in members }
+    current = self.sets.setdefault(key, set())
+    added = len(members - current)
+    current |= members
+    return added
+
+  def srem(self, key: str, *members) -> int:
+    current = self.sets.get(key, set())
+    members = { _bytes(member) for member in members }
+    removed = len(current & members)
+    current -= members
+    if not current:
+      self.sets.pop(key, None)
+    return removed
+
+  def scard(self, key: str) -> int:
+    return len(self.sets.get(key, ()))
+
+  def smembers(self, key: str) -> "set[bytes]":
+    return set(self.sets.get(key, ()))
+
+class FakeS3Error(Exception):
+  def __init__(self, code: str):
+    super().__init__(code)
+    self.response = { "Error" : { "Code" : code } }
+
+class FakeNoSuchKey(FakeS3Error):
+  pass
+
+class _FakeBody:
+  def __init__(self, data: bytes):
+    self._data = data
+
+  def iter_chunks(self, chunk_size: int):
+    for offset in range(0, len(self._data), chunk_size):
+      yield self._data[offset : offset + chunk_size]
+
+class FakeS3:
+  exceptions = SimpleNamespace(ClientError = FakeS3Error, NoSuchKey = FakeNoSuchKey)
+
+  def __init__(self, page_size: int = 2):
+    # (bucket, key) -> (body, last modified)
+    self.objects : dict[tuple[str, str], tuple[bytes, datetime]] = {}
+    self.page_size = page_size
+
+  def put_object(self, Bucket: str, Key: str, Body: bytes, **kwargs) -> dict:
+    self.objects[(Bucket, Key)] = (
+      Body, datetime.fromtimestamp(time.time(), timezone.utc)
+    )
+    return {}
+
+  def head_object(self, Bucket: str, Key: str) -> dict:
+    if (Bucket, Key) not in self.objects:
+      raise FakeS3Error("404")
+    body, last_modified = self.objects[(Bucket, Key)]
+    return {
+      "ContentLength" : len(body),
+      "ETag" : f'"{hashlib.md5(body).hexdigest()}"',
+      "LastModified" : last_modified
+    }
+
+  # Like S3, a range past the end of the object is cut to the object
+  def get_object(self, Bucket: str, Key: str, Range: str | None = None) -> dict:
+    if (Bucket, Key) not in self.objects:
+      raise FakeNoSuchKey("NoSuchKey")
+    body = self.objects[(Bucket, Key)][0]
+    if Range is not None:
+      start, _, end = Range.removeprefix("bytes=").partition("-")
+      body = body[int(start) : int(end) + 1]
+    return { "Body" : _FakeBody(body) }
+
+  def delete_object(self, Bucket: str, Key: str) -> dict:
+    self.objects.pop((Bucket, Key), None)
+    return {}
+
+  def get_paginator(self, operation: str) -> "FakeS3":
+    assert operation == "list_objects_v2"
+    return self
+
+  def paginate(self, Bucket: str, Prefix: str = ""):
+    contents = [
+      { "Key" : key, "LastModified" : last_modified }
+      for (bucket, key), (_, last_modified) in sorted(self.objects.items())
+      if bucket == Bucket and key.startswith(Prefix)
+    ]
+    for offset in range(0, len(contents), self.page_size):
+      yield { "Contents" : contents[offset : offset + self.page_size] }
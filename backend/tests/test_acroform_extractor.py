@@ -0,0 +1,78 @@
+from decimal import Decimal
+from pathlib import Path
+import pymupdf
+import pytest
+
+from services.acroform_extractor import extract_acroform
+
+SAMPLE_DOCS = Path(__file__).resolve().parent / "../sample_docs"
+
+FORM_NAMES = { "w2" : "W-2", "nec" : "1099-NEC", "int" : "1099-INT" }
+
+def _widget(pdf_path: Path, name: str) -> str:
+  with pymupdf.open(pdf_path) as doc:
+    for page in doc:
+      for widget in page.widgets():
+        if widget.field_name == name:
+          return widget.field_value
+  raise KeyError(name)
+
+def test_sample_documents_are_read_from_their_widgets():
+  w2 = extract_acroform(str(SAMPLE_DOCS / "1/w2_1.pdf"))
+  assert w2.forms_submitted == ["W-2"]
+  assert w2.w2.wages == Decimal("81484.73")
+  assert w2.w2.federal_income_tax_withheld == Decimal("6670.95")
+
+  nec = extract_acroform(str(SAMPLE_DOCS / "1/nec_1.pdf"))
+  assert nec.forms_submitted == ["1099-NEC"]
+  assert nec.nec_1099.nonemployee_compensation == Decimal("19990.64")
+  assert nec.w2.wages == 0
+
+  interest = extract_acroform(str(SAMPLE_DOCS / "1/int_1.pdf"))
+  assert interest.forms_submitted == ["1099-INT"]
+  assert interest.int_1099.interest_income == Decimal("657.04")
+
+@pytest.mark.parametrize(
+  "pdf_path",
+  sorted(SAMPLE_DOCS.glob("[0-9]*/*.pdf")),
+  ids = lambda path: path.name
+)
+def test_every_sample_document_has_a_layout(pdf_path):
+  data = extract_acroform(str(pdf_path))
+  kind = pdf_path.name.split("_")[0]
+  assert data.forms_submitted == [FORM_NAMES[kind]]
+
+  amount = {
+    "w2" : data.w2.wages,
+    "nec" : data.nec_1099.nonemployee_compensation,
+    "int" : data.int_1099.interest_income
+  }[kind]
+  assert amount == Decimal(_widget(pdf_path, "1"))
+
+# the cue for the LLM fallback
+@pytest.mark.parametrize("template", [
+  "2024 Form W-2.pdf", "Form 1099-NEC.pdf", "Form 1099-INT.pdf", "f1040_2024.pdf"
+])
+def test_blank_or_unknown_forms_are_not_read(template):
+  assert extract_acroform(str(SAMPLE_DOCS / "templates" / template)) is None
+
+def test_flattened_document_is_not_read(tmp_path):
+  with pymupdf.open(SAMPLE_DOCS / "1/w2_1.pdf") as doc:
+    doc.bake()
+    doc.save(tmp_path / "flat.pdf")
+  assert extract_acroform(str(tmp_path / "flat.pdf")) is None
+
+def test_invalid_amount_is_not_read(tmp_path):
+  with pymupdf.open(SAMPLE_DOCS / "1/w2_1.pdf") as doc:
+    for widget in doc[0].widgets():
+      if widget.field_name == "1":
+        widget.field_value = "see attached"
+        widget.update()
+    doc.save(tmp_path / "w2.pdf")
+  assert extract_acroform(str(tmp_path / "w2.pdf")) is None
+
+def test_document_without_widgets_is_not_read(tmp_path):
+  doc = pymupdf.open()
+  doc.new_page().insert_text((72, 72), "Form W-2 Wage and Tax Statement")
+  doc.save(tmp_path / "scan.pdf")
+  assert extract_acroform(str(tmp_path / "scan.pdf")) is None
@@ -0,0 +1,85 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import json
+import pymupdf
+import pytest
+
+from api import app_context as app_context_module
+from api import endpoints
+from api.app_context import create_app_context
+from core import config
+from main import app
+from tax_policy import policy_registry
+from tax_policy.policy_registry import TaxPolicyNotFoundError, TaxPolicyRegistry
+
+# no render processes to spawn at startup
+@pytest.fixture(autouse = True)
+def no_render_workers(monkeypatch):
+  monkeypatch.setattr(config, "SUBMIT_CPU_WORKERS", 0)
+
+def test_health_is_ready_once_started():
+  with TestClient(app) as client:
+    response = client.get("/api/health")
+    assert response.status_code == 200
+    health = response.json()
+    assert health["status"] == "ready"
+    assert set(health["checks"]) == {
+      "form_1040_template",
+      "tax_policies",
+      "llm_client",
+      "extraction_cache",
+      "document_store",
+      "job_store",
+      "render_workers"
+    }
+    assert all(check["status"] == "ok" for check in health["checks"].values())
+    assert health["engine"]["in_flight"] == 0
+    context = app.state.context
+
+  # shutting down
+  assert not context.ready
+  assert client.get("/api/health").status_code == 503
+
+def test_health_is_unavailable_while_starting():
+  app = FastAPI()
+  app.include_router(endpoints.router)
+  response = TestClient(app).get("/api/health")
+  assert response.status_code == 503
+  assert response.json() == { "status" : "unavailable" }
+
+def test_startup_fails_without_the_form_1040_template(monkeypatch, tmp_path):
+  monkeypatch.setattr(app_context_module, "FORM_1040_TEMPLATE_PATH", tmp_path / "f1040.pdf")
+  with pytest.raises(FileNotFoundError):
+    create_app_context()
+
+def test_startup_fails_on_a_template_without_fields(monkeypatch, tmp_path):
+  doc = pymupdf.open()
+  doc.new_page()
+  doc.save(tmp_path / "f1040.pdf")
+  monkeypatch.setattr(app_context_module, "FORM_1040_TEMPLATE_PATH", tmp_path / "f1040.pdf")
+  with pytest.raises(ValueError):
+    create_app_context()
+
+def test_startup_fails_without_the_tax_policy_table(monkeypatch, tmp_path):
+  monkeypatch.setattr(policy_registry, "_registry", TaxPolicyRegistry(tmp_path))
+  with pytest.raises(TaxPolicyNotFoundError):
+    create_app_context()
+
+def test_startup_fails_on_an_incomplete_tax_policy_table(monkeypatch, tmp_path):
+  policy = json.loads((policy_registry.POLICY_DATA_DIR / "2024.json").read_text())
+  del policy["filing_statuses"]["Head of Household"]
+  (tmp_path / "2024.json").write_text(json.dumps(policy))
+  monkeypatch.setattr(policy_registry, "_registry", TaxPolicyRegistry(tmp_path))
+  with pytest.raises(TaxPolicyNotFoundError):
+    create_app_context()
+
+@pytest.mark.parametrize("settings", [
+  { "SUBMIT_PIPELINE" : "fibers" },
+  { "WEB_CONCURRENCY" : 2, "DOCUMENT_STORE_BACKEND" : "memory" },
+  { "WEB_CONCURRENCY" : 2, "DOCUMENT_STORE_BACKEND" : "filesystem", "JOB_STORE_BACKEND" : "memory" },
+])
+def test_startup_fails_on_invalid_settings(monkeypatch, settings):
+  for name, value in settings.items():
+    monkeypatch.setattr(config, name, value)
+  with pytest.raises(ValueError):
+    create_app_context()
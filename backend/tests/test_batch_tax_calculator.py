@@ -0,0 +1,92 @@
+from decimal import Decimal
+import numpy as np
+import pytest
+
+from models.tax_schema import INTData, NECData, TaxBracket, TaxFormData, W2Data
+from models.user_pii import FilingType
+from services.batch_tax_calculator import BatchTaxCalculator, from_cents, to_cents
+from services.tax_calculator import TaxCalculator
+from tax_policy.policy_registry import get_bracket_schedule, get_tax_policy
+
+TAX_YEAR = 2024
+
+def _profiles(schedule, standard_deduction: Decimal) -> list:
+  rng = np.random.default_rng(2024)
+  incomes = [Decimal(int(c)).scaleb(-2) for c in rng.integers(0, 120_000_000, 300)]
+  # right at, one cent below and one cent above every threshold, after the
+  # standard deduction, plus half cent rounding cases
+  for limit in schedule.lower_limits[1:]:
+    for delta in ("-0.01", "0", "0.01", "0.05", "0.50"):
+      incomes.append(limit + standard_deduction + Decimal(delta))
+  incomes += [Decimal("0"), standard_deduction, standard_deduction + Decimal("0.01")]
+
+  withheld = [Decimal(int(c)).scaleb(-2) for c in rng.integers(0, 5_000_000, len(incomes))]
+  profiles = []
+  for income, tax_withheld in zip(incomes, withheld):
+    # split over the three forms in whole cents
+    nec = (income / 4).quantize(Decimal("0.01"))
+    interest = (income / 8).quantize(Decimal("0.01"))
+    profiles.append(TaxFormData(
+      forms_submitted = ["W-2", "1099-NEC", "1099-INT"],
+      w2 = W2Data(wages = income - nec - interest, federal_income_tax_withheld = tax_withheld),
+      nec_1099 = NECData(nonemployee_compensation = nec),
+      int_1099 = INTData(interest_income = interest)
+    ))
+  return profiles
+
+def _total_income(data: TaxFormData) -> Decimal:
+  return (
+    data.w2.wages + data.nec_1099.nonemployee_compensation + data.int_1099.interest_income
+  )
+
+@pytest.mark.parametrize("filing_status", list(FilingType))
+def test_matches_summarize_for_every_filing_status(filing_status):
+  policy = get_tax_policy(TAX_YEAR, filing_status)
+  schedule = get_bracket_schedule(TAX_YEAR, filing_status)
+  calculator = TaxCalculator(brackets = schedule, standard_deduction = policy.standard_deduction)
+  batch = BatchTaxCalculator(brackets = schedule, standard_deduction = policy.standard_deduction)
+
+  profiles = _profiles(schedule, policy.standard_deduction)
+  expected = [calculator.summarize(data) for data in profiles]
+
+  result = batch.summarize_cents(
+    to_cents(_total_income(data) for data in profiles),
+    to_cents(data.w2.federal_income_tax_withheld for data in profiles)
+  )
+  for field in (
+    "total_income", "taxable_income", "total_tax_withheld",
+    "estimated_tax_due", "estimated_refund", "amount_owed"
+  ):
+    assert from_cents(getattr(result, field)) == [
+      getattr(summary, field) for summary in expected
+    ], field
+
+def test_rounds_half_to_even_like_decimal():
+  # 10% of 0.05 is half a cent
+  brackets = [TaxBracket(lower_limit = 0, upper_limit = None, rate = Decimal("0.1"))]
+  calculator = TaxCalculator(brackets = brackets, standard_deduction = Decimal("0"))
+  batch = BatchTaxCalculator(brackets = brackets, standard_deduction = Decimal("0"))
+
+  incomes = [Decimal("0.05"), Decimal("0.15"), Decimal("0.25"), Decimal("1.35")]
+  assert from_cents(batch.calculate_tax_cents(to_cents(incomes))) == [
+    calculator.calculate_tax(income) for income in incomes
+  ]
+
+def test_per_taxpayer_deduction():
+  schedule = get_bracket_schedule(TAX_YEAR, FilingType.single)
+  batch = BatchTaxCalculator(brackets = schedule, standard_deduction = Decimal("14600"))
+  result = batch.summarize_cents(
+    to_cents(["50000", "50000"]),
+    to_cents(["0", "0"]),
+    deduction_cents = to_cents(["14600", "30000"])
+  )
+  assert from_cents(result.taxable_income) == [Decimal("35400.00"), Decimal("20000.00")]
+
+def test_rejects_fractions_of_a_cent_and_huge_incomes():
+  with pytest.raises(ValueError):
+    to_cents(["1.005"])
+
+  schedule = get_bracket_schedule(TAX_YEAR, FilingType.single)
+  batch = BatchTaxCalculator(brackets = schedule, standard_deduction = Decimal("14600"))
+  with pytest.raises(ValueError):
+    batch.calculate_tax_cents(np.array([10 ** 16], dtype = np.int64))
@@ -0,0 +1,209 @@
+from decimal import Decimal
+from types import SimpleNamespace
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import asyncio
+import io
+import json
+import zipfile
+import pymupdf
+import pytest
+
+from api import endpoints
+from api.app_context import get_app_context
+from core import config
+from models.tax_schema import TaxReturnSummary
+from services.execution_engine import EngineSaturatedError, ExecutionEngine
+from services.llm_gateway import LLMUnavailableError
+from services.single_flight import SingleFlight
+
+PII = {
+  "first_name_middle_initial" : "Jane Q",
+  "last_name" : "Public",
+  "ssn" : "123-45-6789",
+  "address" : "1 Main St",
+  "city" : "Springfield",
+  "state" : "IL",
+  "zip_code" : "62701",
+  "filing_status" : "Single",
+}
+
+SUMMARY = TaxReturnSummary(
+  forms_submitted = ["W-2"],
+  total_income = Decimal("50000"),
+  taxable_income = Decimal("35400"),
+  total_tax_withheld = Decimal("5000"),
+  estimated_tax_due = Decimal("4016"),
+  estimated_refund = Decimal("984"),
+  amount_owed = Decimal("0")
+)
+
+def _archive(taxpayers: int = 3, bad: set = frozenset()) -> bytes:
+  buffer = io.BytesIO()
+  with zipfile.ZipFile(buffer, "w") as archive:
+    lines = []
+    for i in range(taxpayers):
+      name = f"{i}/w2.pdf"
+      archive.writestr(name, b"not a pdf" if i in bad else b"%PDF-1.7 " + bytes(i))
+      lines.append(json.dumps({
+        "taxpayer_id" : f"t{i}", "pii" : PII, "documents" : [name]
+      }))
+    archive.writestr("manifest.jsonl", "\n".join(lines))
+  return buffer.getvalue()
+
+@pytest.fixture
+def pipelines(monkeypatch) -> list:
+  calls = []
+
+  def run_pipeline(context, temp_pdf_paths, pii, document_id):
+    assert all(path.read_bytes().startswith(b"%PDF-") for path in temp_pdf_paths)
+    calls.append("threads")
+    return SUMMARY
+
+  async def run_pipeline_async(context, temp_pdf_paths, pii, document_id):
+    assert all(path.read_bytes().startswith(b"%PDF-") for path in temp_pdf_paths)
+    calls.append("async")
+    return SUMMARY
+
+  monkeypatch.setattr(endpoints, "_run_pipeline", run_pipeline)
+  monkeypatch.setattr(endpoints, "_run_pipeline_async", run_pipeline_async)
+  return calls
+
+@pytest.fixture
+def context():
+  engine = ExecutionEngine(max_in_flight = 2, max_queued = 0, io_workers = 2, cpu_workers = 0)
+  yield SimpleNamespace(
+    engine = engine,
+    active_batches = 0,
+    batch_slots = asyncio.Semaphore(2),
+    in_flight_submissions = SingleFlight()
+  )
+  engine.shutdown()
+
+@pytest.fixture
+def client(context) -> TestClient:
+  app = FastAPI()
+  app.include_router(endpoints.router)
+  app.dependency_overrides[get_app_context] = lambda: context
+  return TestClient(app)
+
+def _post(client: TestClient, archive: bytes):
+  return client.post(
+    "/api/batches", files = { "archive" : ("batch.zip", archive, "application/zip") }
+  )
+
+def _results(response) -> dict:
+  return {
+    result["taxpayer_id"] : result
+    for result in map(json.loads, response.text.splitlines())
+  }
+
+@pytest.mark.parametrize("pipeline", ["async", "threads"])
+def test_batch_uses_configured_pipeline(client, context, pipelines, monkeypatch, pipeline):
+  monkeypatch.setattr(config, "SUBMIT_PIPELINE", pipeline)
+  response = _post(client, _archive(bad = {1}))
+
+  assert response.status_code == 200
+  results = _results(response)
+  assert results["t0"]["status"] == "succeeded"
+  assert results["t0"]["tax_return_summary"] == SUMMARY.model_dump(mode = "json")
+  assert results["t1"] == {
+    "taxpayer_id" : "t1", "status" : "failed", "error" : "1/w2.pdf is not a PDF"
+  }
+  assert results["t2"]["status"] == "succeeded"
+  assert pipelines == [pipeline, pipeline]
+  assert context.active_batches == 0
+# The taxpayers of all batches share BATCH_MAX_IN_FLIGHT engine slots,
+# the other engine slots stay free for interactive submissions
+@pytest.mark.parametrize("pipeline", ["async", "threads"])
+def test_batch_taxpayers_hold_at_most_the_batch_slots(
+  client, context, monkeypatch, pipeline
+):
+  monkeypatch.setattr(config, "SUBMIT_PIPELINE", pipeline)
+  monkeypatch.setattr(config, "BATCH_MAX_IN_FLIGHT", 4)
+  context.batch_slots = asyncio.Semaphore(1)
+  engine_in_flight = []
+
+  def run_pipeline(context, temp_pdf_paths, pii, document_id):
+    engine_in_flight.append(context.engine.stats()["in_flight"])
+    return SUMMARY
+
+  async def run_pipeline_async(context, temp_pdf_paths, pii, document_id):
+    engine_in_flight.append(context.engine.stats()["in_flight"])
+    await asyncio.sleep(0.01)
+    return SUMMARY
+
+  monkeypatch.setattr(endpoints, "_run_pipeline", run_pipeline)
+  monkeypatch.setattr(endpoints, "_run_pipeline_async", run_pipeline_async)
+  response = _post(client, _archive(taxpayers = 4))
+
+  assert response.status_code == 200
+  assert all(result["status"] == "succeeded" for result in _results(response).values())
+  assert engine_in_flight == [1, 1, 1, 1]
+
+def test_batch_rejected_while_all_slots_are_taken(client, context, pipelines, monkeypatch):
+  monkeypatch.setattr(config, "BATCH_MAX_CONCURRENT", 1)
+  context.active_batches = 1
+  response = _post(client, _archive())
+  assert response.status_code == 503
+  assert response.headers["retry-after"] == "30"
+  assert response.headers["x-submission-started"] == "false"
+  assert pipelines == []
+
+# Only the 503 of a submission that was never started can be sent again,
+# one that reached the LLM may have been paid for
+@pytest.mark.parametrize("error, retry_after, not_started", [
+  (EngineSaturatedError(), "5", True),
+  (LLMUnavailableError("rate limited"), "30", False),
+])
+def test_submission_503_tells_whether_it_was_started(
+  client, monkeypatch, error, retry_after, not_started
+):
+  def run_pipeline(context, temp_pdf_paths, pii, document_id):
+    raise error
+
+  monkeypatch.setattr(config, "SUBMIT_PIPELINE", "threads")
+  monkeypatch.setattr(endpoints, "_run_pipeline", run_pipeline)
+  document = pymupdf.open()
+  document.new_page()
+  response = client.post(
+    "/api/submit_tax_form",
+    data = PII,
+    files = { "files" : ("w2.pdf", document.tobytes(), "application/pdf") }
+  )
+
+  assert response.status_code == 503
+  assert response.headers["retry-after"] == retry_after
+  assert ("x-submission-started" in response.headers) == not_started
+
+@pytest.mark.parametrize("archive", [
+  b"%PDF-1.7 not a zip",
+  b"PK\x03\x04 truncated",
+  _archive()[:100],
+  _archive(taxpayers = 0),
+])
+def test_rejected_archive_releases_its_slot(client, context, archive):
+  assert _post(client, archive).status_code == 400
+  assert context.active_batches == 0
+
+def test_oversized_archive_releases_its_slot(client, context, monkeypatch):
+  monkeypatch.setattr(
+    endpoints, "BATCH_UPLOAD_LIMITS",
+    endpoints.BATCH_UPLOAD_LIMITS.model_copy(update = { "max_request_bytes" : 1024 })
+  )
+  assert _post(client, _archive(taxpayers = 50)).status_code == 413
+  assert context.active_batches == 0
+
+def test_slot_is_taken_before_ingestion(client, context, pipelines, monkeypatch):
+  ingest_multipart = endpoints.ingest_multipart
+  slots = []
+
+  async def ingest(*args, **kwargs):
+    slots.append(context.active_batches)
+    return await ingest_multipart(*args, **kwargs)
+
+  monkeypatch.setattr(endpoints, "ingest_multipart", ingest)
+  response = _post(client, _archive())
+  assert response.status_code == 200
+  assert slots == [1]
+  assert context.active_batches == 0
@@ -0,0 +1,71 @@
+from decimal import Decimal
+import pytest
+
+from models.tax_schema import TaxBracket
+from tax_policy.bracket_schedule import BracketSchedule
+
+BRACKETS = [
+  TaxBracket(lower_limit = Decimal("0"), upper_limit = Decimal("11600"), rate = Decimal("0.10")),
+  TaxBracket(lower_limit = Decimal("11600"), upper_limit = Decimal("47150"), rate = Decimal("0.12")),
+  TaxBracket(lower_limit = Decimal("47150"), upper_limit = Decimal("100525"), rate = Decimal("0.22")),
+  TaxBracket(lower_limit = Decimal("100525"), upper_limit = None, rate = Decimal("0.24")),
+]
+
+# Bracket by bracket, the definition the schedule has to match
+def _walk(brackets, taxable_income: Decimal) -> Decimal:
+  tax = Decimal("0")
+  for bracket in brackets:
+    if taxable_income <= bracket.lower_limit:
+      break
+    upper = taxable_income if bracket.upper_limit is None else min(taxable_income, bracket.upper_limit)
+    tax += (upper - bracket.lower_limit) * bracket.rate
+  return tax.quantize(Decimal("0.01"))
+
+@pytest.mark.parametrize("taxable_income", [
+  "0", "0.01", "5000", "11599.99", "11600", "11600.01", "47150", "47150.05",
+  "100524.99", "100525", "100525.01", "250000", "1000000000.37",
+])
+def test_tax_matches_walking_the_brackets(taxable_income):
+  schedule = BracketSchedule(BRACKETS)
+  assert schedule.tax(Decimal(taxable_income)) == _walk(BRACKETS, Decimal(taxable_income))
+
+def test_brackets_are_sorted():
+  assert BracketSchedule(reversed(BRACKETS)).brackets == tuple(BRACKETS)
+
+def test_cumulative_tax_at_thresholds():
+  schedule = BracketSchedule(BRACKETS)
+  assert schedule.cumulative_tax == (
+    Decimal("0"), Decimal("1160.00"), Decimal("5426.00"), Decimal("17168.50")
+  )
+
+def test_tax_of_negative_income_is_zero():
+  assert BracketSchedule(BRACKETS).tax(Decimal("-10")) == Decimal("0.00")
+
+@pytest.mark.parametrize("taxable_income, rate", [
+  ("0", "0.10"), ("11599.99", "0.10"), ("11600", "0.12"),
+  ("100525", "0.24"), ("5000000", "0.24"), ("-1", "0"),
+])
+def test_marginal_rate(taxable_income, rate):
+  assert BracketSchedule(BRACKETS).marginal_rate(Decimal(taxable_income)) == Decimal(rate)
+
+def test_effective_rate():
+  schedule = BracketSchedule(BRACKETS)
+  assert schedule.effective_rate(Decimal("0")) == Decimal("0")
+  assert schedule.effective_rate(Decimal("11600")) == Decimal("0.1")
+  assert Decimal("0.10") < schedule.effective_rate(Decimal("47150")) < Decimal("0.12")
+
+def test_is_immutable():
+  schedule = BracketSchedule(BRACKETS)
+  with pytest.raises(AttributeError):
+    schedule.rates = ()
+  with pytest.raises(AttributeError):
+    del schedule.brackets
+
+def test_invalid_brackets():
+  with pytest.raises(ValueError):
+    BracketSchedule([])
+  with pytest.raises(ValueError):
+    BracketSchedule([
+      TaxBracket(lower_limit = Decimal("0"), upper_limit = None, rate = Decimal("0.1")),
+      TaxBracket(lower_limit = Decimal("100"), upper_limit = None, rate = Decimal("0.2")),
+    ])
@@ -0,0 +1,293 @@
+from types import SimpleNamespace
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import os
+import pytest
+import time
+
+from api.app_context import get_app_context
+from api.endpoints import router
+from services import document_store as document_store_module
+from services.document_store import (
+  DocumentTruncatedError,
+  FilesystemDocumentStore,
+  InMemoryDocumentStore,
+  RedisDocumentStore,
+  S3DocumentStore,
+  create_document_store
+)
+from tests.fakes import FakeRedis, FakeS3
+
+DOCUMENT_ID = "0123456789abcdef.pdf"
+# a few chunks and a partial one
+DATA = bytes(range(256)) * 700
+
+class _Clock:
+  def __init__(self):
+    # file mtimes are compared with it
+    self.now = time.time()
+
+  def __call__(self) -> float:
+    return self.now
+
+@pytest.fixture
+def clock(monkeypatch) -> _Clock:
+  clock = _Clock()
+  monkeypatch.setattr(document_store_module.time, "time", clock)
+  return clock
+
+def _store(backend: str, tmp_path):
+  if backend == "memory":
+    return InMemoryDocumentStore(max_bytes = 10 * len(DATA), retention_seconds = 60)
+  if backend == "filesystem":
+    return FilesystemDocumentStore(tmp_path / "documents", retention_seconds = 60)
+  if backend == "s3":
+    return S3DocumentStore("bucket", retention_seconds = 60, client = FakeS3())
+  return RedisDocumentStore(retention_seconds = 60, client = FakeRedis())
+
+@pytest.fixture(params = ["memory", "filesystem", "s3", "redis"])
+def store(request, tmp_path):
+  return _store(request.param, tmp_path)
+
+# the stores shared by workers, read from outside the process
+@pytest.fixture(params = ["filesystem", "s3", "redis"])
+def shared_store(request, tmp_path):
+  return _store(request.param, tmp_path)
+
+def _age(store, clock: _Clock, seconds: float) -> None:
+  # the age of a file is its mtime
+  if isinstance(store, FilesystemDocumentStore):
+    path = store._path(DOCUMENT_ID)
+    mtime = path.stat().st_mtime - seconds
+    os.utime(path, (mtime, mtime))
+  else:
+    clock.now += seconds
+
+def _client(store) -> TestClient:
+  app = FastAPI()
+  app.include_router(router)
+  app.dependency_overrides[get_app_context] = lambda: SimpleNamespace(
+    document_store = store
+  )
+  return TestClient(app)
+
+@pytest.fixture
+def client(store) -> TestClient:
+  return _client(store)
+
+def test_put_stat_read(store):
+  store.put(DOCUMENT_ID, DATA)
+  document = store.stat(DOCUMENT_ID)
+  assert document.size == len(DATA)
+  assert b"".join(store.read(DOCUMENT_ID)) == DATA
+  assert b"".join(store.read(DOCUMENT_ID, 10, 20)) == DATA[10:21]
+
+def test_etag_changes_with_content(store):
+  store.put(DOCUMENT_ID, DATA)
+  etag = store.stat(DOCUMENT_ID).etag
+  assert store.stat(DOCUMENT_ID).etag == etag
+
+  store.put(DOCUMENT_ID, DATA[:-1])
+  assert store.stat(DOCUMENT_ID).etag != etag
+
+@pytest.mark.parametrize("document_id", ["../secret", ".hidden", "a/b.pdf", ""])
+def test_invalid_ids(store, document_id):
+  with pytest.raises(ValueError):
+    store.put(document_id, DATA)
+  assert store.stat(document_id) is None
+
+def test_missing_document_raises_key_error(store):
+  assert store.stat(DOCUMENT_ID) is None
+  with pytest.raises(KeyError):
+    next(store.read(DOCUMENT_ID))
+  with pytest.raises(KeyError):
+    next(store.read(DOCUMENT_ID, 0, 10))
+
+def test_documents_expire(store, clock):
+  store.put(DOCUMENT_ID, DATA)
+  _age(store, clock, 59)
+  assert store.stat(DOCUMENT_ID) is not None
+
+  _age(store, clock, 2)
+  assert store.stat(DOCUMENT_ID) is None
+  # Redis expires the keys itself
+  assert store.evictions == (0 if isinstance(store, RedisDocumentStore) else 1)
+  with pytest.raises(KeyError):
+    next(store.read(DOCUMENT_ID, 0, 10))
+
+def test_purge_expired(store, clock):
+  store.put(DOCUMENT_ID, DATA)
+  assert store.purge_expired() == 0
+  _age(store, clock, 61)
+  assert store.purge_expired() == (0 if isinstance(store, RedisDocumentStore) else 1)
+  assert store.stat(DOCUMENT_ID) is None
+
+def test_copy(store):
+  store.put(DOCUMENT_ID, DATA)
+  store.copy(DOCUMENT_ID, "copy.pdf")
+  assert b"".join(store.read("copy.pdf")) == DATA
+  with pytest.raises(KeyError):
+    store.copy("missing.pdf", "other.pdf")
+
+# replaced by a shorter document after stat, before or while being read
+def _cut_short(store, length: int) -> None:
+  if isinstance(store, FilesystemDocumentStore):
+    with open(store._path(DOCUMENT_ID), "r+b") as f:
+      f.truncate(length)
+  else:
+    store.put(DOCUMENT_ID, DATA[:length])
+
+def test_read_raises_when_document_is_cut_short(shared_store):
+  shared_store.put(DOCUMENT_ID, DATA)
+  chunks = shared_store.read(DOCUMENT_ID, 0, len(DATA) - 1)
+  _cut_short(shared_store, 100)
+
+  with pytest.raises(DocumentTruncatedError):
+    b"".join(chunks)
+
+def test_s3_store_purges_every_page(clock):
+  client = FakeS3(page_size = 2)
+  store = S3DocumentStore("bucket", retention_seconds = 60, client = client)
+  for name in ("a.pdf", "b.pdf", "c.pdf"):
+    store.put(name, DATA)
+  client.put_object(Bucket = "bucket", Key = "other/d.pdf", Body = DATA)
+
+  clock.now += 61
+  assert store.purge_expired() == 3
+  assert list(client.objects) == [("bucket", "other/d.pdf")]
+
+def test_s3_store_reads_ranges():
+  client = FakeS3()
+  store = S3DocumentStore("bucket", retention_seconds = 60, prefix = "docs/", client = client)
+  store.put(DOCUMENT_ID, DATA)
+  assert ("bucket", f"docs/{DOCUMENT_ID}") in client.objects
+  assert b"".join(store.read(DOCUMENT_ID, 70000, 140000)) == DATA[70000:140001]
+  store.delete(DOCUMENT_ID)
+  assert client.objects == {}
+
+def test_redis_store_keys_expire_with_retention():
+  client = FakeRedis()
+  store = RedisDocumentStore(retention_seconds = 59.5, client = client)
+  store.put(DOCUMENT_ID, DATA)
+  for key in (f"tax:documents:{DOCUMENT_ID}", f"tax:documents:{DOCUMENT_ID}:meta"):
+    assert 59 < client.ttl(key) <= 60
+  store.delete(DOCUMENT_ID)
+  assert client.values == {}
+
+def test_memory_store_evicts_oldest_over_budget():
+  store = InMemoryDocumentStore(max_bytes = 2 * len(DATA), retention_seconds = 60)
+  for name in ("a.pdf", "b.pdf", "c.pdf"):
+    store.put(name, DATA)
+  assert store.stat("a.pdf") is None
+  assert store.stat("b.pdf") is not None
+  assert store.size_bytes == 2 * len(DATA)
+  with pytest.raises(ValueError):
+    store.put("d.pdf", DATA * 3)
+
+def test_create_document_store_requires_settings():
+  with pytest.raises(ValueError):
+    create_document_store("memory", 60)
+  with pytest.raises(ValueError):
+    create_document_store("filesystem", 60)
+  with pytest.raises(ValueError):
+    create_document_store("s3", 60)
+  with pytest.raises(ValueError):
+    create_document_store("redis", 60)
+  with pytest.raises(ValueError):
+    create_document_store("tape", 60)
+
+def test_download(client, store):
+  store.put(DOCUMENT_ID, DATA)
+  response = client.get(f"/api/documents/{DOCUMENT_ID}")
+  assert response.status_code == 200
+  assert response.content == DATA
+  assert response.headers["content-length"] == str(len(DATA))
+  assert response.headers["etag"] == store.stat(DOCUMENT_ID).etag
+  assert response.headers["accept-ranges"] == "bytes"
+
+def test_download_not_modified(client, store):
+  store.put(DOCUMENT_ID, DATA)
+  etag = store.stat(DOCUMENT_ID).etag
+  response = client.get(
+    f"/api/documents/{DOCUMENT_ID}", headers = { "If-None-Match" : f'"other", {etag}' }
+  )
+  assert response.status_code == 304
+  assert response.content == b""
+
+@pytest.mark.parametrize("range_header, start, end", [
+  ("bytes=0-99", 0, 99),
+  ("bytes=100000-", 100000, len(DATA) - 1),
+  ("bytes=-500", len(DATA) - 500, len(DATA) - 1),
+  ("bytes=179000-999999", 179000, len(DATA) - 1),
+])
+def test_download_range(client, store, range_header, start, end):
+  store.put(DOCUMENT_ID, DATA)
+  response = client.get(
+    f"/api/documents/{DOCUMENT_ID}", headers = { "Range" : range_header }
+  )
+  assert response.status_code == 206
+  assert response.content == DATA[start : end + 1]
+  assert response.headers["content-range"] == f"bytes {start}-{end}/{len(DATA)}"
+
+def test_download_unsatisfiable_range(client, store):
+  store.put(DOCUMENT_ID, DATA)
+  response = client.get(
+    f"/api/documents/{DOCUMENT_ID}", headers = { "Range" : f"bytes={len(DATA)}-" }
+  )
+  assert response.status_code == 416
+  assert response.headers["content-range"] == f"bytes */{len(DATA)}"
+
+def test_download_stale_if_range_sends_whole_document(client, store):
+  store.put(DOCUMENT_ID, DATA)
+  response = client.get(
+    f"/api/documents/{DOCUMENT_ID}",
+    headers = { "Range" : "bytes=0-99", "If-Range" : '"stale"' }
+  )
+  assert response.status_code == 200
+  assert response.content == DATA
+
+def test_download_missing_or_expired(client, store, clock):
+  assert client.get(f"/api/documents/{DOCUMENT_ID}").status_code == 404
+  store.put(DOCUMENT_ID, DATA)
+  _age(store, clock, 61)
+  assert client.get(f"/api/documents/{DOCUMENT_ID}").status_code == 404
+
+def test_download_expired_between_stat_and_read(client, store, monkeypatch):
+  store.put(DOCUMENT_ID, DATA)
+  stat = store.stat
+
+  def stat_then_expire(document_id):
+    document = stat(document_id)
+    store.delete(document_id)
+    return document
+
+  monkeypatch.setattr(store, "stat", stat_then_expire)
+  response = client.get(f"/api/documents/{DOCUMENT_ID}")
+  assert response.status_code == 404
+
+def _cut_short_after_stat(store, monkeypatch, length: int) -> None:
+  stat = store.stat
+
+  def stat_then_cut_short(document_id):
+    document = stat(document_id)
+    _cut_short(store, length)
+    return document
+
+  monkeypatch.setattr(store, "stat", stat_then_cut_short)
+
+def test_download_cut_short_before_first_chunk(shared_store, monkeypatch):
+  client = _client(shared_store)
+  shared_store.put(DOCUMENT_ID, DATA)
+  _cut_short_after_stat(shared_store, monkeypatch, 100)
+  response = client.get(
+    f"/api/documents/{DOCUMENT_ID}", headers = { "Range" : "bytes=1000-" }
+  )
+  assert response.status_code == 404
+
+def test_download_cut_short_while_streaming(shared_store, monkeypatch):
+  client = _client(shared_store)
+  shared_store.put(DOCUMENT_ID, DATA)
+  _cut_short_after_stat(shared_store, monkeypatch, shared_store.CHUNK_SIZE + 100)
+  # the response fails rather than ending short of its Content-Length
+  with pytest.raises(DocumentTruncatedError):
+    client.get(f"/api/documents/{DOCUMENT_ID}")
@@ -0,0 +1,218 @@
+from types import SimpleNamespace
+from fastapi import FastAPI
+import asyncio
+import os
+import threading
+import httpx
+import pymupdf
+import pytest
+
+from api import endpoints
+from api.app_context import get_app_context
+from core import config
+from services.execution_engine import EngineSaturatedError, ExecutionEngine
+from tests.test_batches import PII, SUMMARY
+
+def _engine(max_in_flight: int = 1, max_queued: int = 1, io_workers: int = 2, cpu_workers: int = 0):
+  return ExecutionEngine(
+    max_in_flight = max_in_flight,
+    max_queued = max_queued,
+    io_workers = io_workers,
+    cpu_workers = cpu_workers
+  )
+
+# Until the engine reports the given stats, or fails after a second
+async def _until(engine: ExecutionEngine, **stats) -> None:
+  for _ in range(1000):
+    current = engine.stats()
+    if all(current[name] == value for name, value in stats.items()):
+      return
+    await asyncio.sleep(0.001)
+  raise AssertionError(f"engine stats {engine.stats()}, expected {stats}")
+
+def test_submission_waits_for_a_free_slot_then_is_rejected():
+  engine = _engine(max_in_flight = 1, max_queued = 1)
+  release = threading.Event()
+  started = []
+
+  def blocking(name: str) -> str:
+    started.append(name)
+    release.wait(5)
+    return name
+
+  async def scenario():
+    first = asyncio.ensure_future(engine.submit(blocking, "first"))
+    await _until(engine, in_flight = 1)
+    second = asyncio.ensure_future(engine.submit(blocking, "second"))
+    await _until(engine, queued = 1)
+
+    # one running, one waiting: the wait queue is full
+    with pytest.raises(EngineSaturatedError):
+      await engine.submit(blocking, "third")
+    assert started == ["first"]
+
+    release.set()
+    return await asyncio.gather(first, second)
+
+  try:
+    assert asyncio.run(scenario()) == ["first", "second"]
+  finally:
+    release.set()
+    engine.shutdown()
+
+  assert started == ["first", "second"]
+  assert engine.stats()["in_flight"] == 0
+  assert engine.stats()["queued"] == 0
+
+def test_coroutine_submissions_share_the_slots():
+  engine = _engine(max_in_flight = 1, max_queued = 0)
+
+  async def scenario():
+    release = asyncio.Event()
+
+    async def blocking() -> str:
+      await release.wait()
+      return "done"
+
+    first = asyncio.ensure_future(engine.submit_async(blocking))
+    await _until(engine, in_flight = 1)
+    with pytest.raises(EngineSaturatedError):
+      await engine.submit(lambda: "threads")
+    with pytest.raises(EngineSaturatedError):
+      await engine.submit_async(blocking)
+
+    release.set()
+    return await first
+
+  assert asyncio.run(scenario()) == "done"
+  assert engine.stats()["in_flight"] == 0
+  engine.shutdown()
+
+def test_run_waits_past_max_queued():
+  engine = _engine(max_in_flight = 1, max_queued = 0)
+  release = threading.Event()
+
+  async def scenario():
+    first = asyncio.ensure_future(engine.run(release.wait, 5))
+    await _until(engine, in_flight = 1)
+    # no admission check: waits for the slot instead of being rejected
+    second = asyncio.ensure_future(engine.run(lambda: "second"))
+    await _until(engine, queued = 1)
+    release.set()
+    return await asyncio.gather(first, second)
+
+  try:
+    assert asyncio.run(scenario()) == [True, "second"]
+  finally:
+    release.set()
+    engine.shutdown()
+
+def test_cancelled_submission_keeps_its_slot_until_the_thread_is_done():
+  engine = _engine(max_in_flight = 1, max_queued = 0)
+  release = threading.Event()
+
+  async def scenario():
+    task = asyncio.ensure_future(engine.submit(release.wait, 5))
+    await _until(engine, in_flight = 1)
+    task.cancel()
+    await asyncio.sleep(0.01)
+    # the thread still runs, so does the slot
+    assert engine.stats()["in_flight"] == 1
+    with pytest.raises(EngineSaturatedError):
+      await engine.submit(lambda: None)
+
+    release.set()
+    await _until(engine, in_flight = 0)
+    return await engine.submit(lambda: "next")
+
+  try:
+    assert asyncio.run(scenario()) == "next"
+  finally:
+    release.set()
+    engine.shutdown()
+
+def test_shutdown_cancels_waiting_work_and_stops_the_threads():
+  engine = _engine(max_in_flight = 2, max_queued = 0, io_workers = 1)
+  release = threading.Event()
+  ran = []
+
+  async def scenario():
+    running = asyncio.ensure_future(engine.submit(release.wait, 5))
+    # in the thread pool queue behind the running one
+    waiting = asyncio.ensure_future(engine.submit(ran.append, "waiting"))
+    await _until(engine, in_flight = 2)
+
+    engine.shutdown()
+    with pytest.raises(asyncio.CancelledError):
+      await waiting
+    release.set()
+    assert await running is True
+    await _until(engine, in_flight = 0)
+
+  try:
+    asyncio.run(scenario())
+  finally:
+    release.set()
+
+  assert ran == []
+  for thread in engine._io_pool._threads:
+    thread.join(5)
+    assert not thread.is_alive()
+
+def test_shutdown_stops_the_render_processes():
+  engine = _engine(cpu_workers = 1)
+  engine.warm_up(os.getpid)
+  processes = list(engine._cpu_pool._processes.values())
+  assert processes
+
+  engine.shutdown()
+  assert engine._cpu_pool is None
+  assert not any(process.is_alive() for process in processes)
+
+def test_no_render_processes_without_cpu_workers():
+  engine = _engine(cpu_workers = 0)
+  assert engine.cpu_executor() is None
+  engine.warm_up(os.getpid)
+  engine.shutdown()
+
+def test_saturated_engine_answers_503(monkeypatch):
+  engine = _engine(max_in_flight = 1, max_queued = 0)
+  release = threading.Event()
+
+  def run_pipeline(context, temp_pdf_paths, pii, document_id):
+    release.wait(5)
+    return SUMMARY
+
+  monkeypatch.setattr(config, "SUBMIT_PIPELINE", "threads")
+  monkeypatch.setattr(config, "SUBMIT_COALESCE_IDENTICAL", False)
+  monkeypatch.setattr(endpoints, "_run_pipeline", run_pipeline)
+  app = FastAPI()
+  app.include_router(endpoints.router)
+  app.dependency_overrides[get_app_context] = lambda: SimpleNamespace(engine = engine)
+
+  document = pymupdf.open()
+  document.new_page()
+  files = { "files" : ("w2.pdf", document.tobytes(), "application/pdf") }
+
+  async def scenario():
+    async with httpx.AsyncClient(
+      transport = httpx.ASGITransport(app = app), base_url = "http://test"
+    ) as client:
+      first = asyncio.ensure_future(
+        client.post("/api/submit_tax_form", data = PII, files = files)
+      )
+      await _until(engine, in_flight = 1)
+      busy = await client.post("/api/submit_tax_form", data = PII, files = files)
+      release.set()
+      return await first, busy
+
+  try:
+    first, busy = asyncio.run(scenario())
+  finally:
+    release.set()
+    engine.shutdown()
+
+  assert first.status_code == 200
+  assert busy.status_code == 503
+  assert busy.headers["retry-after"] == "5"
+  assert busy.headers["x-submission-started"] == "false"
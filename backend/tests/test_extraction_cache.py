@@ -0,0 +1,121 @@
+from decimal import Decimal
+import pytest
+
+from models.tax_schema import NECData, TaxFormData, W2Data
+from services import extraction_cache
+from services.extraction_cache import (
+  ExtractionCache,
+  InMemoryCacheBackend,
+  SQLiteCacheBackend,
+  create_extraction_cache
+)
+
+PDF = b"%PDF-1.7 first document"
+
+def _data(wages: str) -> TaxFormData:
+  return TaxFormData(
+    forms_submitted = ["W-2"],
+    w2 = W2Data(wages = wages, federal_income_tax_withheld = "100")
+  )
+
+class _Clock:
+  def __init__(self):
+    self.now = 1000.0
+
+  def __call__(self) -> float:
+    return self.now
+
+@pytest.fixture
+def clock(monkeypatch) -> _Clock:
+  clock = _Clock()
+  monkeypatch.setattr(extraction_cache.time, "monotonic", clock)
+  monkeypatch.setattr(extraction_cache.time, "time", clock)
+  return clock
+
+@pytest.fixture(params = ["memory", "sqlite"])
+def make_backend(request, tmp_path):
+  def make(max_entries: int = 10, ttl_seconds: float = 60):
+    if request.param == "memory":
+      return InMemoryCacheBackend(max_entries, ttl_seconds)
+    return SQLiteCacheBackend(tmp_path / "cache.sqlite3", max_entries, ttl_seconds)
+  return make
+
+def test_key_is_stable():
+  assert (
+    ExtractionCache.make_key(PDF, "model", "instructions")
+    == ExtractionCache.make_key(PDF, "model", "instructions")
+  )
+
+@pytest.mark.parametrize("changes", [
+  { "pdf_bytes" : b"%PDF-1.7 second document" },
+  { "model" : "other-model" },
+  { "instructions" : "other instructions" },
+  { "schema" : NECData },
+  { "variant" : "w2" },
+])
+def test_key_depends_on_every_input(changes):
+  inputs = { "pdf_bytes" : PDF, "model" : "model", "instructions" : "instructions" }
+  assert (
+    ExtractionCache.make_key(**inputs)
+    != ExtractionCache.make_key(**{ **inputs, **changes })
+  )
+
+def test_key_depends_on_format_version(monkeypatch):
+  key = ExtractionCache.make_key(PDF, "model", "instructions")
+  monkeypatch.setattr(
+    extraction_cache, "CACHE_FORMAT_VERSION", extraction_cache.CACHE_FORMAT_VERSION + 1
+  )
+  assert ExtractionCache.make_key(PDF, "model", "instructions") != key
+
+def test_round_trip_and_stats(make_backend):
+  cache = ExtractionCache(make_backend())
+  assert cache.get("key") is None
+
+  cache.put("key", _data("50000.25"))
+  data = cache.get("key")
+  assert data.w2.wages == Decimal("50000.25")
+  assert data == _data("50000.25")
+  assert cache.stats() == { "hits" : 1, "misses" : 1, "evictions" : 0, "entries" : 1 }
+
+def test_entries_expire_after_ttl(make_backend, clock):
+  cache = ExtractionCache(make_backend(ttl_seconds = 60))
+  cache.put("key", _data("1"))
+
+  clock.now += 59
+  assert cache.get("key") is not None
+  clock.now += 2
+  assert cache.get("key") is None
+  assert cache.stats()["evictions"] == 1
+  assert cache.stats()["entries"] == 0
+
+def test_least_recently_used_is_evicted(make_backend, clock):
+  cache = ExtractionCache(make_backend(max_entries = 2))
+  cache.put("a", _data("1"))
+  clock.now += 1
+  cache.put("b", _data("2"))
+  clock.now += 1
+  # a becomes the most recently used
+  assert cache.get("a") is not None
+  clock.now += 1
+  cache.put("c", _data("3"))
+
+  assert cache.get("b") is None
+  assert cache.get("a") is not None
+  assert cache.get("c") is not None
+  assert cache.stats()["evictions"] == 1
+  assert cache.stats()["entries"] == 2
+
+def test_sqlite_cache_is_shared_by_instances(tmp_path):
+  path = tmp_path / "cache.sqlite3"
+  create_extraction_cache("sqlite", 10, 60, path).put("key", _data("7"))
+  assert create_extraction_cache("sqlite", 10, 60, path).get("key") == _data("7")
+
+def test_create_extraction_cache_backends(tmp_path):
+  assert create_extraction_cache("none", 10, 60) is None
+  assert isinstance(
+    create_extraction_cache("memory", 10, 60).backend, InMemoryCacheBackend
+  )
+  with pytest.raises(ValueError):
+    create_extraction_cache("sqlite", 10, 60)
+  with pytest.raises(ValueError):
+    create_extraction_cache("disk", 10, 60)
@@ -0,0 +1,233 @@
+from decimal import Decimal
+from pydantic import ValidationError
+from types import SimpleNamespace
+import asyncio
+import base64
+import os
+import threading
+import pymupdf
+import pytest
+
+from models.tax_schema import INTData, NECData, TaxFormData, W2Data
+from services.form_extractor import (
+  ExtractionSettings,
+  FormExtractor,
+  merge_tax_form_data,
+  render_pdf_pages
+)
+from services.llm_gateway import LLMUnavailableError
+from services.metrics import DOCUMENTS_EXTRACTED
+from services.render_profiles import RenderProfile, select_render_profile
+
+SAMPLE_DOCS = os.path.join(os.path.dirname(__file__), "..", "sample_docs")
+
+def _sample(name: str) -> str:
+  return os.path.join(SAMPLE_DOCS, name)
+
+def _data(form: str, **amounts: str) -> TaxFormData:
+  return TaxFormData.model_validate({
+    "forms_submitted" : [form],
+    "w2" : W2Data(
+      wages = amounts.get("wages", "0"),
+      federal_income_tax_withheld = amounts.get("withheld", "0")
+    ),
+    "1099_nec" : NECData(nonemployee_compensation = amounts.get("nec", "0")),
+    "1099_int" : INTData(interest_income = amounts.get("interest", "0"))
+  })
+
+# gateway.parse returning, or failing with, each outcome in turn
+class _FakeGateway:
+  def __init__(self, outcomes: list):
+    self.outcomes = list(outcomes)
+    self.requests = []
+
+  def parse(self, **request):
+    self.requests.append(request)
+    outcome = self.outcomes.pop(0)
+    if isinstance(outcome, Exception):
+      raise outcome
+    return SimpleNamespace(output_parsed = outcome)
+
+  async def parse_async(self, **request):
+    return self.parse(**request)
+
+def _extractor(gateway = None, **settings) -> FormExtractor:
+  return FormExtractor(
+    settings = ExtractionSettings(**settings),
+    gateway = gateway or _FakeGateway([])
+  )
+
+def _llm_documents() -> float:
+  return DOCUMENTS_EXTRACTED.value(path = "llm")
+
+def test_merge_sums_amounts_and_keeps_forms_in_order():
+  merged = merge_tax_form_data([
+    _data("W-2", wages = "50000.10", withheld = "5000"),
+    _data("1099-INT", interest = "12.50"),
+    _data("W-2", wages = "1000", withheld = "100.05"),
+    _data("1099-NEC", nec = "2500")
+  ])
+  assert merged.forms_submitted == ["W-2", "1099-INT", "1099-NEC"]
+  assert merged.w2.wages == Decimal("51000.10")
+  assert merged.w2.federal_income_tax_withheld == Decimal("5100.05")
+  assert merged.nec_1099.nonemployee_compensation == Decimal("2500")
+  assert merged.int_1099.interest_income == Decimal("12.50")
+
+# Every document extracted concurrently by name, "bad.pdf" failing
+# its first `failures` attempts
+def _per_document(monkeypatch, failures: int, error: Exception | None = None):
+  extractor = _extractor(read_acroforms = False, max_concurrency = 3)
+  attempts = {}
+  lock = threading.Lock()
+
+  def parse(pdf_paths):
+    (pdf_path,) = pdf_paths
+    with lock:
+      attempts[pdf_path] = attempts.get(pdf_path, 0) + 1
+      attempt = attempts[pdf_path]
+    if pdf_path == "bad.pdf" and attempt <= failures:
+      raise error or ValueError("The model did not return any tax form data")
+    return _data("W-2", wages = "100", withheld = "10")
+
+  monkeypatch.setattr(extractor, "_parse_with_llm", parse)
+  return extractor, attempts
+
+def test_failed_document_is_retried_on_its_own(monkeypatch):
+  extractor, attempts = _per_document(monkeypatch, failures = 1)
+  before = _llm_documents()
+
+  data = extractor.extract_from_pdfs(["a.pdf", "bad.pdf", "c.pdf"])
+  assert data.w2.wages == Decimal("300")
+  assert attempts == { "a.pdf" : 1, "bad.pdf" : 2, "c.pdf" : 1 }
+  # counted once per document, not per attempt
+  assert _llm_documents() - before == 3
+
+def test_document_failing_every_attempt_fails_the_submission(monkeypatch):
+  extractor, attempts = _per_document(monkeypatch, failures = 2)
+  before = _llm_documents()
+
+  with pytest.raises(ValueError):
+    extractor.extract_from_pdfs(["a.pdf", "bad.pdf", "c.pdf"])
+  assert attempts["bad.pdf"] == extractor.settings.document_attempts == 2
+  assert _llm_documents() - before == 2
+
+def test_unavailable_llm_is_not_retried_per_document(monkeypatch):
+  extractor, attempts = _per_document(
+    monkeypatch, failures = 2, error = LLMUnavailableError("throttled")
+  )
+  with pytest.raises(LLMUnavailableError):
+    extractor.extract_from_pdfs(["a.pdf", "bad.pdf"])
+  assert attempts["bad.pdf"] == 1
+
+def test_retried_document_is_counted_once():
+  w2 = _data("W-2", wages = "81484.73", withheld = "6670.95")
+  gateway = _FakeGateway([None, w2])
+  extractor = _extractor(gateway, read_acroforms = False)
+  before = _llm_documents()
+
+  assert extractor.extract_from_pdfs([_sample("1/w2_1.pdf")]) == w2
+  assert len(gateway.requests) == 2
+  assert _llm_documents() - before == 1
+
+def test_fillable_documents_skip_the_llm():
+  acroform = DOCUMENTS_EXTRACTED.value(path = "acroform")
+  extractor = _extractor()
+
+  data = extractor.extract_from_pdfs([
+    _sample("1/w2_1.pdf"), _sample("1/nec_1.pdf"), _sample("1/int_1.pdf")
+  ])
+  assert data.forms_submitted == ["W-2", "1099-NEC", "1099-INT"]
+  assert data.w2.wages == Decimal("81484.73")
+  assert data.nec_1099.nonemployee_compensation == Decimal("19990.64")
+  assert data.int_1099.interest_income == Decimal("657.04")
+  assert extractor.gateway.requests == []
+  assert DOCUMENTS_EXTRACTED.value(path = "acroform") - acroform == 3
+
+@pytest.mark.parametrize("extraction_mode", ["combined", "per_document"])
+def test_flattened_document_falls_back_to_the_llm(tmp_path, extraction_mode):
+  flattened = tmp_path / "w2.pdf"
+  with pymupdf.open(_sample("1/w2_1.pdf")) as doc:
+    doc.bake()
+    doc.save(flattened)
+  gateway = _FakeGateway([_data("W-2", wages = "81484.73", withheld = "6670.95")])
+  extractor = _extractor(gateway, extraction_mode = extraction_mode)
+
+  data = extractor.extract_from_pdfs([str(flattened), _sample("1/int_1.pdf")])
+  assert data.forms_submitted == ["W-2", "1099-INT"]
+  assert data.w2.wages == Decimal("81484.73")
+  assert data.int_1099.interest_income == Decimal("657.04")
+  # only the page of the flattened W-2 is sent
+  (request,) = gateway.requests
+  assert len(request["input"][0]["content"]) == 1
+
+def test_acroforms_are_not_read_when_disabled():
+  gateway = _FakeGateway([_data("1099-INT", interest = "657.04")])
+  extractor = _extractor(gateway, read_acroforms = False)
+  extractor.extract_from_pdfs([_sample("1/int_1.pdf")])
+  assert len(gateway.requests) == 1
+
+# what the retry of adaptive mode renders with, cheap for the tests
+FALLBACK_PROFILE = RenderProfile(dpi = 72, jpeg_quality = 60)
+
+def _validation_error() -> ValidationError:
+  try:
+    W2Data(wages = "-1", federal_income_tax_withheld = "0")
+  except ValidationError as e:
+    return e
+
+def _images(request: dict) -> list:
+  return [image["image_url"] for image in request["input"][0]["content"]]
+
+def _rendered(pdf_path: str, profile: RenderProfile | None) -> list:
+  return [
+    f"data:image/jpeg;base64,{base64.b64encode(page).decode('ascii')}"
+    for page in render_pdf_pages(pdf_path, None, profile).pages
+  ]
+
+def _extract_adaptive(outcomes: list, use_async: bool) -> tuple:
+  gateway = _FakeGateway(outcomes)
+  extractor = _extractor(
+    gateway,
+    read_acroforms = False,
+    render_mode = "adaptive",
+    render_profile = FALLBACK_PROFILE
+  )
+  pdf_paths = [_sample("1/w2_1.pdf")]
+  if use_async:
+    data = asyncio.run(extractor.extract_from_pdfs_async(pdf_paths))
+  else:
+    data = extractor.extract_from_pdfs(pdf_paths)
+  return data, gateway.requests
+
+W2 = _data("W-2", wages = "81484.73", withheld = "6670.95")
+
+@pytest.mark.parametrize("use_async", [False, True])
+@pytest.mark.parametrize("first", [
+  _validation_error(),
+  # a W-2 without wages: the cheap rendering was probably unreadable
+  _data("W-2", withheld = "6670.95"),
+  None
+], ids = ["invalid", "implausible", "empty"])
+def test_adaptive_mode_falls_back_to_the_full_profile(first, use_async):
+  data, requests = _extract_adaptive([first, W2], use_async)
+
+  assert data == W2
+  adaptive, fallback = requests
+  pdf_path = _sample("1/w2_1.pdf")
+  assert select_render_profile("W-2") != FALLBACK_PROFILE
+  assert _images(adaptive) == _rendered(pdf_path, profile = None)
+  assert _images(fallback) == _rendered(pdf_path, FALLBACK_PROFILE)
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_adaptive_mode_keeps_a_plausible_result(use_async):
+  data, requests = _extract_adaptive([W2], use_async)
+  assert data == W2
+  assert len(requests) == 1
+
+def test_fixed_mode_renders_with_the_configured_profile():
+  gateway = _FakeGateway([W2])
+  extractor = _extractor(gateway, read_acroforms = False, render_profile = FALLBACK_PROFILE)
+  extractor.extract_from_pdfs([_sample("1/w2_1.pdf")])
+
+  (request,) = gateway.requests
+  assert _images(request) == _rendered(_sample("1/w2_1.pdf"), FALLBACK_PROFILE)
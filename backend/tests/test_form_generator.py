@@ -0,0 +1,95 @@
+from decimal import Decimal
+from pathlib import Path
+import pymupdf
+import pytest
+
+from models.tax_schema import TaxFormData
+from models.user_pii import FilingType, UserPII
+from services.form_generator import (
+  FORM_1040_TAX_YEAR,
+  Form1040Generator,
+  Form1040Template
+)
+from tax_policy.policy_registry import get_tax_policy
+
+TEMPLATE_PATH = Path(__file__).resolve().parent / "../static/templates/f1040_2024.pdf"
+
+@pytest.fixture(scope = "module")
+def template() -> Form1040Template:
+  return Form1040Template.load(TEMPLATE_PATH)
+
+def _widget_values(pdf_bytes: bytes) -> dict[str, str]:
+  with pymupdf.open(stream = pdf_bytes, filetype = "pdf") as doc:
+    return {
+      widget.field_name : widget.field_value
+      for page in doc for widget in page.widgets()
+    }
+
+def test_template_indexes_every_widget(template):
+  assert len(template.widget_index) == len(_widget_values(template.template_bytes))
+  assert {"1a", "ssn", "filing_status_single_checkbox"} <= set(template.widget_index)
+
+def test_fill_sets_text_and_checkbox_widgets(template):
+  values = _widget_values(template.fill({
+    "first_name_middle_initial" : "Jane Q",
+    "1a" : "50000.00",
+    "37" : "0",
+    "filing_status_single_checkbox" : "Yes",
+    # not on the form
+    "99z" : "ignored"
+  }))
+
+  assert values["first_name_middle_initial"] == "Jane Q"
+  assert values["1a"] == "50000.00"
+  assert values["37"] == "0"
+  assert values["filing_status_single_checkbox"] == "Yes"
+  assert values["1b"] == ""
+  assert "99z" not in values
+
+def test_fill_leaves_the_template_untouched(template):
+  template_bytes = template.template_bytes
+  first = _widget_values(template.fill({ "1a" : "1" }))
+  second = _widget_values(template.fill({ "1b" : "2" }))
+
+  assert template.template_bytes == template_bytes
+  assert (first["1a"], first["1b"]) == ("1", "")
+  assert (second["1a"], second["1b"]) == ("", "2")
+
+def test_template_without_widgets_is_rejected():
+  doc = pymupdf.open()
+  doc.new_page()
+  with pytest.raises(ValueError):
+    Form1040Template(doc.tobytes())
+
+def test_generated_return_reads_back(template):
+  generator = Form1040Generator(
+    get_tax_policy(FORM_1040_TAX_YEAR, FilingType.single), template = template
+  )
+  data = TaxFormData.model_validate({
+    "forms_submitted" : ["W-2", "1099-INT"],
+    "w2" : { "wages" : "50000", "federal_income_tax_withheld" : "5000" },
+    "1099_int" : { "interest_income" : "100.50" }
+  })
+  pii = UserPII(
+    first_name_middle_initial = "Jane Q",
+    last_name = "Public",
+    ssn = "123-45-6789",
+    address = "1 Main St",
+    city = "Springfield",
+    state = "IL",
+    zip_code = "62701"
+  )
+
+  summary, pdf_bytes = generator.generate_pdf_bytes(data, pii)
+  values = _widget_values(pdf_bytes)
+
+  assert values["last_name"] == "Public"
+  assert values["ssn"] == "123-45-6789"
+  # optional and left empty
+  assert values["apt_no"] == ""
+  assert values["filing_status_single_checkbox"] == "Yes"
+  assert Decimal(values["1a"]) == Decimal("50000")
+  assert Decimal(values["2b"]) == Decimal("100.50")
+  assert Decimal(values["9"]) == summary.total_income == Decimal("50100.50")
+  assert Decimal(values["15"]) == summary.taxable_income
+  assert Decimal(values["25a"]) == Decimal("5000")
@@ -0,0 +1,99 @@
+from pathlib import Path
+from types import SimpleNamespace
+import asyncio
+import base64
+import pymupdf
+import pytest
+
+from models.user_pii import UserPII
+from services.acroform_extractor import extract_acroform
+from services.document_store import InMemoryDocumentStore
+from services.form_extractor import ExtractionSettings, merge_tax_form_data, render_pdf_pages
+from services.generate_filled_1040 import generate_filled_1040, generate_filled_1040_async
+from services.llm_gateway import LLMGateway
+from services.render_profiles import RenderProfile
+
+SAMPLE_DOCS = Path(__file__).resolve().parent / "../sample_docs"
+TEMPLATE_PATH = Path(__file__).resolve().parent / "../static/templates/f1040_2024.pdf"
+
+DOCUMENTS = [SAMPLE_DOCS / "2/w2_2.pdf", SAMPLE_DOCS / "2/nec_2.pdf", SAMPLE_DOCS / "2/int_2.pdf"]
+
+PII = UserPII(
+  first_name_middle_initial = "Jane Q",
+  last_name = "Public",
+  ssn = "123-45-6789",
+  address = "1 Main St",
+  city = "Springfield",
+  state = "IL",
+  zip_code = "62701"
+)
+
+# Stands in for OpenAI's client.responses: "reads" every page image it is
+# sent by looking up what the document's widgets say
+class _FakeResponses:
+  def __init__(self, settings: ExtractionSettings):
+    self.calls = 0
+    self._answers = {}
+    for pdf_path in DOCUMENTS:
+      (page,) = render_pdf_pages(str(pdf_path), None, settings.render_profile).pages
+      image_url = f"data:image/jpeg;base64,{base64.b64encode(page).decode('ascii')}"
+      self._answers[image_url] = extract_acroform(str(pdf_path))
+
+  def parse(self, input: list, timeout: float, **kwargs):
+    self.calls += 1
+    answers = [self._answers[image["image_url"]] for image in input[0]["content"]]
+    return SimpleNamespace(
+      output_parsed = merge_tax_form_data(answers),
+      usage = SimpleNamespace(total_tokens = 1000)
+    )
+
+class _FakeAsyncResponses(_FakeResponses):
+  async def parse(self, **kwargs):
+    await asyncio.sleep(0)
+    return super().parse(**kwargs)
+
+def _widget_values(pdf_bytes: bytes) -> dict[str, str]:
+  with pymupdf.open(stream = pdf_bytes, filetype = "pdf") as doc:
+    return {
+      widget.field_name : widget.field_value
+      for page in doc for widget in page.widgets()
+    }
+
+@pytest.mark.parametrize("extraction_mode", ["combined", "per_document"])
+def test_async_pipeline_matches_threads_pipeline(extraction_mode):
+  # every document goes to the (fake) LLM, rendered cheaply
+  settings = ExtractionSettings(
+    read_acroforms = False,
+    extraction_mode = extraction_mode,
+    render_profile = RenderProfile(dpi = 36, grayscale = True, jpeg_quality = 50)
+  )
+  responses = _FakeResponses(settings)
+  async_responses = _FakeAsyncResponses(settings)
+  gateway = LLMGateway(
+    client = SimpleNamespace(responses = responses),
+    async_client = SimpleNamespace(responses = async_responses)
+  )
+  store = InMemoryDocumentStore(max_bytes = 10 * 1024 * 1024, retention_seconds = 60)
+  pipeline = {
+    "file_buffers" : DOCUMENTS,
+    "pii" : PII,
+    "input_pdf_path" : TEMPLATE_PATH,
+    "extraction_settings" : settings,
+    "document_store" : store,
+    "llm_gateway" : gateway
+  }
+
+  threads = generate_filled_1040(**pipeline, document_id = "threads.pdf")
+  assert (responses.calls, async_responses.calls) == (
+    1 if extraction_mode == "combined" else 3, 0
+  )
+  coroutine = asyncio.run(generate_filled_1040_async(**pipeline, document_id = "async.pdf"))
+  assert async_responses.calls == responses.calls
+
+  assert coroutine == threads
+  assert threads.forms_submitted == ["W-2", "1099-NEC", "1099-INT"]
+  assert threads.total_income > 0
+  assert (
+    _widget_values(b"".join(store.read("async.pdf")))
+    == _widget_values(b"".join(store.read("threads.pdf")))
+  )
@@ -0,0 +1,279 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+import asyncio
+import sqlite3
+import time
+import pytest
+
+from api.app_context import AppContext
+from models.job_schema import JobStatus, TaxFormJob
+from services import job_store as job_store_module
+from services.job_store import (
+  INTERRUPTED_JOB_ERROR,
+  InMemoryJobStore,
+  JobNotFoundError,
+  RedisJobStore,
+  SQLiteJobStore,
+  create_job_store
+)
+from tests.fakes import FakeRedis
+
+class _Clock:
+  def __init__(self):
+    self.offset = 0.0
+
+  def advance(self, seconds: float) -> None:
+    self.offset += seconds
+
+# Moves the job store's datetime.now and the fake Redis key TTLs (on
+# time.time) forward together
+@pytest.fixture
+def clock(monkeypatch) -> _Clock:
+  clock = _Clock()
+  real_time = time.time
+
+  class _Datetime(datetime):
+    @classmethod
+    def now(cls, tz = None):
+      return datetime.now(tz) + timedelta(seconds = clock.offset)
+
+  monkeypatch.setattr(job_store_module, "datetime", _Datetime)
+  monkeypatch.setattr(time, "time", lambda: real_time() + clock.offset)
+  return clock
+
+@pytest.fixture(params = ["memory", "sqlite", "redis"])
+def make_store(request, tmp_path):
+  redis_client = FakeRedis()
+
+  def make(retention_seconds: int = 3600, lease_seconds: float = 60):
+    if request.param == "redis":
+      return RedisJobStore(retention_seconds, lease_seconds, client = redis_client)
+    return create_job_store(
+      backend = request.param,
+      retention_seconds = retention_seconds,
+      lease_seconds = lease_seconds,
+      path = tmp_path / "jobs.sqlite3"
+    )
+  return make
+
+def test_job_lifecycle(make_store):
+  store = make_store()
+  job = store.create()
+  assert job.status == JobStatus.queued
+  assert store.count_pending() == 1
+
+  store.update(job.job_id, status = JobStatus.running)
+  assert store.get(job.job_id).status == JobStatus.running
+  assert store.count_pending() == 1
+
+  store.update(job.job_id, status = JobStatus.succeeded, document_id = "a.pdf")
+  finished = store.get(job.job_id)
+  assert finished.status == JobStatus.succeeded
+  assert finished.document_id == "a.pdf"
+  assert store.count_pending() == 0
+
+def test_unknown_job(make_store):
+  store = make_store()
+  with pytest.raises(JobNotFoundError):
+    store.get("missing")
+  with pytest.raises(JobNotFoundError):
+    store.update("missing", status = JobStatus.running)
+
+def test_finished_jobs_are_dropped_after_retention(make_store, clock):
+  store = make_store(retention_seconds = 60)
+  job = store.create()
+  store.update(job.job_id, status = JobStatus.failed, error = "boom")
+  pending = store.create()
+
+  clock.advance(30)
+  store.create()
+  assert store.get(job.job_id).error == "boom"
+
+  clock.advance(31)
+  store.create()
+  with pytest.raises(JobNotFoundError):
+    store.get(job.job_id)
+  # pending jobs are not dropped, they are failed once their lease runs out
+  assert store.get(pending.job_id).status == JobStatus.failed
+
+def test_job_with_expired_lease_is_failed(make_store, clock):
+  store = make_store()
+  queued = store.create()
+  running = store.create()
+  store.update(running.job_id, status = JobStatus.running)
+
+  clock.advance(59)
+  assert store.count_pending() == 2
+
+  # as left behind by a worker that was killed
+  clock.advance(2)
+  assert store.count_pending() == 0
+  for job_id in (queued.job_id, running.job_id):
+    job = store.get(job_id)
+    assert job.status == JobStatus.failed
+    assert job.error == INTERRUPTED_JOB_ERROR
+
+def test_stale_jobs_are_failed_on_create(make_store, clock):
+  store = make_store()
+  orphan = store.create()
+
+  clock.advance(61)
+  store.create()
+  assert store.get(orphan.job_id).status == JobStatus.failed
+  assert store.count_pending() == 1
+
+def test_renewed_lease_keeps_job_pending(make_store, clock):
+  store = make_store()
+  job = store.create()
+
+  clock.advance(40)
+  store.renew([job.job_id])
+  clock.advance(40)
+  assert store.count_pending() == 1
+  assert store.get(job.job_id).status == JobStatus.queued
+
+  clock.advance(21)
+  assert store.count_pending() == 0
+
+def test_renew_does_not_revive_finished_job(make_store):
+  store = make_store()
+  job = store.create()
+  store.update(job.job_id, status = JobStatus.succeeded)
+
+  store.renew([job.job_id])
+  assert store.count_pending() == 0
+  assert store.get(job.job_id).status == JobStatus.succeeded
+
+def test_renew_does_not_revive_stale_job(make_store, clock):
+  store = make_store()
+  job = store.create()
+
+  clock.advance(61)
+  assert store.count_pending() == 0
+  store.renew([job.job_id])
+  assert store.count_pending() == 0
+  assert store.get(job.job_id).status == JobStatus.failed
+
+def test_workers_share_sqlite_store(tmp_path, clock):
+  path = tmp_path / "jobs.sqlite3"
+  killed = SQLiteJobStore(path, retention_seconds = 3600, lease_seconds = 60)
+  orphan = killed.create()
+
+  clock.advance(61)
+  alive = SQLiteJobStore(path, retention_seconds = 3600, lease_seconds = 60)
+  alive.owner = "other-host:1"
+  job = alive.create()
+  assert alive.count_pending() == 1
+  assert alive.get(orphan.job_id).error == INTERRUPTED_JOB_ERROR
+
+  # only the owner renews a lease
+  clock.advance(40)
+  killed.renew([job.job_id])
+  clock.advance(40)
+  assert killed.count_pending() == 0
+  assert killed.get(job.job_id).status == JobStatus.failed
+
+def test_workers_share_redis_store(clock):
+  client = FakeRedis()
+  killed = RedisJobStore(3600, 60, client = client)
+  orphan = killed.create()
+  killed.update(orphan.job_id, status = JobStatus.running)
+
+  clock.advance(61)
+  alive = RedisJobStore(3600, 60, client = client)
+  job = alive.create()
+  assert alive.count_pending() == 1
+  assert alive.get(orphan.job_id).error == INTERRUPTED_JOB_ERROR
+  assert client.smembers("tax:jobs:pending") == { job.job_id.encode() }
+  # failed jobs expire like finished ones
+  assert 3599 < client.ttl(f"tax:jobs:{orphan.job_id}") <= 3600
+
+def test_redis_store_forgets_pending_job_that_expired():
+  client = FakeRedis()
+  store = RedisJobStore(3600, 60, client = client)
+  job = store.create()
+  client.delete(f"tax:jobs:{job.job_id}", f"tax:jobs:{job.job_id}:lease")
+
+  assert store.count_pending() == 0
+  assert client.smembers("tax:jobs:pending") == set()
+
+def test_sqlite_store_migrates_jobs_without_lease(tmp_path):
+  path = tmp_path / "jobs.sqlite3"
+  now = datetime.now(timezone.utc)
+  job = TaxFormJob(
+    job_id = "old", status = JobStatus.running, created_at = now, updated_at = now
+  )
+  conn = sqlite3.connect(path)
+  conn.execute(
+    """CREATE TABLE jobs (
+      job_id TEXT PRIMARY KEY,
+      status TEXT NOT NULL,
+      job TEXT NOT NULL,
+      updated_at REAL NOT NULL
+    )"""
+  )
+  conn.execute(
+    "INSERT INTO jobs VALUES (?, ?, ?, ?)",
+    ("old", "running", job.model_dump_json(), now.timestamp())
+  )
+  conn.commit()
+  conn.close()
+
+  store = SQLiteJobStore(path, retention_seconds = 3600, lease_seconds = 60)
+  assert store.count_pending() == 0
+  assert store.get("old").error == INTERRUPTED_JOB_ERROR
+
+def _context(job_store) -> AppContext:
+  return AppContext(
+    engine = SimpleNamespace(shutdown = lambda: None),
+    llm_gateway = None,
+    extraction_cache = None,
+    extraction_settings = None,
+    document_store = None,
+    job_store = job_store,
+    form_1040_template_path = None,
+    form_1040_template = None,
+    form_1040_generators = {}
+  )
+
+def test_running_jobs_renew_their_lease():
+  async def scenario():
+    store = InMemoryJobStore(retention_seconds = 3600, lease_seconds = 0.04)
+    context = _context(store)
+    job = store.create()
+    release = asyncio.Event()
+
+    context.start_job(job.job_id, release.wait())
+    await asyncio.sleep(0.2)
+    pending = store.count_pending()
+    release.set()
+    await asyncio.sleep(0)
+    return pending, context.job_tasks
+
+  pending, job_tasks = asyncio.run(scenario())
+  assert pending == 1
+  assert job_tasks == {}
+
+def test_close_fails_unfinished_jobs():
+  async def scenario():
+    store = InMemoryJobStore(retention_seconds = 3600, lease_seconds = 60)
+    context = _context(store)
+    unfinished = store.create()
+    finished = store.create()
+
+    async def finish():
+      store.update(finished.job_id, status = JobStatus.succeeded)
+
+    task = context.start_job(unfinished.job_id, asyncio.Event().wait())
+    context.start_job(finished.job_id, finish())
+    await asyncio.sleep(0)
+    context.close()
+    await asyncio.sleep(0)
+    return store, task, unfinished.job_id, finished.job_id
+
+  store, task, unfinished, finished = asyncio.run(scenario())
+  assert task.cancelled()
+  assert store.get(unfinished).status == JobStatus.failed
+  assert store.get(unfinished).error == INTERRUPTED_JOB_ERROR
+  assert store.get(finished).status == JobStatus.succeeded
+  assert store.count_pending() == 0
@@ -0,0 +1,180 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import json
+import threading
+import time
+import pymupdf
+import pytest
+
+from api import endpoints
+from api.app_context import AppContext, get_app_context
+from core import config
+from services.document_store import InMemoryDocumentStore
+from services.execution_engine import ExecutionEngine
+from services.job_store import InMemoryJobStore
+from tests.test_batches import PII, SUMMARY
+
+def _pdf() -> bytes:
+  document = pymupdf.open()
+  document.new_page()
+  return document.tobytes()
+
+FILES = { "files" : ("w2.pdf", _pdf(), "application/pdf") }
+
+# Jobs run _run_pipeline in the engine's threads, held until released
+class _Pipeline:
+  def __init__(self):
+    self.release = threading.Event()
+    self.error : Exception | None = None
+    self.calls = 0
+
+  def __call__(self, context, temp_pdf_paths, pii, document_id):
+    self.calls += 1
+    self.release.wait(5)
+    if self.error is not None:
+      raise self.error
+    context.document_store.put(document_id, b"%PDF-1.7 return")
+    return SUMMARY
+
+@pytest.fixture
+def pipeline(monkeypatch) -> _Pipeline:
+  pipeline = _Pipeline()
+  monkeypatch.setattr(config, "SUBMIT_PIPELINE", "threads")
+  monkeypatch.setattr(config, "JOB_EVENTS_POLL_SECONDS", 0.01)
+  monkeypatch.setattr(endpoints, "_run_pipeline", pipeline)
+  yield pipeline
+  pipeline.release.set()
+
+@pytest.fixture
+def context() -> AppContext:
+  context = AppContext(
+    engine = ExecutionEngine(max_in_flight = 2, max_queued = 0, io_workers = 2, cpu_workers = 0),
+    llm_gateway = None,
+    extraction_cache = None,
+    extraction_settings = None,
+    document_store = InMemoryDocumentStore(max_bytes = 1024 * 1024, retention_seconds = 60),
+    job_store = InMemoryJobStore(retention_seconds = 3600, lease_seconds = 60),
+    form_1040_template_path = None,
+    form_1040_template = None,
+    form_1040_generators = {}
+  )
+  yield context
+  context.close()
+
+# One event loop for the whole test, so jobs keep running between requests
+@pytest.fixture
+def client(context, pipeline):
+  app = FastAPI()
+  app.include_router(endpoints.router)
+  app.dependency_overrides[get_app_context] = lambda: context
+  with TestClient(app) as client:
+    yield client
+
+def _create(client: TestClient):
+  return client.post("/api/jobs", data = PII, files = FILES)
+
+def _until_status(client: TestClient, job_id: str, status: str) -> dict:
+  for _ in range(500):
+    job = client.get(f"/api/jobs/{job_id}").json()
+    if job["status"] == status:
+      return job
+    time.sleep(0.01)
+  raise AssertionError(f"job {job_id} is {job['status']}, expected {status}")
+
+def _events(response) -> list:
+  return [
+    json.loads(line.removeprefix("data: "))
+    for line in response.text.splitlines() if line.startswith("data: ")
+  ]
+
+def test_job_runs_to_success(client, pipeline):
+  response = _create(client)
+  assert response.status_code == 202
+  job = response.json()
+  assert job["status"] == "queued"
+  assert job["status_url"] == f"/api/jobs/{job['job_id']}"
+
+  _until_status(client, job["job_id"], "running")
+  # not done yet: the status instead of the result
+  result = client.get(job["result_url"])
+  assert result.status_code == 202
+  assert result.json()["status"] == "running"
+
+  pipeline.release.set()
+  done = _until_status(client, job["job_id"], "succeeded")
+  result = client.get(job["result_url"])
+  assert result.status_code == 200
+  assert result.json() == {
+    "document_id" : done["document_id"],
+    "tax_return_summary" : SUMMARY.model_dump(mode = "json")
+  }
+
+def test_failed_job_result(client, pipeline):
+  pipeline.error = RuntimeError("boom")
+  pipeline.release.set()
+  job = _create(client).json()
+
+  _until_status(client, job["job_id"], "failed")
+  result = client.get(job["result_url"])
+  assert result.status_code == 500
+  assert result.json() == { "error" : endpoints.PROCESSING_ERROR }
+
+@pytest.mark.parametrize("path", ["", "/result", "/events"])
+def test_unknown_job(client, path):
+  response = client.get(f"/api/jobs/missing{path}")
+  assert response.status_code == 404
+  assert response.json() == { "error" : "Job not found" }
+
+def test_events_end_with_the_terminal_status(client, pipeline):
+  job = _create(client).json()
+  _until_status(client, job["job_id"], "running")
+  threading.Timer(0.1, pipeline.release.set).start()
+
+  response = client.get(job["events_url"])
+  assert response.status_code == 200
+  assert response.headers["content-type"].startswith("text/event-stream")
+  events = _events(response)
+  assert [event["status"] for event in events] == ["running", "succeeded"]
+  assert events[-1]["document_id"] is not None
+
+def test_events_of_a_finished_job(client, pipeline):
+  pipeline.release.set()
+  job = _create(client).json()
+  _until_status(client, job["job_id"], "succeeded")
+
+  events = _events(client.get(job["events_url"]))
+  assert [event["status"] for event in events] == ["succeeded"]
+
+def test_jobs_are_rejected_once_max_pending(client, context, pipeline, monkeypatch):
+  monkeypatch.setattr(config, "JOB_MAX_PENDING", 1)
+  assert _create(client).status_code == 202
+
+  response = _create(client)
+  assert response.status_code == 503
+  assert response.headers["retry-after"] == "5"
+  assert response.headers["x-submission-started"] == "false"
+  assert context.job_store.count_pending() == 1
+
+  pipeline.release.set()
+  for _ in range(500):
+    if context.job_store.count_pending() == 0:
+      break
+    time.sleep(0.01)
+  assert _create(client).status_code == 202
+
+def test_identical_job_runs_along_with_the_first(client, context, pipeline, monkeypatch):
+  monkeypatch.setattr(config, "SUBMIT_COALESCE_IDENTICAL", True)
+  first = _create(client).json()
+  _until_status(client, first["job_id"], "running")
+
+  second = _create(client).json()
+  # waits for the first job's extraction, not for an engine slot
+  _until_status(client, second["job_id"], "running")
+  assert context.engine.stats()["in_flight"] == 1
+
+  pipeline.release.set()
+  first = _until_status(client, first["job_id"], "succeeded")
+  second = _until_status(client, second["job_id"], "succeeded")
+  assert pipeline.calls == 1
+  assert first["document_id"] != second["document_id"]
+  assert context.document_store.stat(second["document_id"]) is not None
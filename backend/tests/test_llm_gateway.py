@@ -0,0 +1,230 @@
+from types import SimpleNamespace
+import asyncio
+import os
+import subprocess
+import sys
+import httpx
+import openai
+import pytest
+
+from services import llm_gateway as llm_gateway_module
+from services.llm_gateway import LLMGateway, LLMUnavailableError, TokenBucket
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+class _Clock:
+  def __init__(self):
+    self.now = 1000.0
+    self.sleeps = []
+    # added to every sleep, like a sleep that wakes up late
+    self.oversleep = 0.0
+
+  def monotonic(self) -> float:
+    return self.now
+
+  def sleep(self, seconds: float) -> None:
+    self.sleeps.append(seconds)
+    self.now += seconds + self.oversleep
+
+  async def async_sleep(self, seconds: float) -> None:
+    self.sleep(seconds)
+
+# Budget waits and backoff sleeps move a fake clock instead of sleeping.
+# Jitter draws the upper bound of its range.
+@pytest.fixture
+def clock(monkeypatch) -> _Clock:
+  clock = _Clock()
+  monkeypatch.setattr(llm_gateway_module, "time", SimpleNamespace(
+    monotonic = clock.monotonic, sleep = clock.sleep
+  ))
+  monkeypatch.setattr(llm_gateway_module, "asyncio", SimpleNamespace(
+    sleep = clock.async_sleep, to_thread = asyncio.to_thread
+  ))
+  monkeypatch.setattr(llm_gateway_module, "random", SimpleNamespace(
+    uniform = lambda low, high: high
+  ))
+  return clock
+
+def _error(status_code: int, retry_after: str | None = None) -> Exception:
+  headers = {} if retry_after is None else { "retry-after" : retry_after }
+  response = httpx.Response(
+    status_code,
+    headers = headers,
+    request = httpx.Request("POST", "https://api.openai.com/v1/responses")
+  )
+  if status_code == 429:
+    return openai.RateLimitError("rate limited", response = response, body = None)
+  return openai.InternalServerError("server error", response = response, body = None)
+
+def _response(total_tokens: int = 900):
+  return SimpleNamespace(usage = SimpleNamespace(total_tokens = total_tokens))
+
+# client.responses.parse failing with, or returning, each outcome in turn
+class _FakeResponses:
+  def __init__(self, outcomes: list, clock: _Clock | None = None, latency: float = 0.0):
+    self.outcomes = list(outcomes)
+    self.timeouts = []
+    self._clock = clock
+    self._latency = latency
+
+  def parse(self, timeout: float, **kwargs):
+    self.timeouts.append(timeout)
+    if self._clock is not None:
+      self._clock.now += self._latency
+    outcome = self.outcomes.pop(0)
+    if isinstance(outcome, Exception):
+      raise outcome
+    return outcome
+
+class _FakeAsyncResponses(_FakeResponses):
+  async def parse(self, timeout: float, **kwargs):
+    return super().parse(timeout, **kwargs)
+
+def _gateway(outcomes: list, clock: _Clock | None = None, latency: float = 0.0, **settings):
+  responses = _FakeResponses(outcomes, clock, latency)
+  gateway = LLMGateway(client = SimpleNamespace(responses = responses), **settings)
+  return gateway, responses
+
+def test_token_bucket_waits_for_refill(clock):
+  bucket = TokenBucket(per_minute = 60)
+  assert bucket.reserve(60) == 0
+  assert bucket.reserve(3) == pytest.approx(3)
+
+  clock.now += 3
+  assert bucket.reserve(1) == pytest.approx(1)
+
+def test_token_bucket_settles_what_was_reserved(clock):
+  bucket = TokenBucket(per_minute = 60)
+  # larger than the budget: takes the whole bucket, not more
+  assert bucket.reserve(90) == 0
+  bucket.settle(90, used = 75)
+  # 75 used out of 60, 15 in debt
+  assert bucket.reserve(1) == pytest.approx(16)
+
+  bucket.settle(1)
+  bucket.settle(60)
+  assert bucket.reserve(60) == pytest.approx(15)
+
+def test_parse_retries_throttling_honoring_retry_after(clock):
+  response = _response()
+  gateway, _ = _gateway(
+    [_error(429, retry_after = "3"), _error(500), response],
+    backoff_base_seconds = 0.5
+  )
+  assert gateway.parse(input = "w2") is response
+
+  # Retry-After wins over a shorter backoff, then full jitter up to base * 2
+  assert clock.sleeps == [3.0, 1.0]
+  stats = gateway.stats()
+  assert stats["calls"] == 1
+  assert stats["retries"] == 2
+  assert stats["rate_limited"] == 1
+  assert stats["failures"] == 0
+  assert stats["tokens_used"] == 900
+
+def test_parse_backoff_is_capped_and_fails_after_max_attempts(clock):
+  gateway, responses = _gateway(
+    [_error(500)] * 5,
+    max_attempts = 5,
+    backoff_base_seconds = 1,
+    backoff_max_seconds = 3
+  )
+  with pytest.raises(LLMUnavailableError):
+    gateway.parse(input = "w2")
+
+  assert clock.sleeps == [1, 2, 3, 3]
+  assert responses.outcomes == []
+  assert gateway.stats()["failures"] == 1
+
+def test_parse_gives_up_when_retry_after_is_past_the_deadline(clock):
+  gateway, responses = _gateway(
+    [_error(429, retry_after = "30"), _response()],
+    deadline_seconds = 10
+  )
+  with pytest.raises(LLMUnavailableError):
+    gateway.parse(input = "w2")
+  assert clock.sleeps == []
+  assert len(responses.outcomes) == 1
+
+def test_request_timeout_is_cut_to_the_deadline(clock):
+  gateway, responses = _gateway(
+    [_error(500), _response()],
+    clock = clock,
+    latency = 7,
+    request_timeout_seconds = 60,
+    deadline_seconds = 10,
+    backoff_base_seconds = 1
+  )
+  gateway.parse(input = "w2")
+  # 7s for the first request and 1s of backoff leave 2s
+  assert responses.timeouts == [10, pytest.approx(2)]
+
+def test_parse_waits_for_the_request_budget(clock):
+  gateway, responses = _gateway(
+    [_response(), _response()], requests_per_minute = 1, tokens_per_minute = 0
+  )
+  gateway.parse(input = "first")
+  gateway.parse(input = "second")
+  assert clock.sleeps == [pytest.approx(60)]
+
+def test_parse_fails_fast_when_the_budget_wait_is_past_the_deadline(clock):
+  gateway, responses = _gateway(
+    [_response()], requests_per_minute = 1, tokens_per_minute = 0, deadline_seconds = 30
+  )
+  gateway.request_bucket.reserve(1)
+  with pytest.raises(LLMUnavailableError):
+    gateway.parse(input = "w2")
+  assert responses.timeouts == []
+  # the reservation was given back
+  assert gateway.request_bucket.reserve(1) == pytest.approx(60)
+
+def test_parse_is_not_sent_once_the_deadline_passed(clock):
+  gateway, responses = _gateway(
+    [_response()], requests_per_minute = 1, tokens_per_minute = 0, deadline_seconds = 60
+  )
+  gateway.request_bucket.reserve(1)
+  # the budget wait fits in the deadline, the sleep overshoots it
+  clock.now += 1
+  clock.oversleep = 5
+  with pytest.raises(LLMUnavailableError):
+    gateway.parse(input = "w2")
+  assert responses.timeouts == []
+  assert gateway.stats()["in_flight"] == 0
+
+def test_token_budget_is_settled_with_the_usage(clock):
+  gateway, _ = _gateway(
+    [_response(total_tokens = 1500)], requests_per_minute = 0, tokens_per_minute = 6000
+  )
+  gateway.parse(estimated_tokens = 1000, input = "w2")
+  # 1500 used, 4500 left
+  assert gateway.token_bucket.reserve(4500) == 0
+  assert gateway.token_bucket.reserve(100) == pytest.approx(1)
+
+def test_parse_async_retries_without_a_thread(clock):
+  responses = _FakeAsyncResponses([_error(429, retry_after = "2"), _response()])
+  gateway = LLMGateway(
+    client = SimpleNamespace(responses = _FakeResponses([])),
+    async_client = SimpleNamespace(responses = responses)
+  )
+  response = asyncio.run(gateway.parse_async(input = "w2"))
+
+  assert response.usage.total_tokens == 900
+  assert clock.sleeps == [2.0]
+  assert gateway.stats()["retries"] == 1
+
+def test_parse_async_runs_a_sync_only_client_in_a_thread(clock):
+  gateway, responses = _gateway([_response()])
+  assert gateway.async_client is None
+  response = asyncio.run(gateway.parse_async(input = "w2"))
+  assert response.usage.total_tokens == 900
+  assert responses.outcomes == []
+
+def test_openai_is_only_imported_with_a_gateway():
+  script = (
+    "import sys\n"
+    "import services.llm_gateway\n"
+    "assert 'openai' not in sys.modules\n"
+    "services.llm_gateway.LLMGateway(api_key = 'test')\n"
+    "assert 'openai' in sys.modules\n"
+  )
+  subprocess.run([sys.executable, "-c", script], cwd = BACKEND_DIR, check = True)
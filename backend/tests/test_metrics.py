@@ -0,0 +1,114 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+
+from services.metrics import MetricsRegistry
+
+def _registry() -> MetricsRegistry:
+  registry = MetricsRegistry()
+  registry.counter("requests_total", "Requests", ("route",))
+  registry.histogram("latency_seconds", "Latency", buckets = (0.1, 1))
+  return registry
+
+def _samples(text: str) -> dict:
+  return {
+    line.rsplit(" ", 1)[0] : float(line.rsplit(" ", 1)[1])
+    for line in text.splitlines() if line and not line.startswith("#")
+  }
+
+def _exited_pid() -> int:
+  process = subprocess.Popen([sys.executable, "-c", "pass"])
+  process.wait()
+  return process.pid
+
+# A snapshot as written by another worker of the same server
+def _write_worker(directory, pid: int, snapshot: dict, server: int | None = None) -> None:
+  server = os.getppid() if server is None else server
+  (directory / f"{server}-{pid}-1.json").write_text(json.dumps(snapshot))
+
+@pytest.fixture
+def registry(tmp_path):
+  registry = _registry()
+  yield registry
+  registry.disable_multiprocess()
+
+def test_single_process_render():
+  registry = _registry()
+  registry.counter("requests_total", "", ("route",)).inc(route = "/a")
+  registry.histogram("latency_seconds", "").observe(0.5)
+  registry.gauge("in_flight", "In flight", lambda: 3)
+  registry.gauge("broken", "Broken", lambda: 1 / 0)
+
+  samples = _samples(registry.render())
+  assert samples['requests_total{route="/a"}'] == 1
+  assert samples['latency_seconds_bucket{le="0.1"}'] == 0
+  assert samples['latency_seconds_bucket{le="1"}'] == 1
+  assert samples['latency_seconds_bucket{le="+Inf"}'] == 1
+  assert samples["latency_seconds_sum"] == 0.5
+  assert samples["in_flight"] == 3
+  assert "broken" not in samples
+
+def test_workers_are_added_up(registry, tmp_path):
+  registry.counter("requests_total", "", ("route",)).inc(2, route = "/a")
+  registry.histogram("latency_seconds", "").observe(0.05)
+  registry.gauge("in_flight", "In flight", lambda: 3)
+  registry.gauge("jobs_pending", "Shared", lambda: 7, aggregate = "max")
+  registry.enable_multiprocess(tmp_path, flush_seconds = 60)
+
+  other = _registry()
+  other.counter("requests_total", "", ("route",)).inc(route = "/a")
+  other.counter("requests_total", "", ("route",)).inc(route = "/b")
+  other.histogram("latency_seconds", "").observe(5)
+  other.gauge("in_flight", "", lambda: 4)
+  other.gauge("jobs_pending", "", lambda: 7, aggregate = "max")
+  # a live process standing in for the other worker
+  _write_worker(tmp_path, os.getpid(), other.snapshot())
+
+  samples = _samples(registry.render())
+  assert samples['requests_total{route="/a"}'] == 3
+  assert samples['requests_total{route="/b"}'] == 1
+  assert samples['latency_seconds_bucket{le="0.1"}'] == 1
+  assert samples['latency_seconds_bucket{le="+Inf"}'] == 2
+  assert samples["latency_seconds_count"] == 2
+  assert samples["in_flight"] == 7
+  assert samples["jobs_pending"] == 7
+
+def test_exited_workers_keep_counting_without_gauges(registry, tmp_path):
+  registry.gauge("in_flight", "In flight", lambda: 1)
+  registry.enable_multiprocess(tmp_path, flush_seconds = 60)
+
+  exited = _registry()
+  exited.counter("requests_total", "", ("route",)).inc(5, route = "/a")
+  exited.gauge("in_flight", "", lambda: 100)
+  _write_worker(tmp_path, _exited_pid(), exited.snapshot())
+
+  samples = _samples(registry.render())
+  assert samples['requests_total{route="/a"}'] == 5
+  assert samples["in_flight"] == 1
+
+def test_previous_server_runs_are_deleted(registry, tmp_path):
+  snapshot = { "requests_total" : [[["/a"], 5]] }
+  _write_worker(tmp_path, _exited_pid(), snapshot, server = 1)
+  # another server sharing the directory, still running
+  _write_worker(tmp_path, os.getpid(), snapshot, server = 1)
+
+  registry.enable_multiprocess(tmp_path, flush_seconds = 60)
+  assert len(list(tmp_path.glob("1-*.json"))) == 1
+  # only workers of this server are added up
+  assert 'requests_total{route="/a"}' not in _samples(registry.render())
+
+def test_snapshot_is_written_on_flush_and_disable(registry, tmp_path):
+  counter = registry.counter("requests_total", "", ("route",))
+  registry.enable_multiprocess(tmp_path, flush_seconds = 60)
+  path, = tmp_path.glob("*.json")
+  assert json.loads(path.read_text())["requests_total"] == []
+
+  counter.inc(route = "/a")
+  registry.disable_multiprocess()
+  assert json.loads(path.read_text())["requests_total"] == [[["/a"], 1]]
+
+def test_unknown_gauge_aggregate():
+  with pytest.raises(ValueError):
+    MetricsRegistry().gauge("g", "", lambda: 1, aggregate = "mean")
@@ -0,0 +1,101 @@
+from decimal import Decimal
+import json
+import pytest
+
+from models.user_pii import FilingType
+from tax_policy.policy_registry import (
+  TaxPolicyNotFoundError,
+  TaxPolicyRegistry,
+  get_bracket_schedule,
+  get_tax_policy
+)
+
+# 2024 standard deductions, IRS Rev. Proc. 2023-34
+STANDARD_DEDUCTIONS = {
+  FilingType.single : "14600",
+  FilingType.married_joint : "29200",
+  FilingType.married_separate : "14600",
+  FilingType.head_of_household : "21900",
+  FilingType.qualifying_spouse : "29200",
+}
+
+@pytest.mark.parametrize("filing_status", list(FilingType))
+def test_2024_policy_of_every_filing_status(filing_status):
+  policy = get_tax_policy(2024, filing_status)
+  assert policy.tax_year == 2024
+  assert policy.filing_status == filing_status
+  assert policy.standard_deduction == Decimal(STANDARD_DEDUCTIONS[filing_status])
+
+  brackets = policy.brackets
+  assert [b.rate for b in brackets] == [
+    Decimal(rate) for rate in ("0.10", "0.12", "0.22", "0.24", "0.32", "0.35", "0.37")
+  ]
+  assert brackets[0].lower_limit == 0
+  assert brackets[-1].upper_limit is None
+  # contiguous
+  for lower, upper in zip(brackets, brackets[1:]):
+    assert upper.lower_limit == lower.upper_limit
+
+@pytest.mark.parametrize("filing_status", list(FilingType))
+def test_bracket_schedule_is_compiled_once(filing_status):
+  schedule = get_bracket_schedule(2024, filing_status)
+  assert get_bracket_schedule(2024, filing_status) is schedule
+  assert schedule.brackets == get_tax_policy(2024, filing_status).brackets
+
+def test_unknown_year():
+  with pytest.raises(TaxPolicyNotFoundError):
+    get_tax_policy(1999, FilingType.single)
+
+def _write_policy(path, tax_year: int, statuses: dict) -> None:
+  path.write_text(json.dumps({
+    "tax_year" : tax_year,
+    "version" : f"{tax_year}.test",
+    "filing_statuses" : statuses
+  }))
+
+def test_years_are_loaded_on_first_use(tmp_path):
+  _write_policy(tmp_path / "2030.json", 2030, {
+    "Single" : {
+      "standard_deduction" : "20000",
+      "brackets" : [{ "rate" : "0.1", "up_to" : "1000" }, { "rate" : "0.2", "up_to" : None }]
+    }
+  })
+  (tmp_path / "2031.toml").write_text("this is not parsed until 2031 is requested")
+
+  registry = TaxPolicyRegistry(tmp_path)
+  assert registry.available_years() == [2030, 2031]
+
+  policy = registry.get(2030, FilingType.single)
+  assert policy.version == "2030.test"
+  assert policy.brackets[1].lower_limit == Decimal("1000")
+  assert registry.get(2030, FilingType.single) is policy
+  with pytest.raises(TaxPolicyNotFoundError):
+    registry.get(2030, FilingType.married_joint)
+  with pytest.raises(ValueError):
+    registry.get(2031, FilingType.single)
+
+def test_toml_policy(tmp_path):
+  (tmp_path / "2032.toml").write_text("""
+tax_year = 2032
+version = "2032.1"
+
+[filing_statuses.Single]
+standard_deduction = "15000"
+brackets = [{ rate = "0.1", up_to = "10000" }, { rate = "0.3" }]
+""")
+  policy = TaxPolicyRegistry(tmp_path).get(2032, FilingType.single)
+  assert policy.standard_deduction == Decimal("15000")
+  assert policy.brackets[-1].upper_limit is None
+
+@pytest.mark.parametrize("tax_year, brackets", [
+  # file named after another year
+  (2034, [{ "rate" : "0.1", "up_to" : None }]),
+  # open ended bracket that is not the last one
+  (2033, [{ "rate" : "0.1", "up_to" : None }, { "rate" : "0.2", "up_to" : None }]),
+])
+def test_invalid_policy_files(tmp_path, tax_year, brackets):
+  _write_policy(tmp_path / "2033.json", tax_year, {
+    "Single" : { "standard_deduction" : "1", "brackets" : brackets }
+  })
+  with pytest.raises(ValueError):
+    TaxPolicyRegistry(tmp_path).get(2033, FilingType.single)
@@ -0,0 +1,177 @@
+from decimal import Decimal
+from pathlib import Path
+from types import SimpleNamespace
+import asyncio
+import pytest
+
+from api import endpoints
+from core import config
+from models.tax_schema import TaxReturnSummary
+from models.user_pii import UserPII
+from services.document_store import InMemoryDocumentStore
+from services.single_flight import SingleFlight
+from services.upload_ingestion import SpooledUpload
+
+def test_concurrent_calls_share_one_execution():
+  async def scenario():
+    flight = SingleFlight()
+    calls = 0
+    release = asyncio.Event()
+
+    async def work():
+      nonlocal calls
+      calls += 1
+      await release.wait()
+      return "result"
+
+    callers = [asyncio.create_task(flight.run("key", work)) for _ in range(5)]
+    await asyncio.sleep(0)
+    assert flight.in_flight() == 1
+    assert flight.running("key") and not flight.running("other")
+    release.set()
+    results = await asyncio.gather(*callers)
+    return calls, results, flight.in_flight(), flight.running("key")
+
+  calls, results, in_flight, running = asyncio.run(scenario())
+  assert calls == 1
+  assert not running
+  assert [result for result, _ in results] == ["result"] * 5
+  assert [shared for _, shared in results] == [False, True, True, True, True]
+  assert in_flight == 0
+
+def test_different_keys_run_separately():
+  async def scenario():
+    flight = SingleFlight()
+    return await asyncio.gather(
+      flight.run("a", lambda: asyncio.sleep(0, "a")),
+      flight.run("b", lambda: asyncio.sleep(0, "b"))
+    )
+
+  assert asyncio.run(scenario()) == [("a", False), ("b", False)]
+
+def test_completed_calls_are_not_cached():
+  async def scenario():
+    flight = SingleFlight()
+    calls = []
+
+    async def work():
+      calls.append(1)
+      return len(calls)
+
+    return [await flight.run("key", work) for _ in range(2)]
+
+  assert asyncio.run(scenario()) == [(1, False), (2, False)]
+
+def test_exception_is_shared_and_not_kept():
+  async def scenario():
+    flight = SingleFlight()
+    release = asyncio.Event()
+
+    async def fail():
+      await release.wait()
+      raise ValueError("boom")
+
+    callers = [asyncio.create_task(flight.run("key", fail)) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*callers, return_exceptions = True)
+    again = await flight.run("key", lambda: asyncio.sleep(0, "ok"))
+    return results, again
+
+  results, again = asyncio.run(scenario())
+  assert all(isinstance(result, ValueError) for result in results)
+  assert again == ("ok", False)
+
+def test_cancelled_caller_does_not_cancel_the_others():
+  async def scenario():
+    flight = SingleFlight()
+    release = asyncio.Event()
+
+    async def work():
+      await release.wait()
+      return "result"
+
+    first = asyncio.create_task(flight.run("key", work))
+    second = asyncio.create_task(flight.run("key", work))
+    await asyncio.sleep(0)
+    first.cancel()
+    await asyncio.sleep(0)
+    release.set()
+    return first, await second
+
+  first, second = asyncio.run(scenario())
+  assert first.cancelled()
+  assert second == ("result", True)
+
+SUMMARY = TaxReturnSummary(
+  forms_submitted = ["W-2"],
+  total_income = Decimal("50000"),
+  taxable_income = Decimal("35400"),
+  total_tax_withheld = Decimal("5000"),
+  estimated_tax_due = Decimal("4016"),
+  estimated_refund = Decimal("984"),
+  amount_owed = Decimal("0")
+)
+
+PII = UserPII.model_validate({
+  "first_name_middle_initial" : "Jane Q",
+  "last_name" : "Public",
+  "ssn" : "123-45-6789",
+  "address" : "1 Main St",
+  "city" : "Springfield",
+  "state" : "IL",
+  "zip_code" : "62701",
+  "filing_status" : "Single",
+})
+
+def _upload(sha256: str) -> SpooledUpload:
+  return SpooledUpload(
+    field_name = "files", filename = "w2.pdf", path = Path("w2.pdf"), size = 1, sha256 = sha256
+  )
+
+def test_submission_key():
+  key = endpoints._submission_key([_upload("a"), _upload("b")], PII)
+  assert endpoints._submission_key([_upload("a"), _upload("b")], PII) == key
+  # other documents, another order, another taxpayer
+  assert endpoints._submission_key([_upload("a")], PII) != key
+  assert endpoints._submission_key([_upload("b"), _upload("a")], PII) != key
+  other = PII.model_copy(update = { "last_name" : "Other" })
+  assert endpoints._submission_key([_upload("a"), _upload("b")], other) != key
+
+@pytest.mark.parametrize("coalesce, runs", [(True, 1), (False, 3)])
+def test_identical_submissions_get_their_own_document(monkeypatch, coalesce, runs):
+  monkeypatch.setattr(config, "SUBMIT_COALESCE_IDENTICAL", coalesce)
+  store = InMemoryDocumentStore(max_bytes = 1024 * 1024, retention_seconds = 60)
+  context = SimpleNamespace(document_store = store, in_flight_submissions = SingleFlight())
+  document_ids = [f"document{i}.pdf" for i in range(3)]
+
+  async def scenario():
+    calls = []
+    release = asyncio.Event()
+
+    def run(document_id):
+      async def pipeline():
+        calls.append(document_id)
+        await release.wait()
+        store.put(document_id, b"%PDF-1.7 " + document_id.encode())
+        return SUMMARY
+      return pipeline
+
+    callers = [
+      asyncio.create_task(endpoints._coalesced(context, "key", document_id, run(document_id)))
+      for document_id in document_ids
+    ]
+    await asyncio.sleep(0)
+    release.set()
+    return calls, await asyncio.gather(*callers)
+
+  calls, summaries = asyncio.run(scenario())
+  assert len(calls) == runs
+  assert summaries == [SUMMARY] * 3
+  # every caller can download its own document
+  for document_id in document_ids:
+    assert b"".join(store.read(document_id)).startswith(b"%PDF-1.7 document")
+  if coalesce:
+    assert {b"".join(store.read(document_id)) for document_id in document_ids} == {
+      b"%PDF-1.7 document0.pdf"
+    }
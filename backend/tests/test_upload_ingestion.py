@@ -0,0 +1,198 @@
+import asyncio
+import tempfile
+import uuid
+import pymupdf
+import pytest
+
+from services.upload_ingestion import (
+  UploadLimits,
+  UploadRejected,
+  ingest_multipart,
+  sniff_pdf,
+  verify_pdf_uploads
+)
+
+LIMITS = UploadLimits(
+  max_file_bytes = 64 * 1024,
+  max_request_bytes = 200 * 1024,
+  max_files = 3,
+  max_field_bytes = 256,
+  max_fields = 4
+)
+
+def _pdf(pages: int = 1) -> bytes:
+  with pymupdf.open() as doc:
+    for _ in range(pages):
+      doc.new_page()
+    return doc.tobytes()
+
+# Head of a linearized PDF, which declares its page count
+def _linearized_head(pages: int) -> bytes:
+  return (
+    b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n"
+    b"1 0 obj\n<< /Linearized 1 /L 123456 /H [ 600 200 ] /O 5 /E 9000 "
+    + f"/N {pages} /T 120000 >>\nendobj\n".encode()
+  ).ljust(2048, b" ")
+
+def _body(fields: dict, files: list, boundary: str) -> bytes:
+  parts = []
+  for name, value in fields.items():
+    parts.append(
+      f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+      f"{value}\r\n".encode()
+    )
+  for name, filename, data in files:
+    parts.append(
+      f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+      f'filename="{filename}"\r\nContent-Type: application/pdf\r\n\r\n'.encode()
+      + data + b"\r\n"
+    )
+  parts.append(f"--{boundary}--\r\n".encode())
+  return b"".join(parts)
+
+def _ingest(
+  fields: dict = None,
+  files: list = (),
+  body: bytes | None = None,
+  content_length: int | None = -1,
+  chunk_size: int = 1000,
+  limits: UploadLimits = LIMITS,
+  max_pages: int | None = 10
+):
+  boundary = uuid.uuid4().hex
+  if body is None:
+    body = _body(fields or {}, list(files), boundary)
+
+  async def chunks():
+    for offset in range(0, len(body), chunk_size):
+      yield body[offset : offset + chunk_size]
+
+  return asyncio.run(ingest_multipart(
+    chunks(),
+    content_type = f"multipart/form-data; boundary={boundary}",
+    content_length = len(body) if content_length == -1 else content_length,
+    limits = limits,
+    file_field = "files",
+    suffix = ".pdf",
+    sniff = sniff_pdf,
+    max_pages = max_pages
+  ))
+
+@pytest.fixture(autouse = True)
+def spool_dir(tmp_path, monkeypatch):
+  monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+  return tmp_path
+
+def _rejected(status_code: int, **kwargs) -> str:
+  with pytest.raises(UploadRejected) as e:
+    _ingest(**kwargs)
+  assert e.value.status_code == status_code
+  return e.value.message
+
+def test_fields_and_files_are_spooled(spool_dir):
+  first, second = _pdf(1), _pdf(2)
+  fields, uploads = _ingest(
+    fields = { "last_name" : "Public", "state" : "IL" },
+    files = [("files", "w2.pdf", first), ("files", "../1099.pdf", second)]
+  )
+  assert fields == { "last_name" : "Public", "state" : "IL" }
+  assert [upload.filename for upload in uploads] == ["w2.pdf", "1099.pdf"]
+  assert [upload.path.read_bytes() for upload in uploads] == [first, second]
+  assert uploads[0].size == len(first)
+  assert all(upload.path.parent == spool_dir for upload in uploads)
+
+  # identical files, identical digests
+  _, again = _ingest(files = [("files", "copy.pdf", first)])
+  assert again[0].sha256 == uploads[0].sha256 != uploads[1].sha256
+
+def test_declared_content_length_over_limit(spool_dir):
+  message = _rejected(413, files = [("files", "w2.pdf", _pdf())], content_length = 10 ** 9)
+  assert message == "The upload is too large."
+
+def test_streamed_body_over_limit(spool_dir):
+  files = [("files", f"{i}.pdf", _pdf() + b" " * 60_000) for i in range(3)]
+  limits = LIMITS.model_copy(update = { "max_request_bytes" : 100 * 1024 })
+  _rejected(413, files = files, content_length = None, limits = limits)
+  assert list(spool_dir.iterdir()) == []
+
+def test_file_over_limit(spool_dir):
+  message = _rejected(413, files = [("files", "big.pdf", _pdf() + b" " * 70_000)])
+  assert message.startswith("big.pdf is larger than")
+  assert list(spool_dir.iterdir()) == []
+
+def test_field_over_limit(spool_dir):
+  _rejected(413, fields = { "address" : "x" * 300 })
+
+def test_too_many_fields(spool_dir):
+  message = _rejected(413, fields = { f"field{i}" : "x" for i in range(5) })
+  assert message == "Too many form fields."
+
+def test_too_many_files(spool_dir):
+  _rejected(400, files = [("files", f"{i}.pdf", _pdf()) for i in range(4)])
+  assert list(spool_dir.iterdir()) == []
+
+def test_declared_page_count_over_limit(spool_dir):
+  message = _rejected(413, files = [("files", "scan.pdf", _linearized_head(11))])
+  assert message == "scan.pdf has more than 10 pages."
+  assert list(spool_dir.iterdir()) == []
+
+def test_declared_page_count_within_limit():
+  _, uploads = _ingest(files = [("files", "scan.pdf", _linearized_head(3))])
+  assert uploads[0].page_count == 3
+
+@pytest.mark.parametrize("data", [b"PK\x03\x04 a zip", b"<html>", b""])
+def test_not_a_pdf(spool_dir, data):
+  message = _rejected(400, files = [("files", "w2.pdf", data)])
+  assert message.startswith("Invalid file type: w2.pdf.")
+  assert list(spool_dir.iterdir()) == []
+
+def test_unexpected_file_field():
+  _rejected(400, files = [("other", "w2.pdf", _pdf())])
+
+def test_not_multipart():
+  with pytest.raises(UploadRejected) as e:
+    asyncio.run(ingest_multipart(
+      None, "application/json", 10, LIMITS, "files", ".pdf", sniff_pdf
+    ))
+  assert e.value.status_code == 400
+
+async def _chunks(body: bytes):
+  yield body
+
+def test_truncated_body(spool_dir):
+  body = _body({ "state" : "IL" }, [("files", "w2.pdf", _pdf())], "b" * 32)
+  with pytest.raises(UploadRejected) as e:
+    asyncio.run(ingest_multipart(
+      _chunks(body[:-200]),
+      f"multipart/form-data; boundary={'b' * 32}",
+      None, LIMITS, "files", ".pdf", sniff_pdf
+    ))
+  assert e.value.status_code == 400
+  assert e.value.message == "The upload is incomplete."
+  assert list(spool_dir.iterdir()) == []
+
+def test_malformed_body(spool_dir):
+  with pytest.raises(UploadRejected) as e:
+    asyncio.run(ingest_multipart(
+      _chunks(b"this is not multipart at all\r\n"),
+      f"multipart/form-data; boundary={'b' * 32}",
+      None, LIMITS, "files", ".pdf", sniff_pdf
+    ))
+  assert e.value.status_code == 400
+
+def test_verify_counts_pages():
+  _, uploads = _ingest(files = [("files", "w2.pdf", _pdf(3))])
+  verify_pdf_uploads(uploads, max_pages = 10)
+  assert uploads[0].page_count == 3
+
+def test_verify_rejects_too_many_pages():
+  _, uploads = _ingest(files = [("files", "w2.pdf", _pdf(4))])
+  with pytest.raises(UploadRejected) as e:
+    verify_pdf_uploads(uploads, max_pages = 3)
+  assert e.value.status_code == 413
+
+def test_verify_rejects_damaged_pdf():
+  _, uploads = _ingest(files = [("files", "w2.pdf", b"%PDF-1.7\n" + b"garbage" * 10)])
+  with pytest.raises(UploadRejected) as e:
+    verify_pdf_uploads(uploads, max_pages = 10)
+  assert e.value.status_code == 400
@@ -1,9 +1,162 @@
+import io
+import os
+import threading
+import time
+import uuid
 import requests
+from requests.adapters import HTTPAdapter
 from typing import List, Optional, Any
+from urllib3.util.retry import Retry
 
-from config import SUBMIT_ENDPOINT, GET_FORM_ENDPOINT
+from config import (
+  SUBMIT_ENDPOINT,
+  GET_FORM_ENDPOINT,
+  BACKEND_CONNECT_TIMEOUT_SECONDS,
+  BACKEND_READ_TIMEOUT_SECONDS,
+  BACKEND_MAX_RETRIES,
+  BACKEND_MAX_CONNECTIONS
+)
 from user_pii_model import FrontUserPII
 
+TIMEOUT = (BACKEND_CONNECT_TIMEOUT_SECONDS, BACKEND_READ_TIMEOUT_SECONDS)
+
+_session : Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+# One keep-alive connection pool for every Streamlit user session (the
+# module is imported once per server process, not on every rerun)
+def _get_session() -> requests.Session:
+  global _session
+  with _session_lock:
+    if _session is None:
+      retry = Retry(
+        total = BACKEND_MAX_RETRIES,
+        # failed connections are retried for any method, nothing was sent
+        connect = BACKEND_MAX_RETRIES,
+        # a submission whose answer was lost may have been processed,
+        # it is not sent again
+        read = 0,
+        status = BACKEND_MAX_RETRIES,
+        status_forcelist = (502, 503, 504),
+        # a submission answered 502 / 503 / 504 may have reached the LLM,
+        # only the one the backend did not start is sent again, by
+        # submit_tax_form
+        allowed_methods = frozenset({ "GET" }),
+        backoff_factor = 0.5,
+        respect_retry_after_header = True,
+        # the last 502 / 503 / 504 response is returned, not raised
+        raise_on_status = False
+      )
+      adapter = HTTPAdapter(
+        pool_connections = 1,
+        pool_maxsize = BACKEND_MAX_CONNECTIONS,
+        max_retries = retry
+      )
+      session = requests.Session()
+      session.mount("http://", adapter)
+      session.mount("https://", adapter)
+      _session = session
+    return _session
+
+# multipart/form-data body read straight from the uploaded files, part by
+# part, instead of being assembled in memory. Seekable, so a retried
+# request sends it again from the start, and sized, so it goes out with a
+# Content-Length (the backend checks it before reading the body).
+class MultipartBody(io.RawIOBase):
+  def __init__(self, fields : dict, files : List[Any]):
+    self.boundary = uuid.uuid4().hex
+    # (bytes or file, size)
+    self._parts : List[tuple] = []
+
+    for name, value in fields.items():
+      self._add(
+        f'--{self.boundary}\r\n'
+        f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+        f'{value}\r\n'.encode("utf-8")
+      )
+
+    for f in files:
+      filename = f.name.replace('"', "%22").replace("\r", "").replace("\n", "")
+      self._add(
+        f'--{self.boundary}\r\n'
+        f'Content-Disposition: form-data; name="files"; filename="{filename}"\r\n'
+        f'Content-Type: {f.type or "application/octet-stream"}\r\n\r\n'
+        .encode("utf-8")
+      )
+      f.seek(0, os.SEEK_END)
+      self._parts.append((f, f.tell()))
+      self._add(b"\r\n")
+
+    self._add(f"--{self.boundary}--\r\n".encode("utf-8"))
+    self.size = sum(size for _, size in self._parts)
+    self._position = 0
+
+  def _add(self, data : bytes) -> None:
+    self._parts.append((data, len(data)))
+
+  @property
+  def content_type(self) -> str:
+    return f"multipart/form-data; boundary={self.boundary}"
+
+  def __len__(self) -> int:
+    return self.size
+
+  def readable(self) -> bool:
+    return True
+
+  def seekable(self) -> bool:
+    return True
+
+  def tell(self) -> int:
+    return self._position
+
+  def seek(self, offset : int, whence : int = os.SEEK_SET) -> int:
+    if whence == os.SEEK_CUR:
+      offset += self._position
+    elif whence == os.SEEK_END:
+      offset += self.size
+    self._position = min(max(offset, 0), self.size)
+    return self._position
+
+  def read(self, size : int = -1) -> bytes:
+    if size is None or size < 0:
+      size = self.size - self._position
+
+    chunks = []
+    start = 0
+    for part, length in self._parts:
+      end = start + length
+      if size <= 0:
+        break
+      if self._position < end:
+        offset = self._position - start
+        count = min(size, length - offset)
+        if isinstance(part, bytes):
+          chunk = part[offset : offset + count]
+        else:
+          part.seek(offset)
+          chunk = part.read(count)
+        chunks.append(chunk)
+        self._position += len(chunk)
+        size -= len(chunk)
+      start = end
+    return b"".join(chunks)
+
+# 503 the backend answers when all its workers are busy, before starting
+# the submission. Its other 503 (document analysis overloaded) comes after
+# LLM calls were made and is not retried.
+def _not_started(response : requests.Response) -> bool:
+  return (
+    response.status_code == 503
+    and response.headers.get("X-Submission-Started") == "false"
+  )
+
+def _retry_after(response : requests.Response) -> float:
+  try:
+    return max(0.0, float(response.headers.get("Retry-After", "")))
+  except ValueError:
+    return 5.0
+
 # Sends multipart/form-data with:
 #   - files : between 1 to 3 PDFs
 #   - PII   : fields matching backend FastAPI params
@@ -13,16 +166,20 @@ def submit_tax_form(
   pii : FrontUserPII
 ) -> Optional[dict]:
   try:
-    files_data = []
-
-    for f in files:
-      files_data.append(("files", (f.name, f.getvalue(), f.type)))
+    body = MultipartBody(pii.model_dump(mode = "json", exclude_none = True), files)
 
-    response = requests.post( 
-      SUBMIT_ENDPOINT,
-      data = pii.model_dump(),
-      files = files_data
-    )
+    for attempt in range(BACKEND_MAX_RETRIES + 1):
+      body.seek(0)
+      response = _get_session().post(
+        SUBMIT_ENDPOINT,
+        data = body,
+        # Content-Length from len(body)
+        headers = { "Content-Type" : body.content_type },
+        timeout = TIMEOUT
+      )
+      if not _not_started(response) or attempt == BACKEND_MAX_RETRIES:
+        break
+      time.sleep(_retry_after(response))
 
     if response.status_code == 200:
       return response.json()
@@ -43,7 +200,7 @@ def get_form_from_server(document_id : str) -> Optional[bytes]:
   try:
     url = f"{GET_FORM_ENDPOINT}/{document_id}"
 
-    response = requests.get(url)
+    response = _get_session().get(url, timeout = TIMEOUT)
 
     if response.status_code == 200:
       return response.content
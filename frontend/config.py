@@ -1,4 +1,24 @@
+import os
+
 # Server configuration
 SERVER_URL = "https://ai-tax-return-f117a8fd9825.herokuapp.com"
-SUBMIT_ENDPOINT = f"{SERVER_URL}/api/submit_tax_form"
-GET_FORM_ENDPOINT = f"{SERVER_URL}/api/documents"
+# Backend as reached from the Streamlit server. In the Docker image both run
+# in the same container, so requests go to uvicorn on localhost instead of
+# out through the public router and nginx.
+INTERNAL_BACKEND_URL = os.getenv("INTERNAL_BACKEND_URL", SERVER_URL).rstrip("/")
+SUBMIT_ENDPOINT = f"{INTERNAL_BACKEND_URL}/api/submit_tax_form"
+GET_FORM_ENDPOINT = f"{INTERNAL_BACKEND_URL}/api/documents"
+
+# Backend requests: connect and read timeouts (a submission is answered
+# once its Form 1040 is generated), and retries honoring Retry-After: of
+# failed connections, of downloads answered 502 / 503 / 504 and of
+# submissions answered 503 before the backend started them
+BACKEND_CONNECT_TIMEOUT_SECONDS = float(
+  os.getenv("BACKEND_CONNECT_TIMEOUT_SECONDS", "5")
+)
+BACKEND_READ_TIMEOUT_SECONDS = float(
+  os.getenv("BACKEND_READ_TIMEOUT_SECONDS", "300")
+)
+BACKEND_MAX_RETRIES = int(os.getenv("BACKEND_MAX_RETRIES", "3"))
+# Keep-alive connections to the backend, shared by all user sessions
+BACKEND_MAX_CONNECTIONS = int(os.getenv("BACKEND_MAX_CONNECTIONS", "10"))
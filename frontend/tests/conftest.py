@@ -0,0 +1,10 @@
+import os
+import sys
+
+FRONTEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if FRONTEND_DIR not in sys.path:
+  sys.path.insert(0, FRONTEND_DIR)
+
+# config is read on import: retries of every kind, against no real backend
+os.environ["INTERNAL_BACKEND_URL"] = "http://backend.test"
+os.environ["BACKEND_MAX_RETRIES"] = "3"
@@ -0,0 +1,180 @@
+from email.parser import BytesParser
+from email.policy import HTTP
+import io
+import json
+import os
+import requests
+from requests.adapters import HTTPAdapter
+import pytest
+
+import api_client
+from api_client import MultipartBody, submit_tax_form
+from user_pii_model import FrontUserPII
+
+PII = FrontUserPII(
+  first_name_middle_initial = "Jane Q",
+  last_name = "Public",
+  ssn = "123-45-6789",
+  address = "1 Main St",
+  city = "Springfield",
+  state = "IL",
+  zip_code = "62701"
+)
+
+# Stands in for Streamlit's UploadedFile, recording how much each read asks
+class _Upload(io.BytesIO):
+  def __init__(self, name: str, data: bytes, type: str = "application/pdf"):
+    super().__init__(data)
+    self.name = name
+    self.type = type
+    self.reads = []
+
+  def read(self, size: int = -1) -> bytes:
+    self.reads.append(size)
+    return super().read(size)
+
+def _uploads() -> list:
+  return [
+    _Upload("w2.pdf", b"%PDF-1.7 " + bytes(range(256)) * 400),
+    _Upload('nec "2024".pdf', b"%PDF-1.7 nec")
+  ]
+
+def _parse(body: bytes, content_type: str) -> list:
+  message = BytesParser(policy = HTTP).parsebytes(
+    f"Content-Type: {content_type}\r\n\r\n".encode() + body
+  )
+  return [
+    (part.get_param("name", header = "content-disposition"),
+     part.get_filename(),
+     part.get_content_type(),
+     part.get_payload(decode = True))
+    for part in message.iter_parts()
+  ]
+
+def test_body_is_the_multipart_encoding_of_fields_and_files():
+  uploads = _uploads()
+  body = MultipartBody({ "last_name" : "Public", "state" : "IL" }, uploads)
+  data = body.read()
+
+  assert len(data) == len(body) == body.size
+  assert _parse(data, body.content_type) == [
+    ("last_name", None, "text/plain", b"Public"),
+    ("state", None, "text/plain", b"IL"),
+    ("files", "w2.pdf", "application/pdf", uploads[0].getvalue()),
+    ("files", "nec %222024%22.pdf", "application/pdf", uploads[1].getvalue())
+  ]
+
+def test_body_is_read_in_pieces_without_loading_the_files():
+  uploads = _uploads()
+  body = MultipartBody({ "last_name" : "Public" }, uploads)
+  whole = body.read()
+  body.seek(0)
+  for upload in uploads:
+    upload.reads.clear()
+
+  chunks = iter(lambda: body.read(1000), b"")
+  assert b"".join(chunks) == whole
+  # never more of a file than was asked for
+  assert max(uploads[0].reads) <= 1000
+  assert body.read() == b""
+
+def test_body_seeks_like_a_file():
+  body = MultipartBody({ "last_name" : "Public" }, _uploads())
+  whole = body.read()
+
+  assert body.seek(-10, os.SEEK_END) == len(whole) - 10
+  assert body.read() == whole[-10:]
+  body.seek(100)
+  assert body.seek(50, os.SEEK_CUR) == 150
+  assert body.read(20) == whole[150:170]
+  assert body.seek(len(whole) + 10) == len(whole)
+  assert body.seek(-1) == 0
+
+# Answers the requests of a session in turn, recording the bodies sent
+class _Backend(HTTPAdapter):
+  def __init__(self, responses: list):
+    super().__init__()
+    self.responses = list(responses)
+    self.requests = []
+
+  def send(self, request, **kwargs):
+    body = request.body.read() if hasattr(request.body, "read") else request.body
+    self.requests.append((request, body))
+
+    status_code, headers, content = self.responses.pop(0)
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers)
+    response._content = json.dumps(content).encode()
+    response.request = request
+    response.url = request.url
+    return response
+
+@pytest.fixture
+def backend(monkeypatch):
+  def mount(*responses) -> _Backend:
+    adapter = _Backend(responses)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    monkeypatch.setattr(api_client, "_session", session)
+    return adapter
+  return mount
+
+@pytest.fixture
+def sleeps(monkeypatch) -> list:
+  sleeps = []
+  monkeypatch.setattr(api_client.time, "sleep", sleeps.append)
+  return sleeps
+
+BUSY = (503, { "Retry-After" : "2", "X-Submission-Started" : "false" }, { "error" : "busy" })
+RESULT = { "document_id" : "a.pdf", "tax_return_summary" : {} }
+
+def test_submission_is_sent_again_when_not_started(backend, sleeps):
+  adapter = backend(BUSY, BUSY, (200, {}, RESULT))
+  assert submit_tax_form(_uploads(), PII) == RESULT
+
+  assert sleeps == [2.0, 2.0]
+  bodies = [body for _, body in adapter.requests]
+  assert len(bodies) == 3
+  # the whole body, every time
+  assert bodies[0] == bodies[1] == bodies[2]
+  request = adapter.requests[-1][0]
+  # streamed from the uploads, not assembled by requests
+  assert isinstance(request.body, MultipartBody)
+  assert request.headers["Content-Length"] == str(len(bodies[0]))
+  assert request.headers["Content-Type"].startswith("multipart/form-data; boundary=")
+
+def test_submission_gives_up_after_max_retries(backend, sleeps):
+  adapter = backend(*[BUSY] * 4)
+  assert submit_tax_form(_uploads(), PII) is None
+  assert len(adapter.requests) == api_client.BACKEND_MAX_RETRIES + 1 == 4
+  assert len(sleeps) == 3
+
+@pytest.mark.parametrize("response", [
+  # may have reached the LLM
+  (503, { "Retry-After" : "30" }, { "error" : "overloaded" }),
+  (500, {}, { "error" : "failed" }),
+  (502, {}, { "error" : "bad gateway" }),
+])
+def test_submission_is_not_sent_again_once_started(backend, sleeps, response):
+  adapter = backend(response)
+  assert submit_tax_form(_uploads(), PII) is None
+  assert len(adapter.requests) == 1
+  assert sleeps == []
+
+def test_retry_after_defaults_when_unreadable():
+  response = requests.Response()
+  response.headers["Retry-After"] = "Wed, 21 Oct 2026 07:28:00 GMT"
+  assert api_client._retry_after(response) == 5.0
+
+# Below submit_tax_form, the connection pool only retries downloads on
+# 502 / 503 / 504, and never a request whose answer was lost
+def test_pool_retries_only_downloads(monkeypatch):
+  monkeypatch.setattr(api_client, "_session", None)
+  retry = api_client._get_session().get_adapter("http://backend.test").max_retries
+
+  assert retry.is_retry("GET", 503)
+  assert not retry.is_retry("POST", 503)
+  assert not retry.is_retry("GET", 500)
+  assert retry.read == 0
+  assert retry.connect == api_client.BACKEND_MAX_RETRIES